@@ -0,0 +1,222 @@
+"""Fleet-wide lifecycle analytics, vectorized with NumPy.
+
+The whole event log is read in one ordered scan into flat arrays
+(instance index, state code, timestamp); every statistic below is then a
+handful of array operations instead of a per-instance SQL function call
+such as GetLifecycleAge. With DB_SHARDS set every shard is scanned in
+parallel and the arrays merged (an instance's events never span shards).
+Results are cached per write version of the tables they read, so repeated
+calls between writes are free.
+"""
+import threading
+import time
+
+import numpy as np
+
+from cache import table_versions
+from lifecycle import STATES, STATE_CODES, END_OF_LIFE
+from shards import scatter_call
+
+SECONDS_PER_DAY = 86400.0
+FETCH_BATCH_SIZE = 50000
+
+_cache_lock = threading.Lock()
+_cache = {}
+
+
+def load_event_arrays(conn):
+    """One ordered scan of the event log.
+
+    Returns a dict of arrays: instance_ids (unique, sorted), product_of
+    (product index per instance), products (ProductIDs), and per event
+    inst (index into instance_ids), code (lifecycle.STATE_CODES) and ts
+    (unix seconds), sorted by instance then time.
+    """
+    cursor = conn.cursor()
+    cursor.execute("SELECT InstanceID, ProductID FROM ProductInstances ORDER BY InstanceID")
+    rows = cursor.fetchall()
+    instance_ids = np.array([r[0] for r in rows], dtype=np.int64)
+    products, product_of = np.unique(np.array([r[1] for r in rows], dtype=object).astype(str),
+                                     return_inverse=True)
+
+    cursor = conn.cursor(buffered=False)
+    cursor.execute("""
+        SELECT InstanceID, EventType, UNIX_TIMESTAMP(EventDate)
+        FROM LifecycleEventsAll
+        ORDER BY InstanceID, EventDate, EventID
+    """)
+    ids, codes, stamps = [], [], []
+    while True:
+        batch = cursor.fetchmany(FETCH_BATCH_SIZE)
+        if not batch:
+            break
+        ids.append(np.fromiter((r[0] for r in batch), dtype=np.int64, count=len(batch)))
+        codes.append(np.fromiter((STATE_CODES.get(r[1], 0) for r in batch), dtype=np.int8, count=len(batch)))
+        stamps.append(np.fromiter((float(r[2]) for r in batch), dtype=np.float64, count=len(batch)))
+    cursor.close()
+
+    event_ids = np.concatenate(ids) if ids else np.empty(0, dtype=np.int64)
+    return {
+        'instance_ids': instance_ids,
+        'products': products,
+        'product_of': product_of,
+        'inst': np.searchsorted(instance_ids, event_ids),
+        'code': np.concatenate(codes) if codes else np.empty(0, dtype=np.int8),
+        'ts': np.concatenate(stamps) if stamps else np.empty(0, dtype=np.float64),
+    }
+
+
+def merge_event_arrays(parts):
+    """One set of load_event_arrays results from several over disjoint instances (one per shard)."""
+    if len(parts) == 1:
+        return parts[0]
+    instance_ids = np.concatenate([p['instance_ids'] for p in parts])
+    product_names = np.concatenate([p['products'][p['product_of']] for p in parts]).astype(str)
+    order = np.argsort(instance_ids, kind='stable')
+    instance_ids = instance_ids[order]
+    products, product_of = np.unique(product_names[order], return_inverse=True)
+
+    inst = np.searchsorted(instance_ids, np.concatenate([p['instance_ids'][p['inst']] for p in parts]))
+    # Each part is ordered by instance then time, so a stable sort on the instance keeps the time order
+    event_order = np.argsort(inst, kind='stable')
+    return {
+        'instance_ids': instance_ids,
+        'products': products,
+        'product_of': product_of,
+        'inst': inst[event_order],
+        'code': np.concatenate([p['code'] for p in parts])[event_order],
+        'ts': np.concatenate([p['ts'] for p in parts])[event_order],
+    }
+
+
+def load_fleet_event_arrays():
+    """load_event_arrays over the whole fleet: every shard, or the single database."""
+    return merge_event_arrays(scatter_call(load_event_arrays))
+
+
+def first_occurrence(data):
+    """(n_instances, n_states) matrix of the first time each state was entered (NaN if never)."""
+    n_inst, n_states = len(data['instance_ids']), len(STATES)
+    first = np.full((n_inst, n_states), np.nan)
+    key = data['inst'].astype(np.int64) * n_states + data['code']
+    # Events are time-ordered within an instance, so the first row of each key is the earliest
+    keys, idx = np.unique(key, return_index=True)
+    first.flat[keys] = data['ts'][idx]
+    return first
+
+
+def milestone_durations(first):
+    """Days between lifecycle milestones, one value per instance (NaN if not reached)."""
+    eol = np.fmin.reduce(first[:, [STATE_CODES[s] for s in END_OF_LIFE]], axis=1)
+    manufactured = first[:, STATE_CODES['Manufactured']]
+    sold = first[:, STATE_CODES['Sold']]
+    repair = first[:, STATE_CODES['Repair']]
+    return {
+        'manufactured_to_sold': (sold - manufactured) / SECONDS_PER_DAY,
+        'sold_to_first_repair': (repair - sold) / SECONDS_PER_DAY,
+        'sold_to_end_of_life': (eol - sold) / SECONDS_PER_DAY,
+        'manufactured_to_end_of_life': (eol - manufactured) / SECONDS_PER_DAY,
+    }, eol
+
+
+def time_in_state(data, now):
+    """Mean days spent in each state, counting open (current) states up to `now`."""
+    inst, code, ts = data['inst'], data['code'], data['ts']
+    if len(ts) == 0:
+        return {}
+    # Each event's state lasts until the instance's next event, or until now
+    next_ts = np.empty_like(ts)
+    next_ts[:-1] = ts[1:]
+    last_of_instance = np.ones(len(ts), dtype=bool)
+    last_of_instance[:-1] = inst[1:] != inst[:-1]
+    next_ts[last_of_instance] = now
+
+    durations = (next_ts - ts) / SECONDS_PER_DAY
+    # Terminal states have no "time in state"
+    terminal = np.isin(code, [STATE_CODES[s] for s in END_OF_LIFE])
+    totals = np.bincount(code[~terminal], weights=durations[~terminal], minlength=len(STATES))
+    counts = np.bincount(code[~terminal], minlength=len(STATES))
+    return {STATES[c]: round(totals[c] / counts[c], 2) for c in range(len(STATES)) if counts[c]}
+
+
+def kaplan_meier(durations, observed):
+    """Kaplan-Meier survival estimate.
+
+    durations: days each unit was followed; observed: True where the unit
+    reached end-of-life (False = still in service, censored).
+    Returns (times, survival) at each distinct end-of-life time.
+    """
+    if len(durations) == 0:
+        return np.empty(0), np.empty(0)
+    order = np.argsort(durations, kind='stable')
+    durations, observed = durations[order], observed[order]
+    times, first_idx, counts = np.unique(durations, return_index=True, return_counts=True)
+    deaths = np.add.reduceat(observed.astype(np.int64), first_idx)
+    at_risk = len(durations) - first_idx
+    survival = np.cumprod(1.0 - deaths / at_risk)
+    has_death = deaths > 0
+    return times[has_death], survival[has_death]
+
+
+def survival_by_product(data, first, eol, now):
+    """Survival curve from sale to end-of-life for each product."""
+    sold = first[:, STATE_CODES['Sold']]
+    in_service = ~np.isnan(sold)
+    observed = ~np.isnan(eol)
+    durations = (np.where(observed, eol, now) - sold) / SECONDS_PER_DAY
+
+    # Group the sold units by product once, instead of a full-fleet mask per product
+    product_of = data['product_of'][in_service]
+    order = np.argsort(product_of, kind='stable')
+    durations, observed = durations[in_service][order], observed[in_service][order]
+    bounds = np.searchsorted(product_of[order], np.arange(len(data['products']) + 1))
+
+    curves = {}
+    for p, product_id in enumerate(data['products']):
+        lo, hi = bounds[p], bounds[p + 1]
+        times, survival = kaplan_meier(durations[lo:hi], observed[lo:hi])
+        curves[str(product_id)] = {
+            'units': int(hi - lo),
+            'ended': int(observed[lo:hi].sum()),
+            'days': [round(float(t), 2) for t in times],
+            'survival': [round(float(s), 4) for s in survival],
+        }
+    return curves
+
+
+def _summary(values):
+    values = values[~np.isnan(values)]
+    if len(values) == 0:
+        return {'count': 0, 'mean': None, 'median': None}
+    return {'count': int(len(values)),
+            'mean': round(float(values.mean()), 2),
+            'median': round(float(np.median(values)), 2)}
+
+
+def compute_fleet_analytics(data, now=None):
+    now = time.time() if now is None else now
+    first = first_occurrence(data)
+    durations, eol = milestone_durations(first)
+    return {
+        'instances': int(len(data['instance_ids'])),
+        'events': int(len(data['ts'])),
+        'milestones': {name: _summary(values) for name, values in durations.items()},
+        'mean_days_in_state': time_in_state(data, now),
+        'survival': survival_by_product(data, first, eol, now),
+    }
+
+
+def fleet_analytics():
+    """compute_fleet_analytics over the live database, cached per data version."""
+    versions, _ = table_versions(('LifecycleEvents', 'ProductInstances'))
+    with _cache_lock:
+        cached = _cache.get(versions)
+    if cached is not None:
+        return cached
+
+    result = compute_fleet_analytics(load_fleet_event_arrays())
+
+    with _cache_lock:
+        _cache.clear()
+        _cache[versions] = result
+    return result
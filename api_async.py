@@ -0,0 +1,117 @@
+"""Async, read-only JSON API.
+
+Runs next to the Flask HTML app (app.py) on its own port, e.g.
+
+    hypercorn api_async:app --bind 0.0.0.0:5001
+
+Every endpoint awaits MySQL through an aiomysql pool instead of parking a
+worker thread on the socket, so one process can keep many slow clients in
+flight at once.
+"""
+import aiomysql
+from quart import Quart, jsonify, abort
+
+import config
+from db import DB_CONFIG
+from model import INSTANCE_FEATURE_QUERY, load_model, predict_recyclable
+
+app = Quart(__name__)
+
+POOL_MIN_SIZE = 1
+POOL_MAX_SIZE = 20
+
+_pool = None
+
+
+@app.before_serving
+async def create_pool():
+    global _pool
+    if config.DB_SHARDS:
+        # Instances and events are on the shards; this API only knows the primary
+        raise RuntimeError("api_async does not support DB_SHARDS; use the Flask API (app.py)")
+    _pool = await aiomysql.create_pool(
+        host=DB_CONFIG['host'],
+        port=DB_CONFIG['port'],
+        user=DB_CONFIG['user'],
+        password=DB_CONFIG['password'],
+        db=DB_CONFIG['database'],
+        minsize=POOL_MIN_SIZE,
+        maxsize=POOL_MAX_SIZE,
+        autocommit=True,
+    )
+    load_model()
+
+
+@app.after_serving
+async def close_pool():
+    _pool.close()
+    await _pool.wait_closed()
+
+
+async def fetch_all(sql, params=()):
+    async with _pool.acquire() as conn:
+        async with conn.cursor(aiomysql.DictCursor) as cursor:
+            await cursor.execute(sql, params)
+            return await cursor.fetchall()
+
+
+async def fetch_one(sql, params=()):
+    async with _pool.acquire() as conn:
+        async with conn.cursor(aiomysql.DictCursor) as cursor:
+            await cursor.execute(sql, params)
+            return await cursor.fetchone()
+
+
+# -------------------------
+# READ-ONLY JSON ENDPOINTS
+# -------------------------
+@app.route('/api/products')
+async def api_products():
+    rows = await fetch_all("SELECT ProductID, ModelName FROM Products")
+    return jsonify(rows)
+
+
+@app.route('/api/instances')
+async def api_instances():
+    rows = await fetch_all("""
+        SELECT InstanceID, SerialNumber, ProductID
+        FROM ProductInstances
+        ORDER BY InstanceID
+    """)
+    return jsonify(rows)
+
+
+@app.route('/api/instances/<int:instance_id>/timeline')
+async def api_timeline(instance_id):
+    rows = await fetch_all("""
+        SELECT EventType, DATE_FORMAT(EventDate, '%%Y-%%m-%%d %%H:%%i') AS EventTime
+        FROM LifecycleEventsAll
+        WHERE InstanceID = %s
+        ORDER BY EventDate
+    """, (instance_id,))
+    return jsonify(rows)
+
+
+@app.route('/api/passports/<product_id>')
+async def api_passport(product_id):
+    rows = await fetch_all("""
+        SELECT ComponentName, MaterialName, WeightInGrams, RecyclableGrade, IsHazardous
+        FROM ProductMaterialPassport
+        WHERE ProductID = %s
+        ORDER BY ComponentName
+    """, (product_id,))
+    return jsonify(rows)
+
+
+@app.route('/api/predict/<int:instance_id>')
+async def api_predict(instance_id):
+    row = await fetch_one(INSTANCE_FEATURE_QUERY, (instance_id,))
+    if row is None:
+        abort(404)
+    result = predict_recyclable(row)
+    result['InstanceID'] = instance_id
+    return jsonify(result)
+
+
+if __name__ == '__main__':
+    app.run(port=5001)
@@ -1,51 +1,97 @@
-from flask import Flask, render_template, request, redirect, url_for, flash, jsonify
-from db import get_db_connection
+import uuid
+
+from flask import Flask, render_template, request, redirect, url_for, flash, jsonify, abort, Response, stream_with_context, session, g
+from db import get_db_connection, get_read_connection
+from exports import EXPORTS, EXPORT_FORMATS, generate_export
+from model import DRIFT_MONITOR, INSTANCE_FEATURE_QUERY, predict_recyclable
+from cache import cached_view, note_write
+from lifecycle import EVENT_TYPES, record_event, recycling_event_type
+from analytics import fleet_analytics
+from catalog import GRADE_SCORE, get_catalog
+from forecast import forecast_returns
+from scenario import ScenarioError, get_engine
+from snapshots import fleet_state_as_of, parse_as_of
+from journal import apply_batch, check_event, get_journal
+from outbox import SHARD_ENTITIES, CursorPruned, open_stream, wait_for_changes
+from olap import OLAP_STORE, OlapConnection, composition_report
+from serials import SERIAL_INDEX
+from search import KINDS as SEARCH_KINDS, SEARCH_INDEX
+from shards import bump_primary, gather_counts, gather_sorted, gather_sum, instance_connection, is_sharded, register_instance, scatter
+import serials
+from streaming import StreamGroup, render_page
+import repository
+import streaming
+import config
+import profiler
 
 app = Flask(__name__)
 app.secret_key = "secret123"
+profiler.init_app(app)
+streaming.init_app(app)
+serials.init_app(app)
+
+
+def read_connection():
+    # Replica for read-only work that has executed this session's last write
+    # (cache.note_write) and the table versions a cached page is keyed on
+    after = ','.join(s for s in (session.get('last_write_gtids'), g.get('read_after')) if s)
+    return get_read_connection(after=after or None)
+
+
+def fleet_query(conn, sql):
+    # Rows from every shard; the columnar copy (olap.py) already holds them all
+    if isinstance(conn, OlapConnection):
+        cursor = conn.cursor(dictionary=True)
+        cursor.execute(sql)
+        return [cursor.fetchall()]
+    return scatter(sql, conn=conn)
+
+
+def fleet_rows(group, query, key):
+    # Instance rows from every shard, merged in `key` order (the query must ORDER BY key)
+    if is_sharded():
+        return [query.row(**r) for r in gather_sorted(scatter(query.sql), key)]
+    return group.query(query)
 
-GRADE_SCORE = {'A': 4, 'B': 3, 'C': 2, 'D': 1}
 
 # -------------------------
 # 1) DASHBOARD / HOME
 # -------------------------
+DASHBOARD_TABLES = ('Products', 'Components', 'RawMaterials', 'Suppliers',
+                    'ProductInstances', 'LifecycleEvents', 'ComponentComposition')
+
+
 @app.route('/')
+@cached_view(*DASHBOARD_TABLES, 'OlapExport')
 def index():
-    conn = get_db_connection()
-    cursor = conn.cursor(dictionary=True)
+    # Aggregates come from the exported columnar copy when nothing it holds has changed since (olap.py)
+    conn = OLAP_STORE.connect(DASHBOARD_TABLES) or read_connection()
+
+    catalog_counts = repository.catalog_counts(conn)
+    total_products = catalog_counts.products
+    total_components = catalog_counts.components
+    total_materials = catalog_counts.materials
+    total_suppliers = catalog_counts.suppliers
+    # Instances and events live on the shards (shards.py); one query per shard, in parallel
+    counts = fleet_query(conn, """
+        SELECT (SELECT COUNT(*) FROM ProductInstances) AS instances,
+               (SELECT COUNT(*) FROM LifecycleEventsAll) AS events
+    """)
+    total_instances = gather_sum(counts, 'instances')
+    total_events = gather_sum(counts, 'events')
 
-    cursor.execute("SELECT COUNT(*) AS cnt FROM Products")
-    total_products = cursor.fetchone()['cnt']
-    cursor.execute("SELECT COUNT(*) AS cnt FROM Components")
-    total_components = cursor.fetchone()['cnt']
-    cursor.execute("SELECT COUNT(*) AS cnt FROM RawMaterials")
-    total_materials = cursor.fetchone()['cnt']
-    cursor.execute("SELECT COUNT(*) AS cnt FROM Suppliers")
-    total_suppliers = cursor.fetchone()['cnt']
-    cursor.execute("SELECT COUNT(*) AS cnt FROM ProductInstances")
-    total_instances = cursor.fetchone()['cnt']
-    cursor.execute("SELECT COUNT(*) AS cnt FROM LifecycleEvents")
-    total_events = cursor.fetchone()['cnt']
-
-    cursor.execute("""
+    dist = gather_counts(fleet_query(conn, """
         SELECT EventType, COUNT(*) AS cnt
-        FROM LifecycleEvents
+        FROM LifecycleEventsAll
         GROUP BY EventType
-    """)
-    rows = cursor.fetchall()
-    dist = {r['EventType']: r['cnt'] for r in rows}
+    """), 'EventType')
     recycled = dist.get('Recycled', 0) + dist.get('Recycled_Hazardous', 0)
     disposed = dist.get('Disposed', 0)
     repair = dist.get('Repair', 0)
 
-    cursor.execute("""
-        SELECT cc.WeightInGrams, rm.RecyclableGrade
-        FROM ComponentComposition cc
-        JOIN RawMaterials rm ON cc.MaterialID = rm.MaterialID
-    """)
-    comp_rows = cursor.fetchall()
-    total_weight = sum(float(r['WeightInGrams']) for r in comp_rows)
-    weighted_score_sum = sum(float(r['WeightInGrams']) * GRADE_SCORE.get(r['RecyclableGrade'], 0) for r in comp_rows)
+    comp_rows = repository.composition_grades(conn)
+    total_weight = sum(float(r.WeightInGrams) for r in comp_rows)
+    weighted_score_sum = sum(float(r.WeightInGrams) * GRADE_SCORE.get(r.RecyclableGrade, 0) for r in comp_rows)
     overall_recyclability_score = round(weighted_score_sum / total_weight, 2) if total_weight > 0 else 0
 
     conn.close()
@@ -69,32 +115,28 @@ def index():
 # -------------------------
 @app.route('/register', methods=['GET', 'POST'])
 def register():
-    conn = get_db_connection()
-    cursor = conn.cursor(dictionary=True)
+    conn = get_db_connection() if request.method == 'POST' else read_connection()
+    products = repository.product_options(conn)
 
-    cursor.execute("SELECT ProductID, ModelName FROM Products")
-    products = cursor.fetchall()
-
-    cursor.execute("""
+    recent = gather_sorted(scatter("""
         SELECT pi.InstanceID, pi.SerialNumber,
-               COALESCE((SELECT le.EventType FROM LifecycleEvents le
-                         WHERE le.InstanceID = pi.InstanceID
-                         ORDER BY le.EventDate DESC LIMIT 1), 'NoEvents') AS current_state,
+               pi.CurrentState AS current_state,
                pi.ProductID
         FROM ProductInstances pi
         ORDER BY pi.InstanceID DESC LIMIT 10
-    """)
-    recent = cursor.fetchall()
+    """, conn=conn), 'InstanceID', reverse=True, limit=10)
 
     if request.method == 'POST':
         serial = request.form['serial'].strip()
         product_id = request.form['product_id']
         try:
-            cursor.callproc('RegisterProductInstance', [serial, product_id])
+            register_instance(conn, serial, product_id)
             conn.commit()
+            note_write()
             flash('✅ Product instance registered successfully!', 'success')
         except Exception as e:
             flash(f'⚠️ {e}', 'error')
+        conn.close()
         return redirect(url_for('register'))
 
     conn.close()
@@ -106,11 +148,10 @@ def register():
 # -------------------------
 @app.route('/instance_detail', methods=['GET', 'POST'])
 def instance_detail():
-    conn = get_db_connection()
-    cursor = conn.cursor(dictionary=True)
+    conn = get_db_connection() if request.method == 'POST' else read_connection()
+    group = StreamGroup(conn)
 
-    cursor.execute("SELECT InstanceID, SerialNumber FROM ProductInstances")
-    instances = cursor.fetchall()
+    instances = fleet_rows(group, repository.INSTANCES, 'InstanceID')
 
     timeline = []
     selected = None
@@ -118,22 +159,25 @@ def instance_detail():
     if request.method == 'POST':
         inst_id = int(request.form['instance_id'])
         event_type = request.form['event_type']
+        shard = group.adopt(instance_connection(inst_id, lambda: conn))
         try:
-            cursor.callproc('AddLifecycleEvent', [inst_id, event_type])
-            conn.commit()
+            # Plain 'Recycled' is upgraded when the product contains hazardous material
+            if event_type == 'Recycled':
+                event_type = recycling_event_type(shard.cursor(), inst_id)
+            # Checked against the lifecycle state machine (lifecycle.py)
+            record_event(shard, inst_id, event_type)
+            shard.commit()
+            bump_primary('LifecycleEvents')
+            note_write()
             flash('✅ Event added', 'success')
         except Exception as e:
+            shard.rollback()
             flash(f'⚠️ {e}', 'error')
 
-        # Note: Using callproc here too for consistency and safety
-        cursor.callproc('GetLifecycleReport', (inst_id,))
-        for result in cursor.stored_results():
-            timeline = result.fetchall()
-            
+        timeline = group.query(repository.TIMELINE, (inst_id,), conn=shard)
         selected = inst_id
 
-    conn.close()
-    return render_template('instance_detail.html', instances=instances, timeline=timeline, selected=selected)
+    return render_page(group, 'instance_detail.html', instances=instances, timeline=timeline, selected=selected)
 
 
 # -------------------------
@@ -141,13 +185,11 @@ def instance_detail():
 # -------------------------
 @app.route('/suppliers', methods=['GET', 'POST'])
 def suppliers():
-    conn = get_db_connection()
+    conn = get_db_connection() if request.method == 'POST' else read_connection()
     cursor = conn.cursor(dictionary=True)
 
-    cursor.execute("SELECT ComponentID, ComponentName FROM Components")
-    components = cursor.fetchall()
-    cursor.execute("SELECT MaterialID, MaterialName FROM RawMaterials")
-    materials = cursor.fetchall()
+    components = repository.component_options(conn)
+    materials = repository.material_options(conn)
 
     if request.method == 'POST':
         s_id = request.form['supplier_id'].strip()
@@ -155,49 +197,21 @@ def suppliers():
         try:
             cursor.callproc('AddNewSupplier', [s_id, s_name])
             conn.commit()
+            note_write()
             flash('✅ Supplier added successfully!', 'success')
         except Exception as e:
             conn.rollback()
             flash(f'⚠️ Error adding supplier: {e}', 'error')
+        conn.close()
         return redirect(url_for('suppliers'))
 
-    cursor.execute("SELECT * FROM Suppliers")
-    suppliers = cursor.fetchall()
-
-    cursor.execute("""
-        SELECT 
-            s.SupplierID, s.SupplierName, c.ComponentName, m.MaterialName
-        FROM Suppliers s
-        LEFT JOIN Sourcing so ON s.SupplierID = so.SupplierID
-        LEFT JOIN Components c ON so.ComponentID = c.ComponentID
-        LEFT JOIN RawMaterials m ON so.MaterialID = m.MaterialID
-        ORDER BY s.SupplierName
-    """)
-    sourcing = cursor.fetchall()
-
-    supplier_types = {}
-    cursor.execute("""
-        SELECT SupplierID,
-               SUM(ComponentID IS NOT NULL) AS comp_count,
-               SUM(MaterialID IS NOT NULL) AS mat_count
-        FROM Sourcing
-        GROUP BY SupplierID
-    """)
-    for row in cursor.fetchall():
-        cid = row['SupplierID']
-        comp_count = row['comp_count'] or 0
-        mat_count = row['mat_count'] or 0
-        if comp_count > 0 and mat_count > 0:
-            supplier_types[cid] = 'Both'
-        elif comp_count > 0:
-            supplier_types[cid] = 'Component Supplier'
-        elif mat_count > 0:
-            supplier_types[cid] = 'Material Supplier'
-        else:
-            supplier_types[cid] = 'Unknown'
+    supplier_types = repository.supplier_types(conn)
 
-    conn.close()
-    return render_template('suppliers.html',
+    # The two long tables are read while the page is sent (streaming.py)
+    group = StreamGroup(conn)
+    suppliers = group.query(repository.SUPPLIERS)
+    sourcing = group.query(repository.SOURCING)
+    return render_page(group, 'suppliers.html',
                             suppliers=suppliers,
                             sourcing=sourcing,
                             supplier_types=supplier_types,
@@ -227,7 +241,9 @@ def add_sourcing():
             )
         else:
             return jsonify({'status': 'error', 'message': 'Invalid supply type'})
+        cursor.callproc('BumpTableVersion', ['Sourcing'])
         conn.commit()
+        note_write()
         return jsonify({'status': 'ok', 'message': 'Sourcing added successfully!'})
     except Exception as e:
         conn.rollback()
@@ -241,7 +257,7 @@ def add_sourcing():
 # -------------------------
 @app.route('/materials', methods=['GET', 'POST'])
 def materials():
-    conn = get_db_connection()
+    conn = get_db_connection() if request.method == 'POST' else read_connection()
     cursor = conn.cursor(dictionary=True)
 
     # --- POST Logic (For *adding* a new material) ---
@@ -255,6 +271,7 @@ def materials():
         try:
             cursor.callproc('AddMaterialComposition', [comp_id, mat_id, weight])
             conn.commit()
+            note_write()
             flash('✅ Composition added', 'success')
         except Exception as e:
             flash(f'⚠️ {e}', 'error')
@@ -269,10 +286,8 @@ def materials():
     # This code now runs for all GET requests
     
     # 1. Always fetch dropdown lists
-    cursor.execute("SELECT ComponentID, ComponentName FROM Components")
-    components = cursor.fetchall()
-    cursor.execute("SELECT MaterialID, MaterialName, IsHazardous FROM RawMaterials")
-    materials_list = cursor.fetchall()
+    components = repository.component_options(conn)
+    materials_list = repository.material_options(conn)
 
     # 2. Check if a component is selected in the URL
     # We look for a URL parameter like: /materials?component=c100
@@ -283,18 +298,12 @@ def materials():
 
     # 3. If a component was selected, fetch its data
     if selected_component_id:
-        cursor.execute("""
-            SELECT cc.ComponentID, cc.MaterialID, rm.MaterialName, cc.WeightInGrams, rm.IsHazardous
-            FROM ComponentComposition cc
-            JOIN RawMaterials rm ON cc.MaterialID = rm.MaterialID
-            WHERE cc.ComponentID = %s
-        """, (selected_component_id,))
-        composition_rows = cursor.fetchall()
+        composition_rows = repository.component_composition(conn, selected_component_id)
 
         # Only build chart data if we have rows
         if composition_rows:
-            labels = [r['MaterialName'] for r in composition_rows]
-            weights = [float(r['WeightInGrams']) for r in composition_rows]
+            labels = [r.MaterialName for r in composition_rows]
+            weights = [float(r.WeightInGrams) for r in composition_rows]
             composition_chart_data = {'labels': labels, 'weights': weights}
 
     conn.close()
@@ -311,14 +320,14 @@ def materials():
 # 6) REPORTS / ANALYTICS PAGE (FIXED)
 # -------------------------
 @app.route('/reports', methods=['GET', 'POST'])
+@cached_view('ProductInstances', 'Products', 'LifecycleEvents', 'Components',
+             'ComponentComposition', 'RawMaterials', 'BillOfMaterial')
 def reports():
-    conn = get_db_connection()
-    cursor = conn.cursor(dictionary=True)
+    conn = read_connection()
+    group = StreamGroup(conn)
 
-    cursor.execute("SELECT InstanceID, SerialNumber FROM ProductInstances")
-    instances = cursor.fetchall()
-    cursor.execute("SELECT ProductID, ModelName FROM Products")
-    products = cursor.fetchall()
+    instances = fleet_rows(group, repository.INSTANCES, 'InstanceID')
+    products = repository.product_options(conn)
 
     lifecycle_timeline = []
     trace_rows = []
@@ -333,74 +342,43 @@ def reports():
     age_in_days = None           
     
 
-    if request.method == 'POST':
-        report_type = request.form.get('report_type')
+    # The report forms submit with GET so results are bookmarkable and cacheable;
+    # request.values still accepts the old POSTed forms.
+    report_type = request.values.get('report_type')
+    if report_type:
 
         if report_type == 'lifecycle':
-            inst_id = request.form.get('instance_id')
+            inst_id = request.values.get('instance_id')
             
             # --- CHANGE 2: Get data for title, age, and sticky dropdown ---
             selected_instance_id = inst_id  # Store this to make dropdown "sticky"
 
-            # Get the serial number AND age
-            cursor.execute("""
-                SELECT SerialNumber, GetLifecycleAge(InstanceID) AS age
-                FROM ProductInstances 
-                WHERE InstanceID = %s
-            """, (inst_id,))
-            
-            result = cursor.fetchone()
+            # Get the serial number AND age (from the instance's shard, if sharded)
+            shard = group.adopt(instance_connection(int(inst_id), lambda: conn)) if (inst_id or '').isdigit() else conn
+            result = repository.instance_age(shard, inst_id)
             if result:
-                selected_instance_serial = result['SerialNumber']
-                age_in_days = result['age']  # <-- STORE THE AGE
+                selected_instance_serial = result.SerialNumber
+                age_in_days = result.age  # <-- STORE THE AGE
             # --- End Change ---
 
             # Now, get the timeline
-            cursor.callproc('GetLifecycleReport', (inst_id,))
-            for result in cursor.stored_results():
-                lifecycle_timeline = result.fetchall()
+            lifecycle_timeline = group.query(repository.TIMELINE, (inst_id,), conn=shard)
 
         elif report_type == 'trace':
-            selected_product_id = request.form.get('product_id') # Store for sticky dropdown
+            selected_product_id = request.values.get('product_id') # Store for sticky dropdown
             
             # Get the product name for the H4 title
-            cursor.execute("SELECT ModelName FROM Products WHERE ProductID = %s", (selected_product_id,))
-            result = cursor.fetchone()
-            if result:
-                selected_product_name = result['ModelName']
+            selected_product_name = repository.product_name(conn, selected_product_id)
 
             # Get the trace data
-            cursor.execute("""
-                    SELECT 
-                        ComponentName, 
-                        MaterialName, 
-                        WeightInGrams, 
-                        RecyclableGrade,
-                        CASE 
-                            WHEN IsHazardous = 1 THEN 'Yes'
-                            ELSE 'No'
-                        END AS IsHazardous
-                    FROM ProductMaterialPassport
-                    WHERE ProductID = %s
-                    ORDER BY ComponentName;
-                """, (selected_product_id,))
-            trace_rows = cursor.fetchall()
+            trace_rows = group.query(repository.PRODUCT_PASSPORT, (selected_product_id,))
         
-    cursor.execute("""
-        SELECT 
-            c.ComponentID,
-            c.ComponentName,
-            GetComponentSummary(c.ComponentID) AS Summary
-        FROM Components c
-        WHERE c.ComponentID IN ('c100', 'c200', 'c310');
-    """)
-    component_hierarchy = cursor.fetchall()
-
-    conn.close()
+    component_hierarchy = repository.component_hierarchy(conn)
     
     # --- CHANGE 3: Pass ALL variables to the template ---
     # Your old code was missing the "selected" variables and the new 'age'
-    return render_template(
+    return render_page(
+        group,
         'reports.html',
         instances=instances,
         products=products,
@@ -416,17 +394,221 @@ def reports():
         
         age_in_days=age_in_days  # <-- PASS THE NEW AGE VARIABLE
     )
+# -------------------------
+# 7) STREAMING EXPORTS (CSV / NDJSON)
+# -------------------------
+# e.g. /export/timelines.csv?event_type=Disposed&gzip=1
+@app.route('/export/<kind>.<fmt>')
+def export(kind, fmt):
+    if kind not in EXPORTS or fmt not in EXPORT_FORMATS:
+        abort(404)
+    if EXPORTS[kind].get('instance_rows') and is_sharded():
+        return jsonify({'status': 'error', 'message': f'The {kind} export is not available with DB_SHARDS set; '
+                                                      'use the columnar export (olap.py)'}), 501
+
+    compress = request.args.get('gzip') == '1'
+    filename = f'{kind}.{fmt}'
+    mimetype = EXPORT_FORMATS[fmt]
+    if compress:
+        filename += '.gz'
+        mimetype = 'application/gzip'
+
+    chunks = generate_export(kind, fmt, request.args, compress=compress)
+    return Response(
+        stream_with_context(chunks),
+        mimetype=mimetype,
+        headers={'Content-Disposition': f'attachment; filename={filename}'}
+    )
+
+
 # -------------------------
 # API
 # -------------------------
 @app.route('/api/products')
 def api_products():
-    conn = get_db_connection()
+    conn = read_connection()
+    rows = repository.product_options(conn)
+    conn.close()
+    return jsonify([r._asdict() for r in rows])
+
+
+@app.route('/api/analytics/fleet')
+def api_fleet_analytics():
+    # Milestone durations, mean time in state and per-product survival curves
+    return jsonify(fleet_analytics())
+
+
+COMPOSITION_TABLES = ('ComponentComposition', 'RawMaterials', 'Components', 'Suppliers', 'Sourcing')
+
+
+@app.route('/api/analytics/composition')
+@cached_view(*COMPOSITION_TABLES, 'OlapExport')
+def api_composition_analytics():
+    # Recyclable mass by grade and supplier mass contribution, from olap.py's copy when current
+    conn = OLAP_STORE.connect(COMPOSITION_TABLES)
+    source = 'olap' if conn is not None else 'database'
+    conn = conn or read_connection()
+    try:
+        report = composition_report(conn)
+    finally:
+        conn.close()
+    return jsonify(dict(report, status='ok', source=source))
+
+
+@app.route('/api/forecast/returns')
+def api_forecast_returns():
+    # Expected kg coming back per material / grade, month by month
+    months = min(request.args.get('months', 12, type=int), 120)
+    return jsonify(forecast_returns(months=months))
+
+
+@app.route('/api/scenarios/score', methods=['POST'])
+def api_scenario_score():
+    # Body: {"overlays": [{"type": "grade", "material": "M2", "grade": "B"}, ...]}
+    body = request.get_json(silent=True) or {}
+    overlays = body.get('overlays', []) if isinstance(body, dict) else body
+    try:
+        results = get_engine(get_catalog()).report(overlays)
+    except ScenarioError as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 400
+    return jsonify({'status': 'ok', 'products': results})
+
+
+@app.route('/api/fleet/state')
+def api_fleet_state():
+    # e.g. /api/fleet/state?as_of=2025-03-31 -> units per state at the end of that day
+    try:
+        as_of = parse_as_of(request.args['as_of'])
+    except (KeyError, ValueError):
+        return jsonify({'status': 'error', 'message': 'as_of must be an ISO date or datetime'}), 400
+    return jsonify({'status': 'ok', 'as_of': request.args['as_of'], 'states': fleet_state_as_of(as_of)})
+
+
+@app.route('/api/events', methods=['POST'])
+def api_events():
+    # Scanner intake. Body: one event or a list of them:
+    # {"instance_id": 7, "event_type": "Sold", "event_uuid": "...", "event_date": "2025-03-31 10:00:00"}
+    # (event_uuid and event_date optional). A retried event_uuid is applied once.
+    body = request.get_json(silent=True)
+    events = body if isinstance(body, list) else [body]
+    try:
+        for e in events:
+            e['instance_id'] = int(e['instance_id'])
+            if e['event_type'] not in EVENT_TYPES:
+                raise ValueError(f"Unknown event type '{e['event_type']}'")
+            # Journaled events must be storable, or they would block the journal behind them
+            check_event(e.get('event_uuid'), e.get('event_date'))
+    except (TypeError, KeyError, ValueError) as e:
+        return jsonify({'status': 'error', 'message': f'Invalid event: {e}'}), 400
+
+    if config.JOURNAL_ENABLED:
+        # Acknowledged once on disk; transition rules are checked when the
+        # flusher applies the batch (rejections are logged there)
+        journal = get_journal()
+        uuids = [journal.append(e['instance_id'], e['event_type'], e.get('event_date'), e.get('event_uuid'))
+                 for e in events]
+        return jsonify({'status': 'accepted', 'event_uuids': uuids}), 202
+
+    records = [{'uuid': e.get('event_uuid') or str(uuid.uuid4()), 'instance_id': e['instance_id'],
+                'event_type': e['event_type'], 'event_date': e.get('event_date')} for e in events]
+    try:
+        # Committed per shard; a retry after a partial failure is deduplicated by event_uuid
+        applied, rejected, duplicates = apply_batch(records)
+    except Exception as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 500
+    if applied:
+        note_write()
+    return jsonify({'status': 'ok', 'applied': applied, 'duplicates': duplicates,
+                    'event_uuids': [r['uuid'] for r in records],
+                    'rejected': [{'instance_id': ev[0], 'event_type': ev[1], 'message': reason}
+                                 for ev, reason in rejected]})
+
+
+def feed_served(entities):
+    # Sharded, instance and event changes are on the shards' own feeds (outbox.py)
+    return not is_sharded() or (entities and not set(entities) & set(SHARD_ENTITIES))
+
+
+def shard_feed_refused():
+    return jsonify({'status': 'error', 'message': 'With DB_SHARDS set the feed carries only '
+                                                  'Supplier, Sourcing and ComponentComposition changes; '
+                                                  'pass them as ?entity='}), 501
+
+
+@app.route('/api/changes')
+def api_changes():
+    # Long-poll change feed: pass the returned cursor back as ?after= on the next call
+    after = request.args.get('after', 0, type=int)
+    limit = min(request.args.get('limit', 500, type=int), 5000)
+    wait = min(request.args.get('wait', 0, type=float), config.OUTBOX_HEARTBEAT)
+    entities = [e for e in request.args.get('entity', '').split(',') if e]
+    if not feed_served(entities):
+        return shard_feed_refused()
+    try:
+        changes = wait_for_changes(after, limit, entities, timeout=wait)
+    except CursorPruned as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 410
+    return jsonify({'changes': changes, 'cursor': changes[-1]['cursor'] if changes else after})
+
+
+@app.route('/api/changes/stream')
+def api_changes_stream():
+    # Server-Sent Events; reconnecting clients resume from Last-Event-ID
+    after = request.headers.get('Last-Event-ID', type=int) or request.args.get('after', 0, type=int)
+    entities = [e for e in request.args.get('entity', '').split(',') if e]
+    if not feed_served(entities):
+        return shard_feed_refused()
+    try:
+        stream = open_stream(after, entities)
+    except CursorPruned as e:
+        # Not 200, so EventSource stops reconnecting
+        return jsonify({'status': 'error', 'message': str(e)}), 410
+    if stream is None:
+        return jsonify({'status': 'error', 'message': 'This worker is serving all the change streams it can; '
+                                                      'retry, or long-poll /api/changes'}), 503, {'Retry-After': '5'}
+    # Not wrapped in stream_with_context: that skips close() on a body never iterated, keeping the slot
+    return Response(stream, mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+
+@app.route('/api/serials/<path:serial>')
+def api_serial_lookup(serial):
+    # Scanner lookup: is this serial registered, what product, what state?
+    summary = SERIAL_INDEX.lookup(serial)
+    if summary is None:
+        return jsonify({'status': 'error', 'message': 'Unknown serial'}), 404
+    return jsonify(summary)
+
+
+@app.route('/metrics')
+def metrics():
+    # Prometheus scrape target: model drift, merged across worker processes
+    return Response(DRIFT_MONITOR.metrics_text(), mimetype='text/plain; version=0.0.4')
+
+
+@app.route('/api/search')
+def api_search():
+    # Ranked matches across names and serials, for the page pickers
+    query = request.args.get('q', '')
+    kinds = [k for k in request.args.get('kind', '').split(',') if k]
+    if any(k not in SEARCH_KINDS for k in kinds):
+        return jsonify({'status': 'error', 'message': f"kind must be among {', '.join(SEARCH_KINDS)}"}), 400
+    limit = max(1, min(request.args.get('limit', 20, type=int), config.SEARCH_MAX_RESULTS))
+    return jsonify(SEARCH_INDEX.search(query, kinds or None, limit))
+
+
+@app.route('/api/predict/<int:instance_id>')
+def api_predict(instance_id):
+    conn = instance_connection(instance_id, read_connection)
     cursor = conn.cursor(dictionary=True)
-    cursor.execute("SELECT ProductID, ModelName FROM Products")
-    rows = cursor.fetchall()
+    cursor.execute(INSTANCE_FEATURE_QUERY, (instance_id,))
+    row = cursor.fetchone()
     conn.close()
-    return jsonify(rows)
+    if row is None:
+        abort(404)
+    result = predict_recyclable(row)
+    result['InstanceID'] = instance_id
+    return jsonify(result)
 
 
 if __name__ == '__main__':
@@ -1,5 +1,6 @@
 from flask import Flask, render_template, request, redirect, url_for, flash, jsonify
 from db import get_db_connection
+import repository
 
 app = Flask(__name__)
 app.secret_key = "secret123"
@@ -31,13 +32,13 @@ def index():
     cursor.execute("SELECT COUNT(*) AS cnt FROM ProductInstances")
     total_instances = cursor.fetchone()['cnt']
 
-    cursor.execute("SELECT COUNT(*) AS cnt FROM LifecycleEvents")
+    cursor.execute("SELECT COUNT(*) AS cnt FROM LifecycleEventsAll")
     total_events = cursor.fetchone()['cnt']
 
     # Donut chart data (Recycled / Disposed / Repair)
     cursor.execute("""
         SELECT EventType, COUNT(*) AS cnt
-        FROM LifecycleEvents
+        FROM LifecycleEventsAll
         GROUP BY EventType
     """)
     rows = cursor.fetchall()
@@ -47,17 +48,12 @@ def index():
     repair = dist.get('Repair', 0)
 
     # Sustainability score
-    cursor.execute("""
-        SELECT cc.WeightInGrams, rm.RecyclableGrade
-        FROM ComponentComposition cc
-        JOIN RawMaterials rm ON cc.MaterialID = rm.MaterialID
-    """)
-    comp_rows = cursor.fetchall()
+    comp_rows = repository.composition_grades(conn)
     total_weight = 0.0
     weighted_score_sum = 0.0
     for r in comp_rows:
-        weight = float(r['WeightInGrams'])
-        grade = r['RecyclableGrade']
+        weight = float(r.WeightInGrams)
+        grade = r.RecyclableGrade
         score = GRADE_SCORE.get(grade, 0)
         total_weight += weight
         weighted_score_sum += weight * score
@@ -86,14 +82,11 @@ def register():
     conn = get_db_connection()
     cursor = conn.cursor(dictionary=True)
 
-    cursor.execute("SELECT ProductID, ModelName FROM Products")
-    products = cursor.fetchall()
+    products = repository.product_options(conn)
 
     cursor.execute("""
         SELECT pi.InstanceID, pi.SerialNumber,
-               COALESCE((SELECT le.EventType FROM LifecycleEvents le
-                         WHERE le.InstanceID = pi.InstanceID
-                         ORDER BY le.EventDate DESC LIMIT 1), 'NoEvents') AS current_state,
+               pi.CurrentState AS current_state,
                pi.ProductID
         FROM ProductInstances pi
         ORDER BY pi.InstanceID DESC LIMIT 10
@@ -123,8 +116,7 @@ def instance_detail():
     conn = get_db_connection()
     cursor = conn.cursor(dictionary=True)
 
-    cursor.execute("SELECT InstanceID, SerialNumber FROM ProductInstances")
-    instances = cursor.fetchall()
+    instances = repository.fetch_all(conn, repository.INSTANCES)
 
     timeline = []
     selected = None
@@ -155,10 +147,8 @@ def suppliers():
     conn = get_db_connection()
     cursor = conn.cursor(dictionary=True)
 
-    cursor.execute("SELECT ComponentID, ComponentName FROM Components")
-    components = cursor.fetchall()
-    cursor.execute("SELECT MaterialID, MaterialName FROM RawMaterials")
-    materials = cursor.fetchall()
+    components = repository.component_options(conn)
+    materials = repository.material_options(conn)
 
     # ✅ FIXED: handle supplier-only form
     if request.method == 'POST':
@@ -184,26 +174,7 @@ def suppliers():
     """)
     sourcing = cursor.fetchall()
 
-    supplier_types = {}
-    cursor.execute("""
-        SELECT SupplierID,
-               SUM(ComponentID IS NOT NULL) AS comp_count,
-               SUM(MaterialID IS NOT NULL) AS mat_count
-        FROM Sourcing
-        GROUP BY SupplierID
-    """)
-    for row in cursor.fetchall():
-        cid = row['SupplierID']
-        comp_count = row['comp_count'] or 0
-        mat_count = row['mat_count'] or 0
-        if comp_count > 0 and mat_count > 0:
-            supplier_types[cid] = 'Both'
-        elif comp_count > 0:
-            supplier_types[cid] = 'Component Supplier'
-        elif mat_count > 0:
-            supplier_types[cid] = 'Material Supplier'
-        else:
-            supplier_types[cid] = 'Unknown'
+    supplier_types = repository.supplier_types(conn)
 
     conn.close()
     return render_template('suppliers.html',
@@ -254,10 +225,8 @@ def materials():
     conn = get_db_connection()
     cursor = conn.cursor(dictionary=True)
 
-    cursor.execute("SELECT ComponentID, ComponentName FROM Components")
-    components = cursor.fetchall()
-    cursor.execute("SELECT MaterialID, MaterialName, IsHazardous FROM RawMaterials")
-    materials_list = cursor.fetchall()
+    components = repository.component_options(conn)
+    materials_list = repository.material_options(conn)
 
     composition_rows = []
     selected_component = None
@@ -280,16 +249,10 @@ def materials():
         selected_component = comp_id_q
 
     if selected_component:
-        cursor.execute("""
-            SELECT cc.ComponentID, cc.MaterialID, rm.MaterialName, cc.WeightInGrams, rm.IsHazardous
-            FROM ComponentComposition cc
-            JOIN RawMaterials rm ON cc.MaterialID = rm.MaterialID
-            WHERE cc.ComponentID = %s
-        """, (selected_component,))
-        composition_rows = cursor.fetchall()
-
-        labels = [r['MaterialName'] for r in composition_rows]
-        weights = [float(r['WeightInGrams']) for r in composition_rows]
+        composition_rows = repository.component_composition(conn, selected_component)
+
+        labels = [r.MaterialName for r in composition_rows]
+        weights = [float(r.WeightInGrams) for r in composition_rows]
         composition_chart_data = {'labels': labels, 'weights': weights}
 
     conn.close()
@@ -306,10 +269,8 @@ def reports():
     conn = get_db_connection()
     cursor = conn.cursor(dictionary=True)
 
-    cursor.execute("SELECT InstanceID, SerialNumber FROM ProductInstances")
-    instances = cursor.fetchall()
-    cursor.execute("SELECT ProductID, ModelName FROM Products")
-    products = cursor.fetchall()
+    instances = repository.fetch_all(conn, repository.INSTANCES)
+    products = repository.product_options(conn)
 
     lifecycle_timeline = []
     trace_rows = []
@@ -335,11 +296,9 @@ def reports():
 @app.route('/api/products')
 def api_products():
     conn = get_db_connection()
-    cursor = conn.cursor(dictionary=True)
-    cursor.execute("SELECT ProductID, ModelName FROM Products")
-    rows = cursor.fetchall()
+    rows = repository.product_options(conn)
     conn.close()
-    return jsonify(rows)
+    return jsonify([r._asdict() for r in rows])
 
 
 if __name__ == '__main__':
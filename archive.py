@@ -0,0 +1,144 @@
+"""Lifecycle event retention job.
+
+    python archive.py
+
+1. Splits monthly partitions off LifecycleEvents' catch-all `pmax` partition
+   so the next PARTITION_MONTHS_AHEAD months each have their own.
+2. Moves every event of instances that were recycled/disposed more than
+   ARCHIVE_AFTER_DAYS ago into LifecycleEventsArchive, ARCHIVE_BATCH_SIZE
+   instances per transaction, with set-based INSERT ... SELECT / DELETE.
+3. Drops partitions older than the cutoff that the move left empty.
+
+Timelines keep reading both tiers through the LifecycleEventsAll view.
+Safe to run repeatedly (e.g. nightly from cron). With DB_SHARDS set it
+runs on every shard in turn, where the instances and their events are.
+"""
+from datetime import date, timedelta
+
+import config
+from db import get_db_connection
+from shards import get_shards
+
+CLOSED_EVENT_TYPES = ('Recycled', 'Recycled_Hazardous', 'Disposed')
+
+
+def _month_start(d, months_ahead=0):
+    month = d.month - 1 + months_ahead
+    return date(d.year + month // 12, month % 12 + 1, 1)
+
+
+def list_partitions(cursor):
+    """Return [(name, upper_bound_date or None for MAXVALUE)] in order."""
+    cursor.execute("""
+        SELECT PARTITION_NAME,
+               CASE WHEN PARTITION_DESCRIPTION = 'MAXVALUE' THEN NULL
+                    ELSE FROM_DAYS(PARTITION_DESCRIPTION) END AS upper_bound
+        FROM information_schema.PARTITIONS
+        WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = 'LifecycleEvents'
+        ORDER BY PARTITION_ORDINAL_POSITION
+    """)
+    return cursor.fetchall()
+
+
+def ensure_future_partitions(conn, months_ahead):
+    cursor = conn.cursor()
+    bounds = [b for _, b in list_partitions(cursor) if b is not None]
+    last_bound = max(bounds) if bounds else _month_start(date.today())
+    target = _month_start(date.today(), months_ahead + 1)
+
+    new_parts = []
+    bound = last_bound
+    while bound < target:
+        upper = _month_start(bound, 1)
+        new_parts.append(
+            f"PARTITION p{bound:%Y%m} VALUES LESS THAN (TO_DAYS('{upper:%Y-%m-%d}'))"
+        )
+        bound = upper
+
+    if new_parts:
+        cursor.execute(
+            "ALTER TABLE LifecycleEvents REORGANIZE PARTITION pmax INTO ("
+            + ", ".join(new_parts)
+            + ", PARTITION pmax VALUES LESS THAN MAXVALUE)"
+        )
+    return len(new_parts)
+
+
+def closed_instance_ids(conn, cutoff):
+    cursor = conn.cursor()
+    placeholders = ", ".join(["%s"] * len(CLOSED_EVENT_TYPES))
+    cursor.execute(f"""
+        SELECT DISTINCT InstanceID
+        FROM LifecycleEvents
+        WHERE EventType IN ({placeholders}) AND EventDate < %s
+        ORDER BY InstanceID
+    """, CLOSED_EVENT_TYPES + (cutoff,))
+    return [row[0] for row in cursor.fetchall()]
+
+
+def archive_instances(conn, instance_ids):
+    """Move all events of `instance_ids` to the archive in one transaction."""
+    cursor = conn.cursor()
+    placeholders = ", ".join(["%s"] * len(instance_ids))
+    params = tuple(instance_ids)
+    try:
+        # Tells Before_Lifecycle_Delete not to copy these rows to LifecycleBackup
+        cursor.execute("SET @archiving = 1")
+        cursor.execute(f"""
+            INSERT INTO LifecycleEventsArchive (EventID, EventType, EventDate, InstanceID)
+            SELECT EventID, EventType, EventDate, InstanceID
+            FROM LifecycleEvents
+            WHERE InstanceID IN ({placeholders})
+        """, params)
+        moved = cursor.rowcount
+        cursor.execute(f"DELETE FROM LifecycleEvents WHERE InstanceID IN ({placeholders})", params)
+        conn.commit()
+        return moved
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cursor.execute("SET @archiving = NULL")
+
+
+def drop_empty_partitions(conn, cutoff):
+    cursor = conn.cursor()
+    dropped = []
+    for name, upper_bound in list_partitions(cursor):
+        if upper_bound is None or upper_bound > cutoff:
+            continue
+        cursor.execute(f"SELECT 1 FROM LifecycleEvents PARTITION ({name}) LIMIT 1")
+        if cursor.fetchone() is None:
+            cursor.execute(f"ALTER TABLE LifecycleEvents DROP PARTITION {name}")
+            dropped.append(name)
+    return dropped
+
+
+def run(archive_after_days=None, batch_size=None, months_ahead=None):
+    archive_after_days = config.ARCHIVE_AFTER_DAYS if archive_after_days is None else archive_after_days
+    batch_size = batch_size or config.ARCHIVE_BATCH_SIZE
+    months_ahead = config.PARTITION_MONTHS_AHEAD if months_ahead is None else months_ahead
+    cutoff = date.today() - timedelta(days=archive_after_days)
+
+    nodes = [(f"shard {s.index}", s.connect) for s in get_shards()] or [('primary', get_db_connection)]
+    for name, connect in nodes:
+        conn = connect()
+        try:
+            added = ensure_future_partitions(conn, months_ahead)
+
+            ids = closed_instance_ids(conn, cutoff)
+            moved = 0
+            for i in range(0, len(ids), batch_size):
+                moved += archive_instances(conn, ids[i:i + batch_size])
+
+            dropped = drop_empty_partitions(conn, cutoff)
+        finally:
+            conn.close()
+
+        print(f"[{name}] Partitions added: {added}")
+        print(f"[{name}] Instances archived: {len(ids)} ({moved} events)")
+        print(f"[{name}] Empty partitions dropped: {', '.join(dropped) or 'none'}")
+
+
+if __name__ == '__main__':
+    run()
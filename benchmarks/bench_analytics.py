@@ -0,0 +1,76 @@
+"""Fleet analytics over a synthetic event log.
+
+    python benchmarks/bench_analytics.py [events] [products]
+
+Builds load_event_arrays-style arrays for ~`events` lifecycle events
+(Manufactured -> Sold -> Repair -> Recycled/Disposed, one to four events
+per instance) and times compute_fleet_analytics on them, step by step.
+Defaults to 10M events over 500 products. Reading the log from the
+database is not included; see bench_olap.py for the scan.
+"""
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import analytics  # noqa: E402
+from lifecycle import STATE_CODES  # noqa: E402
+
+PATH = [STATE_CODES[s] for s in ('Manufactured', 'Sold', 'Repair')]
+END = [STATE_CODES[s] for s in ('Recycled', 'Disposed')]
+
+
+def synthetic_arrays(n_events, n_products, seed=42):
+    rng = np.random.default_rng(seed)
+    n_instances = n_events * 2 // 5
+    counts = rng.integers(1, 5, n_instances)
+    inst = np.repeat(np.arange(n_instances), counts)
+    starts = np.cumsum(counts) - counts
+    position = np.arange(len(inst)) - starts[inst]
+
+    code = np.where(position < 3, np.array(PATH + [0], dtype=np.int8)[np.minimum(position, 3)],
+                    np.array(END, dtype=np.int8)[rng.integers(0, 2, len(inst))]).astype(np.int8)
+    # Events 1-200 days apart from a start within the last four years
+    gaps = rng.uniform(1, 200, len(inst)) * analytics.SECONDS_PER_DAY
+    elapsed = np.cumsum(gaps)
+    elapsed -= (elapsed - gaps)[starts][inst]
+    ts = 1.6e9 + rng.uniform(0, 4 * 365 * analytics.SECONDS_PER_DAY, n_instances)[inst] + elapsed
+
+    products = np.array([f"P{p:05d}" for p in range(n_products)])
+    return {
+        'instance_ids': np.arange(1, n_instances + 1, dtype=np.int64),
+        'products': products,
+        'product_of': rng.integers(0, n_products, n_instances),
+        'inst': inst,
+        'code': code,
+        'ts': ts,
+    }
+
+
+def timed(label, fn, *args):
+    start = time.perf_counter()
+    result = fn(*args)
+    print(f"{label:<28} {time.perf_counter() - start:>8.2f} s")
+    return result
+
+
+def main(n_events=10000000, n_products=500):
+    data = synthetic_arrays(n_events, n_products)
+    now = float(data['ts'].max())
+    print(f"{len(data['ts']):,} events, {len(data['instance_ids']):,} instances, {n_products} products")
+
+    start = time.perf_counter()
+    first = timed('first_occurrence', analytics.first_occurrence, data)
+    _, eol = timed('milestone_durations', analytics.milestone_durations, first)
+    timed('time_in_state', analytics.time_in_state, data, now)
+    timed('survival_by_product', analytics.survival_by_product, data, first, eol, now)
+    print(f"{'total':<28} {time.perf_counter() - start:>8.2f} s")
+
+    timed('compute_fleet_analytics', analytics.compute_fleet_analytics, data, now)
+
+
+if __name__ == '__main__':
+    main(*(int(a) for a in sys.argv[1:3]))
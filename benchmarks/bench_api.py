@@ -0,0 +1,73 @@
+"""Concurrent-client benchmark for the JSON API.
+
+Start both servers with a single worker each, then point this script at them:
+
+    python app.py                                              # sync, :5000
+    hypercorn api_async:app --workers 1 --bind 127.0.0.1:5001  # async, :5001
+
+    python benchmarks/bench_api.py http://127.0.0.1:5000/api/products
+    python benchmarks/bench_api.py http://127.0.0.1:5001/api/products
+
+For each concurrency level it reports throughput and latency percentiles;
+the level where p99 latency blows up is how many concurrent clients the
+worker sustains.
+"""
+import http.client
+import statistics
+import sys
+import threading
+import time
+from urllib.parse import urlsplit
+
+DURATION_SECONDS = 10
+CONCURRENCY_LEVELS = [1, 8, 32, 128, 256]
+
+
+def client(url, deadline, latencies, errors):
+    parts = urlsplit(url)
+    conn = http.client.HTTPConnection(parts.hostname, parts.port, timeout=30)
+    path = parts.path + ('?' + parts.query if parts.query else '')
+    while time.perf_counter() < deadline:
+        start = time.perf_counter()
+        try:
+            conn.request('GET', path)
+            resp = conn.getresponse()
+            resp.read()
+            if resp.status != 200:
+                errors.append(resp.status)
+                continue
+        except Exception as e:
+            errors.append(e)
+            conn.close()
+            conn = http.client.HTTPConnection(parts.hostname, parts.port, timeout=30)
+            continue
+        latencies.append(time.perf_counter() - start)
+    conn.close()
+
+
+def run(url, concurrency):
+    latencies, errors = [], []
+    deadline = time.perf_counter() + DURATION_SECONDS
+    threads = [threading.Thread(target=client, args=(url, deadline, latencies, errors))
+               for _ in range(concurrency)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    latencies.sort()
+    if not latencies:
+        print(f"{concurrency:>5} clients: no successful requests ({len(errors)} errors)")
+        return
+    p50 = latencies[len(latencies) // 2] * 1000
+    p99 = latencies[int(len(latencies) * 0.99) - 1] * 1000
+    print(f"{concurrency:>5} clients: {len(latencies) / DURATION_SECONDS:8.1f} req/s  "
+          f"mean {statistics.mean(latencies) * 1000:7.2f} ms  p50 {p50:7.2f} ms  "
+          f"p99 {p99:7.2f} ms  errors {len(errors)}")
+
+
+if __name__ == '__main__':
+    target = sys.argv[1] if len(sys.argv) > 1 else 'http://127.0.0.1:5001/api/products'
+    print(f"Benchmarking {target} for {DURATION_SECONDS}s per level")
+    for level in CONCURRENCY_LEVELS:
+        run(target, level)
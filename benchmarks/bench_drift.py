@@ -0,0 +1,93 @@
+"""Cost and accuracy of the drift summaries (drift.py).
+
+    python benchmarks/bench_drift.py [predictions]
+
+Feeds `predictions` synthetic feature rows through DriftMonitor.observe
+(the per-request cost), then reports the sketch's size and rank error
+against the exact values, the size of the per-process file, how long
+scoring (/metrics) takes, and the drift scores for an unshifted stream and
+for total_weight shifted by one standard deviation.
+"""
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+directory = tempfile.mkdtemp(prefix='bench-drift-')
+os.environ['DRIFT_DIR'] = directory
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import joblib  # noqa: E402
+import numpy as np  # noqa: E402
+
+import drift  # noqa: E402
+from model import FEATURES, SCALER_PATH  # noqa: E402
+
+
+class Frame(dict):
+    """The two things build_reference uses of predict.py's DataFrame."""
+
+    @property
+    def columns(self):
+        return list(self)
+
+
+def rows(rng, n, shift=0.0):
+    return {
+        'total_weight': rng.normal(1300 + shift, 200, n),
+        'avg_recyclability': rng.uniform(1, 4, n),
+        'hazardous_count': rng.integers(0, 5, n).astype(float),
+        'component_count': rng.integers(5, 12, n).astype(float),
+    }
+
+
+def stream(reference_path, columns, probabilities):
+    monitor = drift.DriftMonitor(FEATURES, reference_path, SCALER_PATH)
+    n = len(probabilities)
+    start = time.perf_counter()
+    for i in range(n):
+        monitor.observe({f: float(columns[f][i]) for f in FEATURES}, float(probabilities[i]))
+    return monitor, (time.perf_counter() - start) / n * 1e6
+
+
+def main(n=200000):
+    try:
+        rng = np.random.default_rng(7)
+        reference_path = os.path.join(directory, 'reference.pkl')
+        joblib.dump(drift.build_reference(Frame(rows(rng, 20000)), rng.beta(2, 3, 20000)), reference_path)
+
+        columns = rows(rng, n)
+        monitor, per_call = stream(reference_path, columns, rng.beta(2, 3, n))
+        print(f"observe(): {per_call:.1f} us per prediction ({n:,} predictions)")
+
+        summary = next(iter(monitor._windows.values()))['total_weight']
+        exact = np.sort(columns['total_weight'])
+        points = list(np.quantile(exact, drift.QUANTILES))
+        error = max(abs(s - np.searchsorted(exact, p, side='right') / n)
+                    for s, p in zip(summary.sketch.cdf(points), points))
+        held = sum(map(len, summary.sketch.levels))
+        print(f"sketch: {held:,} values held, max rank error {error:.4f}")
+        monitor.flush()
+        size = sum(os.path.getsize(os.path.join(directory, f)) for f in os.listdir(directory) if f.endswith('.json'))
+        print(f"per-process file: {size / 1000:.0f} kB")
+
+        start = time.perf_counter()
+        scores = monitor.scores()
+        print(f"scores() / GET /metrics: {(time.perf_counter() - start) * 1000:.1f} ms")
+        print(f"{'':<22} {'psi':>7} {'ks':>7} {'mean_shift':>11}")
+        for label, shift in (('unshifted', 0.0), ('total_weight +1 sd', 200.0)):
+            if shift:
+                for f in os.listdir(directory):
+                    if f.endswith('.json'):
+                        os.remove(os.path.join(directory, f))
+                monitor, _ = stream(reference_path, rows(rng, 20000, shift), rng.beta(2, 3, 20000))
+                scores = monitor.scores()
+            entry = scores['total_weight']
+            print(f"{label:<22} {entry['psi']:>7.3f} {entry['ks']:>7.3f} {entry['mean_shift']:>11.3f}")
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    main(*(int(a) for a in sys.argv[1:2]))
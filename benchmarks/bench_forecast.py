@@ -0,0 +1,53 @@
+"""Return-flow forecast benchmark on a synthetic catalog.
+
+    python benchmarks/bench_forecast.py [products] [materials] [months]
+
+Defaults to 100k products x 1k materials with ~20 materials per product,
+the sizes the forecast is meant to handle interactively, and a synthetic
+event log of 10 events per product (bench_analytics.py) for the survival
+curves. The expected units are computed once per write to the event
+tables; the returns are computed per request.
+"""
+import os
+import sys
+import time
+
+import numpy as np
+from scipy import sparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bench_analytics import synthetic_arrays  # noqa: E402
+from forecast import expected_returns, expected_units, returns_by_grade  # noqa: E402
+
+MATERIALS_PER_PRODUCT = 20
+
+
+def main(n_products=100000, n_materials=1000, months=24):
+    rng = np.random.default_rng(42)
+    nnz = n_products * MATERIALS_PER_PRODUCT
+    mass = sparse.csr_matrix(
+        (rng.uniform(1, 500, nnz),
+         (np.repeat(np.arange(n_products), MATERIALS_PER_PRODUCT), rng.integers(0, n_materials, nnz))),
+        shape=(n_products, n_materials)
+    )
+    grades = rng.choice(['A', 'B', 'C', 'D'], n_materials)
+    data = synthetic_arrays(n_products * 10, n_products)
+
+    start = time.perf_counter()
+    units = expected_units(data, data['ts'].max())
+    survival = time.perf_counter() - start
+
+    start = time.perf_counter()
+    grams = expected_returns(mass, units[:months])
+    by_grade = returns_by_grade(grams / 1000.0, grades)
+    elapsed = time.perf_counter() - start
+
+    print(f"{n_products} products x {n_materials} materials ({mass.nnz} non-zeros), {months} months")
+    print(f"expected units ({len(data['inst'])} events): {survival:.2f} s")
+    print(f"forecast: {elapsed * 1000:.1f} ms")
+    print(f"month 1 total: {by_grade[0].sum():,.0f} kg")
+
+
+if __name__ == '__main__':
+    main(*(int(a) for a in sys.argv[1:4]))
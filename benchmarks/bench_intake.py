@@ -0,0 +1,53 @@
+"""Intake latency of the write-behind journal.
+
+    python benchmarks/bench_intake.py [events per thread] [threads]
+
+Appends events to a throwaway journal (no flusher, no database) and prints
+the per-append latency percentiles, i.e. what a scanner waits for before it
+gets its 202. Each append is durable (group-committed fsync).
+"""
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from journal import Journal  # noqa: E402
+
+
+def main(n=2000, threads=8):
+    directory = tempfile.mkdtemp(prefix='bench-journal-')
+    journal = Journal(directory)
+    latencies = []
+    lock = threading.Lock()
+
+    def scanner(t):
+        mine = []
+        for i in range(n):
+            start = time.perf_counter()
+            journal.append(t * n + i, 'Sold')
+            mine.append(time.perf_counter() - start)
+        with lock:
+            latencies.extend(mine)
+
+    start = time.perf_counter()
+    workers = [threading.Thread(target=scanner, args=(t,)) for t in range(threads)]
+    for w in workers:
+        w.start()
+    for w in workers:
+        w.join()
+    elapsed = time.perf_counter() - start
+    journal.close()
+
+    latencies.sort()
+    pct = lambda p: latencies[min(len(latencies) - 1, int(p / 100 * len(latencies)))] * 1000  # noqa: E731
+    print(f"{threads} threads x {n} events: {len(latencies) / elapsed:,.0f} events/s")
+    print(f"latency ms  p50 {pct(50):.3f}  p95 {pct(95):.3f}  p99 {pct(99):.3f}")
+    shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    main(*(int(a) for a in sys.argv[1:3]))
@@ -0,0 +1,123 @@
+"""Dashboard aggregates on the database vs the exported Parquet copy.
+
+    python benchmarks/bench_olap.py [events]
+
+Fills a throwaway SQLite database with `events` lifecycle events spread
+over 10,000 instances, times a full and an incremental olap.export(), then
+runs the dashboard's fleet aggregates (instance / event counts, event
+distribution, recyclability) and the composition report against SQLite and
+against DuckDB on the exported files.
+"""
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+directory = tempfile.mkdtemp(prefix='bench-olap-')
+os.environ['DB_BACKEND'] = 'sqlite'
+os.environ['DB_SQLITE_PATH'] = os.path.join(directory, 'bench.sqlite3')
+os.environ['OLAP_DIR'] = os.path.join(directory, 'olap')
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import sqlite_backend  # noqa: E402
+from lifecycle import END_OF_LIFE, LIFECYCLE  # noqa: E402
+
+INSTANCES = 10000
+
+DASHBOARD_SQL = [
+    "SELECT (SELECT COUNT(*) FROM ProductInstances) AS instances, (SELECT COUNT(*) FROM LifecycleEventsAll) AS events",
+    "SELECT EventType, COUNT(*) AS cnt FROM LifecycleEventsAll GROUP BY EventType",
+    "SELECT cc.WeightInGrams, rm.RecyclableGrade FROM ComponentComposition cc "
+    "JOIN RawMaterials rm ON cc.MaterialID = rm.MaterialID",
+]
+
+
+def fill():
+    conn = sqlite_backend.connect()
+    conn.raw.executemany("INSERT INTO ProductInstances (SerialNumber, ProductID) VALUES (?, 'P100')",
+                         ((f"BENCH-{i:06d}",) for i in range(INSTANCES)))
+    conn.raw.commit()
+    conn.close()
+
+
+def add_events(events, seed=7):
+    rng = random.Random(seed)
+    conn = sqlite_backend.connect()
+    raw = conn.raw
+    states = dict(raw.execute("SELECT InstanceID, CurrentState FROM ProductInstances"))
+    live = [i for i, state in states.items() if LIFECYCLE[state]]
+    # Histories that Before_Lifecycle_Insert accepts: after Sold, mostly repairs, so
+    # about one end-of-life event per instance over the whole run
+    when = datetime.fromisoformat(raw.execute("SELECT MAX(EventDate) FROM LifecycleEvents").fetchone()[0])
+    rows = []
+    while len(rows) < events and live:
+        k = rng.randrange(len(live))
+        inst = live[k]
+        allowed = LIFECYCLE[states[inst]]
+        if 'Repair' in allowed and rng.random() >= len(states) / events:
+            event = 'Repair'
+        else:
+            event = rng.choice([e for e in allowed if e != 'Repair'])
+        when += timedelta(seconds=1)
+        rows.append((event, when.strftime('%Y-%m-%d %H:%M:%S'), inst))
+        states[inst] = event
+        if event in END_OF_LIFE:
+            live[k] = live[-1]
+            live.pop()
+    raw.executemany("INSERT INTO LifecycleEvents (EventType, EventDate, InstanceID) VALUES (?, ?, ?)", rows)
+    raw.commit()
+    conn.close()
+
+
+def best_of(fn, runs=5):
+    times = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+    return min(times) * 1000
+
+
+def dashboard(conn):
+    cursor = conn.cursor(dictionary=True)
+    for sql in DASHBOARD_SQL:
+        cursor.execute(sql)
+        cursor.fetchall()
+
+
+def main(events=1000000):
+    try:
+        fill()
+        add_events(events)
+        import olap
+
+        start = time.perf_counter()
+        olap.export()
+        full = time.perf_counter() - start
+        fill_more = 10000
+        add_events(fill_more, seed=8)
+        start = time.perf_counter()
+        olap.export()
+        incremental = time.perf_counter() - start
+        size = sum(os.path.getsize(os.path.join(d, f)) for d, _, files in os.walk(os.environ['OLAP_DIR'])
+                   for f in files)
+        print(f"{events:,} events: full export {full:.1f} s, incremental (+{fill_more:,}) {incremental:.2f} s, "
+              f"{size / 1e6:.1f} MB of Parquet")
+
+        store = olap.OLAP_STORE.connect()
+        db = sqlite_backend.connect()
+        print(f"{'query':<24} {'SQLite ms':>10} {'DuckDB ms':>10}")
+        print(f"{'dashboard aggregates':<24} {best_of(lambda: dashboard(db)):>10.1f} "
+              f"{best_of(lambda: dashboard(store)):>10.1f}")
+        print(f"{'composition report':<24} {best_of(lambda: olap.composition_report(db)):>10.1f} "
+              f"{best_of(lambda: olap.composition_report(store)):>10.1f}")
+        db.close()
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    main(*(int(a) for a in sys.argv[1:2]))
@@ -0,0 +1,146 @@
+"""Row decode and allocation cost: dictionary cursors vs repository rows.
+
+    python benchmarks/bench_rows.py [rows]
+
+1. In memory: turning `rows` five-column result tuples into dicts (what
+   cursor(dictionary=True) does per row) vs namedtuples (repository.Query)
+   vs leaving them as tuples. Time per row, and bytes per row held while
+   the result list is alive (tracemalloc).
+2. SQLite backend: the sourcing page query over `rows` sourcing rows, with
+   a dictionary cursor and through repository.fetch_all.
+3. MySQL, if DB_BACKEND is mysql and DB_HOST answers: a small dropdown query run 5,000 times on one
+   pooled connection over the text protocol vs as a cached prepared
+   statement, and the large query both ways. Skipped otherwise.
+"""
+import gc
+import os
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+from decimal import Decimal
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+COLUMNS = ['ComponentID', 'MaterialID', 'MaterialName', 'WeightInGrams', 'UpdatedAt']
+
+
+def per_row(fn, rows, repeat=5):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn(rows)
+        best = min(best, time.perf_counter() - start)
+    return best / len(rows) * 1e9
+
+
+def bytes_per_row(fn, rows):
+    gc.collect()
+    tracemalloc.start()
+    result = fn(rows)
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del result
+    return size / len(rows)
+
+
+def in_memory(n):
+    from repository import Query
+
+    row = Query('Composition', COLUMNS, '').row
+    rows = [(f"c{i % 500}", f"m{i % 80}", f"Material {i % 80}", Decimal('12.50'), datetime(2025, 1, 1))
+            for i in range(n)]
+    decoders = [
+        ('dict (dictionary=True)', lambda rs: [dict(zip(COLUMNS, r)) for r in rs]),
+        ('namedtuple (repository)', lambda rs: [row._make(r) for r in rs]),
+        ('tuple', lambda rs: list(rs)),
+    ]
+    print(f"1. decoding {n:,} rows of {len(COLUMNS)} columns")
+    print(f"   {'rows as':<26} {'ns/row':>8} {'bytes/row':>10}")
+    for label, fn in decoders:
+        print(f"   {label:<26} {per_row(fn, rows):>8.0f} {bytes_per_row(fn, rows):>10.0f}")
+
+
+def sqlite_backend_query(n, path):
+    import repository
+    import sqlite_backend
+
+    conn = sqlite_backend.connect(path)
+    raw = conn.raw
+    component = raw.execute("SELECT ComponentID FROM Components LIMIT 1").fetchone()[0]
+    raw.executemany("INSERT INTO Suppliers (SupplierID, SupplierName) VALUES (?, ?)",
+                    ((f"BS{i:07d}", f"Bench Supplier {i}") for i in range(n)))
+    raw.executemany("INSERT INTO Sourcing (SupplierID, ComponentID) VALUES (?, ?)",
+                    ((f"BS{i:07d}", component) for i in range(n)))
+    raw.commit()
+
+    def dictionary(_):
+        cursor = conn.cursor(dictionary=True)
+        cursor.execute(repository.SOURCING.sql)
+        return cursor.fetchall()
+
+    def rows(_):
+        return repository.fetch_all(conn, repository.SOURCING)
+
+    print(f"2. SQLite backend, sourcing query over {n:,} rows")
+    print(f"   {'cursor':<26} {'ns/row':>8} {'bytes/row':>10}")
+    for label, fn in (('dictionary=True', dictionary), ('repository.fetch_all', rows)):
+        result_rows = [None] * n
+        print(f"   {label:<26} {per_row(fn, result_rows, repeat=3):>8.0f} {bytes_per_row(fn, result_rows):>10.0f}")
+    conn.close()
+
+
+def mysql_queries(repeat=5000):
+    import mysql.connector
+
+    import config
+    import repository
+    from db import get_db_connection
+
+    if config.DB_BACKEND != 'mysql':
+        print("3. MySQL: skipped (DB_BACKEND is not mysql)")
+        return
+    try:
+        conn = get_db_connection()
+    except mysql.connector.Error as e:
+        print(f"3. MySQL: skipped ({e})")
+        return
+    try:
+        def text(query):
+            cursor = conn.cursor(dictionary=True)
+            cursor.execute(query.sql)
+            return cursor.fetchall()
+
+        def prepared(query):
+            return repository.fetch_all(conn, query)
+
+        print(f"3. MySQL at {config.DB_HOST}:{config.DB_PORT}")
+        for label, fn in (('text protocol, dict rows', text), ('prepared, namedtuple rows', prepared)):
+            fn(repository.PRODUCTS)
+            start = time.perf_counter()
+            for _ in range(repeat):
+                fn(repository.PRODUCTS)
+            small = (time.perf_counter() - start) / repeat * 1e6
+            start = time.perf_counter()
+            count = len(fn(repository.SOURCING))
+            large = (time.perf_counter() - start) * 1000
+            print(f"   {label:<28} dropdown {small:>7.0f} us/query   sourcing ({count:,} rows) {large:>7.1f} ms")
+    finally:
+        conn.close()
+
+
+def main(n=200000):
+    in_memory(n)
+    directory = tempfile.mkdtemp(prefix='bench-rows-')
+    try:
+        sqlite_backend_query(n, os.path.join(directory, 'bench.sqlite3'))
+    finally:
+        shutil.rmtree(directory)
+    mysql_queries()
+
+
+if __name__ == '__main__':
+    main(*(int(a) for a in sys.argv[1:2]))
@@ -0,0 +1,80 @@
+"""Search index build time, memory and query latency at scale.
+
+    python benchmarks/bench_search.py [serials]
+
+Builds a search.InvertedIndex of `serials` serial numbers plus 50,000
+component / material / supplier / product names, writes it as the shared
+snapshot the workers map (search.FrozenIndex), then times a mix of queries
+on both: whole serials, serial fragments, name prefixes, two-word queries,
+one-letter prefixes and misses.
+"""
+import os
+import random
+import resource
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from search import FrozenIndex, InvertedIndex, write_index  # noqa: E402
+
+NAME_WORDS = ['battery', 'pack', 'aluminum', 'frame', 'steel', 'casing', 'copper', 'wire', 'lithium', 'cell',
+              'display', 'panel', 'glass', 'plastic', 'abs', 'motor', 'housing', 'circuit', 'board', 'screw',
+              'recycled', 'alloy', 'rubber', 'seal', 'global', 'metals', 'components', 'supply', 'green', 'works']
+NAME_KINDS = ['component', 'material', 'supplier', 'product']
+
+
+def fill(index, serials, names=50000, seed=3):
+    rng = random.Random(seed)
+    for i in range(names):
+        text = ' '.join(rng.sample(NAME_WORDS, rng.randint(1, 3))).title() + f" {rng.randrange(10, 999)}"
+        index.add(NAME_KINDS[i % len(NAME_KINDS)], f"N{i}", text)
+    for i in range(serials):
+        index.add('serial', i + 1, f"{rng.choice(['SN', 'PX', 'EV'])}-{2020 + i % 6}-{rng.randrange(10 ** 7):07d}")
+
+
+def main(serials=3000000):
+    index = InvertedIndex()
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    start = time.perf_counter()
+    fill(index, serials)
+    build = time.perf_counter() - start
+    # Linux reports KiB
+    size = (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - rss) * 1024
+    print(f"{len(index):,} entries: built in {build:.1f} s, {size / 1e6:.0f} MB "
+          f"({len(index.words):,} words, {len(index.grams):,} prefix/n-gram keys)")
+
+    path = os.path.join(tempfile.mkdtemp(), 'search.snapshot')
+    start = time.perf_counter()
+    write_index(index, path, {})
+    written = time.perf_counter() - start
+    frozen = FrozenIndex(path)
+    print(f"snapshot: written in {written:.1f} s, {os.path.getsize(path) / 1e6:.0f} MB shared; "
+          f"{len(frozen.alive) / 1e6:.1f} MB of its own per worker")
+
+    rng = random.Random(5)
+    picks = [index.texts[rng.randrange(50000, len(index))] for _ in range(200)]
+    queries = {
+        'whole serial': picks,
+        'serial fragment (5 digits)': [p[-6:-1] for p in picks],
+        'name prefix': [w[:4] for w in rng.choices(NAME_WORDS, k=200)],
+        'two words': [' '.join(rng.sample(NAME_WORDS, 2)) for _ in range(200)],
+        'one letter': [rng.choice('abcdefgpsw') for _ in range(200)],
+        'miss': [f"qz{i}x" for i in range(200)],
+    }
+    for name, searched in (('in memory', index), ('snapshot', frozen)):
+        print(f"{name + ': query':<28} {'median ms':>10} {'p99 ms':>8} {'results':>8}")
+        for label, texts in queries.items():
+            times, hits = [], 0
+            for text in texts:
+                t = time.perf_counter()
+                hits += len(searched.search(text, limit=20))
+                times.append((time.perf_counter() - t) * 1000)
+            times.sort()
+            print(f"{label:<28} {times[len(times) // 2]:>10.3f} {times[int(len(times) * 0.99)]:>8.3f} "
+                  f"{hits / len(texts):>8.1f}")
+
+
+if __name__ == '__main__':
+    main(*(int(a) for a in sys.argv[1:2]))
@@ -0,0 +1,92 @@
+"""Lookup throughput of /api/serials/<serial> for one worker.
+
+    python benchmarks/bench_serials.py [registered serials] [lookups]
+
+Registers `registered serials` instances in a throwaway SQLite database,
+then replays a scanner mix against one process: 90% scans of registered
+serials (skewed, so a hot set stays in the LRU) and 10% unknown serials.
+Prints lookups/s for the SerialIndex alone and for the full WSGI request,
+against the 20k lookups/s per worker target.
+"""
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+TARGET = 20000
+
+directory = tempfile.mkdtemp(prefix='bench-serials-')
+os.environ['DB_BACKEND'] = 'sqlite'
+os.environ['DB_SQLITE_PATH'] = os.path.join(directory, 'bench.sqlite3')
+os.environ.setdefault('CACHE_VERSION_TTL', '1.0')
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import sqlite_backend  # noqa: E402
+
+
+def register(n):
+    conn = sqlite_backend.connect()
+    raw = conn.raw
+    raw.executemany("INSERT INTO ProductInstances (SerialNumber, ProductID) VALUES (?, 'P100')",
+                    ((f"BENCH-{i:08d}",) for i in range(n)))
+    raw.execute("""
+        INSERT INTO LifecycleEvents (EventType, EventDate, InstanceID)
+        SELECT 'Manufactured', '2024-01-01 00:00:00', InstanceID FROM ProductInstances
+        WHERE SerialNumber LIKE 'BENCH-%'
+    """)
+    raw.commit()
+    conn.close()
+
+
+def scans(n, registered, seed=7):
+    rng = random.Random(seed)
+    out = []
+    for _ in range(n):
+        if rng.random() < 0.1:
+            out.append(f"UNKNOWN-{rng.randrange(10 ** 9):09d}")
+        else:
+            # Pareto-skewed: most scans hit a small set of devices
+            out.append(f"BENCH-{min(int(rng.paretovariate(1.2)) - 1, registered - 1):08d}")
+    return out
+
+
+def run(label, fn, serials):
+    fn(serials[0])
+    start = time.perf_counter()
+    for s in serials:
+        fn(s)
+    rate = len(serials) / (time.perf_counter() - start)
+    print(f"{label:<28} {rate:>10,.0f} lookups/s  ({rate / TARGET:.0%} of {TARGET:,} target)")
+
+
+def main(registered=100000, lookups=50000):
+    try:
+        register(registered)
+        from app import app
+        from serials import SERIAL_INDEX
+
+        serials = scans(lookups, registered)
+        print(f"{registered:,} registered serials, {lookups:,} scans (10% unknown)")
+        run("SerialIndex.lookup", SERIAL_INDEX.lookup, serials)
+
+        environ_base = {'REQUEST_METHOD': 'GET', 'SERVER_NAME': 'bench', 'SERVER_PORT': '80',
+                        'wsgi.url_scheme': 'http', 'SCRIPT_NAME': '', 'QUERY_STRING': ''}
+
+        def http(serial):
+            environ = dict(environ_base, PATH_INFO='/api/serials/' + serial)
+            body = app.wsgi_app(environ, lambda status, headers, exc_info=None: None)
+            b''.join(body)
+            if hasattr(body, 'close'):
+                body.close()
+
+        run("GET /api/serials/<serial>", http, serials)
+        print(f"LRU entries {len(SERIAL_INDEX._summaries):,}, "
+              f"Bloom {SERIAL_INDEX.bloom.size / 8 / 1e6:.1f} MB with {SERIAL_INDEX.bloom.hashes} hashes")
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    main(*(int(a) for a in sys.argv[1:3]))
@@ -0,0 +1,114 @@
+"""Time to first byte and peak memory of the large pages, streamed vs whole.
+
+    python benchmarks/bench_streaming.py [rows]
+
+Builds a throwaway SQLite database holding `rows` suppliers (each with a
+sourcing row) and `rows` lifecycle events on one new instance (manufactured,
+sold, then repaired over and over), then requests
+/suppliers and that instance's lifecycle report once with STREAM_TEMPLATES=1
+and once with STREAM_TEMPLATES=0. Every measurement runs in a fresh process,
+so peak RSS is that request's own high-water mark (growth over the process
+after start-up and a warm-up request).
+
+It also times a fresh process's first page (template compilation included)
+with an empty and with a populated Jinja bytecode cache.
+"""
+import os
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+def build_database(path, rows):
+    os.environ['DB_BACKEND'] = 'sqlite'
+    os.environ['DB_SQLITE_PATH'] = path
+    import sqlite_backend
+
+    conn = sqlite_backend.connect()
+    raw = conn.raw
+    component = raw.execute("SELECT ComponentID FROM Components ORDER BY ComponentID LIMIT 1").fetchone()[0]
+    instance = raw.execute("INSERT INTO ProductInstances (SerialNumber, ProductID) VALUES ('BENCH-STREAM', 'P100')"
+                           ).lastrowid
+    raw.executemany("INSERT INTO Suppliers (SupplierID, SupplierName) VALUES (?, ?)",
+                    ((f"BS{i:07d}", f"Bench Supplier {i}") for i in range(rows)))
+    raw.executemany("INSERT INTO Sourcing (SupplierID, ComponentID) VALUES (?, ?)",
+                    ((f"BS{i:07d}", component) for i in range(rows)))
+    raw.executemany("INSERT INTO LifecycleEvents (EventType, EventDate, InstanceID) VALUES (?, ?, ?)",
+                    ((['Manufactured', 'Sold'][i] if i < 2 else 'Repair', f"2020-01-01 00:00:00.{i:06d}", instance)
+                     for i in range(rows)))
+    raw.commit()
+    conn.close()
+    return instance
+
+
+def measure(url):
+    """Run in the child: TTFB, total time, bytes and RSS growth for one GET of `url`."""
+    from werkzeug.test import EnvironBuilder
+
+    from app import app
+
+    def get(target):
+        environ = EnvironBuilder(path=target.split('?')[0], query_string=target.partition('?')[2]).get_environ()
+        start = time.perf_counter()
+        body = app.wsgi_app(environ, lambda status, headers, exc_info=None: None)
+        first, size = None, 0
+        try:
+            for chunk in body:
+                if chunk and first is None:
+                    first = time.perf_counter() - start
+                size += len(chunk)
+        finally:
+            if hasattr(body, 'close'):
+                body.close()
+        return first, time.perf_counter() - start, size
+
+    _, cold, _ = get('/reports')
+    baseline = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    ttfb, total, size = get(url)
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - baseline
+    print(f"{ttfb * 1000:.1f} {total * 1000:.1f} {size} {peak} {cold * 1000:.1f}")
+
+
+def run(path, url, streamed, jinja_cache):
+    env = dict(os.environ, DB_SQLITE_PATH=path, STREAM_TEMPLATES=streamed, CACHE_ENABLED='0',
+               JINJA_CACHE_DIR=jinja_cache)
+    out = subprocess.run([sys.executable, __file__, '--measure', url], env=env, cwd=ROOT,
+                         capture_output=True, text=True, check=True).stdout
+    return out.split()[-5:]
+
+
+def main(rows=100000):
+    directory = tempfile.mkdtemp(prefix='bench-streaming-')
+    try:
+        path = os.path.join(directory, 'bench.sqlite3')
+        instance = build_database(path, rows)
+        urls = ['/suppliers', f'/reports?report_type=lifecycle&instance_id={instance}']
+        print(f"{rows:,} rows")
+        print(f"{'view':<44} {'mode':<9} {'TTFB ms':>9} {'total ms':>9} {'MB sent':>8} {'peak RSS +MB':>13}")
+        for url in urls:
+            for streamed in ('1', '0'):
+                ttfb, total, size, peak, _ = run(path, url, streamed, os.path.join(directory, 'jinja'))
+                mode = 'streamed' if streamed == '1' else 'whole'
+                print(f"{url:<44} {mode:<9} {float(ttfb):>9.1f} {float(total):>9.1f} "
+                      f"{int(size) / 1e6:>8.1f} {int(peak) / 1024:>13.1f}")
+
+        cache = os.path.join(directory, 'jinja-cold')
+        empty = run(path, '/', '1', cache)[-1]
+        populated = run(path, '/', '1', cache)[-1]
+        print(f"first /reports in a new process: {float(empty):.1f} ms with an empty bytecode cache, "
+              f"{float(populated):.1f} ms with a populated one")
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    if sys.argv[1:2] == ['--measure']:
+        measure(sys.argv[2])
+    else:
+        main(*(int(a) for a in sys.argv[1:2]))
@@ -0,0 +1,46 @@
+"""In-process request benchmark of the Flask views on the SQLite backend.
+
+    python benchmarks/bench_views.py [requests per view]
+
+Runs each view through Flask's test client against a fresh in-memory
+SQLite database, so the timings are the app's own work (routing, queries
+through the driver API, templating) without a network or MySQL server.
+Response caching is off so every request runs the view.
+"""
+import os
+import sys
+import time
+
+os.environ.setdefault('DB_BACKEND', 'sqlite')
+os.environ.setdefault('DB_SQLITE_PATH', ':memory:')
+os.environ.setdefault('CACHE_ENABLED', '0')
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import app  # noqa: E402
+
+VIEWS = [
+    '/',
+    '/register',
+    '/suppliers',
+    '/materials?component=C101',
+    '/reports?report_type=lifecycle&instance_id=1',
+    '/reports?report_type=trace&product_id=P100',
+    '/api/products',
+    '/export/timelines.csv',
+]
+
+
+def main(n=500):
+    client = app.test_client()
+    print(f"{'view':<48} {'req/s':>8} {'ms/req':>8}")
+    for view in VIEWS:
+        client.get(view)
+        start = time.perf_counter()
+        for _ in range(n):
+            client.get(view)
+        elapsed = time.perf_counter() - start
+        print(f"{view:<48} {n / elapsed:>8.0f} {elapsed / n * 1000:>8.2f}")
+
+
+if __name__ == '__main__':
+    main(*(int(a) for a in sys.argv[1:2]))
@@ -0,0 +1,145 @@
+"""Response caching for read views, driven by per-table write versions.
+
+Every write procedure bumps a counter in TableVersions (see commands.sql).
+A cached view names the tables it reads; its ETag is derived from those
+tables' versions, so it changes exactly when one of them is written.
+
+The versions themselves are cached in-process for CACHE_VERSION_TTL seconds,
+which means conditional GETs and LRU hits inside that window never touch
+MySQL. Writes made by this process drop the snapshot immediately, so a
+redirect after a POST always sees fresh data; writes from other workers are
+picked up within the TTL.
+"""
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from datetime import date, timezone
+from functools import wraps
+
+from flask import g, has_request_context, request, session, make_response
+
+import config
+from db import get_db_connection, primary_gtid_executed
+
+_lock = threading.Lock()
+_versions = {}
+_last_modified = {}
+_gtid_set = None
+_refreshed_at = 0.0
+_pages = OrderedDict()
+
+
+def _refresh_versions():
+    global _refreshed_at, _gtid_set
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    cursor.execute("SELECT TableName, Version, UpdatedAt FROM TableVersions")
+    rows = cursor.fetchall()
+    # Read after the versions: a replica that has executed this set has every write they count
+    gtid_set = primary_gtid_executed(conn)
+    conn.close()
+    with _lock:
+        _gtid_set = gtid_set
+        _versions.clear()
+        _last_modified.clear()
+        for table, version, updated_at in rows:
+            _versions[table] = version
+            # UpdatedAt is written with UTC_TIMESTAMP()
+            _last_modified[table] = updated_at.replace(tzinfo=timezone.utc)
+        _refreshed_at = time.monotonic()
+
+
+def table_versions(tables):
+    if time.monotonic() - _refreshed_at > config.CACHE_VERSION_TTL:
+        _refresh_versions()
+    with _lock:
+        versions = tuple(_versions.get(t, 0) for t in tables)
+        stamps = [_last_modified[t] for t in tables if _last_modified.get(t)]
+    return versions, max(stamps) if stamps else None
+
+
+def versions_gtid_set():
+    """The primary's gtid_executed when table_versions() last refreshed (None without replicas)."""
+    with _lock:
+        return _gtid_set
+
+
+def note_write():
+    """Call after this process commits a write so the next read re-checks versions.
+
+    Inside a request it also records the primary's gtid_executed in the
+    session, so the user's following reads (e.g. the redirect after a POST)
+    only go to replicas that have executed the write.
+    """
+    global _refreshed_at
+    _refreshed_at = 0.0
+    if has_request_context():
+        gtid_set = primary_gtid_executed()
+        if gtid_set:
+            session['last_write_gtids'] = gtid_set
+
+
+def _get_page(key):
+    with _lock:
+        page = _pages.get(key)
+        if page is not None:
+            _pages.move_to_end(key)
+        return page
+
+
+def _put_page(key, page):
+    with _lock:
+        _pages[key] = page
+        _pages.move_to_end(key)
+        while len(_pages) > config.CACHE_MAX_ENTRIES:
+            _pages.popitem(last=False)
+
+
+def _not_modified(etag, last_modified):
+    if request.if_none_match:
+        return request.if_none_match.contains(etag)
+    since = request.if_modified_since
+    if since is not None and last_modified is not None:
+        return since >= last_modified.replace(microsecond=0)
+    return False
+
+
+def cached_view(*tables):
+    """Cache a GET view's rendered output until one of `tables` is written."""
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            # Pending flash messages are rendered into the page, so that
+            # response is specific to this user and this moment
+            if request.method != 'GET' or not config.CACHE_ENABLED or '_flashes' in session:
+                return view(*args, **kwargs)
+
+            versions, last_modified = table_versions(tables)
+            # A replica rendering this page must be at least as new as these versions
+            g.read_after = versions_gtid_set()
+            # The date is part of the key because some pages show ages in days
+            key = (request.endpoint, tuple(sorted(kwargs.items())),
+                   tuple(sorted(request.args.items(multi=True))), versions, date.today())
+            etag = hashlib.sha1(repr(key).encode('utf-8')).hexdigest()
+
+            if _not_modified(etag, last_modified):
+                response = make_response('', 304)
+            else:
+                page = _get_page(key)
+                if page is None:
+                    rendered = make_response(view(*args, **kwargs))
+                    if rendered.status_code != 200:
+                        return rendered
+                    page = (rendered.get_data(), rendered.mimetype)
+                    _put_page(key, page)
+                response = make_response(page[0])
+                response.mimetype = page[1]
+
+            response.set_etag(etag)
+            if last_modified is not None:
+                response.last_modified = last_modified
+            response.headers['Cache-Control'] = 'no-cache'
+            return response
+        return wrapper
+    return decorator
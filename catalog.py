@@ -0,0 +1,362 @@
+"""Matrix form of the product catalog.
+
+Products, Components, RawMaterials, BillOfMaterial and ComponentComposition
+are loaded once into integer-coded arrays and sparse matrices:
+
+    bom          components x components  child quantity per parent
+    composition  components x materials   grams per unit of component
+    rollup       products   x components  units of each component in one
+                                          product (BOM fully expanded)
+    mass         products   x materials   grams of each material in one product
+
+so questions like "how much of each material is in each product" become a
+single sparse product instead of a recursive join per product.
+
+Web workers share one copy: the catalog is written to a columnar snapshot
+file (CATALOG_SNAPSHOT_PATH) that every worker memory-maps read-only, so
+the arrays live once in the page cache however many workers there are.
+
+    python catalog.py build     # write the snapshot for the current catalog now
+
+Workers rebuild it themselves when the catalog tables change (one at a
+time, under a file lock) and swap it in with a rename; a worker still
+using the previous file keeps its mapping until it lets go of it.
+"""
+import fcntl
+import json
+import mmap
+import os
+import struct
+import sys
+import threading
+
+import numpy as np
+from scipy import sparse
+
+import config
+from cache import table_versions
+from db import get_db_connection
+
+# Utility: grade -> score (A=4..D=1)
+GRADE_SCORE = {'A': 4, 'B': 3, 'C': 2, 'D': 1}
+GRADES = ['A', 'B', 'C', 'D']
+
+CATALOG_TABLES = ('Products', 'Components', 'RawMaterials', 'BillOfMaterial', 'ComponentComposition')
+
+
+class Catalog:
+
+    def __init__(self, product_ids, product_names, product_root, component_ids, component_names,
+                 material_ids, material_names, material_grade, material_hazard, bom, composition):
+        self.product_ids = np.asarray(product_ids)
+        self.product_names = np.asarray(product_names)
+        self.product_root = np.asarray(product_root, dtype=np.int32)
+        self.component_ids = np.asarray(component_ids)
+        self.component_names = np.asarray(component_names)
+        self.material_ids = np.asarray(material_ids)
+        self.material_names = np.asarray(material_names)
+        # Index into GRADES, -1 for no grade
+        self.material_grade_code = np.array([GRADES.index(g) if g in GRADES else -1 for g in material_grade],
+                                            dtype=np.int8)
+        self.material_hazard = np.asarray(material_hazard, dtype=bool)
+        self.bom = _canonical(sparse.csr_matrix(bom, dtype=np.float32))
+        self.composition = _canonical(sparse.csr_matrix(composition, dtype=np.float32))
+        self.rollup = _canonical(expand_bom(self.product_root, self.bom))
+        self.mass = _canonical((self.rollup @ self.composition).tocsr())
+        self.versions = None
+        self.source = None
+
+    @classmethod
+    def from_arrays(cls, arrays, versions=None, source=None):
+        """A catalog over existing arrays (e.g. a mapped snapshot), without copying them."""
+        catalog = cls.__new__(cls)
+        for name in ('product_ids', 'product_names', 'product_root', 'component_ids', 'component_names',
+                     'material_ids', 'material_names', 'material_grade_code'):
+            setattr(catalog, name, arrays[name])
+        catalog.material_hazard = arrays['material_hazard'].view(np.bool_)
+        n_p, n_c, n_m = len(catalog.product_ids), len(catalog.component_ids), len(catalog.material_ids)
+        for name, shape in (('bom', (n_c, n_c)), ('composition', (n_c, n_m)),
+                            ('rollup', (n_p, n_c)), ('mass', (n_p, n_m))):
+            setattr(catalog, name, sparse.csr_matrix(
+                (arrays[name + '_data'], arrays[name + '_indices'], arrays[name + '_indptr']),
+                shape=shape, copy=False
+            ))
+        catalog.versions = versions
+        catalog.source = source
+        return catalog
+
+    @property
+    def material_grade(self):
+        return np.array(GRADES + [''])[self.material_grade_code]
+
+    @property
+    def grade_scores(self):
+        # GRADES is ordered A..D, so the score is len(GRADES) - code
+        code = self.material_grade_code.astype(np.float64)
+        return np.where(code >= 0, len(GRADES) - code, 0.0)
+
+    def index_of(self, kind, ids):
+        lookup = {str(v): i for i, v in enumerate(getattr(self, kind + '_ids'))}
+        return np.array([lookup[str(i)] for i in ids], dtype=np.int64)
+
+
+def _canonical(matrix):
+    # Sorted, duplicate-free indices, so scipy never needs to fix them up in
+    # place (a mapped snapshot is read-only)
+    matrix.sum_duplicates()
+    matrix.indices = matrix.indices.astype(np.int32, copy=False)
+    matrix.indptr = matrix.indptr.astype(np.int32, copy=False)
+    return matrix
+
+
+def expand_bom(product_root, bom):
+    """products x components matrix of total units per product.
+
+    Starts from each product's root assembly and walks the BOM one level at
+    a time (root, root @ B, root @ B^2, ...); the BOM is a DAG so this ends
+    after `depth` levels.
+    """
+    n_products, n_components = len(product_root), bom.shape[0]
+    has_root = product_root >= 0
+    level = sparse.csr_matrix(
+        (np.ones(has_root.sum()), (np.flatnonzero(has_root), product_root[has_root])),
+        shape=(n_products, n_components)
+    )
+    total = level.copy()
+    for _ in range(n_components):
+        level = level @ bom
+        if level.nnz == 0:
+            break
+        total = total + level
+    return total.tocsr()
+
+
+def load_catalog(conn):
+    cursor = conn.cursor()
+    cursor.execute("SELECT ComponentID, ComponentName FROM Components ORDER BY ComponentID")
+    components = cursor.fetchall()
+    comp_index = {c[0]: i for i, c in enumerate(components)}
+
+    cursor.execute("SELECT MaterialID, MaterialName, RecyclableGrade, IsHazardous FROM RawMaterials ORDER BY MaterialID")
+    materials = cursor.fetchall()
+    mat_index = {m[0]: i for i, m in enumerate(materials)}
+
+    cursor.execute("SELECT ProductID, ModelName, RootComponentID FROM Products ORDER BY ProductID")
+    products = cursor.fetchall()
+
+    cursor.execute("SELECT ParentComponentID, ChildComponentID, Quantity FROM BillOfMaterial")
+    bom_rows = cursor.fetchall()
+    cursor.execute("SELECT ComponentID, MaterialID, WeightInGrams FROM ComponentComposition")
+    comp_rows = cursor.fetchall()
+
+    n_c, n_m = len(components), len(materials)
+    bom = sparse.csr_matrix(
+        ([float(r[2]) for r in bom_rows],
+         ([comp_index[r[0]] for r in bom_rows], [comp_index[r[1]] for r in bom_rows])),
+        shape=(n_c, n_c)
+    )
+    composition = sparse.csr_matrix(
+        ([float(r[2]) for r in comp_rows],
+         ([comp_index[r[0]] for r in comp_rows], [mat_index[r[1]] for r in comp_rows])),
+        shape=(n_c, n_m)
+    )
+    return Catalog(
+        product_ids=[p[0] for p in products],
+        product_names=[p[1] for p in products],
+        product_root=[comp_index.get(p[2], -1) for p in products],
+        component_ids=[c[0] for c in components],
+        component_names=[c[1] for c in components],
+        material_ids=[m[0] for m in materials],
+        material_names=[m[1] for m in materials],
+        material_grade=[m[2] or '' for m in materials],
+        material_hazard=[bool(m[3]) for m in materials],
+        bom=bom,
+        composition=composition,
+    )
+
+
+# -------------------------
+# SHARED SNAPSHOT
+# -------------------------
+# Layout: magic, header length (u64), JSON header, then each array at a
+# 64-byte aligned offset. The header records every array's dtype, shape
+# and offset, and the table versions the catalog was built from.
+# search.py keeps its index in the same layout.
+SNAPSHOT_MAGIC = b'SPLMCAT1'
+SNAPSHOT_ALIGN = 64
+STRING_COLUMNS = ('product_ids', 'product_names', 'component_ids', 'component_names',
+                  'material_ids', 'material_names')
+
+
+def snapshot_arrays(catalog):
+    arrays = {
+        'product_root': catalog.product_root.astype(np.int32),
+        'material_grade_code': catalog.material_grade_code.astype(np.int8),
+        'material_hazard': catalog.material_hazard.astype(np.int8),
+    }
+    for name in STRING_COLUMNS:
+        # Fixed-width unicode, so the mapped column is a plain numpy array
+        arrays[name] = np.asarray(getattr(catalog, name)).astype(str)
+    for name in ('bom', 'composition', 'rollup', 'mass'):
+        matrix = getattr(catalog, name)
+        arrays[name + '_indptr'] = matrix.indptr.astype(np.int32)
+        arrays[name + '_indices'] = matrix.indices.astype(np.int32)
+        # Weights as stored are float32; the expanded totals keep float64
+        arrays[name + '_data'] = matrix.data.astype(np.float32 if name in ('bom', 'composition') else np.float64)
+    return arrays
+
+
+def write_columns(path, magic, header, arrays):
+    """Write `arrays` and the JSON-able `header` to `path` atomically (temp file + rename)."""
+    entries, offset = {}, 0
+    for name, array in arrays.items():
+        offset = -(-offset // SNAPSHOT_ALIGN) * SNAPSHOT_ALIGN
+        entries[name] = {'dtype': array.dtype.str, 'shape': list(array.shape), 'offset': offset}
+        offset += array.nbytes
+    header = json.dumps(dict(header, arrays=entries)).encode('utf-8')
+    # Array offsets are relative to the end of the header, which is padded to the alignment
+    start = -(-(len(magic) + 8 + len(header)) // SNAPSHOT_ALIGN) * SNAPSHOT_ALIGN
+
+    tmp = f"{path}.tmp-{os.getpid()}"
+    with open(tmp, 'wb') as f:
+        f.write(magic + struct.pack('<Q', len(header)) + header)
+        for name, array in arrays.items():
+            f.seek(start + entries[name]['offset'])
+            f.write(np.ascontiguousarray(array).tobytes())
+        f.truncate(start + offset)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+
+def map_columns(path, magic):
+    """(header, arrays) written by write_columns, the arrays backed by a read-only mapping of the file."""
+    with open(path, 'rb') as f:
+        mapping = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    if mapping[:len(magic)] != magic:
+        raise ValueError(f"{path} is not a {magic.decode()} file")
+    size, = struct.unpack_from('<Q', mapping, len(magic))
+    header_end = len(magic) + 8 + size
+    header = json.loads(mapping[len(magic) + 8:header_end])
+    start = -(-header_end // SNAPSHOT_ALIGN) * SNAPSHOT_ALIGN
+    arrays = {}
+    for name, entry in header.pop('arrays').items():
+        dtype = np.dtype(entry['dtype'])
+        count = int(np.prod(entry['shape']))
+        if count == 0:
+            arrays[name] = np.empty(entry['shape'], dtype=dtype)
+            continue
+        arrays[name] = np.frombuffer(mapping, dtype=dtype, count=count,
+                                     offset=start + entry['offset']).reshape(entry['shape'])
+    return header, arrays
+
+
+def write_snapshot(catalog, path, versions):
+    """Write `catalog` to `path` atomically."""
+    header = {'versions': list(versions), 'source': database_source()}
+    write_columns(path, SNAPSHOT_MAGIC, header, snapshot_arrays(catalog))
+
+
+def map_snapshot(path):
+    """The catalog in `path`, backed by a read-only mapping of the file."""
+    header, arrays = map_columns(path, SNAPSHOT_MAGIC)
+    return Catalog.from_arrays(arrays, versions=tuple(header['versions']), source=header['source'])
+
+
+def database_source():
+    # Snapshots of different databases must not be mixed up
+    if config.DB_BACKEND == 'sqlite':
+        return f"sqlite:{os.path.abspath(config.DB_SQLITE_PATH)}"
+    return f"mysql:{config.DB_HOST}:{config.DB_PORT}/{config.DB_NAME}"
+
+
+def snapshot_path():
+    """Where the shared snapshot lives, or None when workers should not share one."""
+    if not config.CATALOG_SNAPSHOT_PATH:
+        return None
+    if config.DB_BACKEND == 'sqlite' and config.DB_SQLITE_PATH == ':memory:':
+        # Every process has its own in-memory database
+        return None
+    return config.CATALOG_SNAPSHOT_PATH
+
+
+def _current_enough(catalog, versions):
+    # Versions only grow, so a snapshot at least as new as what this worker
+    # has seen is good (its TableVersions copy may simply be older)
+    return (catalog is not None and catalog.source == database_source() and len(catalog.versions) == len(versions)
+            and all(s >= v for s, v in zip(catalog.versions, versions)))
+
+
+def _try_map(path):
+    try:
+        return map_snapshot(path)
+    except (FileNotFoundError, ValueError):
+        return None
+
+
+def build_snapshot(path, versions):
+    """Load the catalog from the database and publish it at `path`."""
+    conn = get_db_connection()
+    try:
+        catalog = load_catalog(conn)
+    finally:
+        conn.close()
+    write_snapshot(catalog, path, versions)
+    return catalog
+
+
+def shared_catalog(path, versions):
+    """The mapped snapshot, rebuilding it first if it is older than `versions`."""
+    catalog = _try_map(path)
+    if _current_enough(catalog, versions):
+        return catalog
+    fd = os.open(path + '.lock', os.O_RDWR | os.O_CREAT, 0o644)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        # Another worker may have rebuilt it while this one waited
+        catalog = _try_map(path)
+        if not _current_enough(catalog, versions):
+            build_snapshot(path, versions)
+            catalog = map_snapshot(path)
+    finally:
+        os.close(fd)
+    return catalog
+
+
+_lock = threading.Lock()
+_current = (None, None)
+
+
+def get_catalog():
+    """The catalog for the current catalog-table versions, rebuilt after writes."""
+    global _current
+    versions, _ = table_versions(CATALOG_TABLES)
+    with _lock:
+        if _current[0] == versions:
+            return _current[1]
+
+    path = snapshot_path()
+    if path:
+        catalog = shared_catalog(path, versions)
+    else:
+        conn = get_db_connection()
+        try:
+            catalog = load_catalog(conn)
+        finally:
+            conn.close()
+    with _lock:
+        _current = (versions, catalog)
+    return catalog
+
+
+if __name__ == '__main__':
+    if sys.argv[1:] == ['build']:
+        path = snapshot_path()
+        if path is None:
+            sys.exit("No shared snapshot with this configuration (CATALOG_SNAPSHOT_PATH empty or in-memory SQLite)")
+        versions, _ = table_versions(CATALOG_TABLES)
+        built = build_snapshot(path, versions)
+        print(f"Wrote {path}: {len(built.product_ids)} products, {len(built.component_ids)} components, "
+              f"{len(built.material_ids)} materials, {os.path.getsize(path):,} bytes")
+    else:
+        print(__doc__)
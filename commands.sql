@@ -4,16 +4,19 @@ use new_circular;
 
 
 
-CREATE TABLE Products (
-  ProductID VARCHAR(50) PRIMARY KEY,
-  ModelName VARCHAR(100) NOT NULL
-);
-
 CREATE TABLE Components (
   ComponentID VARCHAR(50) PRIMARY KEY,
   ComponentName VARCHAR(100) NOT NULL
 );
 
+CREATE TABLE Products (
+  ProductID VARCHAR(50) PRIMARY KEY,
+  ModelName VARCHAR(100) NOT NULL,
+  /* Top-level assembly of the product in BillOfMaterial */
+  RootComponentID VARCHAR(50),
+  FOREIGN KEY (RootComponentID) REFERENCES Components(ComponentID)
+);
+
 CREATE TABLE RawMaterials (
   MaterialID VARCHAR(50) PRIMARY KEY,
   MaterialName VARCHAR(100) NOT NULL,
@@ -34,17 +37,53 @@ CREATE TABLE ProductInstances (
   InstanceID INT PRIMARY KEY AUTO_INCREMENT,
   SerialNumber VARCHAR(100) NOT NULL UNIQUE,
   ProductID VARCHAR(50) NOT NULL,
+  /* Type of the latest lifecycle event; maintained by After_Lifecycle_Insert */
+  CurrentState VARCHAR(50) NOT NULL DEFAULT 'NoEvents',
   FOREIGN KEY (ProductID) REFERENCES Products(ProductID)
 );
 
+/* The lifecycle state machine (lifecycle.LIFECYCLE): EventType may follow
+   FromState. Before_Lifecycle_Insert checks every new event against it. */
+CREATE TABLE LifecycleTransitions (
+  FromState VARCHAR(50) NOT NULL,
+  EventType VARCHAR(50) NOT NULL,
+  PRIMARY KEY (FromState, EventType)
+);
+
+/* Append-only, range partitioned by EventDate. MySQL does not allow
+   foreign keys on partitioned tables, so InstanceID is only checked by the
+   procedures that write here. archive.py adds monthly partitions ahead of
+   time and moves closed instances out to LifecycleEventsArchive. */
 CREATE TABLE LifecycleEvents (
-  EventID INT PRIMARY KEY AUTO_INCREMENT,
+  EventID INT NOT NULL AUTO_INCREMENT,
   EventType VARCHAR(50) NOT NULL,
   EventDate DATETIME NOT NULL,
   InstanceID INT NOT NULL,
-  FOREIGN KEY (InstanceID) REFERENCES ProductInstances(InstanceID)
+  PRIMARY KEY (EventID, EventDate),
+  KEY idx_le_instance (InstanceID)
+)
+PARTITION BY RANGE (TO_DAYS(EventDate)) (
+  PARTITION p2024 VALUES LESS THAN (TO_DAYS('2025-01-01')),
+  PARTITION p2025 VALUES LESS THAN (TO_DAYS('2026-01-01')),
+  PARTITION pmax VALUES LESS THAN MAXVALUE
 );
 
+/* Cold tier: events of recycled/disposed instances, compressed */
+CREATE TABLE LifecycleEventsArchive (
+  EventID INT PRIMARY KEY,
+  EventType VARCHAR(50) NOT NULL,
+  EventDate DATETIME NOT NULL,
+  InstanceID INT NOT NULL,
+  ArchivedAt DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP,
+  KEY idx_lea_instance (InstanceID, EventDate)
+) ROW_FORMAT=COMPRESSED KEY_BLOCK_SIZE=8;
+
+/* Hot + archived events; read timelines through this */
+CREATE VIEW LifecycleEventsAll AS
+  SELECT EventID, EventType, EventDate, InstanceID FROM LifecycleEvents
+  UNION ALL
+  SELECT EventID, EventType, EventDate, InstanceID FROM LifecycleEventsArchive;
+
 /* ------------------------------------------------------------
    3. BILL OF MATERIALS & COMPOSITION
    ------------------------------------------------------------ */
@@ -68,6 +107,21 @@ CREATE TABLE ComponentComposition (
   FOREIGN KEY (MaterialID) REFERENCES RawMaterials(MaterialID),
   CHECK (WeightInGrams > 0)
 );
+/* Every material of every component in each product's expanded BOM
+   (the passport page, exports and the async API read this) */
+CREATE VIEW ProductMaterialPassport AS
+  WITH RECURSIVE subtree (ProductID, ComponentID) AS (
+    SELECT ProductID, RootComponentID FROM Products WHERE RootComponentID IS NOT NULL
+    UNION
+    SELECT s.ProductID, b.ChildComponentID
+    FROM subtree s JOIN BillOfMaterial b ON b.ParentComponentID = s.ComponentID
+  )
+  SELECT s.ProductID, c.ComponentName, rm.MaterialName, cc.WeightInGrams,
+         rm.RecyclableGrade, rm.IsHazardous
+  FROM subtree s
+  JOIN Components c ON c.ComponentID = s.ComponentID
+  JOIN ComponentComposition cc ON cc.ComponentID = s.ComponentID
+  JOIN RawMaterials rm ON rm.MaterialID = cc.MaterialID;
 
 /* ------------------------------------------------------------
    4. SOURCING (Supplier → Component OR Material)
@@ -87,18 +141,35 @@ CREATE TABLE Sourcing (
   )
 );
 
+/* ------------------------------------------------------------
+   5. HAZARD INDEX
+   Hazardous materials contained in each component's full BOM subtree,
+   so RecycleProduct can classify an instance with one key lookup.
+   Maintained by the triggers on ComponentComposition, BillOfMaterial
+   and RawMaterials (see RefreshHazardIndexFor).
+   ------------------------------------------------------------ */
+
+CREATE TABLE AssemblyHazardIndex (
+  ComponentID VARCHAR(50) PRIMARY KEY,
+  HazardousCount INT NOT NULL DEFAULT 0,
+  HazardousWeight DECIMAL(12, 2) NOT NULL DEFAULT 0,
+  FOREIGN KEY (ComponentID) REFERENCES Components(ComponentID)
+);
+
+/* ------------------------------------------------------------
+   6. WRITE VERSIONS (drives HTTP caching in cache.py)
+   ------------------------------------------------------------ */
+
+CREATE TABLE TableVersions (
+  TableName VARCHAR(64) PRIMARY KEY,
+  Version BIGINT NOT NULL DEFAULT 0,
+  UpdatedAt DATETIME(6) NOT NULL
+);
+
 /* ============================================================
    DATA INSERTION SECTION
    ============================================================ */
 
-/* -------------------------
-   Products
-   ------------------------- */
-
-INSERT INTO Products (ProductID, ModelName) VALUES
-('P100', 'Alpha Laptop 15-inch'),
-('P200', 'Eco Smartphone Model 5');
-
 /* -------------------------
    Components
    ------------------------- */
@@ -113,6 +184,14 @@ INSERT INTO Components (ComponentID, ComponentName) VALUES
 ('C202', '25Wh Battery Pack'),
 ('C300', 'Universal Logic Board');
 
+/* -------------------------
+   Products
+   ------------------------- */
+
+INSERT INTO Products (ProductID, ModelName, RootComponentID) VALUES
+('P100', 'Alpha Laptop 15-inch', 'C100'),
+('P200', 'Eco Smartphone Model 5', 'C200');
+
 /* -------------------------
    Raw Materials
    ------------------------- */
@@ -186,6 +265,18 @@ INSERT INTO Sourcing (SupplierID, ComponentID, MaterialID) VALUES
    Lifecycle Events
    ------------------------- */
 
+INSERT INTO LifecycleTransitions (FromState, EventType) VALUES
+('NoEvents', 'Manufactured'),
+('Manufactured', 'Sold'),
+('Sold', 'Repair'),
+('Sold', 'Recycled'),
+('Sold', 'Recycled_Hazardous'),
+('Sold', 'Disposed'),
+('Repair', 'Repair'),
+('Repair', 'Recycled'),
+('Repair', 'Recycled_Hazardous'),
+('Repair', 'Disposed');
+
 INSERT INTO LifecycleEvents (EventType, EventDate, InstanceID) VALUES
 ('Manufactured', '2024-01-01', 1),
 ('Sold', '2024-01-15', 1),
@@ -292,7 +383,7 @@ BEGIN
 
   SELECT DATE(EventDate)
   INTO manuDate
-  FROM LifecycleEvents
+  FROM LifecycleEventsAll
   WHERE InstanceID = instID AND EventType = 'Manufactured'
   ORDER BY EventDate ASC
   LIMIT 1;
@@ -347,6 +438,14 @@ DELIMITER ;
 
 DELIMITER //
 
+/* Mark a table as written (runs inside the caller's transaction) */
+CREATE PROCEDURE BumpTableVersion(IN pTable VARCHAR(64))
+BEGIN
+  INSERT INTO TableVersions (TableName, Version, UpdatedAt)
+  VALUES (pTable, 1, UTC_TIMESTAMP(6))
+  ON DUPLICATE KEY UPDATE Version = Version + 1, UpdatedAt = UTC_TIMESTAMP(6);
+END //
+
 /* Register product + auto manufacturing event */
 CREATE PROCEDURE RegisterProductInstance(
   IN pSerial VARCHAR(100),
@@ -357,6 +456,7 @@ BEGIN
   VALUES (pSerial, pProductID);
 
   CALL AddLifecycleEvent(LAST_INSERT_ID(), 'Manufactured');
+  CALL BumpTableVersion('ProductInstances');
 END //
 
 /* Insert lifecycle event */
@@ -364,19 +464,63 @@ CREATE PROCEDURE AddLifecycleEvent(IN pInstanceID INT, IN pEventType VARCHAR(50)
 BEGIN
   INSERT INTO LifecycleEvents (EventType, EventDate, InstanceID)
   VALUES (pEventType, NOW(), pInstanceID);
+  CALL BumpTableVersion('LifecycleEvents');
+END //
+
+/* Recompute the hazard index for a component and every assembly above it */
+CREATE PROCEDURE RefreshHazardIndexFor(IN pComponentID VARCHAR(50))
+BEGIN
+  REPLACE INTO AssemblyHazardIndex (ComponentID, HazardousCount, HazardousWeight)
+  WITH RECURSIVE ancestors (ComponentID) AS (
+    SELECT pComponentID
+    UNION
+    SELECT b.ParentComponentID
+    FROM BillOfMaterial b JOIN ancestors a ON b.ChildComponentID = a.ComponentID
+  ),
+  subtree (RootID, ComponentID, Multiplier) AS (
+    SELECT ComponentID, ComponentID, 1 FROM ancestors
+    UNION ALL
+    SELECT s.RootID, b.ChildComponentID, s.Multiplier * b.Quantity
+    FROM subtree s JOIN BillOfMaterial b ON b.ParentComponentID = s.ComponentID
+  )
+  SELECT s.RootID,
+         COUNT(CASE WHEN rm.IsHazardous = 1 THEN 1 END),
+         COALESCE(SUM(CASE WHEN rm.IsHazardous = 1 THEN cc.WeightInGrams * s.Multiplier END), 0)
+  FROM subtree s
+  LEFT JOIN ComponentComposition cc ON cc.ComponentID = s.ComponentID
+  LEFT JOIN RawMaterials rm ON rm.MaterialID = cc.MaterialID
+  GROUP BY s.RootID;
+END //
+
+/* Rebuild the whole hazard index (initial load, material hazard changes) */
+CREATE PROCEDURE RefreshHazardIndex()
+BEGIN
+  REPLACE INTO AssemblyHazardIndex (ComponentID, HazardousCount, HazardousWeight)
+  WITH RECURSIVE subtree (RootID, ComponentID, Multiplier) AS (
+    SELECT ComponentID, ComponentID, 1 FROM Components
+    UNION ALL
+    SELECT s.RootID, b.ChildComponentID, s.Multiplier * b.Quantity
+    FROM subtree s JOIN BillOfMaterial b ON b.ParentComponentID = s.ComponentID
+  )
+  SELECT s.RootID,
+         COUNT(CASE WHEN rm.IsHazardous = 1 THEN 1 END),
+         COALESCE(SUM(CASE WHEN rm.IsHazardous = 1 THEN cc.WeightInGrams * s.Multiplier END), 0)
+  FROM subtree s
+  LEFT JOIN ComponentComposition cc ON cc.ComponentID = s.ComponentID
+  LEFT JOIN RawMaterials rm ON rm.MaterialID = cc.MaterialID
+  GROUP BY s.RootID;
 END //
 
-/* Log recycling + hazardous check */
+/* Log recycling + hazardous check (per instance, via the hazard index) */
 CREATE PROCEDURE RecycleProduct(IN instID INT)
 BEGIN
-  DECLARE hazCount INT;
+  DECLARE hazCount INT DEFAULT 0;
 
-  SELECT COUNT(*) INTO hazCount
-  FROM ComponentComposition cc
-  JOIN BillOfMaterial bom ON cc.ComponentID = bom.ChildComponentID
-  WHERE cc.MaterialID IN (
-    SELECT MaterialID FROM RawMaterials WHERE IsHazardous = 1
-  );
+  SELECT COALESCE(h.HazardousCount, 0) INTO hazCount
+  FROM ProductInstances pi
+  JOIN Products p ON p.ProductID = pi.ProductID
+  LEFT JOIN AssemblyHazardIndex h ON h.ComponentID = p.RootComponentID
+  WHERE pi.InstanceID = instID;
 
   IF hazCount > 0 THEN
     INSERT INTO LifecycleEvents(EventType, EventDate, InstanceID)
@@ -385,6 +529,7 @@ BEGIN
     INSERT INTO LifecycleEvents(EventType, EventDate, InstanceID)
     VALUES ('Recycled', NOW(), instID);
   END IF;
+  CALL BumpTableVersion('LifecycleEvents');
 END //
 
 /* Trace product composition */
@@ -403,6 +548,7 @@ CREATE PROCEDURE AddNewSupplier(IN sID VARCHAR(50), IN sName VARCHAR(100))
 BEGIN
   INSERT INTO Suppliers(SupplierID, SupplierName)
   VALUES (sID, sName);
+  CALL BumpTableVersion('Suppliers');
 END //
 
 /* Summary of supplier items */
@@ -426,6 +572,7 @@ BEGIN
   ELSE
     INSERT INTO ComponentComposition(ComponentID, MaterialID, WeightInGrams)
     VALUES (cID, mID, w);
+    CALL BumpTableVersion('ComponentComposition');
   END IF;
 END //
 
@@ -434,7 +581,7 @@ CREATE PROCEDURE GetLifecycleReport(IN instID INT)
 BEGIN
   SELECT EventType,
          DATE_FORMAT(EventDate, '%Y-%m-%d %H:%i') AS EventTime
-  FROM LifecycleEvents
+  FROM LifecycleEventsAll
   WHERE InstanceID = instID
   ORDER BY EventDate;
 END //
@@ -448,25 +595,63 @@ DELIMITER ;
 /* Backup table for lifecycle deletes */
 CREATE TABLE LifecycleBackup LIKE LifecycleEvents;
 
+/* Seed catalog rows above were inserted before the hazard index triggers */
+CALL RefreshHazardIndex();
+
+/* Seed events above were inserted before After_Lifecycle_Insert existed */
+UPDATE ProductInstances pi
+SET CurrentState = COALESCE((
+  SELECT le.EventType FROM LifecycleEvents le
+  WHERE le.InstanceID = pi.InstanceID
+  ORDER BY le.EventDate DESC, le.EventID DESC
+  LIMIT 1), 'NoEvents');
+
 DELIMITER //
 
-/* Prevent disposal before sale */
-CREATE TRIGGER Before_Disposal_Check
+/* Transition rules (e.g. no disposal before sale) for every writer,
+   including the procedures and scripts that bypass lifecycle.py: one
+   primary-key lookup of the instance's CurrentState, locked so concurrent
+   inserts for the same instance are checked one after the other. This
+   replaced the per-insert history scan of the old Before_Disposal_Check.
+   Events are appended only: one dated before the instance's latest event
+   is refused, as the current state says nothing about the past. */
+CREATE TRIGGER Before_Lifecycle_Insert
 BEFORE INSERT ON LifecycleEvents
 FOR EACH ROW
 BEGIN
-  IF NEW.EventType = 'Disposed' THEN
-    IF NOT EXISTS (
-      SELECT 1 FROM LifecycleEvents
-      WHERE InstanceID = NEW.InstanceID
-        AND EventType = 'Sold'
-    ) THEN
-      SIGNAL SQLSTATE '45000'
-      SET MESSAGE_TEXT = 'Cannot dispose unsold product';
-    END IF;
+  DECLARE state VARCHAR(50);
+  SELECT CurrentState INTO state
+  FROM ProductInstances WHERE InstanceID = NEW.InstanceID
+  FOR UPDATE;
+
+  IF state IS NULL OR NOT EXISTS (
+    SELECT 1 FROM LifecycleTransitions
+    WHERE FromState = state AND EventType = NEW.EventType
+  ) THEN
+    SIGNAL SQLSTATE '45000'
+    SET MESSAGE_TEXT = 'Lifecycle event not allowed in the instance''s current state';
+  END IF;
+
+  IF EXISTS (
+    SELECT 1 FROM LifecycleEvents
+    WHERE InstanceID = NEW.InstanceID AND EventDate > NEW.EventDate
+  ) THEN
+    SIGNAL SQLSTATE '45000'
+    SET MESSAGE_TEXT = 'Lifecycle event dated before the instance''s latest event';
   END IF;
 END //
 
+/* Keep the instance's current state in step with its event log; the
+   event just inserted is its latest (Before_Lifecycle_Insert). */
+CREATE TRIGGER After_Lifecycle_Insert
+AFTER INSERT ON LifecycleEvents
+FOR EACH ROW
+BEGIN
+  UPDATE ProductInstances
+  SET CurrentState = NEW.EventType
+  WHERE InstanceID = NEW.InstanceID;
+END //
+
 /* Hazardous material limit */
 CREATE TRIGGER Before_Hazardous_Material
 BEFORE INSERT ON ComponentComposition
@@ -482,13 +667,74 @@ BEGIN
   END IF;
 END //
 
-/* Backup lifecycle before deletion */
+/* Hazard index maintenance */
+CREATE TRIGGER After_Composition_Insert
+AFTER INSERT ON ComponentComposition
+FOR EACH ROW
+BEGIN
+  CALL RefreshHazardIndexFor(NEW.ComponentID);
+END //
+
+CREATE TRIGGER After_Composition_Update
+AFTER UPDATE ON ComponentComposition
+FOR EACH ROW
+BEGIN
+  CALL RefreshHazardIndexFor(NEW.ComponentID);
+  IF OLD.ComponentID <> NEW.ComponentID THEN
+    CALL RefreshHazardIndexFor(OLD.ComponentID);
+  END IF;
+END //
+
+CREATE TRIGGER After_Composition_Delete
+AFTER DELETE ON ComponentComposition
+FOR EACH ROW
+BEGIN
+  CALL RefreshHazardIndexFor(OLD.ComponentID);
+END //
+
+CREATE TRIGGER After_BOM_Insert
+AFTER INSERT ON BillOfMaterial
+FOR EACH ROW
+BEGIN
+  CALL RefreshHazardIndexFor(NEW.ParentComponentID);
+END //
+
+CREATE TRIGGER After_BOM_Update
+AFTER UPDATE ON BillOfMaterial
+FOR EACH ROW
+BEGIN
+  CALL RefreshHazardIndexFor(NEW.ParentComponentID);
+  IF OLD.ParentComponentID <> NEW.ParentComponentID THEN
+    CALL RefreshHazardIndexFor(OLD.ParentComponentID);
+  END IF;
+END //
+
+CREATE TRIGGER After_BOM_Delete
+AFTER DELETE ON BillOfMaterial
+FOR EACH ROW
+BEGIN
+  CALL RefreshHazardIndexFor(OLD.ParentComponentID);
+END //
+
+CREATE TRIGGER After_Material_Hazard_Update
+AFTER UPDATE ON RawMaterials
+FOR EACH ROW
+BEGIN
+  IF NOT (OLD.IsHazardous <=> NEW.IsHazardous) THEN
+    CALL RefreshHazardIndex();
+  END IF;
+END //
+
+/* Backup lifecycle before deletion (skipped for archive.py's bulk moves,
+   which set @archiving and copy the rows to LifecycleEventsArchive) */
 CREATE TRIGGER Before_Lifecycle_Delete
 BEFORE DELETE ON LifecycleEvents
 FOR EACH ROW
 BEGIN
-  INSERT INTO LifecycleBackup
-  SELECT * FROM LifecycleEvents WHERE EventID = OLD.EventID;
+  IF @archiving IS NULL THEN
+    INSERT INTO LifecycleBackup (EventID, EventType, EventDate, InstanceID)
+    VALUES (OLD.EventID, OLD.EventType, OLD.EventDate, OLD.InstanceID);
+  END IF;
 END //
 
 DELIMITER ;
@@ -0,0 +1,188 @@
+import os
+
+
+def _env_int(name, default):
+    value = os.environ.get(name)
+    return int(value) if value not in (None, '') else default
+
+
+# -------------------------
+# DATABASE
+# -------------------------
+# 'mysql', or 'sqlite' for the in-process backend in sqlite_backend.py
+DB_BACKEND = os.environ.get('DB_BACKEND', 'mysql')
+# SQLite database file; ':memory:' keeps a fresh seeded copy per process
+DB_SQLITE_PATH = os.environ.get('DB_SQLITE_PATH', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'circular_economy.sqlite3'))
+DB_HOST = os.environ.get('DB_HOST', 'localhost')
+DB_PORT = _env_int('DB_PORT', 3306)
+DB_USER = os.environ.get('DB_USER', 'root')
+DB_PASSWORD = os.environ.get('DB_PASSWORD', 'Spurthi1-5')
+DB_NAME = os.environ.get('DB_NAME', 'circular_economy_db')
+# Connections kept per worker process; 0 disables pooling.
+# mysql-connector caps a single pool at 32.
+DB_POOL_SIZE = _env_int('DB_POOL_SIZE', 8)
+# Keep prepared statements (repository.py) on pooled connections between
+# requests; pooled sessions are then rolled back on return instead of reset,
+# so session state (user variables, temporary tables) carries over. Off by default.
+DB_STATEMENT_CACHE = os.environ.get('DB_STATEMENT_CACHE', '0') == '1'
+# Read replicas for read-only views, e.g. "replica1:3306,replica2:3306"
+DB_REPLICAS = os.environ.get('DB_REPLICAS', '')
+# Replicas further behind than this (seconds) are skipped
+DB_REPLICA_MAX_LAG = float(os.environ.get('DB_REPLICA_MAX_LAG', '5'))
+DB_REPLICA_CHECK_INTERVAL = float(os.environ.get('DB_REPLICA_CHECK_INTERVAL', '2'))
+# How long a read may wait (seconds) for a replica to execute the session's
+# last write (WAIT_FOR_EXECUTED_GTID_SET); 0 only checks, and falls back to the primary
+DB_REPLICA_GTID_WAIT = float(os.environ.get('DB_REPLICA_GTID_WAIT', '0'))
+# Shard nodes for ProductInstances / LifecycleEvents (shards.py), e.g.
+# "127.0.0.1:3307,127.0.0.1:3308" or "sqlite:/tmp/s0.db,sqlite:/tmp/s1.db".
+# Empty keeps everything on the primary.
+DB_SHARDS = os.environ.get('DB_SHARDS', '')
+# InstanceIDs a worker reserves from the primary at a time
+DB_SHARD_ID_BLOCK = _env_int('DB_SHARD_ID_BLOCK', 100)
+
+# -------------------------
+# WEB SERVER (serve.py)
+# -------------------------
+WEB_BIND = os.environ.get('WEB_BIND', '0.0.0.0:8000')
+WEB_WORKERS = _env_int('WEB_WORKERS', (os.cpu_count() or 1) * 2 + 1)
+WEB_THREADS = _env_int('WEB_THREADS', 4)
+WEB_TIMEOUT = _env_int('WEB_TIMEOUT', 30)
+WEB_MAX_REQUESTS = _env_int('WEB_MAX_REQUESTS', 0)
+
+# -------------------------
+# RESPONSE CACHE (cache.py)
+# -------------------------
+CACHE_ENABLED = os.environ.get('CACHE_ENABLED', '1') == '1'
+# How long a worker trusts its copy of TableVersions before re-reading it
+CACHE_VERSION_TTL = float(os.environ.get('CACHE_VERSION_TTL', '1.0'))
+CACHE_MAX_ENTRIES = _env_int('CACHE_MAX_ENTRIES', 256)
+
+# -------------------------
+# LIFECYCLE ARCHIVAL (archive.py)
+# -------------------------
+# Instances closed (recycled/disposed) longer than this move to the archive
+ARCHIVE_AFTER_DAYS = _env_int('ARCHIVE_AFTER_DAYS', 90)
+ARCHIVE_BATCH_SIZE = _env_int('ARCHIVE_BATCH_SIZE', 500)
+PARTITION_MONTHS_AHEAD = _env_int('PARTITION_MONTHS_AHEAD', 3)
+
+# -------------------------
+# EVENT INTAKE JOURNAL (journal.py)
+# -------------------------
+# 1: /api/events acknowledges once the event is journaled; 0: inserts synchronously
+JOURNAL_ENABLED = os.environ.get('JOURNAL_ENABLED', '0') == '1'
+JOURNAL_DIR = os.environ.get('JOURNAL_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'journal'))
+JOURNAL_SEGMENT_BYTES = _env_int('JOURNAL_SEGMENT_BYTES', 64 * 1024 * 1024)
+JOURNAL_FLUSH_BATCH = _env_int('JOURNAL_FLUSH_BATCH', 1000)
+JOURNAL_FLUSH_INTERVAL = float(os.environ.get('JOURNAL_FLUSH_INTERVAL', '0.2'))
+# A retried event_uuid is recognised for this long; older JournalApplied rows are pruned
+JOURNAL_APPLIED_RETENTION_DAYS = _env_int('JOURNAL_APPLIED_RETENTION_DAYS', 7)
+
+# -------------------------
+# CHANGE FEED (outbox.py)
+# -------------------------
+OUTBOX_POLL_INTERVAL = float(os.environ.get('OUTBOX_POLL_INTERVAL', '0.25'))
+# Longest wait for a long-poll, and the SSE keep-alive period
+OUTBOX_HEARTBEAT = float(os.environ.get('OUTBOX_HEARTBEAT', '25'))
+OUTBOX_RETENTION_DAYS = _env_int('OUTBOX_RETENTION_DAYS', 7)
+# SSE streams per worker; each holds a thread, so leave some for other requests
+OUTBOX_MAX_STREAMS = _env_int('OUTBOX_MAX_STREAMS', max(WEB_THREADS // 2, 1))
+
+# -------------------------
+# REQUEST PROFILER (profiler.py)
+# -------------------------
+# Endpoints or paths always profiled, e.g. "reports,/suppliers"
+PROFILE_ROUTES = os.environ.get('PROFILE_ROUTES', '')
+# Fraction of all requests profiled (0 = off)
+PROFILE_SAMPLE_RATE = float(os.environ.get('PROFILE_SAMPLE_RATE', '0'))
+# Requests sending "X-Profile: <token>" are profiled; empty disables the header
+PROFILE_TOKEN = os.environ.get('PROFILE_TOKEN', '')
+PROFILE_INTERVAL_MS = float(os.environ.get('PROFILE_INTERVAL_MS', '5'))
+PROFILE_DIR = os.environ.get('PROFILE_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'profiles'))
+
+# -------------------------
+# SERIAL LOOKUP (serials.py)
+# -------------------------
+# The Bloom filter is sized for at least this many serials (or twice the
+# current count); lookups of unknown serials hit the database at this rate
+SERIAL_BLOOM_CAPACITY = _env_int('SERIAL_BLOOM_CAPACITY', 1000000)
+SERIAL_BLOOM_ERROR_RATE = float(os.environ.get('SERIAL_BLOOM_ERROR_RATE', '0.01'))
+# Instance summaries kept per worker
+SERIAL_CACHE_ENTRIES = _env_int('SERIAL_CACHE_ENTRIES', 100000)
+# Answer lookups before Flask's request handling (see serials.init_app)
+SERIAL_FAST_PATH = os.environ.get('SERIAL_FAST_PATH', '1') == '1'
+
+# -------------------------
+# CATALOG SNAPSHOT (catalog.py)
+# -------------------------
+# Memory-mapped catalog file shared by all workers on the host; empty
+# makes every worker load its own copy from the database
+CATALOG_SNAPSHOT_PATH = os.environ.get('CATALOG_SNAPSHOT_PATH', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'catalog.snapshot'))
+
+# -------------------------
+# PAGE RENDERING (streaming.py)
+# -------------------------
+# Stream large pages as they render; 0 renders them whole, as before
+STREAM_TEMPLATES = os.environ.get('STREAM_TEMPLATES', '1') == '1'
+# Rows fetched from the database per round trip while streaming
+STREAM_BATCH_SIZE = _env_int('STREAM_BATCH_SIZE', 500)
+# Template output pieces collected before each write to the client
+STREAM_BUFFER_ITEMS = _env_int('STREAM_BUFFER_ITEMS', 200)
+# Compiled templates are cached here across restarts; empty disables it
+JINJA_CACHE_DIR = os.environ.get('JINJA_CACHE_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), '.jinja_cache'))
+
+# -------------------------
+# FLEET SNAPSHOTS (snapshots.py)
+# -------------------------
+SNAPSHOT_DIR = os.environ.get('SNAPSHOT_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'snapshots'))
+SNAPSHOT_INTERVAL_DAYS = float(os.environ.get('SNAPSHOT_INTERVAL_DAYS', '7'))
+SNAPSHOT_LAG_HOURS = float(os.environ.get('SNAPSHOT_LAG_HOURS', '24'))
+
+# -------------------------
+# COLUMNAR ANALYTICS (olap.py)
+# -------------------------
+OLAP_DIR = os.environ.get('OLAP_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'olap'))
+# Serve dashboard / report aggregates from the exported files when they exist
+OLAP_QUERIES = os.environ.get('OLAP_QUERIES', '1') == '1'
+# Older exports are ignored and the database is queried instead (seconds)
+OLAP_MAX_AGE = float(os.environ.get('OLAP_MAX_AGE', '3600'))
+# How often a worker looks for a newer manifest (seconds)
+OLAP_CHECK_INTERVAL = float(os.environ.get('OLAP_CHECK_INTERVAL', '5'))
+OLAP_THREADS = _env_int('OLAP_THREADS', 2)
+# Rows per database round trip (and at most per file) while exporting
+OLAP_BATCH_ROWS = _env_int('OLAP_BATCH_ROWS', 100000)
+# IDs below the watermark re-checked each run for rows that committed late
+OLAP_ID_OVERLAP = _env_int('OLAP_ID_OVERLAP', 10000)
+# A month's files are merged into one once there are more than this many
+OLAP_COMPACT_FILES = _env_int('OLAP_COMPACT_FILES', 16)
+
+# -------------------------
+# SEARCH (search.py)
+# -------------------------
+# Start loading the index in each worker as it forks, rather than on the first search
+SEARCH_PRELOAD = os.environ.get('SEARCH_PRELOAD', '1') == '1'
+# A search stops collecting matches once it has this many...
+SEARCH_CANDIDATES = _env_int('SEARCH_CANDIDATES', 200)
+# ...or has looked at this many entries (bounds queries like "sn" that match every serial)
+SEARCH_SCAN_LIMIT = _env_int('SEARCH_SCAN_LIMIT', 20000)
+SEARCH_MAX_WORDS = _env_int('SEARCH_MAX_WORDS', 8)
+SEARCH_MAX_RESULTS = _env_int('SEARCH_MAX_RESULTS', 50)
+# Index file shared by all workers on the host (memory-mapped); empty makes
+# every worker build the whole index in its own memory
+SEARCH_SNAPSHOT_PATH = os.environ.get('SEARCH_SNAPSHOT_PATH', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'search.snapshot'))
+# Entries a worker adds on top of the shared index before a new one is written
+SEARCH_SNAPSHOT_MAX_DELTA = _env_int('SEARCH_SNAPSHOT_MAX_DELTA', 100000)
+
+# -------------------------
+# MODEL DRIFT (drift.py)
+# -------------------------
+# Summarize every served prediction's features for GET /metrics
+DRIFT_MONITOR = os.environ.get('DRIFT_MONITOR', '1') == '1'
+DRIFT_DIR = os.environ.get('DRIFT_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'drift'))
+# Summaries cover wall-clock windows this long (seconds); scores use the current and previous one
+DRIFT_WINDOW = _env_int('DRIFT_WINDOW', 3600)
+# How often each process writes its summaries for the others to merge (seconds)
+DRIFT_FLUSH_INTERVAL = float(os.environ.get('DRIFT_FLUSH_INTERVAL', '10'))
+# Fewer predictions than this in the windows give no drift scores
+DRIFT_MIN_COUNT = _env_int('DRIFT_MIN_COUNT', 100)
+# KLL accuracy: rank error ~1.7/k, at most ~6k values held per feature
+DRIFT_SKETCH_K = _env_int('DRIFT_SKETCH_K', 200)
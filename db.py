@@ -1,10 +1,303 @@
+import os
+import sqlite3
+import threading
+import time
+
 import mysql.connector
+from mysql.connector import pooling
+from mysql.connector.abstracts import MySQLConnectionAbstract
+
+import config
+
+DB_CONFIG = {
+    'host': config.DB_HOST,
+    'port': config.DB_PORT,
+    'user': config.DB_USER,
+    'password': config.DB_PASSWORD,
+    'database': config.DB_NAME,
+}
+
+class StatementPool(pooling.MySQLConnectionPool):
+    """A pool that keeps each connection's session, and so its prepared
+    statements (repository.py), across checkouts. A returned connection is
+    rolled back rather than reset: that ends its transaction and discards
+    unread results, but leaves user variables, so code that sets one
+    (@archiving) must clear it again."""
+
+    def __init__(self, **kwargs):
+        super().__init__(pool_reset_session=False, **kwargs)
+
+    def add_connection(self, cnx=None):
+        if cnx is not None:
+            try:
+                cnx.rollback()
+            except mysql.connector.Error:
+                # A broken connection is reconnected when next checked out
+                pass
+        super().add_connection(cnx)
+
+
+def make_pool(name, settings):
+    pool_class = StatementPool if config.DB_STATEMENT_CACHE else pooling.MySQLConnectionPool
+    return pool_class(pool_name=name, pool_size=config.DB_POOL_SIZE, **settings)
+
+
+# One pool per process: a pool created before a fork must not be shared
+# with the children, so it is rebuilt whenever the pid changes.
+_pool = None
+_pool_pid = None
 
 def get_db_connection():
-    conn = mysql.connector.connect(
-        host='localhost',
-        user='root',           
-        password='Spurthi1-5',  
-        database='circular_economy_db'
-    )
+    """Connection to the primary; use it for every write."""
+    global _pool, _pool_pid
+    if config.DB_BACKEND == 'sqlite':
+        import sqlite_backend
+        return sqlite_backend.connect()
+
+    if config.DB_POOL_SIZE <= 0:
+        return mysql.connector.connect(**DB_CONFIG)
+
+    if _pool is None or _pool_pid != os.getpid():
+        _pool = make_pool(f'splm-{os.getpid()}', DB_CONFIG)
+        _pool_pid = os.getpid()
+    # close() on a pooled connection hands it back to the pool
+    conn = _pool.get_connection()
     return conn
+
+
+def discard_connection(conn):
+    """Close `conn` without reading the rest of an unbuffered result.
+
+    For a reader that went away mid-result. The server is told to drop the
+    connection (from a second one to the same server), so closing it reads
+    at most what is already on the way; a pooled connection goes back to
+    its pool disconnected and is reconnected when next checked out.
+    """
+    # Pooled (and replica-tracked) connections wrap the real one
+    raw = getattr(conn, '_cnx', conn)
+    if isinstance(raw, MySQLConnectionAbstract):
+        try:
+            killer = mysql.connector.connect(**dict(DB_CONFIG, host=raw.server_host, port=raw.server_port))
+            try:
+                killer.cursor().execute("KILL %s", (raw.connection_id,))
+            finally:
+                killer.close()
+        except mysql.connector.Error:
+            # Already gone, or the server is unreachable: the close below finds out
+            pass
+        try:
+            raw.close()
+        except mysql.connector.Error:
+            pass
+        # Not cleared by a reconnect; the result went with the old session
+        raw.unread_result = False
+    try:
+        conn.close()
+    except mysql.connector.Error:
+        # The pool's session reset on the dead connection; it is back in the pool all the same
+        pass
+
+
+def is_data_error(error):
+    """True if `error` was caused by the values a statement was given (a
+    constraint, a value the column can't hold, a SIGNAL in a trigger or
+    procedure), not by the connection or the SQL itself."""
+    if isinstance(error, (mysql.connector.DataError, mysql.connector.IntegrityError)):
+        return True
+    if isinstance(error, mysql.connector.DatabaseError) and getattr(error, 'sqlstate', None) == '45000':
+        return True
+    if isinstance(error, (sqlite3.IntegrityError, sqlite3.DataError)):
+        return True
+    if config.DB_BACKEND == 'sqlite':
+        from sqlite_backend import SignalError
+        return isinstance(error, SignalError)
+    return False
+
+
+# -------------------------
+# READ REPLICAS
+# -------------------------
+# Read-only views call get_read_connection(). Each replica's lag and
+# gtid_executed are re-measured at most every DB_REPLICA_CHECK_INTERVAL
+# seconds, and a replica more than DB_REPLICA_MAX_LAG behind is skipped.
+# When the caller passes `after` (a GTID set: the primary's gtid_executed
+# after the session's last write, or when the table versions a cached page
+# is keyed on were read), the replica must also have executed all of it:
+# known from its last measurement, or else asked on the connection
+# (GTID_SUBSET, or WAIT_FOR_EXECUTED_GTID_SET for up to DB_REPLICA_GTID_WAIT
+# seconds). Otherwise the read goes to the primary.
+
+def parse_gtid_set(text):
+    """{source uuid (with tag, if any): [(first, last), ...]} of a gtid_executed string."""
+    gtids = {}
+    for member in (text or '').replace('\n', '').split(','):
+        parts = [p.strip() for p in member.split(':')]
+        if not parts[0]:
+            continue
+        key = parts[0].lower()
+        for part in parts[1:]:
+            if not part[:1].isdigit():
+                # MySQL 8.3+ tagged GTIDs: uuid:tag:1-5
+                key = f"{parts[0].lower()}:{part.lower()}"
+                continue
+            first, _, last = part.partition('-')
+            gtids.setdefault(key, []).append((int(first), int(last or first)))
+    return gtids
+
+
+def gtid_subset(needed, executed):
+    """True if every transaction of `needed` is in `executed` (both parsed with parse_gtid_set)."""
+    for key, intervals in needed.items():
+        have = executed.get(key, ())
+        for first, last in intervals:
+            if not any(f <= first and last <= l for f, l in have):
+                return False
+    return True
+
+
+def primary_gtid_executed(conn=None):
+    """The primary's gtid_executed now (on `conn`, if given), or None when no replica needs it."""
+    if config.DB_BACKEND != 'mysql' or not get_replicas():
+        return None
+    own = conn is None
+    conn = get_db_connection() if own else conn
+    try:
+        cursor = conn.cursor()
+        cursor.execute("SELECT @@GLOBAL.gtid_executed")
+        return cursor.fetchone()[0]
+    finally:
+        if own:
+            conn.close()
+
+
+class Replica:
+
+    def __init__(self, index, host, port):
+        self.name = f'splm-{os.getpid()}-r{index}'
+        self.config = dict(DB_CONFIG, host=host, port=port)
+        self.pool = None
+        self.outstanding = 0
+        self.lag = None
+        self.executed = {}
+        self.checked_at = 0.0
+        self.claimed_at = 0.0
+
+    def connect(self):
+        if config.DB_POOL_SIZE <= 0:
+            return mysql.connector.connect(**self.config)
+        if self.pool is None:
+            self.pool = make_pool(self.name, self.config)
+        return self.pool.get_connection()
+
+    def measure_lag(self):
+        """Seconds behind the primary, or None if replication is stopped / unreachable."""
+        executed = None
+        try:
+            conn = self.connect()
+            try:
+                cursor = conn.cursor(dictionary=True)
+                cursor.execute("SHOW REPLICA STATUS")
+                status = cursor.fetchone()
+                cursor.execute("SELECT @@GLOBAL.gtid_executed AS executed")
+                executed = cursor.fetchone()['executed']
+            finally:
+                conn.close()
+        except mysql.connector.Error:
+            status = None
+        self.lag = None if not status or status.get('Seconds_Behind_Source') is None \
+            else float(status['Seconds_Behind_Source'])
+        self.executed = parse_gtid_set(executed)
+        self.checked_at = time.time()
+        return self.lag
+
+    def has_executed(self, conn, after):
+        """Ask the replica (on `conn`) whether it has executed the GTID set `after`."""
+        cursor = conn.cursor()
+        if config.DB_REPLICA_GTID_WAIT > 0:
+            # 0 once applied, 1 on timeout
+            cursor.execute("SELECT WAIT_FOR_EXECUTED_GTID_SET(%s, %s) = 0", (after, config.DB_REPLICA_GTID_WAIT))
+        else:
+            cursor.execute("SELECT GTID_SUBSET(%s, @@GLOBAL.gtid_executed)", (after,))
+        return bool(cursor.fetchone()[0])
+
+
+class TrackedConnection:
+    """Counts a checked-out replica connection until close()."""
+
+    def __init__(self, conn, replica):
+        self._conn = conn
+        self._replica = replica
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+    def has_executed(self, after):
+        return self._replica.has_executed(self._conn, after)
+
+    def close(self):
+        if self._replica is not None:
+            with _replicas_lock:
+                self._replica.outstanding -= 1
+            self._replica = None
+        self._conn.close()
+
+
+_replicas = None
+_replicas_pid = None
+_replicas_lock = threading.Lock()
+
+
+def get_replicas():
+    global _replicas, _replicas_pid
+    if _replicas is None or _replicas_pid != os.getpid():
+        replicas = []
+        for i, address in enumerate(a.strip() for a in config.DB_REPLICAS.split(',') if a.strip()):
+            host, _, port = address.partition(':')
+            replicas.append(Replica(i, host, int(port or 3306)))
+        _replicas, _replicas_pid = replicas, os.getpid()
+    return _replicas
+
+
+def _refresh_lag(replicas):
+    now = time.time()
+    with _replicas_lock:
+        # Claim the stale ones so concurrent requests don't all re-measure
+        due = [r for r in replicas if now - r.claimed_at > config.DB_REPLICA_CHECK_INTERVAL]
+        for r in due:
+            r.claimed_at = now
+    for r in due:
+        r.measure_lag()
+
+
+def get_read_connection(after=None):
+    """Connection for a read-only request: the least busy fresh replica that
+    has executed the GTID set `after` (if given), else the primary."""
+    replicas = get_replicas() if config.DB_BACKEND == 'mysql' else []
+    if not replicas:
+        return get_db_connection()
+
+    _refresh_lag(replicas)
+    needed = parse_gtid_set(after)
+    with _replicas_lock:
+        fresh = [r for r in replicas if r.lag is not None and r.lag <= config.DB_REPLICA_MAX_LAG]
+        if not fresh:
+            return get_db_connection()
+        # Replicas already known to hold `after` first; else the least busy one is asked
+        known = [r for r in fresh if gtid_subset(needed, r.executed)]
+        replica = min(known or fresh, key=lambda r: r.outstanding)
+        replica.outstanding += 1
+
+    conn = None
+    try:
+        conn = TrackedConnection(replica.connect(), replica)
+        if known or conn.has_executed(after):
+            return conn
+    except mysql.connector.Error:
+        with _replicas_lock:
+            replica.lag = None
+    if conn is not None:
+        conn.close()
+    else:
+        with _replicas_lock:
+            replica.outstanding -= 1
+    return get_db_connection()
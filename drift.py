@@ -0,0 +1,368 @@
+"""Drift monitoring for the recyclability model (model.py, trained by predict.py).
+
+Every prediction served (model.predict_recyclable) feeds its four features
+and the predicted probability into fixed-size summaries; the values
+themselves are not kept:
+
+    moments     count, mean, variance, min, max
+    quantiles   a KLL sketch: ~1% rank error from about a thousand floats
+    bins        counts per decile bin of the training reference
+
+predict.py saves the training reference next to recycle_scaler.pkl
+(recycle_reference.pkl): for each feature and for the training
+predictions, the decile bin edges and their shares, the CDF at a few
+quantiles, and the mean and standard deviation. Drift scores against it:
+
+    psi         population stability index over the reference bins
+                (< 0.1 stable, 0.1-0.25 moderate, > 0.25 major shift)
+    ks          largest gap between the served and training CDFs at the
+                reference quantiles (served side from the sketch)
+    mean_shift  (served mean - training mean) / training standard deviation
+
+Without a reference file only mean_shift is scored, from the moments the
+scaler kept.
+
+Summaries cover wall-clock windows of DRIFT_WINDOW seconds, and scores
+cover the current and the previous window. Each process writes its
+summaries to DRIFT_DIR every DRIFT_FLUSH_INTERVAL seconds, and GET
+/metrics merges every process's file, so the numbers cover all gunicorn
+workers (and api_async.py) whichever worker answers.
+"""
+import bisect
+import glob
+import json
+import math
+import os
+import random
+import threading
+import time
+
+import joblib
+
+import config
+
+PREDICTION = 'probability'
+DECILES = tuple(i / 10 for i in range(1, 10))
+QUANTILES = (0.01, 0.05, 0.1, 0.25, 0.5, 0.75, 0.9, 0.95, 0.99)
+# Quantiles reported on /metrics
+REPORTED_QUANTILES = (0.05, 0.5, 0.95)
+
+
+class Moments:
+    """Running count, mean, variance (Welford), min and max; mergeable."""
+
+    __slots__ = ('count', 'mean', 'm2', 'low', 'high')
+
+    def __init__(self, count=0, mean=0.0, m2=0.0, low=math.inf, high=-math.inf):
+        self.count, self.mean, self.m2, self.low, self.high = count, mean, m2, low, high
+
+    def add(self, x):
+        self.count += 1
+        delta = x - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (x - self.mean)
+        if x < self.low:
+            self.low = x
+        if x > self.high:
+            self.high = x
+
+    def merge(self, other):
+        if not other.count:
+            return
+        count = self.count + other.count
+        delta = other.mean - self.mean
+        self.mean += delta * other.count / count
+        self.m2 += other.m2 + delta * delta * self.count * other.count / count
+        self.count = count
+        self.low, self.high = min(self.low, other.low), max(self.high, other.high)
+
+    @property
+    def std(self):
+        return math.sqrt(self.m2 / self.count) if self.count else 0.0
+
+    def state(self):
+        return [self.count, self.mean, self.m2, self.low, self.high]
+
+
+class QuantileSketch:
+    """KLL sketch (Karnin, Lang & Liberty): compactors of doubling weight; mergeable.
+
+    Level h holds items of weight 2**h. A full level is sorted and every
+    other item (from a random start) moves up a level, so it holds at most
+    about 6k items however many are added.
+    """
+
+    def __init__(self, k=200, levels=None):
+        self.k = k
+        self.levels = levels or [[]]
+        self.size = sum(map(len, self.levels))
+        self._update_max_size()
+
+    def _capacity(self, level):
+        return 2 * int(math.ceil(self.k * (2 / 3) ** (len(self.levels) - level - 1))) + 1
+
+    def _update_max_size(self):
+        self.max_size = sum(self._capacity(h) for h in range(len(self.levels)))
+
+    def add(self, x):
+        self.levels[0].append(x)
+        self.size += 1
+        if self.size >= self.max_size:
+            self._compress()
+
+    def merge(self, other):
+        while len(self.levels) < len(other.levels):
+            self.levels.append([])
+        for items, extra in zip(self.levels, other.levels):
+            items.extend(extra)
+        self.size = sum(map(len, self.levels))
+        self._update_max_size()
+        while self.size >= self.max_size:
+            self._compress()
+
+    def _compress(self):
+        for h in range(len(self.levels)):
+            items = self.levels[h]
+            if len(items) >= self._capacity(h):
+                if h + 1 == len(self.levels):
+                    self.levels.append([])
+                    self._update_max_size()
+                items.sort()
+                # An odd item out stays behind
+                keep = len(items) // 2 * 2
+                self.levels[h + 1].extend(items[random.getrandbits(1):keep:2])
+                del items[:keep]
+                self.size -= keep // 2
+                if self.size < self.max_size:
+                    return
+
+    def _weighted(self):
+        return sorted((x, 1 << h) for h, items in enumerate(self.levels) for x in items)
+
+    def cdf(self, points):
+        """Estimated fraction of values <= each of the sorted `points`."""
+        weighted = self._weighted()
+        total = sum(w for _, w in weighted)
+        fractions, seen, i = [], 0, 0
+        for point in points:
+            while i < len(weighted) and weighted[i][0] <= point:
+                seen += weighted[i][1]
+                i += 1
+            fractions.append(seen / total if total else 0.0)
+        return fractions
+
+    def quantiles(self, qs):
+        weighted = self._weighted()
+        total = sum(w for _, w in weighted)
+        values, seen, i = [], 0, 0
+        for q in qs:
+            while i < len(weighted) - 1 and seen + weighted[i][1] < q * total:
+                seen += weighted[i][1]
+                i += 1
+            values.append(weighted[i][0] if weighted else None)
+        return values
+
+
+class Summary:
+    """Moments, quantile sketch and reference-bin counts of one feature."""
+
+    def __init__(self, edges=None, state=None):
+        if state is None:
+            self.moments = Moments()
+            self.sketch = QuantileSketch(config.DRIFT_SKETCH_K)
+            self.edges = edges
+            self.bins = [0] * (len(edges) + 1) if edges is not None else None
+        else:
+            self.moments = Moments(*state['moments'])
+            self.sketch = QuantileSketch(state['k'], state['levels'])
+            self.edges, self.bins = state['edges'], state['bins']
+
+    def add(self, x):
+        self.moments.add(x)
+        self.sketch.add(x)
+        if self.bins is not None:
+            self.bins[bisect.bisect_left(self.edges, x)] += 1
+
+    def merge(self, other):
+        empty = not self.moments.count
+        self.moments.merge(other.moments)
+        self.sketch.merge(other.sketch)
+        if empty:
+            self.edges, self.bins = other.edges, None if other.bins is None else list(other.bins)
+        elif self.bins is not None and other.bins is not None and other.edges == self.edges:
+            self.bins = [a + b for a, b in zip(self.bins, other.bins)]
+        else:
+            # Counted against another reference (the model was retrained): not comparable
+            self.bins = None
+
+    def state(self):
+        return {'moments': self.moments.state(), 'k': self.sketch.k, 'levels': self.sketch.levels,
+                'edges': self.edges, 'bins': self.bins}
+
+
+def build_reference(frame, probabilities):
+    """What predict.py saves next to the scaler: bins, CDF points and moments per feature and prediction."""
+    import numpy as np
+
+    columns = {name: np.asarray(frame[name], dtype=float) for name in frame.columns}
+    columns[PREDICTION] = np.asarray(probabilities, dtype=float)
+    features = {}
+    for name, values in columns.items():
+        # Repeated edges (discrete features) collapse into one
+        edges = np.unique(np.quantile(values, DECILES))
+        bins = np.bincount(np.searchsorted(edges, values, side='left'), minlength=len(edges) + 1)
+        features[name] = {
+            'edges': edges.tolist(),
+            'fractions': (bins / len(values)).tolist(),
+            'cdf': [(float(v), float(np.mean(values <= v))) for v in np.unique(np.quantile(values, QUANTILES))],
+            'mean': float(values.mean()),
+            'std': float(values.std()),
+            'count': int(len(values)),
+        }
+    return {'features': features, 'created_at': time.strftime('%Y-%m-%dT%H:%M:%S')}
+
+
+def psi(fractions, bins):
+    total = sum(bins)
+    score = 0.0
+    for expected, count in zip(fractions, bins):
+        # Empty bins on either side would make the log infinite
+        expected, actual = max(expected, 1e-4), max(count / total, 1e-4)
+        score += (actual - expected) * math.log(actual / expected)
+    return score
+
+
+class DriftMonitor:
+
+    def __init__(self, features, reference_path, scaler_path):
+        self.features = list(features)
+        self.names = self.features + [PREDICTION]
+        self.reference_path = reference_path
+        self.scaler_path = scaler_path
+        self._reference = None
+        self._windows = {}         # window start -> {name: Summary}
+        self._flushed_at = 0.0
+        self._lock = threading.Lock()
+
+    def reference(self):
+        """{'features': {name: {...}}}: the saved reference, or just the scaler's moments."""
+        if self._reference is None:
+            if os.path.exists(self.reference_path):
+                self._reference = joblib.load(self.reference_path)
+            else:
+                scaler = joblib.load(self.scaler_path)
+                # var_ rather than scale_, which is 1 for features that didn't vary in training
+                self._reference = {'features': {
+                    name: {'mean': float(mean), 'std': math.sqrt(var)}
+                    for name, mean, var in zip(self.features, scaler.mean_, scaler.var_)
+                }}
+        return self._reference
+
+    # -------------------------
+    # OBSERVING
+    # -------------------------
+    def observe(self, features, probability):
+        if not config.DRIFT_MONITOR:
+            return
+        now = time.time()
+        start = now // config.DRIFT_WINDOW * config.DRIFT_WINDOW
+        with self._lock:
+            window = self._windows.get(start)
+            if window is None:
+                reference = self.reference()['features']
+                window = self._windows[start] = {
+                    name: Summary(reference.get(name, {}).get('edges')) for name in self.names
+                }
+                for old in [w for w in self._windows if w < start - config.DRIFT_WINDOW]:
+                    del self._windows[old]
+            for name in self.features:
+                window[name].add(float(features[name]))
+            window[PREDICTION].add(float(probability))
+        if now - self._flushed_at >= config.DRIFT_FLUSH_INTERVAL:
+            self.flush()
+
+    def flush(self):
+        """Write this process's summaries where the other processes can merge them."""
+        self._flushed_at = time.time()
+        with self._lock:
+            data = json.dumps({str(start): {name: s.state() for name, s in window.items()}
+                               for start, window in self._windows.items()})
+        os.makedirs(config.DRIFT_DIR, exist_ok=True)
+        path = os.path.join(config.DRIFT_DIR, f"{os.getpid()}.json")
+        temporary = f"{path}.{threading.get_ident()}.tmp"
+        with open(temporary, 'w') as f:
+            f.write(data)
+        os.replace(temporary, path)
+
+    # -------------------------
+    # SCORING
+    # -------------------------
+    def merged(self):
+        """{name: Summary} over the current and previous window, across every process."""
+        if self._windows:
+            self.flush()
+        now = time.time()
+        since = now // config.DRIFT_WINDOW * config.DRIFT_WINDOW - config.DRIFT_WINDOW
+        merged = {name: Summary() for name in self.names}
+        for path in glob.glob(os.path.join(config.DRIFT_DIR, '*.json')):
+            try:
+                if os.path.getmtime(path) < since:
+                    # A process that has stopped; nothing in it is recent enough
+                    os.remove(path)
+                    continue
+                with open(path) as f:
+                    windows = json.load(f)
+            except (OSError, ValueError):
+                continue
+            for start, window in windows.items():
+                if float(start) >= since:
+                    for name, state in window.items():
+                        if name in merged:
+                            merged[name].merge(Summary(state=state))
+        return merged
+
+    def scores(self):
+        """{name: count, mean, std, quantiles and (given enough observations) psi / ks / mean_shift}."""
+        reference = self.reference()['features']
+        scores = {}
+        for name, summary in self.merged().items():
+            moments = summary.moments
+            entry = {'count': moments.count}
+            if moments.count:
+                entry.update(mean=moments.mean, std=moments.std,
+                             quantiles=dict(zip(REPORTED_QUANTILES, summary.sketch.quantiles(REPORTED_QUANTILES))))
+            expected = reference.get(name)
+            if expected and moments.count >= config.DRIFT_MIN_COUNT:
+                if expected['std'] > 0:
+                    entry['mean_shift'] = (moments.mean - expected['mean']) / expected['std']
+                if 'fractions' in expected and summary.bins is not None and summary.edges == expected['edges']:
+                    entry['psi'] = psi(expected['fractions'], summary.bins)
+                if 'cdf' in expected:
+                    points = [v for v, _ in expected['cdf']]
+                    served = summary.sketch.cdf(points)
+                    entry['ks'] = max(abs(s - f) for s, (_, f) in zip(served, expected['cdf']))
+            scores[name] = entry
+        return scores
+
+    def metrics_text(self):
+        """Prometheus text exposition of scores()."""
+        scores = self.scores()
+        lines = []
+
+        def gauge(metric, help_text, key, extra=None):
+            lines.append(f"# HELP {metric} {help_text}")
+            lines.append(f"# TYPE {metric} gauge")
+            for name, entry in scores.items():
+                for labels, value in (extra(name, entry) if extra else [('', entry.get(key))]):
+                    if value is not None:
+                        lines.append(f'{metric}{{feature="{name}"{labels}}} {value:.6g}')
+
+        gauge('splm_model_observations', 'Predictions summarized in the current and previous window', 'count')
+        gauge('splm_model_feature_mean', 'Mean of served values', 'mean')
+        gauge('splm_model_feature_quantile', 'Quantiles of served values (KLL sketch)', None,
+              lambda name, entry: [(f',quantile="{q}"', v) for q, v in entry.get('quantiles', {}).items()])
+        gauge('splm_model_drift_psi', 'Population stability index against the training reference', 'psi')
+        gauge('splm_model_drift_ks', 'Largest CDF gap against the training reference', 'ks')
+        gauge('splm_model_drift_mean_shift', 'Served mean minus training mean, in training standard deviations',
+              'mean_shift')
+        return '\n'.join(lines) + '\n'
@@ -0,0 +1,155 @@
+import csv
+import io
+import json
+import zlib
+
+from db import discard_connection, get_db_connection
+
+# Rows pulled from the server per round trip while streaming an export
+EXPORT_BATCH_SIZE = 1000
+
+# Each export: base query, the request args it can be filtered on
+# (arg name -> SQL condition), and the ORDER BY clause.
+EXPORTS = {
+    'passports': {
+        'query': """
+            SELECT ProductID, ComponentName, MaterialName, WeightInGrams,
+                   RecyclableGrade, IsHazardous
+            FROM ProductMaterialPassport
+        """,
+        'filters': {
+            'product_id': "ProductID = %s",
+        },
+        'order_by': "ProductID, ComponentName",
+    },
+    'timelines': {
+        'query': """
+            SELECT le.EventID, le.InstanceID, pi.SerialNumber, pi.ProductID,
+                   le.EventType, le.EventDate
+            FROM LifecycleEventsAll le
+            JOIN ProductInstances pi ON pi.InstanceID = le.InstanceID
+        """,
+        'filters': {
+            'instance_id': "le.InstanceID = %s",
+            'product_id': "pi.ProductID = %s",
+            'event_type': "le.EventType = %s",
+            'since': "le.EventDate >= %s",
+            'until': "le.EventDate < %s",
+        },
+        'order_by': "le.InstanceID, le.EventDate",
+        # Instance rows live on the shards when DB_SHARDS is set; not exported from there
+        'instance_rows': True,
+    },
+    'sourcing': {
+        'query': """
+            SELECT s.SupplierID, s.SupplierName, so.ComponentID, c.ComponentName,
+                   so.MaterialID, m.MaterialName
+            FROM Sourcing so
+            JOIN Suppliers s ON s.SupplierID = so.SupplierID
+            LEFT JOIN Components c ON so.ComponentID = c.ComponentID
+            LEFT JOIN RawMaterials m ON so.MaterialID = m.MaterialID
+        """,
+        'filters': {
+            'supplier_id': "so.SupplierID = %s",
+        },
+        'order_by': "s.SupplierID, so.SourcingID",
+    },
+}
+
+EXPORT_FORMATS = {
+    'csv': 'text/csv',
+    'ndjson': 'application/x-ndjson',
+}
+
+
+def build_export_query(kind, args):
+    spec = EXPORTS[kind]
+    conditions = []
+    params = []
+    for arg, condition in spec['filters'].items():
+        value = args.get(arg)
+        if value:
+            conditions.append(condition)
+            params.append(value)
+
+    sql = spec['query']
+    if conditions:
+        sql += " WHERE " + " AND ".join(conditions)
+    sql += " ORDER BY " + spec['order_by']
+    return sql, tuple(params)
+
+
+def stream_rows(sql, params):
+    """Yield (columns, batch) pairs from an unbuffered server-side cursor.
+
+    The connection is only held for as long as the generator is consumed,
+    and at most EXPORT_BATCH_SIZE rows are in memory at a time. An empty
+    result still yields (columns, []) once, so a CSV gets its header.
+    """
+    conn = get_db_connection()
+    cursor = None
+    pending = False
+    try:
+        cursor = conn.cursor(buffered=False)
+        cursor.execute(sql, params)
+        pending = True
+        columns = [d[0] for d in cursor.description]
+        empty = True
+        while True:
+            batch = cursor.fetchmany(EXPORT_BATCH_SIZE)
+            if not batch:
+                pending = False
+                break
+            empty = False
+            yield columns, batch
+        if empty:
+            yield columns, []
+    finally:
+        if pending:
+            # Abandoned mid-export (the client went away): reading the rest could take as
+            # long as the export itself, so the connection is dropped with its result
+            discard_connection(conn)
+        else:
+            if cursor is not None:
+                cursor.close()
+            conn.close()
+
+
+def _csv_chunks(batches):
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+    header_written = False
+    for columns, batch in batches:
+        if not header_written:
+            writer.writerow(columns)
+            header_written = True
+        writer.writerows(batch)
+        yield buf.getvalue().encode('utf-8')
+        buf.seek(0)
+        buf.truncate()
+
+
+def _ndjson_chunks(batches):
+    for columns, batch in batches:
+        if batch:
+            lines = [json.dumps(dict(zip(columns, row)), default=str) for row in batch]
+            yield ('\n'.join(lines) + '\n').encode('utf-8')
+
+
+def _gzip_chunks(chunks):
+    # wbits=31 -> gzip container, so the output is a valid .gz file
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def generate_export(kind, fmt, args, compress=False):
+    sql, params = build_export_query(kind, args)
+    batches = stream_rows(sql, params)
+    chunks = _csv_chunks(batches) if fmt == 'csv' else _ndjson_chunks(batches)
+    if compress:
+        chunks = _gzip_chunks(chunks)
+    return chunks
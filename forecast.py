@@ -0,0 +1,200 @@
+"""Material return-flow forecast for recycler capacity planning.
+
+    expected_units[month, product] = sum over the product's units in service, at age a:
+                                     (S(a + month - 1) - S(a + month)) / S(a)
+    returns_kg[month, material]    = expected_units @ catalog.mass / 1000
+
+S is the product's Kaplan-Meier survival (analytics.kaplan_meier) of age
+at end of life, in months from the Manufactured event, so a unit's chance
+of coming back depends on how old it is now: a product that lasts three
+years sends back few one-year-old units next month and many
+three-year-old ones. Ages are rounded to whole months.
+
+Where the curve has nothing to say, a constant monthly hazard h
+(end-of-life events / unit-months at risk) stands in: past the product's
+longest follow-up S is extended by (1 - h) ** months, and products with no
+end-of-life history yet (h is then the fleet-wide rate), or units older
+than every unit that has ended, use (1 - h) ** months alone.
+
+Expected units are computed for all MAX_MONTHS months at once and cached
+per write version of the event tables, like the analytics and the catalog,
+so only the small matrix product runs per request between writes.
+"""
+import threading
+import time
+from datetime import date
+
+import numpy as np
+from scipy import sparse
+
+import analytics
+from cache import table_versions
+from catalog import GRADES, get_catalog
+from lifecycle import STATE_CODES
+
+SECONDS_PER_MONTH = 30.4375 * 86400
+HAZARD_TABLES = ('LifecycleEvents', 'ProductInstances')
+# Longest forecast served (the cached expected units cover this many months)
+MAX_MONTHS = 120
+# (product, age) pairs whose survival is evaluated at once
+PAIR_CHUNK = 16384
+
+_lock = threading.Lock()
+_current = (None, None)
+
+
+def unit_ages(data, now):
+    """(age, ended, known) per instance: months from Manufactured to end of life, or to `now`."""
+    first = analytics.first_occurrence(data)
+    _, eol = analytics.milestone_durations(first)
+    start = first[:, STATE_CODES['Manufactured']]
+    known = ~np.isnan(start)
+    ended = known & ~np.isnan(eol)
+    age = np.where(known, np.maximum(np.where(ended, eol, now) - start, 0) / SECONDS_PER_MONTH, 0)
+    return age, ended, known
+
+
+def product_hazards(data, now, ages=None):
+    """Monthly end-of-life hazard and current in-service units per product."""
+    age, ended, known = unit_ages(data, now) if ages is None else ages
+
+    n_products = len(data['products'])
+    product_of = data['product_of']
+    events = np.bincount(product_of, weights=ended, minlength=n_products)
+    months = np.bincount(product_of, weights=age, minlength=n_products)
+    in_service = np.bincount(product_of, weights=known & ~ended, minlength=n_products)
+
+    fleet_hazard = events.sum() / months.sum() if months.sum() > 0 else 0.0
+    with np.errstate(divide='ignore', invalid='ignore'):
+        hazard = np.where(events > 0, events / months, fleet_hazard)
+    return np.clip(hazard, 0.0, 1.0), in_service
+
+
+def survival_curves(data, ages):
+    """Kaplan-Meier survival by age (months) at end of life, for every product.
+
+    Returns (times, survival, bounds, follow_up): product p's curve steps
+    down to survival[bounds[p]:bounds[p + 1]] at ages times[p];
+    follow_up[p] is its oldest unit's age.
+    """
+    age, ended, known = ages
+    n_products = len(data['products'])
+    product_of = data['product_of'][known]
+    order = np.argsort(product_of, kind='stable')
+    age, ended, product_of = age[known][order], ended[known][order], product_of[order]
+    unit_bounds = np.searchsorted(product_of, np.arange(n_products + 1))
+
+    follow_up = np.zeros(n_products)
+    times, survival = [], []
+    for p in range(n_products):
+        lo, hi = unit_bounds[p], unit_bounds[p + 1]
+        if hi > lo:
+            follow_up[p] = age[lo:hi].max()
+        t, s = analytics.kaplan_meier(age[lo:hi], ended[lo:hi]) if ended[lo:hi].any() else (np.empty(0),) * 2
+        times.append(t)
+        survival.append(s)
+    bounds = np.concatenate(([0], np.cumsum([len(t) for t in times]))).astype(np.int64)
+    return times, np.concatenate(survival) if survival else np.empty(0), bounds, follow_up
+
+
+def expected_units(data, now, months=MAX_MONTHS):
+    """(months x products) expected end-of-life units among the units in service at `now`."""
+    ages = unit_ages(data, now)
+    age, ended, known = ages
+    hazard, _ = product_hazards(data, now, ages)
+    times, survival, bounds, follow_up = survival_curves(data, ages)
+    n_products = len(data['products'])
+
+    # One sorted key space for every product's curve: p * span + age
+    span = float(np.ceil(follow_up.max() if n_products else 0) + months + 2)
+    keys = np.concatenate([p * span + t for p, t in enumerate(times)]) if times else np.empty(0)
+    has_curve = bounds[1:] > bounds[:-1]
+
+    # In-service units by (product, whole months of age)
+    serving = known & ~ended
+    pairs, counts = np.unique(data['product_of'][serving] * span + np.rint(age[serving]), return_counts=True)
+    units = np.zeros((months, n_products))
+    steps = np.arange(months + 1, dtype=np.float64)
+    for lo in range(0, len(pairs), PAIR_CHUNK):
+        p = (pairs[lo:lo + PAIR_CHUNK] // span).astype(np.int64)
+        a = pairs[lo:lo + PAIR_CHUNK] - p * span
+        t = a[:, None] + steps[None, :]
+        horizon = follow_up[p][:, None]
+        # Survival at each age: the curve up to the follow-up, then the constant hazard
+        found = np.searchsorted(keys, p[:, None] * span + np.minimum(t, horizon), side='right')
+        curve = np.where(found > bounds[p][:, None], survival[np.maximum(found - 1, 0)] if len(survival) else 1.0, 1.0)
+        decay = (1.0 - hazard[p])[:, None]
+        s = curve * decay ** np.maximum(t - horizon, 0)
+        # No end of life in the product's history, or older than every unit that ended
+        constant = ~has_curve[p] | (s[:, 0] <= 0)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            conditional = np.where(constant[:, None], decay ** steps[None, :], s / s[:, :1])
+        ending = (conditional[:, :-1] - conditional[:, 1:]) * counts[lo:lo + PAIR_CHUNK, None]
+        units += (sparse.csr_matrix((np.ones(len(p)), (p, np.arange(len(p)))), shape=(n_products, len(p)))
+                  @ ending).T
+    return units
+
+
+def fleet_forecast(now=None):
+    """(products, expected_units for MAX_MONTHS months, in_service) for the live fleet.
+
+    With now=None the result is cached per HAZARD_TABLES version and
+    measured at the time it was computed.
+    """
+    global _current
+    versions = None
+    if now is None:
+        versions, _ = table_versions(HAZARD_TABLES)
+        with _lock:
+            if _current[0] == versions:
+                return _current[1]
+        now = time.time()
+
+    data = analytics.load_fleet_event_arrays()
+    _, in_service = product_hazards(data, now)
+    result = (data['products'], expected_units(data, now), in_service)
+    if versions is not None:
+        with _lock:
+            _current = (versions, result)
+    return result
+
+
+def expected_returns(mass, units):
+    """(months x materials) expected grams returned, from (months x products) expected units."""
+    # (months x products) @ (products x materials) == ((materials x products) @ units.T).T
+    return np.asarray((sparse.csr_matrix(mass).T @ units.T).T)
+
+
+def returns_by_grade(grams, material_grade):
+    onehot = np.array([[g == grade for grade in GRADES] for g in material_grade], dtype=np.float64)
+    return grams @ onehot if len(onehot) else np.zeros((grams.shape[0], len(GRADES)))
+
+
+def _month_labels(start, months):
+    labels = []
+    for k in range(1, months + 1):
+        m = start.month - 1 + k
+        labels.append(f"{start.year + m // 12}-{m % 12 + 1:02d}")
+    return labels
+
+
+def forecast_returns(months=12, now=None):
+    """Expected kg returned per material and per grade for each of the next `months` months."""
+    catalog = get_catalog()
+    months = min(months, MAX_MONTHS)
+    products, units, _ = fleet_forecast(now)
+    now = time.time() if now is None else now
+    # analytics indexes products by the ProductIDs that have instances; map onto the catalog rows
+    rows = catalog.index_of('product', products)
+    mass = catalog.mass[rows] if len(rows) else sparse.csr_matrix((0, len(catalog.material_ids)))
+
+    grams = expected_returns(mass, units[:months])
+    kg = grams / 1000.0
+    by_grade = returns_by_grade(kg, catalog.material_grade)
+    return {
+        'months': _month_labels(date.fromtimestamp(now), months),
+        'by_material': {str(name): [round(float(v), 3) for v in kg[:, j]]
+                        for j, name in enumerate(catalog.material_names)},
+        'by_grade': {grade: [round(float(v), 3) for v in by_grade[:, g]]
+                     for g, grade in enumerate(GRADES)},
+    }
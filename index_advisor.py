@@ -0,0 +1,348 @@
+"""Index advisor and EXPLAIN regression check for the app's SQL.
+
+Collects every statement the app runs -- SQL string literals in the
+project's .py files, the export queries, and the statements inside the
+functions/procedures in commands.sql -- and EXPLAINs each one against the
+database in DB_NAME. Full table scans, filesorts and temporary tables are
+flagged, and an index is proposed for each scanned table from the columns
+its filter uses.
+
+Point DB_NAME at a scratch copy of the schema, never at production:
+
+    python index_advisor.py --generate 200000      # load a large synthetic dataset
+    python index_advisor.py                        # report
+    python index_advisor.py --analyze              # + EXPLAIN ANALYZE timings
+    python index_advisor.py --write-migration      # proposals -> migrations/NNN_*.sql
+    python index_advisor.py --update-baseline      # accept current plans
+    python index_advisor.py --check                # CI: exit 1 on plan regressions
+
+The baseline (explain_baseline.json) records the flags of each statement's
+plan; --check fails when a statement gains a flag it did not have, a new
+statement arrives with any, or a statement cannot be EXPLAINed at all.
+"""
+import argparse
+import ast
+import glob
+import hashlib
+import json
+import os
+import random
+import re
+import sys
+
+from db import get_db_connection
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+BASELINE_PATH = os.path.join(BASE_DIR, 'explain_baseline.json')
+MIGRATIONS_DIR = os.path.join(BASE_DIR, 'migrations')
+SCHEMA_PATH = os.path.join(BASE_DIR, 'commands.sql')
+
+# Scripts that are not part of the application
+# (sqlite_backend.py: SQLite dialect, never sent to MySQL)
+SKIP_FILES = {'index_advisor.py', 'migrate.py', 'tempCodeRunnerFile.py', 'app2.py', 'workingreportscode.py',
+              'sqlite_backend.py'}
+
+# Tables smaller than this are not worth flagging for full scans
+MIN_SCAN_ROWS = 1000
+
+SQL_START = re.compile(r'^\s*(SELECT|WITH|UPDATE|DELETE|INSERT)\b', re.IGNORECASE)
+SAMPLE_VALUE = "'1'"
+
+
+# -------------------------
+# 1) STATEMENT COLLECTION
+# -------------------------
+def _normalize(sql):
+    sql = sql.strip().rstrip(';')
+    # Driver placeholders (%s) and escaped percents -> a literal the planner accepts
+    sql = sql.replace('%s', SAMPLE_VALUE).replace('%%', '%')
+    return sql
+
+
+def statements_from_python():
+    found = []
+    for path in sorted(glob.glob(os.path.join(BASE_DIR, '*.py'))):
+        if os.path.basename(path) in SKIP_FILES:
+            continue
+        tree = ast.parse(open(path, encoding='utf-8').read())
+        # Pieces of f-strings are not complete statements
+        fragments = {id(part) for node in ast.walk(tree) if isinstance(node, ast.JoinedStr) for part in node.values}
+        for node in ast.walk(tree):
+            if id(node) in fragments:
+                continue
+            if isinstance(node, ast.Constant) and isinstance(node.value, str) and SQL_START.match(node.value):
+                found.append((f"{os.path.basename(path)}:{node.lineno}", _normalize(node.value)))
+    return found
+
+
+def statements_from_exports():
+    from exports import EXPORTS, build_export_query
+    found = []
+    for kind, spec in EXPORTS.items():
+        args = {arg: '1' for arg in spec['filters']}
+        sql, _ = build_export_query(kind, args)
+        found.append((f"exports.py:{kind}", _normalize(sql)))
+    return found
+
+
+ROUTINE = re.compile(
+    r'CREATE\s+(PROCEDURE|FUNCTION)\s+(\w+)(.*?)\bBEGIN\b(.*?)END\s*//',
+    re.IGNORECASE | re.DOTALL
+)
+PARAMETER = re.compile(
+    r'(\w+)\s+(?:INT|BIGINT|VARCHAR|DECIMAL|DATETIME|DATE|BOOLEAN|TEXT)\b',
+    re.IGNORECASE
+)
+BODY_STATEMENT = re.compile(
+    r'((?:WITH\s+RECURSIVE|SELECT|UPDATE|DELETE\s+FROM|INSERT\s+INTO|REPLACE\s+INTO)\b.*?);',
+    re.IGNORECASE | re.DOTALL
+)
+
+
+def statements_from_routines(schema_path=SCHEMA_PATH):
+    """Statements inside stored routines, with parameters replaced by sample literals."""
+    found = []
+    text = open(schema_path, encoding='utf-8').read()
+    for kind, name, header, body in ROUTINE.findall(text):
+        names = [p for p in PARAMETER.findall(header) if p.upper() != 'RETURNS']
+        body = re.sub(r'/\*.*?\*/', ' ', body, flags=re.DOTALL)
+        for stmt in BODY_STATEMENT.findall(body):
+            # SELECT ... INTO var FROM ... -> SELECT ... FROM ...
+            stmt = re.sub(r'\bINTO\s+\w+(\s*,\s*\w+)*\s+(?=FROM\b)', '', stmt, flags=re.IGNORECASE)
+            for param in names:
+                stmt = re.sub(rf'\b{re.escape(param)}\b', SAMPLE_VALUE, stmt)
+            found.append((f"commands.sql:{name}", _normalize(stmt)))
+    return found
+
+
+def collect_statements():
+    seen = {}
+    for source, sql in statements_from_python() + statements_from_exports() + statements_from_routines():
+        if SQL_START.match(sql) and sql not in seen.values():
+            seen[source if source not in seen else f"{source}#{len(seen)}"] = sql
+    return seen
+
+
+def statement_key(sql):
+    return hashlib.sha1(' '.join(sql.split()).encode('utf-8')).hexdigest()[:12]
+
+
+# -------------------------
+# 2) PLAN ANALYSIS
+# -------------------------
+def _walk_tables(node):
+    if isinstance(node, dict):
+        if 'table' in node and isinstance(node['table'], dict) and 'table_name' in node['table']:
+            yield node['table']
+        for value in node.values():
+            yield from _walk_tables(value)
+    elif isinstance(node, list):
+        for value in node:
+            yield from _walk_tables(value)
+
+
+def _walk_keys(node, key):
+    if isinstance(node, dict):
+        for k, value in node.items():
+            if k == key and value is True:
+                yield k
+            yield from _walk_keys(value, key)
+    elif isinstance(node, list):
+        for value in node:
+            yield from _walk_keys(value, key)
+
+
+def analyze_plan(plan):
+    """Return (flags, scans) for an EXPLAIN FORMAT=JSON document."""
+    flags = set()
+    scans = []
+    for table in _walk_tables(plan):
+        rows = table.get('rows_examined_per_scan', 0)
+        if table.get('access_type') == 'ALL' and rows >= MIN_SCAN_ROWS:
+            flags.add(f"full_scan:{table['table_name']}")
+            scans.append(table)
+    if any(_walk_keys(plan, 'using_filesort')):
+        flags.add('filesort')
+    if any(_walk_keys(plan, 'using_temporary_table')):
+        flags.add('temporary')
+    return sorted(flags), scans
+
+
+COLUMN_REF = re.compile(r'`(\w+)`\.`(\w+)`\.`(\w+)`|`(\w+)`\.`(\w+)`')
+
+
+def propose_index(table):
+    """Columns the table is filtered on, in the order the condition mentions them."""
+    condition = table.get('attached_condition', '')
+    alias = table['table_name']
+    columns = []
+    for match in COLUMN_REF.finditer(condition):
+        t, c = (match.group(2), match.group(3)) if match.group(1) else (match.group(4), match.group(5))
+        if t == alias and c not in columns:
+            columns.append(c)
+    return columns
+
+
+def explain_all(statements, analyze=False):
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    results = {}
+    try:
+        for source, sql in statements.items():
+            entry = {'source': source, 'sql': ' '.join(sql.split())}
+            try:
+                cursor.execute("EXPLAIN FORMAT=JSON " + sql)
+                plan = json.loads(cursor.fetchone()[0])
+                entry['flags'], scans = analyze_plan(plan)
+                entry['proposals'] = [
+                    {'table': t['table_name'], 'columns': propose_index(t)}
+                    for t in scans if propose_index(t)
+                ]
+                if analyze and sql.lstrip().upper().startswith(('SELECT', 'WITH')):
+                    cursor.execute("EXPLAIN ANALYZE " + sql)
+                    entry['analyze'] = cursor.fetchone()[0]
+            except Exception as e:
+                entry['error'] = str(e)
+            conn.rollback()
+            results[statement_key(sql)] = entry
+    finally:
+        conn.close()
+    return results
+
+
+# -------------------------
+# 3) REPORTING / BASELINE / MIGRATIONS
+# -------------------------
+def print_report(results):
+    for key, entry in sorted(results.items(), key=lambda kv: kv[1]['source']):
+        if entry.get('error'):
+            print(f"?  {entry['source']}: could not EXPLAIN ({entry['error']})")
+        elif entry['flags']:
+            print(f"⚠️  {entry['source']}: {', '.join(entry['flags'])}")
+            for p in entry['proposals']:
+                print(f"     -> index on {p['table']}({', '.join(p['columns'])})")
+        if entry.get('analyze'):
+            print(entry['analyze'])
+
+
+def check_regressions(results, baseline):
+    regressions = []
+    for key, entry in results.items():
+        if entry.get('error'):
+            # A statement that can't be EXPLAINed can't be checked either
+            regressions.append((entry['source'], [f"error: {entry['error']}"]))
+            continue
+        before = set(baseline.get(key, {}).get('flags', []))
+        new_flags = set(entry['flags']) - before
+        if new_flags:
+            regressions.append((entry['source'], sorted(new_flags)))
+    return regressions
+
+
+def write_baseline(results, path=BASELINE_PATH):
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump({k: {'source': v['source'], 'flags': v.get('flags', [])} for k, v in results.items()},
+                  f, indent=2, sort_keys=True)
+        f.write("\n")
+
+
+def write_migration(results):
+    """Write the distinct index proposals as the next numbered migration."""
+    proposals = {}
+    for entry in results.values():
+        for p in entry.get('proposals', []):
+            proposals[(p['table'], tuple(p['columns']))] = entry['source']
+    if not proposals:
+        return None
+
+    os.makedirs(MIGRATIONS_DIR, exist_ok=True)
+    existing = sorted(glob.glob(os.path.join(MIGRATIONS_DIR, '[0-9][0-9][0-9]_*.sql')))
+    number = int(os.path.basename(existing[-1])[:3]) + 1 if existing else 1
+    path = os.path.join(MIGRATIONS_DIR, f"{number:03d}_index_advisor.sql")
+    lines = ["/* Generated by index_advisor.py -- review before applying */", ""]
+    for (table, columns), source in sorted(proposals.items()):
+        name = "idx_" + "_".join([table.lower()] + [c.lower() for c in columns])[:60]
+        lines.append(f"/* {source} */")
+        lines.append(f"CREATE INDEX {name} ON {table} ({', '.join(columns)});")
+        lines.append("")
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write("\n".join(lines))
+    return path
+
+
+# -------------------------
+# 4) SYNTHETIC DATASET
+# -------------------------
+def generate_dataset(instances, events_per_instance=4, batch_size=5000):
+    """Append `instances` product instances with their lifecycle events."""
+    rng = random.Random(7)
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    try:
+        cursor.execute("SELECT ProductID FROM Products")
+        products = [r[0] for r in cursor.fetchall()]
+        cursor.execute("SELECT COALESCE(MAX(InstanceID), 0) FROM ProductInstances")
+        next_id = cursor.fetchone()[0] + 1
+
+        for start in range(0, instances, batch_size):
+            ids = range(next_id + start, next_id + min(start + batch_size, instances))
+            cursor.executemany(
+                "INSERT INTO ProductInstances (InstanceID, SerialNumber, ProductID) VALUES (%s, %s, %s)",
+                [(i, f"GEN-{i:09d}", rng.choice(products)) for i in ids]
+            )
+            events = []
+            for i in ids:
+                path = ['Manufactured', 'Sold', 'Repair', rng.choice(['Recycled', 'Disposed'])]
+                day = rng.randint(0, 700)
+                for event in path[:events_per_instance]:
+                    events.append((event, day, i))
+                    day += rng.randint(1, 200)
+            cursor.executemany(
+                "INSERT INTO LifecycleEvents (EventType, EventDate, InstanceID) "
+                "VALUES (%s, DATE_ADD('2024-01-01', INTERVAL %s DAY), %s)",
+                events
+            )
+            conn.commit()
+        cursor.execute("ANALYZE TABLE ProductInstances, LifecycleEvents")
+        cursor.fetchall()
+    finally:
+        conn.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--generate', type=int, metavar='N', help='insert N synthetic instances first')
+    parser.add_argument('--analyze', action='store_true', help='also run EXPLAIN ANALYZE on reads')
+    parser.add_argument('--check', action='store_true', help='exit 1 if any plan regressed vs the baseline')
+    parser.add_argument('--update-baseline', action='store_true')
+    parser.add_argument('--write-migration', action='store_true')
+    args = parser.parse_args(argv)
+
+    if args.generate:
+        generate_dataset(args.generate)
+
+    results = explain_all(collect_statements(), analyze=args.analyze)
+    print_report(results)
+
+    if args.write_migration:
+        path = write_migration(results)
+        print(f"Migration written: {path}" if path else "No index proposals")
+
+    if args.update_baseline:
+        write_baseline(results)
+        print(f"Baseline updated: {BASELINE_PATH}")
+
+    if args.check:
+        if not os.path.exists(BASELINE_PATH):
+            print(f"❌ No baseline at {BASELINE_PATH}; run --update-baseline on the scratch database first")
+            return 2
+        baseline = json.load(open(BASELINE_PATH, encoding='utf-8'))
+        regressions = check_regressions(results, baseline)
+        for source, flags in regressions:
+            print(f"❌ Plan regression in {source}: {', '.join(flags)}")
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
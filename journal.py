@@ -0,0 +1,433 @@
+"""Write-behind intake journal for lifecycle events.
+
+Scanner events are appended to a local append-only journal and acknowledged
+as soon as they are on disk; a background flusher moves them into
+LifecycleEvents in batched transactions.
+
+    JOURNAL_DIR/
+      w-<pid>/              one directory per process that takes intake
+        LOCK                flock held by the owning process
+        seg-00000001.log    newline-delimited JSON records
+        checkpoint.json     {"segment": n, "offset": bytes} applied so far
+
+Durability: appends are group-committed -- whoever arrives while no fsync
+is running performs one for everybody written so far, so concurrent
+scanners share fsyncs and a lone scanner pays one.
+
+Exactly-once: every record carries an EventUUID. The flusher inserts the
+batch's events and their UUIDs into JournalApplied in the same transaction,
+and skips UUIDs already there, so replaying a batch whose checkpoint write
+was lost (crash between commit and checkpoint) applies nothing twice.
+A record that can never be stored is logged and recorded as rejected, so it
+cannot hold up the records behind it; /api/events checks event_uuid and
+event_date before journaling (check_event). JournalApplied rows are kept for JOURNAL_APPLIED_RETENTION_DAYS: every
+flusher prunes older ones about once an hour, on every node.
+
+Recovery: a directory whose LOCK can be taken has no live owner; any
+flusher adopts it, replays it from its checkpoint and removes it.
+
+    python journal.py         # replay every orphaned journal now
+    python journal.py prune   # delete expired JournalApplied rows (e.g. from cron with JOURNAL_ENABLED=0)
+"""
+import fcntl
+import glob
+import json
+import logging
+import os
+import shutil
+import sys
+import threading
+import time
+import uuid
+from datetime import datetime
+
+import config
+from cache import note_write
+from db import get_db_connection, is_data_error
+from lifecycle import apply_events, lock_states, recycling_event_type
+from shards import bump_primary, get_shards, group_by_shard, shard_connection
+
+log = logging.getLogger(__name__)
+
+SEGMENT_PATTERN = 'seg-*.log'
+EVENT_DATE_FORMAT = '%Y-%m-%d %H:%M:%S'
+# JournalApplied.EventUUID is CHAR(36)
+MAX_UUID_LENGTH = 36
+# Seconds between a flusher's JournalApplied prunes
+PRUNE_INTERVAL = 3600
+
+
+def check_event(event_uuid=None, event_date=None):
+    """Raise ValueError unless the (optional) event_uuid and event_date can be stored as given."""
+    if event_uuid is not None and not (isinstance(event_uuid, str) and len(event_uuid) <= MAX_UUID_LENGTH):
+        raise ValueError(f"event_uuid must be a string of at most {MAX_UUID_LENGTH} characters")
+    if event_date is not None:
+        try:
+            datetime.strptime(event_date, EVENT_DATE_FORMAT)
+        except (TypeError, ValueError):
+            raise ValueError(f"event_date must be 'YYYY-MM-DD HH:MM:SS', not {event_date!r}") from None
+
+
+def _segment_path(directory, number):
+    return os.path.join(directory, f'seg-{number:08d}.log')
+
+
+def _segments(directory):
+    return sorted(int(os.path.basename(p)[4:12]) for p in glob.glob(os.path.join(directory, SEGMENT_PATTERN)))
+
+
+def _lock(directory):
+    """Exclusive, non-blocking ownership of a journal directory; None if owned elsewhere."""
+    fd = os.open(os.path.join(directory, 'LOCK'), os.O_RDWR | os.O_CREAT, 0o644)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        os.close(fd)
+        return None
+    return fd
+
+
+def _fsync_dir(directory):
+    fd = os.open(directory, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+# -------------------------
+# 1) APPEND SIDE
+# -------------------------
+class Journal:
+
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self._lock_fd = _lock(directory)
+        if self._lock_fd is None:
+            raise RuntimeError(f"Journal {directory} is owned by another process")
+        existing = _segments(directory)
+        self.segment = existing[-1] if existing else 1
+        self._fd = self._open_segment()
+        self._cond = threading.Condition()
+        self._written = 0      # records written to the file
+        self._synced = 0       # records known to be on disk
+        self._syncing = False
+
+    def _open_segment(self):
+        fd = os.open(_segment_path(self.directory, self.segment), os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+        _fsync_dir(self.directory)
+        return fd
+
+    def append(self, instance_id, event_type, event_date=None, event_uuid=None):
+        """Durably journal one event; returns its EventUUID once it is on disk."""
+        record = {
+            'uuid': event_uuid or str(uuid.uuid4()),
+            'instance_id': int(instance_id),
+            'event_type': event_type,
+            'event_date': event_date or datetime.now().strftime(EVENT_DATE_FORMAT),
+        }
+        line = (json.dumps(record, separators=(',', ':')) + '\n').encode('utf-8')
+
+        with self._cond:
+            if os.fstat(self._fd).st_size + len(line) > config.JOURNAL_SEGMENT_BYTES:
+                while self._syncing:
+                    self._cond.wait()
+                self._rotate()
+            os.write(self._fd, line)
+            self._written += 1
+            mine = self._written
+            while self._synced < mine:
+                if not self._syncing:
+                    self._group_sync()
+                else:
+                    self._cond.wait()
+        return record['uuid']
+
+    def _group_sync(self):
+        # Called with the condition held; the fsync itself runs without it
+        # so later appends can queue up behind this one
+        self._syncing = True
+        target, fd = self._written, self._fd
+        self._cond.release()
+        try:
+            os.fsync(fd)
+        finally:
+            self._cond.acquire()
+            self._syncing = False
+        self._synced = max(self._synced, target)
+        self._cond.notify_all()
+
+    def _rotate(self):
+        os.fsync(self._fd)
+        os.close(self._fd)
+        self._synced = self._written
+        self.segment += 1
+        self._fd = self._open_segment()
+
+    def close(self):
+        with self._cond:
+            os.fsync(self._fd)
+            os.close(self._fd)
+        os.close(self._lock_fd)
+
+
+# -------------------------
+# 2) FLUSH SIDE
+# -------------------------
+def read_checkpoint(directory):
+    try:
+        with open(os.path.join(directory, 'checkpoint.json'), encoding='utf-8') as f:
+            data = json.load(f)
+        return data['segment'], data['offset']
+    except FileNotFoundError:
+        segments = _segments(directory)
+        return (segments[0] if segments else 1), 0
+
+
+def write_checkpoint(directory, segment, offset):
+    path = os.path.join(directory, 'checkpoint.json')
+    with open(path + '.tmp', 'w', encoding='utf-8') as f:
+        json.dump({'segment': segment, 'offset': offset}, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(path + '.tmp', path)
+
+
+def read_batch(directory, segment, offset, limit):
+    """Up to `limit` complete records from (segment, offset); returns (records, segment, offset)."""
+    records = []
+    segments = [s for s in _segments(directory) if s >= segment]
+    for number in segments:
+        if number != segment:
+            segment, offset = number, 0
+        with open(_segment_path(directory, number), 'rb') as f:
+            f.seek(offset)
+            for line in f:
+                if not line.endswith(b'\n'):
+                    # Torn tail of an append still in progress (or cut off by a crash)
+                    return records, segment, offset
+                records.append(json.loads(line))
+                offset += len(line)
+                if len(records) >= limit:
+                    return records, segment, offset
+    return records, segment, offset
+
+
+def apply_records(conn, records):
+    """Insert a batch of journal records exactly once. Returns (applied, rejected, duplicates).
+
+    A record that can never be stored (a malformed field, or a value the
+    database refuses) is rejected on its own rather than failing the batch,
+    which would otherwise be retried from the same checkpoint forever.
+    """
+    cursor = conn.cursor()
+    rejected = []
+    valid = []
+    for r in records:
+        try:
+            check_event(r.get('uuid'), r.get('event_date'))
+            if not r.get('uuid') or type(r.get('instance_id')) is not int:
+                raise ValueError("record has no event_uuid or instance_id")
+        except ValueError as e:
+            rejected.append(((r.get('instance_id'), r.get('event_type'), r.get('event_date')), str(e)))
+        else:
+            valid.append(r)
+    if not valid:
+        return 0, rejected, 0
+
+    uuids = [r['uuid'] for r in valid]
+    placeholders = ", ".join(["%s"] * len(uuids))
+    cursor.execute(f"SELECT EventUUID FROM JournalApplied WHERE EventUUID IN ({placeholders})", tuple(uuids))
+    seen = {row[0] for row in cursor.fetchall()}
+    # A record may also repeat inside one batch if a scanner retried with the same UUID
+    fresh = {}
+    for r in valid:
+        if r['uuid'] not in seen:
+            fresh.setdefault(r['uuid'], r)
+    fresh = list(fresh.values())
+    duplicates = len(valid) - len(fresh)
+    if not fresh:
+        return 0, rejected, duplicates
+
+    # Locked before the savepoint, so a retry below still holds them
+    lock_states(cursor, list(dict.fromkeys(r['instance_id'] for r in fresh)))
+    cursor.execute("SAVEPOINT journal_batch")
+    try:
+        applied, batch_rejected = _apply_fresh(conn, cursor, fresh)
+    except Exception as e:
+        if not is_data_error(e):
+            raise
+        cursor.execute("ROLLBACK TO SAVEPOINT journal_batch")
+        # Some record is refused by the database: apply them one by one to find it
+        applied, batch_rejected = 0, []
+        for r in fresh:
+            cursor.execute("SAVEPOINT journal_record")
+            try:
+                a, rj = _apply_fresh(conn, cursor, [r])
+            except Exception as e:
+                if not is_data_error(e):
+                    raise
+                cursor.execute("ROLLBACK TO SAVEPOINT journal_record")
+                cursor.execute("INSERT INTO JournalApplied (EventUUID, Rejected) VALUES (%s, 1)", (r['uuid'],))
+                a, rj = 0, [((r['instance_id'], r['event_type'], r['event_date']), str(e))]
+            applied += a
+            batch_rejected.extend(rj)
+    return applied, rejected + batch_rejected, duplicates
+
+
+def _apply_fresh(conn, cursor, fresh):
+    events = []
+    for r in fresh:
+        event_type = r['event_type']
+        # Same upgrade the event form applies for products with hazardous material
+        if event_type == 'Recycled':
+            event_type = recycling_event_type(cursor, r['instance_id'])
+        events.append((r['instance_id'], event_type, r['event_date']))
+
+    accepted, rejected = apply_events(conn, events)
+    # Rejected events are recorded too, so they are not retried on every replay
+    rejected_events = {id(e) for e, _ in rejected}
+    cursor.executemany(
+        "INSERT INTO JournalApplied (EventUUID, Rejected) VALUES (%s, %s)",
+        [(r['uuid'], int(id(e) in rejected_events)) for r, e in zip(fresh, events)]
+    )
+    return len(accepted), rejected
+
+
+def apply_batch(records):
+    """apply_records() on each shard holding some of `records`, committed per shard."""
+    applied, rejected, duplicates = 0, [], 0
+    for index, batch in group_by_shard(records, lambda r: r['instance_id']).items():
+        conn = shard_connection(index)
+        try:
+            a, r, d = apply_records(conn, batch)
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            conn.close()
+        applied, duplicates = applied + a, duplicates + d
+        rejected.extend(r)
+    if applied:
+        bump_primary('LifecycleEvents')
+    return applied, rejected, duplicates
+
+
+def drain(directory, batch_size=None):
+    """Apply everything journaled in `directory` since its checkpoint; returns records consumed."""
+    batch_size = batch_size or config.JOURNAL_FLUSH_BATCH
+    segment, offset = read_checkpoint(directory)
+    consumed = 0
+    while True:
+        records, next_segment, next_offset = read_batch(directory, segment, offset, batch_size)
+        if not records:
+            break
+        applied, rejected, _ = apply_batch(records)
+        if applied:
+            note_write()
+        for event, reason in rejected:
+            log.warning("Journal event %s rejected: %s", event, reason)
+        write_checkpoint(directory, next_segment, next_offset)
+        segment, offset = next_segment, next_offset
+        consumed += len(records)
+
+    # Segments before the checkpoint's are fully applied
+    for number in _segments(directory):
+        if number < segment:
+            os.remove(_segment_path(directory, number))
+    return consumed
+
+
+def prune_applied(days=None):
+    """Delete JournalApplied rows older than `days` on every node; returns the number deleted.
+
+    A UUID retried after that is applied again, so keep `days` well above
+    how long a scanner retries or an orphaned journal can wait for replay.
+    """
+    days = config.JOURNAL_APPLIED_RETENTION_DAYS if days is None else days
+    cutoff = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(time.time() - days * 86400))
+    deleted = 0
+    for connect in [get_db_connection] + [s.connect for s in get_shards()]:
+        conn = connect()
+        try:
+            cursor = conn.cursor()
+            cursor.execute("DELETE FROM JournalApplied WHERE AppliedAt < %s", (cutoff,))
+            deleted += cursor.rowcount
+            conn.commit()
+        finally:
+            conn.close()
+    return deleted
+
+
+def adopt_orphans(own_directory=None):
+    """Replay and remove journals left behind by processes that have exited."""
+    replayed = 0
+    for directory in glob.glob(os.path.join(config.JOURNAL_DIR, 'w-*')):
+        if directory == own_directory:
+            continue
+        fd = _lock(directory)
+        if fd is None:
+            continue
+        try:
+            replayed += drain(directory)
+            shutil.rmtree(directory)
+        finally:
+            os.close(fd)
+    return replayed
+
+
+class Flusher(threading.Thread):
+    """Drains this process's journal every JOURNAL_FLUSH_INTERVAL seconds."""
+
+    def __init__(self, journal):
+        super().__init__(name='journal-flusher', daemon=True)
+        self.journal = journal
+        self.wake = threading.Event()
+        self.stopping = False
+        self.pruned_at = None
+
+    def run(self):
+        while not self.stopping:
+            try:
+                drain(self.journal.directory)
+                adopt_orphans(self.journal.directory)
+                if self.pruned_at is None or time.monotonic() - self.pruned_at >= PRUNE_INTERVAL:
+                    prune_applied()
+                    self.pruned_at = time.monotonic()
+            except Exception:
+                # The database may be down; the journal keeps the events until it is back
+                log.exception("Journal flush failed")
+            self.wake.wait(config.JOURNAL_FLUSH_INTERVAL)
+            self.wake.clear()
+
+    def stop(self):
+        self.stopping = True
+        self.wake.set()
+        self.join()
+        drain(self.journal.directory)
+
+
+_journal = None
+_journal_pid = None
+_journal_lock = threading.Lock()
+
+
+def get_journal():
+    """This process's journal, with its flusher running (started on first use)."""
+    global _journal, _journal_pid
+    with _journal_lock:
+        if _journal is None or _journal_pid != os.getpid():
+            _journal = Journal(os.path.join(config.JOURNAL_DIR, f'w-{os.getpid()}'))
+            _journal_pid = os.getpid()
+            Flusher(_journal).start()
+    return _journal
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    if sys.argv[1:] == ['prune']:
+        print(f"Pruned {prune_applied()} JournalApplied rows")
+    else:
+        print(f"Replayed {adopt_orphans()} journaled events")
@@ -0,0 +1,179 @@
+"""Lifecycle state machine for product instances.
+
+An instance's state is the type of its latest event ('NoEvents' before the
+first one). LIFECYCLE below is the whole rule set; it is compiled once into
+a dense transition table so validating an event is a single indexed lookup
+against the instance's current state, instead of a scan of its history.
+
+The current state is ProductInstances.CurrentState, kept up to date by the
+After_Lifecycle_Insert trigger. apply_events locks the affected rows,
+validates a whole batch against them and inserts the accepted events. The
+same rules are in the LifecycleTransitions table, which the
+Before_Lifecycle_Insert trigger checks for writers that bypass this module
+(stored procedures, older scripts).
+
+Events are only ever appended: one dated before the instance's latest event
+is refused, here and by the trigger, since the current state says nothing
+about whether it was allowed at the time (or whether the later events still
+are after it).
+"""
+from datetime import datetime
+
+# state -> events that may follow it
+LIFECYCLE = {
+    'NoEvents': ['Manufactured'],
+    'Manufactured': ['Sold'],
+    'Sold': ['Repair', 'Recycled', 'Recycled_Hazardous', 'Disposed'],
+    'Repair': ['Repair', 'Recycled', 'Recycled_Hazardous', 'Disposed'],
+    'Recycled': [],
+    'Recycled_Hazardous': [],
+    'Disposed': [],
+}
+
+STATES = list(LIFECYCLE)
+STATE_CODES = {state: code for code, state in enumerate(STATES)}
+EVENT_TYPES = STATES[1:]
+END_OF_LIFE = ('Recycled', 'Recycled_Hazardous', 'Disposed')
+
+
+def compile_transitions(lifecycle):
+    table = [bytearray(len(STATES)) for _ in STATES]
+    for state, events in lifecycle.items():
+        for event in events:
+            table[STATE_CODES[state]][STATE_CODES[event]] = 1
+    return table
+
+
+TRANSITIONS = compile_transitions(LIFECYCLE)
+
+
+class IllegalTransition(ValueError):
+    pass
+
+
+def is_allowed(state, event_type):
+    code = STATE_CODES.get(event_type)
+    if code is None or code == 0:
+        return False
+    state_code = STATE_CODES.get(state)
+    if state_code is None:
+        # e.g. a CurrentState written by a newer version of the rules
+        return False
+    return bool(TRANSITIONS[state_code][code])
+
+
+def check_transition(state, event_type):
+    if event_type not in STATE_CODES or event_type == 'NoEvents':
+        raise IllegalTransition(f"Unknown event type '{event_type}'")
+    if not is_allowed(state, event_type):
+        raise IllegalTransition(f"Cannot record '{event_type}' for an instance in state '{state}'")
+
+
+def lock_states(cursor, instance_ids):
+    """InstanceID -> CurrentState, with the rows locked until the caller commits."""
+    placeholders = ", ".join(["%s"] * len(instance_ids))
+    cursor.execute(
+        f"SELECT InstanceID, CurrentState FROM ProductInstances WHERE InstanceID IN ({placeholders}) FOR UPDATE",
+        tuple(instance_ids)
+    )
+    return {row[0]: row[1] for row in cursor.fetchall()}
+
+
+def latest_event_dates(cursor, instance_ids):
+    """InstanceID -> EventDate of its latest live event, for instances that have one."""
+    placeholders = ", ".join(["%s"] * len(instance_ids))
+    cursor.execute(
+        f"SELECT InstanceID, MAX(EventDate) FROM LifecycleEvents WHERE InstanceID IN ({placeholders}) "
+        f"GROUP BY InstanceID",
+        tuple(instance_ids)
+    )
+    return {row[0]: _as_datetime(row[1]) for row in cursor.fetchall()}
+
+
+def _as_datetime(value):
+    if value is None:
+        return datetime.now()
+    if isinstance(value, datetime):
+        return value
+    # Journal records and SQLite hand back ISO strings
+    return datetime.fromisoformat(str(value))
+
+
+def validate_batch(states, events, latest=None):
+    """Walk `events` in order from `states`.
+
+    events are (instance_id, event_type, event_date) tuples; event_date may
+    be None for "now". `latest` maps instances to the date of their latest
+    event; an event dated before it is rejected. Returns (accepted,
+    rejected, final_states) where rejected is a list of (event, reason).
+    """
+    states = dict(states)
+    latest = dict(latest or {})
+    accepted, rejected = [], []
+    for event in events:
+        inst_id, event_type = event[0], event[1]
+        state = states.get(inst_id)
+        if state is None:
+            rejected.append((event, f"Unknown instance {inst_id}"))
+            continue
+        try:
+            check_transition(state, event_type)
+        except IllegalTransition as e:
+            rejected.append((event, str(e)))
+            continue
+        when = _as_datetime(event[2] if len(event) > 2 else None)
+        if inst_id in latest and when < latest[inst_id]:
+            rejected.append((event, f"Event dated {when} is before the instance's latest event ({latest[inst_id]})"))
+            continue
+        accepted.append(event)
+        states[inst_id] = event_type
+        latest[inst_id] = when
+    return accepted, rejected, states
+
+
+def apply_events(conn, events):
+    """Validate and insert a batch of lifecycle events. The caller commits.
+
+    The touched ProductInstances rows are locked first, so the batch is
+    validated against states no other writer can change before the commit.
+    Returns (accepted, rejected) like validate_batch.
+    """
+    cursor = conn.cursor()
+    instance_ids = list(dict.fromkeys(e[0] for e in events))
+    states = lock_states(cursor, instance_ids)
+    accepted, rejected, _ = validate_batch(states, events, latest_event_dates(cursor, instance_ids))
+    if not accepted:
+        return accepted, rejected
+
+    # Before_Lifecycle_Insert re-checks each row; After_Lifecycle_Insert keeps CurrentState in step
+    cursor.executemany(
+        "INSERT INTO LifecycleEvents (EventType, EventDate, InstanceID) "
+        "VALUES (%s, COALESCE(%s, NOW()), %s)",
+        [(e[1], e[2] if len(e) > 2 else None, e[0]) for e in accepted]
+    )
+    cursor.callproc('BumpTableVersion', ['LifecycleEvents'])
+    return accepted, rejected
+
+
+def recycling_event_type(cursor, instance_id):
+    """'Recycled_Hazardous' if the instance's product contains hazardous material.
+
+    One primary-key lookup in AssemblyHazardIndex, which holds per-assembly
+    totals over the whole BOM subtree.
+    """
+    cursor.execute("""
+        SELECT COALESCE(h.HazardousCount, 0)
+        FROM ProductInstances pi
+        JOIN Products p ON p.ProductID = pi.ProductID
+        LEFT JOIN AssemblyHazardIndex h ON h.ComponentID = p.RootComponentID
+        WHERE pi.InstanceID = %s
+    """, (instance_id,))
+    row = cursor.fetchone()
+    return 'Recycled_Hazardous' if row and row[0] > 0 else 'Recycled'
+
+
+def record_event(conn, instance_id, event_type):
+    """Validate and insert one event; raises IllegalTransition. The caller commits."""
+    accepted, rejected = apply_events(conn, [(instance_id, event_type, None)])
+    if rejected:
+        raise IllegalTransition(rejected[0][1])
@@ -0,0 +1,81 @@
+"""Apply migrations/NNN_*.sql in order, once each.
+
+    python migrate.py           # apply pending migrations
+    python migrate.py --status  # list applied / pending
+
+Applied versions are recorded in the SchemaMigrations table.
+"""
+import glob
+import os
+import re
+import sys
+
+from db import get_db_connection
+
+MIGRATIONS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'migrations')
+
+
+def list_migrations():
+    """[(version, path)] sorted by version."""
+    paths = glob.glob(os.path.join(MIGRATIONS_DIR, '[0-9][0-9][0-9]_*.sql'))
+    return sorted((int(os.path.basename(p)[:3]), p) for p in paths)
+
+
+def split_statements(text):
+    """Plain ';'-separated DDL; comments are dropped (no DELIMITER blocks)."""
+    text = re.sub(r'/\*.*?\*/', ' ', text, flags=re.DOTALL)
+    text = re.sub(r'--[^\n]*', ' ', text)
+    return [s.strip() for s in text.split(';') if s.strip()]
+
+
+def applied_versions(cursor):
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS SchemaMigrations (
+          Version INT PRIMARY KEY,
+          Name VARCHAR(200) NOT NULL,
+          AppliedAt DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+    cursor.execute("SELECT Version FROM SchemaMigrations")
+    return {r[0] for r in cursor.fetchall()}
+
+
+def migrate(connect=get_db_connection):
+    """Apply every pending migration; returns the names applied."""
+    conn = connect()
+    cursor = conn.cursor()
+    done = []
+    try:
+        applied = applied_versions(cursor)
+        for version, path in list_migrations():
+            if version in applied:
+                continue
+            with open(path, encoding='utf-8') as f:
+                statements = split_statements(f.read())
+            # DDL commits implicitly in MySQL, so a failed migration stops here
+            # and is retried from the top after the cause is fixed
+            for stmt in statements:
+                cursor.execute(stmt)
+            cursor.execute(
+                "INSERT INTO SchemaMigrations (Version, Name) VALUES (%s, %s)",
+                (version, os.path.basename(path))
+            )
+            conn.commit()
+            done.append(os.path.basename(path))
+    finally:
+        conn.close()
+    return done
+
+
+if __name__ == '__main__':
+    if '--status' in sys.argv:
+        conn = get_db_connection()
+        try:
+            applied = applied_versions(conn.cursor())
+        finally:
+            conn.close()
+        for version, path in list_migrations():
+            print(f"{'applied' if version in applied else 'pending'}  {os.path.basename(path)}")
+    else:
+        for name in migrate():
+            print(f"Applied {name}")
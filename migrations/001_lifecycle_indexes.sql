@@ -0,0 +1,12 @@
+/* Indexes for the timeline and lifecycle-age lookups (index_advisor.py).
+
+   GetLifecycleAge filters on InstanceID + EventType and sorts by EventDate;
+   timelines and "latest event" lookups filter on InstanceID and sort by
+   EventDate. Both are served in index order without a filesort. */
+ALTER TABLE LifecycleEvents
+  DROP INDEX idx_le_instance,
+  ADD INDEX idx_le_instance_date (InstanceID, EventDate),
+  ADD INDEX idx_le_instance_type_date (InstanceID, EventType, EventDate);
+
+ALTER TABLE LifecycleEventsArchive
+  ADD INDEX idx_lea_instance_type_date (InstanceID, EventType, EventDate);
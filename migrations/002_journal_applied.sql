@@ -0,0 +1,10 @@
+/* EventUUIDs of journal records already applied (journal.py).
+   Written in the same transaction as the events, so replays are no-ops.
+   Rows older than JOURNAL_APPLIED_RETENTION_DAYS are pruned by the
+   flusher (journal.prune_applied), by AppliedAt. */
+CREATE TABLE JournalApplied (
+  EventUUID CHAR(36) PRIMARY KEY,
+  Rejected BOOLEAN NOT NULL DEFAULT FALSE,
+  AppliedAt DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP,
+  KEY idx_journal_applied_at (AppliedAt)
+);
@@ -0,0 +1,43 @@
+/* Transactional outbox behind the change feed (outbox.py).
+   Rows are written by AFTER INSERT triggers, so they commit or roll back
+   with the write itself whichever path made it (procedures, apply_events,
+   the intake journal, /add_sourcing). FeedSeq is assigned afterwards, in
+   commit order, by outbox.sequence_pending(). */
+CREATE TABLE ChangeOutbox (
+  ChangeID BIGINT PRIMARY KEY AUTO_INCREMENT,
+  EntityType VARCHAR(32) NOT NULL,
+  EntityID VARCHAR(100) NOT NULL,
+  ChangeType VARCHAR(16) NOT NULL,
+  Payload JSON NOT NULL,
+  CreatedAt DATETIME(6) NOT NULL DEFAULT CURRENT_TIMESTAMP(6),
+  FeedSeq BIGINT NULL,
+  UNIQUE KEY idx_outbox_feedseq (FeedSeq)
+);
+
+CREATE TRIGGER Outbox_ProductInstance_Insert AFTER INSERT ON ProductInstances FOR EACH ROW
+  INSERT INTO ChangeOutbox (EntityType, EntityID, ChangeType, Payload)
+  VALUES ('ProductInstance', NEW.InstanceID, 'insert',
+          JSON_OBJECT('InstanceID', NEW.InstanceID, 'SerialNumber', NEW.SerialNumber, 'ProductID', NEW.ProductID));
+
+CREATE TRIGGER Outbox_LifecycleEvent_Insert AFTER INSERT ON LifecycleEvents FOR EACH ROW
+  INSERT INTO ChangeOutbox (EntityType, EntityID, ChangeType, Payload)
+  VALUES ('LifecycleEvent', NEW.EventID, 'insert',
+          JSON_OBJECT('EventID', NEW.EventID, 'InstanceID', NEW.InstanceID, 'EventType', NEW.EventType,
+                      'EventDate', DATE_FORMAT(NEW.EventDate, '%Y-%m-%d %H:%i:%s')));
+
+CREATE TRIGGER Outbox_Supplier_Insert AFTER INSERT ON Suppliers FOR EACH ROW
+  INSERT INTO ChangeOutbox (EntityType, EntityID, ChangeType, Payload)
+  VALUES ('Supplier', NEW.SupplierID, 'insert',
+          JSON_OBJECT('SupplierID', NEW.SupplierID, 'SupplierName', NEW.SupplierName));
+
+CREATE TRIGGER Outbox_Sourcing_Insert AFTER INSERT ON Sourcing FOR EACH ROW
+  INSERT INTO ChangeOutbox (EntityType, EntityID, ChangeType, Payload)
+  VALUES ('Sourcing', NEW.SourcingID, 'insert',
+          JSON_OBJECT('SourcingID', NEW.SourcingID, 'SupplierID', NEW.SupplierID,
+                      'ComponentID', NEW.ComponentID, 'MaterialID', NEW.MaterialID));
+
+CREATE TRIGGER Outbox_Composition_Insert AFTER INSERT ON ComponentComposition FOR EACH ROW
+  INSERT INTO ChangeOutbox (EntityType, EntityID, ChangeType, Payload)
+  VALUES ('ComponentComposition', CONCAT(NEW.ComponentID, '/', NEW.MaterialID), 'insert',
+          JSON_OBJECT('ComponentID', NEW.ComponentID, 'MaterialID', NEW.MaterialID,
+                      'WeightInGrams', NEW.WeightInGrams));
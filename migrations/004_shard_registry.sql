@@ -0,0 +1,14 @@
+/* Global instance registry for sharded deployments (shards.py). Used on
+   the primary only: it allocates InstanceIDs in blocks from IdBlocks and
+   keeps serial numbers unique across shards in SerialRegistry. Shard
+   nodes get the tables too, unused. */
+CREATE TABLE IdBlocks (
+  Name VARCHAR(64) PRIMARY KEY,
+  NextID BIGINT NOT NULL
+);
+
+CREATE TABLE SerialRegistry (
+  SerialNumber VARCHAR(100) PRIMARY KEY,
+  InstanceID INT NOT NULL UNIQUE,
+  RegisteredAt DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
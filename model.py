@@ -0,0 +1,65 @@
+import os
+
+import joblib
+
+from drift import DriftMonitor
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+MODEL_PATH = os.path.join(BASE_DIR, 'recycle_predictor.pkl')
+SCALER_PATH = os.path.join(BASE_DIR, 'recycle_scaler.pkl')
+# Training-time feature distribution, written by predict.py for drift.py
+REFERENCE_PATH = os.path.join(BASE_DIR, 'recycle_reference.pkl')
+
+# Same feature order the model was trained with in predict.py
+FEATURES = ["total_weight", "avg_recyclability", "hazardous_count", "component_count"]
+
+# predict.py's training query, narrowed to a single instance
+INSTANCE_FEATURE_QUERY = """
+SELECT
+    pi.InstanceID,
+    SUM(cc.WeightInGrams) AS total_weight,
+    AVG(
+        CASE rm.RecyclableGrade
+            WHEN 'A' THEN 4
+            WHEN 'B' THEN 3
+            WHEN 'C' THEN 2
+            WHEN 'D' THEN 1
+            ELSE 0
+        END
+    ) AS avg_recyclability,
+    SUM(rm.IsHazardous) AS hazardous_count,
+    COUNT(DISTINCT cc.ComponentID) AS component_count
+FROM ProductInstances pi
+JOIN BillOfMaterial bom ON bom.ParentComponentID LIKE 'C%'
+JOIN ComponentComposition cc ON bom.ChildComponentID = cc.ComponentID
+JOIN RawMaterials rm ON rm.MaterialID = cc.MaterialID
+WHERE pi.InstanceID = %s
+GROUP BY pi.InstanceID
+"""
+
+_model = None
+_scaler = None
+
+DRIFT_MONITOR = DriftMonitor(FEATURES, REFERENCE_PATH, SCALER_PATH)
+
+
+def load_model():
+    global _model, _scaler
+    if _model is None:
+        _model = joblib.load(MODEL_PATH)
+        _scaler = joblib.load(SCALER_PATH)
+    return _model, _scaler
+
+
+def predict_recyclable(row):
+    """Score one feature row (a dict keyed by FEATURES) with the saved model."""
+    model, scaler = load_model()
+    features = {f: float(row[f] or 0) for f in FEATURES}
+    x = scaler.transform([[features[f] for f in FEATURES]])
+    probability = float(model.predict_proba(x)[0][1])
+    DRIFT_MONITOR.observe(features, probability)
+    return {
+        'features': features,
+        'recyclable': probability >= 0.5,
+        'probability': round(probability, 4),
+    }
@@ -0,0 +1,506 @@
+"""Columnar copy of the lifecycle and catalog data for analytical queries.
+
+    python olap.py export              # append what changed since the last export
+    python olap.py export --every 60   # ... and keep doing so every 60 s
+    python olap.py rebuild             # start over from an empty OLAP_DIR
+
+export() copies the database into Parquet files under OLAP_DIR:
+
+    events/month=YYYY-MM/*.parquet     LifecycleEventsAll, by event month
+    instances/*.parquet                ProductInstances (ID, serial, product)
+    catalog/<table>/v<version>.parquet one file per catalog table
+
+Events and instances are append-only: each run reads rows above the
+EventID / InstanceID watermark of every source (the primary, or each shard
+when DB_SHARDS is set). IDs are handed out before commit, so a run also
+re-reads the last OLAP_ID_OVERLAP IDs below the watermark and appends any
+that committed late. A catalog table is rewritten whenever its
+TableVersions entry moves.
+
+manifest.json lists the live files; readers only ever look at files it
+names, so a run (or compaction of a month's small files into one) is
+atomic for them. Each run that changes something bumps the 'OlapExport'
+TableVersions entry, so cached pages built on this data are refreshed.
+
+OLAP_STORE.connect() opens an in-process DuckDB connection on the newest
+manifest, with views named like the MySQL tables (LifecycleEventsAll,
+ProductInstances, Products, ComponentComposition, ...), so aggregate SQL
+written for MySQL runs unchanged. It returns None when nothing has been
+exported, the export is older than OLAP_MAX_AGE, or one of the `tables`
+the caller reads has a newer TableVersions entry than the export saw;
+callers then query the database as before.
+
+Deleted rows are not followed (nothing deletes instances or events except
+archival, which keeps EventIDs). After moving rows between nodes (e.g.
+`shards.py init`), run `python olap.py rebuild`.
+"""
+import fcntl
+import json
+import os
+import shutil
+import sys
+import threading
+import time
+from datetime import datetime
+from decimal import Decimal
+
+import duckdb
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+import config
+from cache import table_versions
+from catalog import GRADE_SCORE
+from db import get_db_connection
+from shards import get_shards, is_sharded
+
+MANIFEST = 'manifest.json'
+
+EVENT_SCHEMA = pa.schema([
+    ('Source', pa.string()),
+    ('EventID', pa.int64()),
+    ('EventType', pa.string()),
+    ('EventDate', pa.timestamp('us')),
+    ('InstanceID', pa.int64()),
+])
+INSTANCE_SCHEMA = pa.schema([
+    ('Source', pa.string()),
+    ('InstanceID', pa.int64()),
+    ('SerialNumber', pa.string()),
+    ('ProductID', pa.string()),
+])
+CATALOG_SCHEMAS = {
+    'Products': pa.schema([('ProductID', pa.string()), ('ModelName', pa.string()),
+                           ('RootComponentID', pa.string())]),
+    'Components': pa.schema([('ComponentID', pa.string()), ('ComponentName', pa.string())]),
+    'RawMaterials': pa.schema([('MaterialID', pa.string()), ('MaterialName', pa.string()),
+                               ('IsHazardous', pa.int8()), ('RecyclableGrade', pa.string())]),
+    'Suppliers': pa.schema([('SupplierID', pa.string()), ('SupplierName', pa.string())]),
+    'BillOfMaterial': pa.schema([('ParentComponentID', pa.string()), ('ChildComponentID', pa.string()),
+                                 ('Quantity', pa.int32())]),
+    'ComponentComposition': pa.schema([('ComponentID', pa.string()), ('MaterialID', pa.string()),
+                                       ('WeightInGrams', pa.float64())]),
+    'Sourcing': pa.schema([('SourcingID', pa.int64()), ('SupplierID', pa.string()),
+                           ('ComponentID', pa.string()), ('MaterialID', pa.string())]),
+}
+# The same statements for both tiers; run in one transaction, so an event
+# archived between the two reads is seen exactly once
+EVENT_QUERIES = [
+    f"SELECT EventID, EventType, EventDate, InstanceID FROM {table} WHERE EventID > %s ORDER BY EventID"
+    for table in ('LifecycleEvents', 'LifecycleEventsArchive')
+]
+INSTANCE_QUERY = ("SELECT InstanceID, SerialNumber, ProductID FROM ProductInstances "
+                  "WHERE InstanceID > %s ORDER BY InstanceID")
+SOURCE_TABLES = ('ProductInstances', 'LifecycleEvents')
+
+
+def _path(*parts):
+    return os.path.join(config.OLAP_DIR, *parts)
+
+
+def read_manifest(directory=None):
+    try:
+        with open(os.path.join(directory or config.OLAP_DIR, MANIFEST)) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def _write_manifest(manifest):
+    path = _path(MANIFEST)
+    tmp = path + '.tmp'
+    with open(tmp, 'w') as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+
+def _write_parquet(table, *parts):
+    """Write `table` to OLAP_DIR/parts (atomically); returns the path relative to OLAP_DIR."""
+    path = _path(*parts)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    pq.write_table(table, path + '.tmp', compression='zstd')
+    os.replace(path + '.tmp', path)
+    return os.path.join(*parts)
+
+
+def _value(value):
+    if isinstance(value, Decimal):
+        return float(value)
+    return value
+
+
+def _timestamp(value):
+    # The SQLite backend returns DATETIME columns as text
+    return datetime.fromisoformat(value) if isinstance(value, str) else value
+
+
+# -------------------------
+# EXPORT
+# -------------------------
+def _sources():
+    if is_sharded():
+        return [(f"s{shard.index}", shard.connect) for shard in get_shards()]
+    return [('primary', get_db_connection)]
+
+
+def _exported_ids(files, column, source, above):
+    """IDs of `source` above `above` already in `files` (row-group statistics skip the rest)."""
+    if not files:
+        return set()
+    rows = duckdb.execute(f"SELECT {column} FROM read_parquet(?) WHERE Source = ? AND {column} > ?",
+                          [[_path(f) for f in files], source, above]).fetchall()
+    return {r[0] for r in rows}
+
+
+def _export_rows(conn, queries, column, source, manifest, key, write):
+    """Append rows of `queries` with `column` above the watermark (less the overlap) not yet exported."""
+    watermark = manifest['watermarks'].setdefault(source, {}).get(key, 0)
+    low = max(watermark - config.OLAP_ID_OVERLAP, 0)
+    exported = _exported_ids(manifest[key], column, source, low)
+    count = 0
+    for sql in queries:
+        cursor = conn.cursor(buffered=False)
+        cursor.execute(sql, (low,))
+        while True:
+            rows = cursor.fetchmany(config.OLAP_BATCH_ROWS)
+            if not rows:
+                break
+            batch = [(source,) + tuple(_value(v) for v in r) for r in rows if r[0] not in exported]
+            if batch:
+                write(batch)
+                count += len(batch)
+            watermark = max(watermark, rows[-1][0])
+        cursor.close()
+    manifest['watermarks'][source][key] = watermark
+    return count
+
+
+def _arrow(rows, schema):
+    return pa.Table.from_arrays([pa.array(column, type=field.type) for column, field in zip(zip(*rows), schema)],
+                                schema=schema)
+
+
+def _export_source(conn, source, manifest):
+    def write_events(batch):
+        by_month = {}
+        for row in batch:
+            row = row[:3] + (_timestamp(row[3]),) + row[4:]
+            by_month.setdefault(f"{row[3]:%Y-%m}", []).append(row)
+        for month, rows in by_month.items():
+            manifest['events'].append(_write_parquet(
+                _arrow(rows, EVENT_SCHEMA), 'events', f"month={month}", f"{source}-{rows[0][1]}-{rows[-1][1]}.parquet"))
+
+    def write_instances(batch):
+        manifest['instances'].append(_write_parquet(
+            _arrow(batch, INSTANCE_SCHEMA), 'instances', f"{source}-{batch[0][1]}-{batch[-1][1]}.parquet"))
+
+    events = _export_rows(conn, EVENT_QUERIES, 'EventID', source, manifest, 'events', write_events)
+    instances = _export_rows(conn, [INSTANCE_QUERY], 'InstanceID', source, manifest,
+                             'instances', write_instances)
+    return events, instances
+
+
+def _read_versions(conn, tables):
+    placeholders = ", ".join(["%s"] * len(tables))
+    cursor = conn.cursor()
+    cursor.execute(f"SELECT TableName, Version FROM TableVersions WHERE TableName IN ({placeholders})",
+                   tuple(tables))
+    versions = dict(cursor.fetchall())
+    cursor.close()
+    return {table: versions.get(table, 0) for table in tables}
+
+
+def _export_catalog(conn, manifest):
+    """Rewrite the catalog tables whose TableVersions entry moved; returns their names."""
+    versions = _read_versions(conn, list(CATALOG_SCHEMAS))
+    cursor = conn.cursor()
+    changed = []
+    for table, schema in CATALOG_SCHEMAS.items():
+        version = versions[table]
+        if manifest['catalog'].get(table, {}).get('version') == version:
+            continue
+        # Read after the version, so the file is at least as new as its name says
+        cursor.execute(f"SELECT {', '.join(schema.names)} FROM {table}")
+        rows = [tuple(_value(v) for v in r) for r in cursor.fetchall()]
+        path = _write_parquet(_arrow(rows, schema) if rows else schema.empty_table(),
+                              'catalog', table, f"v{version}.parquet")
+        old = manifest['catalog'].get(table, {}).get('file')
+        manifest['catalog'][table] = {'version': version, 'file': path}
+        if old and old != path:
+            manifest['retired'].append(old)
+        changed.append(table)
+    return changed
+
+
+def _compact(manifest):
+    """Merge each month (and the instance list) with more than OLAP_COMPACT_FILES files into one file."""
+    groups = [('instances', 'InstanceID', 'instances', list(manifest['instances']))]
+    months = {}
+    for path in manifest['events']:
+        months.setdefault(os.path.dirname(path), []).append(path)
+    groups += [('events', 'EventID', directory, files) for directory, files in sorted(months.items())]
+
+    merged = 0
+    for key, column, directory, files in groups:
+        if len(files) <= config.OLAP_COMPACT_FILES:
+            continue
+        table = pa.concat_tables([pq.read_table(_path(f)) for f in files])
+        table = table.sort_by([('Source', 'ascending'), (column, 'ascending')])
+        path = _write_parquet(table, directory, f"compact-{manifest['generation'] + 1}.parquet")
+        manifest[key] = [f for f in manifest[key] if f not in set(files)] + [path]
+        manifest['retired'].extend(files)
+        merged += len(files)
+    return merged
+
+
+def _new_manifest():
+    return {'generation': 0, 'exported_at': None, 'versions': {}, 'watermarks': {}, 'events': [],
+            'instances': [], 'catalog': {}, 'retired': []}
+
+
+def export():
+    """One incremental run; returns a summary of what was appended."""
+    os.makedirs(config.OLAP_DIR, exist_ok=True)
+    fd = os.open(_path('.lock'), os.O_RDWR | os.O_CREAT, 0o644)
+    try:
+        # One exporter at a time
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        manifest = read_manifest() or _new_manifest()
+        # Files retired by the previous run; readers have had a whole interval to let go of them
+        for path in manifest['retired']:
+            if os.path.exists(_path(path)):
+                os.remove(_path(path))
+        manifest['retired'] = []
+
+        primary = get_db_connection()
+        try:
+            summary = {'catalog': _export_catalog(primary, manifest), 'events': 0, 'instances': 0}
+            # Read before the rows (the shards bump the primary after committing), so the
+            # export holds at least every write these versions count
+            versions = _read_versions(primary, SOURCE_TABLES)
+            primary.rollback()
+            for source, connect in _sources():
+                conn = primary if source == 'primary' else connect()
+                try:
+                    events, instances = _export_source(conn, source, manifest)
+                finally:
+                    if conn is not primary:
+                        conn.close()
+                summary['events'] += events
+                summary['instances'] += instances
+            primary.rollback()
+            summary['compacted'] = _compact(manifest)
+
+            manifest['generation'] += 1
+            manifest['exported_at'] = time.time()
+            manifest['versions'] = dict(versions, **{t: e['version'] for t, e in manifest['catalog'].items()})
+            _write_manifest(manifest)
+            if summary['catalog'] or summary['events'] or summary['instances']:
+                cursor = primary.cursor()
+                cursor.callproc('BumpTableVersion', ['OlapExport'])
+                primary.commit()
+        finally:
+            primary.close()
+    finally:
+        os.close(fd)
+    return summary
+
+
+def rebuild():
+    if os.path.isdir(config.OLAP_DIR):
+        shutil.rmtree(config.OLAP_DIR)
+    return export()
+
+
+# -------------------------
+# QUERIES
+# -------------------------
+class OlapCursor:
+    """The slice of the mysql.connector cursor API the report code uses."""
+
+    def __init__(self, store, cursor, dictionary):
+        self.store = store
+        self.cursor = cursor
+        self.dictionary = dictionary
+        self._columns = []
+
+    def execute(self, sql, params=()):
+        sql = sql.replace('%s', '?')
+        try:
+            self.cursor.execute(sql, list(params or ()))
+        except duckdb.IOException:
+            # A file compacted away since this manifest was loaded: retry on the newest one
+            self.cursor = self.store.reload().cursor()
+            self.cursor.execute(sql, list(params or ()))
+        self._columns = [d[0] for d in self.cursor.description or ()]
+
+    def _row(self, row):
+        if row is None or not self.dictionary:
+            return row
+        return dict(zip(self._columns, row))
+
+    def fetchone(self):
+        return self._row(self.cursor.fetchone())
+
+    def fetchall(self):
+        return [self._row(r) for r in self.cursor.fetchall()]
+
+    def close(self):
+        self.cursor.close()
+
+
+class OlapConnection:
+
+    def __init__(self, store, db):
+        self.store = store
+        self.db = db
+
+    def cursor(self, dictionary=False, buffered=None):
+        return OlapCursor(self.store, self.db.cursor(), dictionary)
+
+    def close(self):
+        pass
+
+
+class OlapStore:
+    """Per-process DuckDB views over the files of the newest manifest."""
+
+    def __init__(self):
+        self.db = None
+        self.generation = None
+        self.exported_at = None
+        self.versions = None
+        self._pid = None
+        self._checked = 0.0
+        self._lock = threading.Lock()
+
+    def _open(self, manifest):
+        db = duckdb.connect(config={'threads': config.OLAP_THREADS})
+        for name, files, schema in (('LifecycleEventsAll', manifest['events'], EVENT_SCHEMA),
+                                    ('ProductInstances', manifest['instances'], INSTANCE_SCHEMA)):
+            if files:
+                db.execute(f"CREATE VIEW {name} AS SELECT * FROM read_parquet({[_path(f) for f in files]!r})")
+            else:
+                db.register(name, schema.empty_table())
+        for name, entry in manifest['catalog'].items():
+            db.execute(f"CREATE VIEW {name} AS SELECT * FROM read_parquet({_path(entry['file'])!r})")
+        return db
+
+    def reload(self):
+        with self._lock:
+            self._checked = 0.0
+        self._refresh()
+        return self.db
+
+    def _refresh(self):
+        now = time.time()
+        with self._lock:
+            if self._pid == os.getpid() and now - self._checked < config.OLAP_CHECK_INTERVAL:
+                return
+            self._checked = now
+            manifest = read_manifest()
+            if manifest is None:
+                self.db = self.generation = self.exported_at = self.versions = None
+            elif self._pid != os.getpid() or manifest['generation'] != self.generation:
+                # A forked worker gets its own database object
+                self.db = self._open(manifest)
+                self.generation = manifest['generation']
+            self._pid = os.getpid()
+            if manifest is not None:
+                self.exported_at = manifest['exported_at']
+                # None for manifests written before versions were recorded: as old as can be
+                self.versions = manifest.get('versions')
+
+    def connect(self, tables=()):
+        """A connection on the exported data, or None if there is none recent enough.
+
+        `tables` are the database tables the caller's queries stand for; any
+        of them written since the export sends the caller to the database.
+        """
+        if not config.OLAP_QUERIES:
+            return None
+        self._refresh()
+        db, exported_at, exported = self.db, self.exported_at, self.versions
+        if db is None or time.time() - exported_at > config.OLAP_MAX_AGE:
+            return None
+        if tables:
+            if exported is None:
+                return None
+            current, _ = table_versions(tables)
+            if any(version > exported.get(table, 0) for table, version in zip(tables, current)):
+                return None
+        return OlapConnection(self, db)
+
+
+OLAP_STORE = OlapStore()
+
+
+# -------------------------
+# REPORTS
+# -------------------------
+# Plain SQL that runs the same on MySQL, SQLite and the DuckDB views
+GRADE_WEIGHTS_SQL = """
+    SELECT rm.RecyclableGrade, COUNT(*) AS compositions, SUM(cc.WeightInGrams) AS grams
+    FROM ComponentComposition cc
+    JOIN RawMaterials rm ON cc.MaterialID = rm.MaterialID
+    GROUP BY rm.RecyclableGrade
+"""
+SUPPLIER_MASS_SQL = """
+    SELECT s.SupplierID, s.SupplierName,
+           SUM(COALESCE(cw.grams, 0)) AS component_grams,
+           SUM(COALESCE(mw.grams, 0)) AS material_grams
+    FROM Suppliers s
+    JOIN Sourcing so ON so.SupplierID = s.SupplierID
+    LEFT JOIN (SELECT ComponentID, SUM(WeightInGrams) AS grams
+               FROM ComponentComposition GROUP BY ComponentID) cw ON cw.ComponentID = so.ComponentID
+    LEFT JOIN (SELECT MaterialID, SUM(WeightInGrams) AS grams
+               FROM ComponentComposition GROUP BY MaterialID) mw ON mw.MaterialID = so.MaterialID
+    GROUP BY s.SupplierID, s.SupplierName
+"""
+
+
+def composition_report(conn):
+    """Recyclable mass by grade over all compositions, and each supplier's share of the mass.
+
+    A component supplier is credited with the component's full material
+    weight, a material supplier with every composition using that material.
+    """
+    cursor = conn.cursor(dictionary=True)
+    cursor.execute(GRADE_WEIGHTS_SQL)
+    grades = [{'grade': r['RecyclableGrade'], 'compositions': r['compositions'], 'grams': float(r['grams'] or 0)}
+              for r in cursor.fetchall()]
+    total = sum(g['grams'] for g in grades)
+    score = sum(g['grams'] * GRADE_SCORE.get(g['grade'], 0) for g in grades)
+
+    cursor.execute(SUPPLIER_MASS_SQL)
+    suppliers = []
+    for r in cursor.fetchall():
+        grams = float(r['component_grams'] or 0) + float(r['material_grams'] or 0)
+        suppliers.append({'supplier_id': r['SupplierID'], 'supplier_name': r['SupplierName'],
+                          'component_grams': float(r['component_grams'] or 0),
+                          'material_grams': float(r['material_grams'] or 0),
+                          'share': round(grams / total, 4) if total else 0})
+    suppliers.sort(key=lambda s: (-(s['component_grams'] + s['material_grams']), s['supplier_id']))
+    return {
+        'total_grams': total,
+        'recyclability_score': round(score / total, 2) if total else 0,
+        'grades': sorted(grades, key=lambda g: (g['grade'] is None, g['grade'] or '')),
+        'suppliers': suppliers,
+    }
+
+
+if __name__ == '__main__':
+    command = sys.argv[1:2]
+    if command == ['export']:
+        every = float(sys.argv[3]) if sys.argv[2:3] == ['--every'] else None
+        while True:
+            print(export())
+            if every is None:
+                break
+            time.sleep(every)
+    elif command == ['rebuild']:
+        print(rebuild())
+    else:
+        print(__doc__)
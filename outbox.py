@@ -0,0 +1,230 @@
+"""Change feed over the ChangeOutbox table.
+
+Triggers (migrations/003_change_outbox.sql) add an outbox row in the same
+transaction as every insert into ProductInstances, LifecycleEvents,
+Suppliers, Sourcing and ComponentComposition. ChangeIDs are allocated at
+insert time, so they can become visible out of order when transactions
+overlap; a consumer keeping "last ChangeID seen" could then skip a change.
+The feed therefore orders by FeedSeq instead, which sequence_pending()
+assigns to committed rows one batch at a time under a named lock -- rows
+only get a FeedSeq once they are visible, so FeedSeq never goes backwards.
+
+    GET /api/changes?after=<cursor>&limit=500&wait=25    long-poll (JSON)
+    GET /api/changes/stream?after=<cursor>               Server-Sent Events
+
+    python outbox.py prune     # drop delivered rows older than OUTBOX_RETENTION_DAYS
+
+A cursor older than the oldest row kept has missed pruned changes; the
+feed refuses it (CursorPruned, HTTP 410) and the consumer must resync.
+Each SSE stream holds a worker thread for as long as the client stays, so
+a worker serves at most OUTBOX_MAX_STREAMS of them (open_stream()).
+
+With DB_SHARDS set every node has its own feed: the primary's carries
+supplier, sourcing and composition changes, each shard's its instances and
+events. The HTTP feed serves the primary's only (SHARD_ENTITIES are
+refused there); in-process followers such as search.py read each shard's.
+"""
+import json
+import sys
+import threading
+import time
+
+import config
+from cache import table_versions
+from db import get_db_connection
+from shards import get_shards
+
+# Tables whose writes produce outbox rows; their versions wake long-polls
+OUTBOX_TABLES = ('ProductInstances', 'LifecycleEvents', 'Suppliers', 'Sourcing', 'ComponentComposition')
+SEQUENCER_LOCK = 'splm_outbox_sequencer'
+# Entities whose changes are on the shards' feeds when DB_SHARDS is set
+SHARD_ENTITIES = ('ProductInstance', 'LifecycleEvent')
+
+# This worker's SSE streams; the rest of its threads stay free for other requests
+_stream_slots = threading.BoundedSemaphore(config.OUTBOX_MAX_STREAMS)
+
+
+class CursorPruned(Exception):
+    """The changes right after the consumer's cursor have been pruned."""
+
+
+def sequence_pending(conn, limit=10000):
+    """Give committed, unsequenced outbox rows the next FeedSeqs.
+
+    Returns how many, or None if another worker holds the sequencer lock.
+    """
+    cursor = conn.cursor()
+    cursor.execute("SELECT GET_LOCK(%s, 0)", (SEQUENCER_LOCK,))
+    if not cursor.fetchone()[0]:
+        return None
+    try:
+        cursor.execute(
+            "SELECT ChangeID FROM ChangeOutbox WHERE FeedSeq IS NULL ORDER BY ChangeID LIMIT %s FOR UPDATE",
+            (limit,)
+        )
+        pending = [row[0] for row in cursor.fetchall()]
+        if pending:
+            cursor.execute("SELECT COALESCE(MAX(FeedSeq), 0) FROM ChangeOutbox")
+            last = cursor.fetchone()[0]
+            cursor.executemany(
+                "UPDATE ChangeOutbox SET FeedSeq = %s WHERE ChangeID = %s",
+                [(last + i + 1, change_id) for i, change_id in enumerate(pending)]
+            )
+        conn.commit()
+    finally:
+        cursor.execute("SELECT RELEASE_LOCK(%s)", (SEQUENCER_LOCK,))
+        cursor.fetchall()
+    return len(pending)
+
+
+def fetch_changes(conn, after=0, limit=500, entities=None):
+    cursor = conn.cursor(dictionary=True)
+    sql = """
+        SELECT FeedSeq, EntityType, EntityID, ChangeType, Payload, CreatedAt
+        FROM ChangeOutbox
+        WHERE FeedSeq > %s
+    """
+    params = [after]
+    if entities:
+        sql += " AND EntityType IN (" + ", ".join(["%s"] * len(entities)) + ")"
+        params += list(entities)
+    sql += " ORDER BY FeedSeq LIMIT %s"
+    params.append(limit)
+    cursor.execute(sql, tuple(params))
+    return [
+        {
+            'cursor': row['FeedSeq'],
+            'entity': row['EntityType'],
+            'id': row['EntityID'],
+            'change': row['ChangeType'],
+            'data': json.loads(row['Payload']),
+            'at': row['CreatedAt'].isoformat() if hasattr(row['CreatedAt'], 'isoformat') else row['CreatedAt'],
+        }
+        for row in cursor.fetchall()
+    ]
+
+
+def check_cursor(conn, after):
+    """Raise CursorPruned if changes after `after` are gone; 0 reads from the oldest kept."""
+    if not after:
+        return
+    cursor = conn.cursor()
+    cursor.execute("SELECT MIN(FeedSeq) FROM ChangeOutbox")
+    oldest = cursor.fetchone()[0]
+    if oldest is not None and after < oldest - 1:
+        raise CursorPruned(f"Changes after cursor {after} have been pruned (the oldest kept is {oldest}); "
+                           "resync and follow from a new cursor")
+
+
+def read_changes(after=0, limit=500, entities=None):
+    """(changes, complete); complete is False if another worker was mid-sequencing."""
+    conn = get_db_connection()
+    try:
+        complete = sequence_pending(conn) is not None
+        check_cursor(conn, after)
+        return fetch_changes(conn, after, limit, entities), complete
+    finally:
+        conn.close()
+
+
+def wait_for_changes(after=0, limit=500, entities=None, timeout=25.0):
+    """Long-poll: return as soon as there are changes after `after`, or [] after `timeout`.
+
+    While waiting, only the in-process TableVersions snapshot (cache.py) is
+    checked, so idle consumers cost no queries between writes.
+    """
+    deadline = time.monotonic() + timeout
+    versions, complete = None, False
+    while True:
+        current, _ = table_versions(OUTBOX_TABLES)
+        if current != versions or not complete:
+            versions = current
+            changes, complete = read_changes(after, limit, entities)
+            if changes:
+                return changes
+        if time.monotonic() >= deadline:
+            return []
+        time.sleep(config.OUTBOX_POLL_INTERVAL)
+
+
+def sse_stream(after=0, entities=None, limit=500):
+    """Server-Sent Events: one `event: change` per row, id = cursor, plus heartbeats."""
+    yield "retry: 2000\n\n"
+    while True:
+        changes = wait_for_changes(after, limit, entities, timeout=config.OUTBOX_HEARTBEAT)
+        if not changes:
+            yield ": keep-alive\n\n"
+            continue
+        chunk = []
+        for change in changes:
+            chunk.append(f"id: {change['cursor']}\nevent: change\ndata: {json.dumps(change)}\n\n")
+        after = changes[-1]['cursor']
+        yield "".join(chunk)
+
+
+class _HeldStream:
+    """An SSE body that gives its slot back when the server closes it, started or not."""
+
+    def __init__(self, events):
+        self.events = events
+        self.held = True
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        return next(self.events)
+
+    def close(self):
+        self.events.close()
+        if self.held:
+            self.held = False
+            _stream_slots.release()
+
+
+def open_stream(after=0, entities=None):
+    """sse_stream() in one of this worker's OUTBOX_MAX_STREAMS slots, or None if all are taken.
+
+    Raises CursorPruned before anything is sent, so the client gets a 410.
+    """
+    conn = get_db_connection()
+    try:
+        check_cursor(conn, after)
+    finally:
+        conn.close()
+    if not _stream_slots.acquire(blocking=False):
+        return None
+    return _HeldStream(sse_stream(after, entities))
+
+
+def prune(days=None):
+    """Delete sequenced rows older than `days` on every node; consumers further behind must resync."""
+    days = config.OUTBOX_RETENTION_DAYS if days is None else days
+    return sum(_prune(connect, days) for connect in [get_db_connection] + [s.connect for s in get_shards()])
+
+
+def _prune(connect, days):
+    conn = connect()
+    try:
+        cursor = conn.cursor()
+        cursor.execute("SELECT MAX(FeedSeq) FROM ChangeOutbox")
+        last = cursor.fetchone()[0]
+        if last is None:
+            return 0
+        # The newest row stays: sequence_pending continues from MAX(FeedSeq)
+        cursor.execute(
+            "DELETE FROM ChangeOutbox WHERE FeedSeq < %s AND CreatedAt < %s",
+            (last, time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(time.time() - days * 86400)))
+        )
+        deleted = cursor.rowcount
+        conn.commit()
+    finally:
+        conn.close()
+    return deleted
+
+
+if __name__ == '__main__':
+    if sys.argv[1:] == ['prune']:
+        print(f"Pruned {prune()} outbox rows")
+    else:
+        print(__doc__)
@@ -6,6 +6,8 @@ from sklearn.linear_model import LogisticRegression
 from sklearn.metrics import accuracy_score, classification_report
 import joblib
 
+from drift import build_reference
+
 # ---------------------------
 # 1. Connect to MySQL
 # ---------------------------
@@ -40,12 +42,12 @@ SELECT
     COUNT(DISTINCT cc.ComponentID) AS component_count,
     CASE 
         WHEN EXISTS (
-            SELECT 1 FROM LifecycleEvents le 
+            SELECT 1 FROM LifecycleEventsAll le 
             WHERE le.InstanceID = pi.InstanceID 
               AND (le.EventType = 'Recycled' OR le.EventType = 'Recycled_Hazardous')
         ) THEN 1
         WHEN EXISTS (
-            SELECT 1 FROM LifecycleEvents le 
+            SELECT 1 FROM LifecycleEventsAll le 
             WHERE le.InstanceID = pi.InstanceID 
               AND le.EventType = 'Disposed'
         ) THEN 0
@@ -109,5 +111,7 @@ print(classification_report(y_test, y_pred, zero_division=0))
 # ---------------------------
 joblib.dump(model, "recycle_predictor.pkl")
 joblib.dump(scaler, "recycle_scaler.pkl")
+# What the served features are compared with (drift.py, GET /metrics)
+joblib.dump(build_reference(X, model.predict_proba(X_scaled)[:, 1]), "recycle_reference.pkl")
 print("\n🎯 Model and scaler saved successfully!")
-print("Files saved as: recycle_predictor.pkl and recycle_scaler.pkl")
+print("Files saved as: recycle_predictor.pkl, recycle_scaler.pkl and recycle_reference.pkl")
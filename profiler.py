@@ -0,0 +1,179 @@
+"""Opt-in sampling profiler for Flask requests.
+
+A request is profiled when its endpoint is listed in PROFILE_ROUTES, when it
+falls in the PROFILE_SAMPLE_RATE fraction, or when it carries
+`X-Profile: <PROFILE_TOKEN>` (only if a token is configured). Everything
+else pays one set lookup in before_request.
+
+While a profiled request runs, a single sampler thread records its stack
+every PROFILE_INTERVAL_MS. Each sample is attributed to SQL (the leaf-most
+known frame is in the DB driver), template (a Jinja template) or Python.
+The results go to PROFILE_DIR:
+
+    <endpoint>-<time>-<pid>.folded   collapsed stacks ("a;b;c 12") for
+                                     flamegraph.pl, speedscope, inferno
+    <endpoint>-<time>-<pid>.json     wall time, samples, sql/template/python ms
+
+and into a Server-Timing header, so the split shows up in the browser's
+network panel. Streamed bodies are only profiled up to the first byte.
+"""
+import itertools
+import json
+import os
+import random
+import sys
+import threading
+import time
+
+from flask import g, request
+
+import config
+
+SQL_MARKERS = (os.sep + 'mysql' + os.sep, os.sep + 'aiomysql' + os.sep, 'sqlite_backend.py', os.sep + 'sqlite3' + os.sep)
+TEMPLATE_MARKERS = ('.html', os.sep + 'jinja2' + os.sep)
+
+
+def _frame_label(code):
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+def classify(filenames):
+    """'sql', 'template' or 'python' for a stack given leaf-first."""
+    for filename in filenames:
+        if any(m in filename for m in SQL_MARKERS):
+            return 'sql'
+        if filename.endswith(TEMPLATE_MARKERS[0]) or TEMPLATE_MARKERS[1] in filename:
+            return 'template'
+    return 'python'
+
+
+class Profile:
+
+    def __init__(self, endpoint, path):
+        self.endpoint = endpoint
+        self.path = path
+        self.stacks = {}
+        self.kinds = {'sql': 0, 'template': 0, 'python': 0}
+        self.samples = 0
+        self.started = time.perf_counter()
+
+    def add(self, frame):
+        labels, filenames = [], []
+        while frame is not None:
+            labels.append(_frame_label(frame.f_code))
+            filenames.append(frame.f_code.co_filename)
+            frame = frame.f_back
+        key = ";".join(reversed(labels))
+        self.stacks[key] = self.stacks.get(key, 0) + 1
+        self.kinds[classify(filenames)] += 1
+        self.samples += 1
+
+    def breakdown(self, wall):
+        """Wall time split by the share of samples in each kind (ms)."""
+        if not self.samples:
+            return {'sql': 0.0, 'template': 0.0, 'python': round(wall * 1000, 2)}
+        return {k: round(wall * 1000 * n / self.samples, 2) for k, n in self.kinds.items()}
+
+
+class Sampler:
+    """One thread sampling every thread that has a Profile registered."""
+
+    def __init__(self):
+        self._active = {}
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = None
+
+    def start(self, thread_id, profile):
+        with self._lock:
+            self._active[thread_id] = profile
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='profiler', daemon=True)
+                self._thread.start()
+        self._wake.set()
+
+    def stop(self, thread_id):
+        with self._lock:
+            return self._active.pop(thread_id, None)
+
+    def _run(self):
+        interval = config.PROFILE_INTERVAL_MS / 1000.0
+        while True:
+            with self._lock:
+                active = dict(self._active)
+            if not active:
+                self._wake.wait()
+                self._wake.clear()
+                continue
+            frames = sys._current_frames()
+            for thread_id, profile in active.items():
+                frame = frames.get(thread_id)
+                if frame is not None:
+                    profile.add(frame)
+            del frames
+            time.sleep(interval)
+
+
+_sampler = Sampler()
+_sequence = itertools.count(1)
+_routes = {r.strip() for r in config.PROFILE_ROUTES.split(',') if r.strip()}
+
+
+def wants_profile():
+    if request.endpoint in _routes or request.path in _routes:
+        return True
+    if config.PROFILE_SAMPLE_RATE > 0 and random.random() < config.PROFILE_SAMPLE_RATE:
+        return True
+    return bool(config.PROFILE_TOKEN) and request.headers.get('X-Profile') == config.PROFILE_TOKEN
+
+
+def write_profile(profile, wall):
+    os.makedirs(config.PROFILE_DIR, exist_ok=True)
+    name = f"{profile.endpoint or 'unknown'}-{time.strftime('%Y%m%dT%H%M%S')}-{os.getpid()}-{next(_sequence)}"
+    base = os.path.join(config.PROFILE_DIR, name)
+    with open(base + '.folded', 'w', encoding='utf-8') as f:
+        for stack, count in sorted(profile.stacks.items()):
+            f.write(f"{stack} {count}\n")
+    with open(base + '.json', 'w', encoding='utf-8') as f:
+        json.dump({
+            'endpoint': profile.endpoint,
+            'path': profile.path,
+            'wall_ms': round(wall * 1000, 2),
+            'samples': profile.samples,
+            'interval_ms': config.PROFILE_INTERVAL_MS,
+            'breakdown_ms': profile.breakdown(wall),
+        }, f, indent=2)
+    return base
+
+
+def _before():
+    if not (_routes or config.PROFILE_SAMPLE_RATE > 0 or config.PROFILE_TOKEN):
+        return
+    if wants_profile():
+        g.profile = Profile(request.endpoint, request.full_path)
+        _sampler.start(threading.get_ident(), g.profile)
+
+
+def _after(response):
+    profile = g.pop('profile', None)
+    if profile is None:
+        return response
+    _sampler.stop(threading.get_ident())
+    wall = time.perf_counter() - profile.started
+    base = write_profile(profile, wall)
+    parts = profile.breakdown(wall)
+    response.headers['Server-Timing'] = ", ".join(f"{k};dur={v}" for k, v in parts.items())
+    response.headers['X-Profile'] = os.path.basename(base)
+    return response
+
+
+def _teardown(exc):
+    # A view that raised never reaches after_request
+    if g.pop('profile', None) is not None:
+        _sampler.stop(threading.get_ident())
+
+
+def init_app(app):
+    app.before_request(_before)
+    app.after_request(_after)
+    app.teardown_request(_teardown)
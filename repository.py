@@ -0,0 +1,210 @@
+"""The queries the web views share, in one place.
+
+Each Query pairs a statement with a row type: a namedtuple, so rows are
+plain tuples with attribute access instead of a dict per row. Jinja
+resolves both `row.ModelName` and `row['ModelName']` on them; Python code
+uses the attribute form (or row._asdict() for JSON).
+
+    rows = repository.product_options(conn)       # [Product(ProductID, ModelName), ...]
+    rows = repository.fetch_all(conn, repository.SUPPLIER_TYPES)
+
+On MySQL, a query is prepared server-side the first time a connection runs
+it, and the prepared cursor is kept on that connection: later requests
+that get the same pooled connection send only the parameters, and the
+server skips parsing and planning. (With DB_STATEMENT_CACHE=1, db.py's
+pools roll returned connections back instead of resetting their session,
+which would drop the statements.) SQLite already caches compiled
+statements per connection, and so does the DuckDB copy (olap.py); for
+those, Query rows are built from an ordinary cursor.
+"""
+from collections import namedtuple
+
+from mysql.connector.abstracts import MySQLConnectionAbstract
+
+import config
+
+
+class Query:
+
+    __slots__ = ('sql', 'row')
+
+    def __init__(self, name, columns, sql):
+        self.sql = sql
+        self.row = namedtuple(name, columns)
+
+
+def _prepared_cursor(conn, query):
+    """The connection's prepared cursor for `query`, or None where statements aren't prepared."""
+    # Pooled (and replica-tracked) connections wrap the real one
+    raw = getattr(conn, '_cnx', conn)
+    if not config.DB_STATEMENT_CACHE or not isinstance(raw, MySQLConnectionAbstract):
+        return None
+    cache = getattr(raw, '_statement_cache', None)
+    # A reconnect starts a new session, without the old session's statements
+    if cache is None or cache[0] != raw.connection_id:
+        cache = raw._statement_cache = (raw.connection_id, {})
+    cursor = cache[1].get(query)
+    if cursor is None:
+        cursor = cache[1][query] = raw.cursor(prepared=True)
+    return cursor
+
+
+def fetch_all(conn, query, params=()):
+    cursor = _prepared_cursor(conn, query)
+    if cursor is None:
+        cursor = conn.cursor()
+    # Same str object each time: mysql.connector reuses the statement
+    cursor.execute(query.sql, params)
+    make = query.row._make
+    return [make(r) for r in cursor.fetchall()]
+
+
+def fetch_one(conn, query, params=()):
+    rows = fetch_all(conn, query, params)
+    return rows[0] if rows else None
+
+
+# -------------------------
+# CATALOG
+# -------------------------
+PRODUCTS = Query('Product', ['ProductID', 'ModelName'], """
+    SELECT ProductID, ModelName FROM Products
+""")
+PRODUCT_NAME = Query('ProductName', ['ModelName'], """
+    SELECT ModelName FROM Products WHERE ProductID = %s
+""")
+COMPONENTS = Query('Component', ['ComponentID', 'ComponentName'], """
+    SELECT ComponentID, ComponentName FROM Components
+""")
+MATERIALS = Query('Material', ['MaterialID', 'MaterialName', 'IsHazardous'], """
+    SELECT MaterialID, MaterialName, IsHazardous FROM RawMaterials
+""")
+CATALOG_COUNTS = Query('CatalogCounts', ['products', 'components', 'materials', 'suppliers'], """
+    SELECT (SELECT COUNT(*) FROM Products) AS products,
+           (SELECT COUNT(*) FROM Components) AS components,
+           (SELECT COUNT(*) FROM RawMaterials) AS materials,
+           (SELECT COUNT(*) FROM Suppliers) AS suppliers
+""")
+COMPOSITION_GRADES = Query('CompositionGrade', ['WeightInGrams', 'RecyclableGrade'], """
+    SELECT cc.WeightInGrams, rm.RecyclableGrade
+    FROM ComponentComposition cc
+    JOIN RawMaterials rm ON cc.MaterialID = rm.MaterialID
+""")
+COMPONENT_COMPOSITION = Query('Composition', ['ComponentID', 'MaterialID', 'MaterialName', 'WeightInGrams',
+                                              'IsHazardous'], """
+    SELECT cc.ComponentID, cc.MaterialID, rm.MaterialName, cc.WeightInGrams, rm.IsHazardous
+    FROM ComponentComposition cc
+    JOIN RawMaterials rm ON cc.MaterialID = rm.MaterialID
+    WHERE cc.ComponentID = %s
+""")
+PRODUCT_PASSPORT = Query('PassportRow', ['ComponentName', 'MaterialName', 'WeightInGrams', 'RecyclableGrade',
+                                         'IsHazardous'], """
+    SELECT ComponentName, MaterialName, WeightInGrams, RecyclableGrade,
+           CASE WHEN IsHazardous = 1 THEN 'Yes' ELSE 'No' END AS IsHazardous
+    FROM ProductMaterialPassport
+    WHERE ProductID = %s
+    ORDER BY ComponentName
+""")
+# The assemblies shown on the reports page
+COMPONENT_HIERARCHY = Query('ComponentSummary', ['ComponentID', 'ComponentName', 'Summary'], """
+    SELECT c.ComponentID, c.ComponentName, GetComponentSummary(c.ComponentID) AS Summary
+    FROM Components c
+    WHERE c.ComponentID IN ('c100', 'c200', 'c310')
+""")
+
+
+def product_options(conn):
+    return fetch_all(conn, PRODUCTS)
+
+
+def product_name(conn, product_id):
+    row = fetch_one(conn, PRODUCT_NAME, (product_id,))
+    return row.ModelName if row else None
+
+
+def component_options(conn):
+    return fetch_all(conn, COMPONENTS)
+
+
+def material_options(conn):
+    return fetch_all(conn, MATERIALS)
+
+
+def catalog_counts(conn):
+    return fetch_one(conn, CATALOG_COUNTS)
+
+
+def composition_grades(conn):
+    return fetch_all(conn, COMPOSITION_GRADES)
+
+
+def component_composition(conn, component_id):
+    return fetch_all(conn, COMPONENT_COMPOSITION, (component_id,))
+
+
+def component_hierarchy(conn):
+    return fetch_all(conn, COMPONENT_HIERARCHY)
+
+
+# -------------------------
+# SUPPLIERS
+# -------------------------
+SUPPLIERS = Query('Supplier', ['SupplierID', 'SupplierName'], """
+    SELECT SupplierID, SupplierName FROM Suppliers
+""")
+SOURCING = Query('SourcingRow', ['SupplierID', 'SupplierName', 'ComponentName', 'MaterialName'], """
+    SELECT s.SupplierID, s.SupplierName, c.ComponentName, m.MaterialName
+    FROM Suppliers s
+    LEFT JOIN Sourcing so ON s.SupplierID = so.SupplierID
+    LEFT JOIN Components c ON so.ComponentID = c.ComponentID
+    LEFT JOIN RawMaterials m ON so.MaterialID = m.MaterialID
+    ORDER BY s.SupplierName
+""")
+SUPPLIER_SOURCING_COUNTS = Query('SupplierSourcing', ['SupplierID', 'comp_count', 'mat_count'], """
+    SELECT SupplierID,
+           SUM(ComponentID IS NOT NULL) AS comp_count,
+           SUM(MaterialID IS NOT NULL) AS mat_count
+    FROM Sourcing
+    GROUP BY SupplierID
+""")
+
+
+def supplier_types(conn):
+    """{SupplierID: 'Component Supplier' | 'Material Supplier' | 'Both' | 'Unknown'}"""
+    types = {}
+    for row in fetch_all(conn, SUPPLIER_SOURCING_COUNTS):
+        components, materials = row.comp_count or 0, row.mat_count or 0
+        if components > 0 and materials > 0:
+            types[row.SupplierID] = 'Both'
+        elif components > 0:
+            types[row.SupplierID] = 'Component Supplier'
+        elif materials > 0:
+            types[row.SupplierID] = 'Material Supplier'
+        else:
+            types[row.SupplierID] = 'Unknown'
+    return types
+
+
+# -------------------------
+# INSTANCES
+# -------------------------
+INSTANCES = Query('Instance', ['InstanceID', 'SerialNumber'], """
+    SELECT InstanceID, SerialNumber FROM ProductInstances ORDER BY InstanceID
+""")
+INSTANCE_AGE = Query('InstanceAge', ['SerialNumber', 'age'], """
+    SELECT SerialNumber, GetLifecycleAge(InstanceID) AS age
+    FROM ProductInstances
+    WHERE InstanceID = %s
+""")
+# Same rows as the GetLifecycleReport procedure, as a plain query so the
+# timeline can be streamed (procedure results arrive fully buffered)
+TIMELINE = Query('TimelineEvent', ['EventType', 'EventTime'], """
+    SELECT EventType, DATE_FORMAT(EventDate, '%Y-%m-%d %H:%i') AS EventTime
+    FROM LifecycleEventsAll
+    WHERE InstanceID = %s
+    ORDER BY EventDate
+""")
+
+
+def instance_age(conn, instance_id):
+    return fetch_one(conn, INSTANCE_AGE, (instance_id,))
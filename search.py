@@ -0,0 +1,756 @@
+"""Search across products, components, materials, suppliers and serials.
+
+    GET /api/search?q=<text>&kind=component,material&limit=20
+
+Each worker keeps an inverted index in memory. Names are split into
+lowercase words; every distinct word gets a posting list of the entries
+that contain it, and is itself indexed by its one- and two-character
+prefixes and its 3- and 4-grams. A query word of one or two characters
+matches words starting with it; a longer one matches words containing it
+(its rarest grams narrow the words down, then each is checked).
+Entries must match every query word, and rank by how well they match:
+whole word, then word prefix, then substring; then by kind and length.
+
+The index follows writes like the serial lookup does (serials.py):
+Supplier and ProductInstance inserts arrive through the change feed
+(outbox.py), from every shard when DB_SHARDS is set, and Products,
+Components and RawMaterials are re-read when their TableVersions move. A
+pruned feed rebuilds the index. Each gunicorn worker starts loading it in
+the background as soon as it forks (SEARCH_PRELOAD); searches that arrive
+before it is ready wait for it.
+
+Workers share one copy, as with the catalog (catalog.py): the index is
+written once to a columnar snapshot file (SEARCH_SNAPSHOT_PATH) that every
+worker maps read-only (FrozenIndex). The snapshot records the feed
+position and catalog versions it was built at; each worker applies the
+writes since then to a small index of its own on top (LayeredIndex). When
+that grows past SEARCH_SNAPSHOT_MAX_DELTA entries, or the feed has been
+pruned past the snapshot, one worker writes a new snapshot and the others
+switch to it.
+"""
+import fcntl
+import heapq
+import itertools
+import os
+import re
+import threading
+import time
+from array import array
+from bisect import bisect_left
+
+import numpy as np
+
+import config
+from cache import table_versions
+from catalog import database_source, map_columns, write_columns
+from db import get_db_connection
+from outbox import fetch_changes, sequence_pending
+from shards import get_shards
+
+# Also the tie-break order between kinds
+KINDS = ('product', 'component', 'material', 'supplier', 'serial')
+KIND_CODES = {kind: code for code, kind in enumerate(KINDS)}
+
+# kind -> (table, query); re-read whole when the table's version moves
+CATALOG_SOURCES = {
+    'product': ('Products', "SELECT ProductID, ModelName FROM Products"),
+    'component': ('Components', "SELECT ComponentID, ComponentName FROM Components"),
+    'material': ('RawMaterials', "SELECT MaterialID, MaterialName FROM RawMaterials"),
+}
+# kind -> (query, feed entity, id field, text field); loaded once, then followed through the feed
+FEED_SOURCES = {
+    'supplier': ("SELECT SupplierID, SupplierName FROM Suppliers", 'Supplier', 'SupplierID', 'SupplierName'),
+    'serial': ("SELECT InstanceID, SerialNumber FROM ProductInstances", 'ProductInstance',
+               'InstanceID', 'SerialNumber'),
+}
+SEARCH_TABLES = ('Products', 'Components', 'RawMaterials', 'Suppliers', 'ProductInstances')
+
+WORD_RE = re.compile(r'[^\W_]+')
+# Prefix keys can't collide with n-grams, which never contain it
+PREFIX = '\x00'
+
+EXACT, WORD_PREFIX, SUBSTRING = 3, 2, 1
+
+
+def words(text):
+    return WORD_RE.findall(text.lower())
+
+
+def word_grams(word):
+    grams = {PREFIX + word[:1], PREFIX + word[:2]}
+    grams.update(word[i:i + 3] for i in range(len(word) - 2))
+    grams.update(word[i:i + 4] for i in range(len(word) - 3))
+    return grams
+
+
+def query_grams(query_word):
+    """(position, gram) for a query word of 3+ characters: 4-grams where it is long enough, being rarer."""
+    n = 4 if len(query_word) >= 4 else 3
+    return [(i, query_word[i:i + n]) for i in range(len(query_word) - n + 1)]
+
+
+def match_score(query_word, word):
+    if word == query_word:
+        return EXACT
+    if word.startswith(query_word):
+        return WORD_PREFIX
+    return SUBSTRING if query_word in word else 0
+
+
+class InvertedIndex:
+    """Entries (kind, id, text) with word postings and a prefix / n-gram index over the words.
+
+    Entries are only ever appended; a changed or removed entry is marked
+    dead and skipped by searches. Searches read without locking: every
+    write is a single append or assignment, and the caller serializes them.
+    """
+
+    def __init__(self):
+        self.kinds = bytearray()
+        self.keys = []
+        self.texts = []
+        self.alive = bytearray()
+        self.entries = [{} for _ in KINDS]    # per kind: id -> entry
+        self.word_ids = {}
+        self.words = []
+        # word -> its entries: an int while there is just one (most serials), then an array
+        self.postings = []
+        self.grams = {}                       # prefix / n-gram -> array of word ids
+
+    def __len__(self):
+        return len(self.texts)
+
+    def add(self, kind, key, text):
+        code = KIND_CODES[kind]
+        ids = self.entries[code]
+        old = ids.get(key)
+        if old is not None:
+            if self.texts[old] == text:
+                return
+            self.alive[old] = 0
+        entry = len(self.texts)
+        self.kinds.append(code)
+        self.keys.append(key)
+        self.texts.append(text)
+        self.alive.append(1)
+        ids[key] = entry
+        for word in set(words(text)):
+            self._post(word, entry)
+
+    def remove(self, kind, key):
+        entry = self.entries[KIND_CODES[kind]].pop(key, None)
+        if entry is not None:
+            self.alive[entry] = 0
+
+    def entry_of(self, kind, key):
+        return self.entries[KIND_CODES[kind]].get(key)
+
+    def live_keys(self, kind):
+        return list(self.entries[KIND_CODES[kind]])
+
+    def _post(self, word, entry):
+        word_id = self.word_ids.get(word)
+        if word_id is None:
+            word_id = len(self.words)
+            self.words.append(word)
+            self.postings.append(entry)
+            self.word_ids[word] = word_id
+            for gram in word_grams(word):
+                ids = self.grams.get(gram)
+                if ids is None:
+                    self.grams[gram] = array('I', (word_id,))
+                else:
+                    ids.append(word_id)
+            return
+        posting = self.postings[word_id]
+        if type(posting) is int:
+            self.postings[word_id] = array('I', (posting, entry))
+        else:
+            posting.append(entry)
+
+    # -------------------------
+    # QUERIES
+    # -------------------------
+    def matching_words(self, query_word, complete=False):
+        """[(score, word id)] for the indexed words `query_word` matches, best first.
+
+        Only enough words to fill a search's candidates, unless `complete`.
+        """
+        if len(query_word) < 3:
+            candidates = self.grams.get(PREFIX + query_word, ())
+            # All of them start with it, and each has an entry: more than this many can't be used
+            candidates = set(candidates if complete else candidates[-config.SEARCH_CANDIDATES:])
+        else:
+            grams = [(i, self.grams.get(gram, ())) for i, gram in query_grams(query_word)]
+            n = len(query_word) - len(grams) + 1
+            start, rarest = grams.pop(min(range(len(grams)), key=lambda i: len(grams[i][1])))
+            # Overlapping grams mostly contain the same words; prefer ones further along
+            grams.sort(key=lambda g: len(g[1]) * (1 + max(0, n - abs(g[0] - start))))
+            candidates = set(rarest if complete else rarest[:config.SEARCH_SCAN_LIMIT])
+            for _, ids in grams:
+                # Once few words are left, checking them beats walking another long list
+                if len(ids) > 8 * len(candidates):
+                    break
+                candidates.intersection_update(ids)
+        exact = self.word_ids.get(query_word)
+        if exact is not None:
+            candidates.add(exact)
+        words = self.words
+        matches = []
+        for word_id in candidates:
+            score = match_score(query_word, words[word_id])
+            if score:
+                matches.append((score, word_id))
+        matches.sort(key=lambda m: (-m[0], len(words[m[1]])))
+        return matches
+
+    def _posting_size(self, word_id):
+        posting = self.postings[word_id]
+        return 1 if type(posting) is int else len(posting)
+
+    def estimate(self, query_word):
+        """Roughly how much work `query_word` is to search for; 0 if nothing can match it."""
+        if len(query_word) < 3:
+            size = len(self.grams.get(PREFIX + query_word, ()))
+        else:
+            size = min(len(self.grams.get(gram, ())) for _, gram in query_grams(query_word))
+        exact = self.word_ids.get(query_word)
+        return size + (0 if exact is None else self._posting_size(exact))
+
+    def _entry_scores(self, query_word):
+        """{entry: best score} for every entry `query_word` matches, or None if that is too many."""
+        matches = self.matching_words(query_word, complete=True)
+        if sum(self._posting_size(w) for _, w in matches) > config.SEARCH_SCAN_LIMIT:
+            return None
+        scores = {}
+        # Worst first, so an entry ends up with its best score
+        for score, word_id in reversed(matches):
+            posting = self.postings[word_id]
+            if type(posting) is int:
+                scores[posting] = score
+            else:
+                scores.update(dict.fromkeys(posting, score))
+        return scores
+
+    def _lead_entries(self, matches):
+        """(score, entry) for the entries of `matches`, best words first and newest entries first."""
+        for score, word_id in matches:
+            posting = self.postings[word_id]
+            if type(posting) is int:
+                yield score, posting
+            else:
+                for entry in reversed(posting):
+                    yield score, entry
+
+    def search(self, query, kinds=None, limit=20):
+        """[(score, kind, id, text)], best first."""
+        query_words = list(dict.fromkeys(words(query)))[:config.SEARCH_MAX_WORDS]
+        if not query_words:
+            return []
+        estimates = [self.estimate(w) for w in query_words]
+        if not all(estimates):
+            return []
+        # Candidates come from the most selective word. The others are looked up in their
+        # entries' scores where there are few enough, and otherwise matched per candidate.
+        lead = min(range(len(query_words)), key=estimates.__getitem__)
+        lookups, checks = [], []
+        for i, other in enumerate(query_words):
+            if i != lead:
+                scores = self._entry_scores(other) if estimates[i] <= config.SEARCH_SCAN_LIMIT else None
+                if scores is None:
+                    checks.append(other)
+                else:
+                    lookups.append(scores)
+        lead_scores = None
+        if lookups and estimates[lead] <= config.SEARCH_SCAN_LIMIT:
+            lead_scores = self._entry_scores(query_words[lead])
+        if lead_scores is not None:
+            # Intersecting the score tables beats visiting the lead's entries one by one
+            common = set(lead_scores).intersection(*lookups)
+            candidates = sorted(((lead_scores[e], e) for e in common), reverse=True)
+        else:
+            candidates = self._lead_entries(self.matching_words(query_words[lead]))
+        codes = None if kinds is None else {KIND_CODES[k] for k in kinds}
+
+        found = {}
+        scanned = 0
+        scan_limit, wanted = config.SEARCH_SCAN_LIMIT, config.SEARCH_CANDIDATES
+        alive, entry_kinds, texts = self.alive, self.kinds, self.texts
+        # Best lead matches come first, so stopping early only drops weaker (or older) matches
+        for score, entry in candidates:
+            if scanned >= scan_limit or len(found) >= wanted:
+                break
+            scanned += 1
+            if not alive[entry] or entry in found or (codes is not None and entry_kinds[entry] not in codes):
+                continue
+            total = score
+            for scores in lookups:
+                best = scores.get(entry)
+                if best is None:
+                    break
+                total += best
+            else:
+                if checks:
+                    entry_words = words(texts[entry])
+                    for other in checks:
+                        best = max(match_score(other, w) for w in entry_words)
+                        if not best:
+                            break
+                        total += best
+                    else:
+                        found[entry] = total
+                else:
+                    found[entry] = total
+
+        ranked = heapq.nsmallest(limit, found.items(),
+                                 key=lambda f: (-f[1], entry_kinds[f[0]], len(texts[f[0]]), texts[f[0]]))
+        return [(score, KINDS[entry_kinds[e]], self.keys[e], texts[e]) for e, score in ranked]
+
+
+# -------------------------
+# SHARED SNAPSHOT
+# -------------------------
+# catalog.py's file layout. Strings are stored as UTF-8 bytes plus end
+# offsets; words, grams and each kind's keys are sorted, so lookups are
+# binary searches and a word's prefixes need no index of their own.
+SNAPSHOT_MAGIC = b'SPLMSRC1'
+
+
+class _Strings:
+    """Column of strings, decoded on access."""
+
+    __slots__ = ('data', 'ends')
+
+    def __init__(self, data, ends):
+        self.data = memoryview(data)
+        self.ends = memoryview(ends)
+
+    def __len__(self):
+        return len(self.ends) - 1
+
+    def __getitem__(self, i):
+        return str(self.data[self.ends[i]:self.ends[i + 1]], 'utf-8')
+
+
+class _Rows:
+    """Row i of a CSR pair: values[ends[i]:ends[i + 1]]."""
+
+    __slots__ = ('ends', 'values')
+
+    def __init__(self, ends, values):
+        self.ends = memoryview(ends)
+        self.values = memoryview(values)
+
+    def __getitem__(self, i):
+        return self.values[self.ends[i]:self.ends[i + 1]]
+
+
+class _Keys:
+    """Entry keys, stored as strings: ints again for the kinds whose keys are (InstanceIDs)."""
+
+    __slots__ = ('strings', 'kinds', 'int_codes')
+
+    def __init__(self, strings, kinds, int_codes):
+        self.strings = strings
+        self.kinds = kinds
+        self.int_codes = int_codes
+
+    def __getitem__(self, entry):
+        key = self.strings[entry]
+        return int(key) if self.kinds[entry] in self.int_codes else key
+
+
+class _Picked:
+    """items[order[i]]: a sorted view of an unsorted column."""
+
+    __slots__ = ('items', 'order')
+
+    def __init__(self, items, order):
+        self.items = items
+        self.order = order
+
+    def __len__(self):
+        return len(self.order)
+
+    def __getitem__(self, i):
+        return self.items[self.order[i]]
+
+
+def _find(strings, s, lo=0, hi=None):
+    """Position of `s` in the sorted `strings`, or None."""
+    hi = len(strings) if hi is None else hi
+    i = bisect_left(strings, s, lo, hi)
+    return i if i < hi and strings[i] == s else None
+
+
+class _SortedWords:
+    """word -> word id, for InvertedIndex.word_ids."""
+
+    def __init__(self, words):
+        self.words = words
+
+    def get(self, word, default=None):
+        i = _find(self.words, word)
+        return default if i is None else i
+
+
+class _SortedGrams:
+    """prefix / n-gram -> word ids, for InvertedIndex.grams."""
+
+    def __init__(self, words, grams, gram_words):
+        self.words = words
+        self.grams = grams
+        self.gram_words = gram_words
+
+    def get(self, gram, default=None):
+        if gram.startswith(PREFIX):
+            # The words starting with it are a run of the sorted words
+            prefix = gram[1:]
+            return range(bisect_left(self.words, prefix), bisect_left(self.words, prefix + '\U0010ffff'))
+        i = _find(self.grams, gram)
+        return default if i is None else self.gram_words[i]
+
+
+def _string_column(strings):
+    encoded = [s.encode('utf-8') for s in strings]
+    ends = np.zeros(len(encoded) + 1, dtype=np.int64)
+    ends[1:] = np.cumsum(np.fromiter(map(len, encoded), dtype=np.int64, count=len(encoded)))
+    return np.frombuffer(b''.join(encoded), dtype=np.uint8), ends
+
+
+def write_index(index, path, header):
+    """Write the live entries of InvertedIndex `index` to `path` atomically, with `header`."""
+    live = np.flatnonzero(np.frombuffer(bytes(index.alive), dtype=np.uint8))
+    renumber = np.full(len(index), -1, dtype=np.int64)
+    renumber[live] = np.arange(len(live))
+    kinds = np.frombuffer(bytes(index.kinds), dtype=np.uint8)[live]
+    keys = [str(index.keys[e]) for e in live]
+    key_order = np.array(sorted(range(len(live)), key=lambda e: (kinds[e], keys[e])), dtype=np.uint32)
+    int_kinds = [kind for code, kind in enumerate(KINDS)
+                 if index.entries[code] and all(type(k) is int for k in index.entries[code])]
+
+    # Words in sorted order; each posting keeps its entries' order, minus the dead ones
+    n_words = len(index.words)
+    word_rank = np.empty(n_words, dtype=np.int64)
+    word_rank[sorted(range(n_words), key=index.words.__getitem__)] = np.arange(n_words)
+    sizes = np.fromiter((1 if type(p) is int else len(p) for p in index.postings), dtype=np.int64, count=n_words)
+    entries = np.fromiter(itertools.chain.from_iterable((p,) if type(p) is int else p for p in index.postings),
+                          dtype=np.int64, count=int(sizes.sum()))
+    entries = renumber[entries]
+    kept = entries >= 0
+    owner = np.repeat(word_rank, sizes)[kept]
+    order = np.argsort(owner, kind='stable')
+    posting_ends = np.zeros(n_words + 1, dtype=np.int64)
+    posting_ends[1:] = np.cumsum(np.bincount(owner, minlength=n_words))
+
+    grams = sorted((gram, ids) for gram, ids in index.grams.items() if not gram.startswith(PREFIX))
+    gram_sizes = np.fromiter((len(ids) for _, ids in grams), dtype=np.int64, count=len(grams))
+    gram_words = word_rank[np.frombuffer(b''.join(ids.tobytes() for _, ids in grams), dtype=np.uint32)]
+    gram_owner = np.repeat(np.arange(len(grams)), gram_sizes)
+    gram_order = np.lexsort((gram_words, gram_owner))
+    gram_ends = np.zeros(len(grams) + 1, dtype=np.int64)
+    gram_ends[1:] = np.cumsum(gram_sizes)
+
+    arrays = {'kinds': kinds, 'key_order': key_order,
+              'kind_ends': np.searchsorted(kinds[key_order], np.arange(len(KINDS) + 1)).astype(np.int64),
+              'postings': entries[kept][order].astype(np.uint32), 'posting_ends': posting_ends,
+              'gram_words': gram_words[gram_order].astype(np.uint32), 'gram_word_ends': gram_ends}
+    for name, strings in (('text', [index.texts[e] for e in live]), ('key', keys),
+                          ('word', [index.words[w] for w in np.argsort(word_rank)]),
+                          ('gram', [gram for gram, _ in grams])):
+        arrays[name + '_data'], arrays[name + '_ends'] = _string_column(strings)
+    write_columns(path, SNAPSHOT_MAGIC, dict(header, int_kinds=int_kinds), arrays)
+
+
+class FrozenIndex(InvertedIndex):
+    """An InvertedIndex mapped read-only from a snapshot written by write_index.
+
+    The mapping is shared with every other worker on the host. Only `alive`
+    is this worker's own, so entries can still be dropped (remove); new and
+    changed ones go on top of it in a LayeredIndex.
+    """
+
+    def __init__(self, path):
+        header, arrays = map_columns(path, SNAPSHOT_MAGIC)
+        self.header = header
+        self.kinds = memoryview(arrays['kinds'])
+        self.texts = _Strings(arrays['text_data'], arrays['text_ends'])
+        self.alive = bytearray(b'\x01') * len(self.texts)
+        self.words = _Strings(arrays['word_data'], arrays['word_ends'])
+        self.word_ids = _SortedWords(self.words)
+        self.postings = _Rows(arrays['posting_ends'], arrays['postings'])
+        self.grams = _SortedGrams(self.words, _Strings(arrays['gram_data'], arrays['gram_ends']),
+                                  _Rows(arrays['gram_word_ends'], arrays['gram_words']))
+        key_strings = _Strings(arrays['key_data'], arrays['key_ends'])
+        self.keys = _Keys(key_strings, self.kinds, {KIND_CODES[kind] for kind in header['int_kinds']})
+        # Per kind, a run of the keys in sorted order
+        self._sorted_keys = _Picked(key_strings, memoryview(arrays['key_order']))
+        self._kind_ends = memoryview(arrays['kind_ends'])
+
+    def add(self, kind, key, text):
+        raise TypeError("a FrozenIndex is read-only; add to the LayeredIndex over it")
+
+    def entry_of(self, kind, key):
+        code = KIND_CODES[kind]
+        i = _find(self._sorted_keys, str(key), self._kind_ends[code], self._kind_ends[code + 1])
+        return None if i is None else self._sorted_keys.order[i]
+
+    def remove(self, kind, key):
+        entry = self.entry_of(kind, key)
+        if entry is not None:
+            self.alive[entry] = 0
+
+    def live_keys(self, kind):
+        code = KIND_CODES[kind]
+        order = self._sorted_keys.order
+        return [self.keys[order[i]] for i in range(self._kind_ends[code], self._kind_ends[code + 1])
+                if self.alive[order[i]]]
+
+
+class LayeredIndex:
+    """A FrozenIndex shared between workers, with this worker's later writes in an InvertedIndex on top.
+
+    A changed entry is dropped from the shared index (for this worker) and
+    added on top; searches run on both and merge their results.
+    """
+
+    def __init__(self, base=None, top=None):
+        self.base = base
+        self.top = InvertedIndex() if top is None else top
+
+    def __len__(self):
+        return len(self.top) + (0 if self.base is None else len(self.base))
+
+    def add(self, kind, key, text):
+        if self.base is not None and self.top.entry_of(kind, key) is None:
+            entry = self.base.entry_of(kind, key)
+            if entry is not None and self.base.alive[entry]:
+                if self.base.texts[entry] == text:
+                    return
+                self.base.alive[entry] = 0
+        self.top.add(kind, key, text)
+
+    def remove(self, kind, key):
+        if self.base is not None:
+            self.base.remove(kind, key)
+        self.top.remove(kind, key)
+
+    def live_keys(self, kind):
+        keys = set(self.top.live_keys(kind))
+        if self.base is not None:
+            keys.update(self.base.live_keys(kind))
+        return keys
+
+    def search(self, query, kinds=None, limit=20):
+        found = self.top.search(query, kinds, limit)
+        if self.base is not None:
+            found += self.base.search(query, kinds, limit)
+        return heapq.nsmallest(limit, found, key=lambda f: (-f[0], KIND_CODES[f[1]], len(f[3]), f[3]))
+
+
+class SearchIndex:
+
+    def __init__(self):
+        self.index = None
+        self.cursors = {}          # feed source -> last FeedSeq applied
+        self.versions = None
+        self.catalog_versions = {}
+        self._sync_lock = threading.Lock()
+
+    def start(self):
+        """Load the index in a background thread (call after forking)."""
+        threading.Thread(target=self.sync, name='search-index', daemon=True).start()
+
+    # -------------------------
+    # FOLLOWING WRITES
+    # -------------------------
+    def sync(self):
+        versions, _ = table_versions(SEARCH_TABLES)
+        if versions == self.versions and self.index is not None:
+            return
+        # One thread catches up; the others keep searching what is there
+        if not self._sync_lock.acquire(blocking=self.index is None):
+            return
+        try:
+            current = dict(zip(SEARCH_TABLES, versions))
+            if self.index is None or self._feed_pruned(self.cursors) or self._delta_too_large():
+                self._rebuild(current)
+            self._apply_catalog(current)
+            complete = self._apply_feed()
+            self.versions = versions if complete else None
+        finally:
+            self._sync_lock.release()
+
+    def _feed_sources(self):
+        """[(source, connect, kinds)]: suppliers live on the primary, instances on the shards."""
+        shards = get_shards()
+        if not shards:
+            return [('primary', get_db_connection, ('supplier', 'serial'))]
+        return [('primary', get_db_connection, ('supplier',))] + [
+            (f"shard-{shard.index}", shard.connect, ('serial',)) for shard in shards
+        ]
+
+    def _feed_pruned(self, cursors):
+        """Whether the feed no longer holds every change after `cursors`."""
+        for source, connect, _ in self._feed_sources():
+            conn = connect()
+            try:
+                cursor = conn.cursor()
+                cursor.execute("SELECT MIN(FeedSeq) FROM ChangeOutbox")
+                oldest = cursor.fetchone()[0]
+            finally:
+                conn.close()
+            if oldest is not None and oldest > cursors.get(source, 0) + 1:
+                return True
+        return False
+
+    def _delta_too_large(self):
+        return self.index.base is not None and len(self.index.top) > config.SEARCH_SNAPSHOT_MAX_DELTA
+
+    def _rebuild(self, versions):
+        path = snapshot_path()
+        if path is None:
+            index, self.cursors, self.catalog_versions = self._read_all(versions)
+            self.index = LayeredIndex(top=index)
+            return
+        base = self._shared_base(path, versions)
+        self.index = LayeredIndex(base)
+        self.cursors = dict(base.header['cursors'])
+        self.catalog_versions = dict(base.header['catalog_versions'])
+
+    def _shared_base(self, path, versions):
+        """The mapped snapshot, first writing a new one if there is none this worker can use."""
+        # Replacing the one in use: only a newer one will do
+        built = None if self.index is None or self.index.base is None else self.index.base.header['built']
+        base = self._try_map(path, built)
+        if base is not None:
+            return base
+        fd = os.open(path + '.lock', os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            # Another worker may have written it while this one waited
+            base = self._try_map(path, built)
+            if base is None:
+                index, cursors, catalog_versions = self._read_all(versions)
+                write_index(index, path, {'source': _snapshot_source(), 'built': time.time(),
+                                          'cursors': cursors, 'catalog_versions': catalog_versions})
+                del index
+                base = FrozenIndex(path)
+        finally:
+            os.close(fd)
+        return base
+
+    def _try_map(self, path, built):
+        try:
+            base = FrozenIndex(path)
+        except (FileNotFoundError, ValueError):
+            return None
+        header = base.header
+        if header['source'] != _snapshot_source() or (built is not None and header['built'] <= built):
+            return None
+        return None if self._feed_pruned(header['cursors']) else base
+
+    def _read_all(self, versions):
+        """A new InvertedIndex of everything, with the feed position and catalog versions it was read at."""
+        index = InvertedIndex()
+        cursors = {}
+        for source, connect, kinds in self._feed_sources():
+            conn = connect()
+            try:
+                cursor = conn.cursor()
+                sequence_pending(conn)
+                # Take the feed position first: anything inserted after it is replayed from the feed
+                cursor.execute("SELECT COALESCE(MAX(FeedSeq), 0) FROM ChangeOutbox")
+                cursors[source] = cursor.fetchone()[0]
+                for kind in kinds:
+                    _load(conn, index, kind, FEED_SOURCES[kind][0])
+            finally:
+                conn.close()
+        conn = get_db_connection()
+        try:
+            for kind, (_, sql) in CATALOG_SOURCES.items():
+                _load(conn, index, kind, sql)
+        finally:
+            conn.close()
+        return index, cursors, {kind: versions[table] for kind, (table, _) in CATALOG_SOURCES.items()}
+
+    def _apply_catalog(self, versions):
+        stale = [kind for kind, (table, _) in CATALOG_SOURCES.items()
+                 if self.catalog_versions.get(kind) != versions[table]]
+        if not stale:
+            return
+        conn = get_db_connection()
+        try:
+            for kind in stale:
+                table, sql = CATALOG_SOURCES[kind]
+                present = _load(conn, self.index, kind, sql)
+                for key in self.index.live_keys(kind) - present:
+                    self.index.remove(kind, key)
+                self.catalog_versions[kind] = versions[table]
+        finally:
+            conn.close()
+
+    def _apply_feed(self):
+        complete = True
+        for source, connect, kinds in self._feed_sources():
+            entities = {FEED_SOURCES[kind][1]: kind for kind in kinds}
+            conn = connect()
+            try:
+                # A busy sequencer may be holding back committed rows; retry next time
+                complete = sequence_pending(conn) is not None and complete
+                while True:
+                    changes = fetch_changes(conn, self.cursors.get(source, 0), 1000, tuple(entities))
+                    for change in changes:
+                        kind = entities[change['entity']]
+                        _, _, id_field, text_field = FEED_SOURCES[kind]
+                        data = change['data']
+                        self.index.add(kind, data[id_field], data[text_field])
+                        self.cursors[source] = change['cursor']
+                    if len(changes) < 1000:
+                        break
+            finally:
+                conn.close()
+        return complete
+
+    # -------------------------
+    # SEARCHES
+    # -------------------------
+    def search(self, query, kinds=None, limit=20):
+        self.sync()
+        return [
+            {'kind': kind, 'id': key, 'text': text, 'score': score}
+            for score, kind, key, text in self.index.search(query, kinds, limit)
+        ]
+
+
+def snapshot_path():
+    """Where the shared snapshot lives, or None when each worker keeps the whole index itself."""
+    if not config.SEARCH_SNAPSHOT_PATH:
+        return None
+    if config.DB_BACKEND == 'sqlite' and config.DB_SQLITE_PATH == ':memory:':
+        # Every process has its own in-memory database
+        return None
+    return config.SEARCH_SNAPSHOT_PATH
+
+
+def _snapshot_source():
+    # Feed positions are per shard, so the shard list is part of it
+    return f"{database_source()} shards={config.DB_SHARDS}"
+
+
+def _load(conn, index, kind, sql):
+    """Add every row of `sql` (id, text) to the index; returns the ids seen."""
+    seen = set()
+    cursor = conn.cursor()
+    cursor.execute(sql)
+    while True:
+        rows = cursor.fetchmany(10000)
+        if not rows:
+            return seen
+        for key, text in rows:
+            if text is not None:
+                index.add(kind, key, text)
+                seen.add(key)
+
+
+SEARCH_INDEX = SearchIndex()
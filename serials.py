@@ -0,0 +1,340 @@
+"""Serial-number lookup for field scanners (GET /api/serials/<serial>).
+
+Each worker keeps two in-memory structures:
+
+    SerialBloom    every registered serial; a serial it has never seen is
+                   answered "unknown" without touching the database
+    summary LRU    serial -> instance, product, current state and
+                   manufacture date for recently scanned serials
+
+Both follow the change feed (outbox.py) rather than polling tables:
+ProductInstance changes add serials to the filter, LifecycleEvent changes
+evict that instance's summary. The feed is only read when the in-process
+TableVersions copy (cache.py) shows a write, so a steady stream of lookups
+costs no queries beyond LRU misses.
+
+If the feed has been pruned past this worker's cursor, or the filter fills
+past its capacity, the filter is rebuilt from ProductInstances.
+
+With DB_SHARDS set (shards.py) the filter follows every shard's feed, with
+a cursor per shard, and a summary is read from the instance's shard after
+the primary's SerialRegistry names the instance.
+
+init_app() answers GET /api/serials/<serial> in front of Flask (request
+context, routing and response objects cost several times the lookup
+itself); anything else, and any lookup that raises, goes through Flask as
+usual. SERIAL_FAST_PATH=0 leaves the route entirely to Flask.
+"""
+import hashlib
+import json
+import math
+import threading
+from collections import OrderedDict, deque
+from datetime import date, datetime
+
+import config
+from cache import table_versions, versions_gtid_set
+from db import get_db_connection, get_read_connection
+from outbox import fetch_changes, sequence_pending
+from shards import get_shards, instance_connection, is_sharded
+
+SERIAL_TABLES = ('ProductInstances', 'LifecycleEvents')
+SERIAL_ENTITIES = ('ProductInstance', 'LifecycleEvent')
+
+SUMMARY_QUERY = """
+    SELECT pi.InstanceID, pi.SerialNumber, pi.ProductID, p.ModelName, pi.CurrentState
+    FROM ProductInstances pi
+    JOIN Products p ON p.ProductID = pi.ProductID
+    WHERE pi.SerialNumber = %s
+"""
+REGISTRY_QUERY = "SELECT InstanceID FROM SerialRegistry WHERE SerialNumber = %s"
+# Asked of each table separately: a correlated lookup through the
+# LifecycleEventsAll view scans both tables instead of using their indexes
+MANUFACTURED_QUERIES = [
+    f"SELECT MIN(EventDate) AS ManufacturedAt FROM {table} WHERE InstanceID = %s AND EventType = 'Manufactured'"
+    for table in ('LifecycleEvents', 'LifecycleEventsArchive')
+]
+
+
+class SerialBloom:
+    """Bloom filter over serial numbers (no false negatives, ~error_rate false positives)."""
+
+    def __init__(self, capacity, error_rate):
+        self.capacity = capacity
+        self.size = max(8, int(math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2)))
+        self.hashes = max(1, int(round(self.size / capacity * math.log(2))))
+        self.bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+
+    def _positions(self, serial):
+        # Double hashing: k positions from one 128-bit digest
+        digest = hashlib.blake2b(serial.encode('utf-8'), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        return [(h1 + i * h2) % self.size for i in range(self.hashes)]
+
+    def add(self, serial):
+        for p in self._positions(serial):
+            self.bits[p >> 3] |= 1 << (p & 7)
+        self.count += 1
+
+    def __contains__(self, serial):
+        bits = self.bits
+        for p in self._positions(serial):
+            if not bits[p >> 3] & (1 << (p & 7)):
+                return False
+        return True
+
+
+class SerialIndex:
+
+    def __init__(self):
+        self.bloom = None
+        self.cursors = {}          # feed source -> last FeedSeq applied
+        self.versions = None
+        self.read_after = None     # GTID set summary reads must include (see db.get_read_connection)
+        self._summaries = OrderedDict()
+        self._by_instance = {}
+        self._generation = 0       # bumped on every eviction, see summary()
+        self._evictions = deque(maxlen=10000)   # (generation, InstanceID, or None for all of them)
+        self._lock = threading.Lock()
+        self._sync_lock = threading.Lock()
+
+    # -------------------------
+    # FOLLOWING WRITES
+    # -------------------------
+    def sync(self):
+        versions, _ = table_versions(SERIAL_TABLES)
+        if versions == self.versions and self.bloom is not None:
+            return
+        # One thread catches up; the others keep answering from what is there
+        if not self._sync_lock.acquire(blocking=self.bloom is None):
+            return
+        try:
+            if self.bloom is None or self._feed_pruned():
+                self._rebuild()
+            complete = self._apply_feed()
+            if self.bloom.count > self.bloom.capacity:
+                # Past capacity the false-positive rate climbs; start over with room to grow
+                self._rebuild()
+                self._apply_feed()
+            self.versions = versions if complete else None
+            self.read_after = versions_gtid_set()
+        finally:
+            self._sync_lock.release()
+
+    def _feed_sources(self):
+        """[(source, connect)]: the database holding the instances, or each shard."""
+        shards = get_shards()
+        if not shards:
+            return [('primary', get_db_connection)]
+        return [(f"shard-{shard.index}", shard.connect) for shard in shards]
+
+    def _feed_pruned(self):
+        for source, connect in self._feed_sources():
+            conn = connect()
+            try:
+                cursor = conn.cursor()
+                cursor.execute("SELECT MIN(FeedSeq) FROM ChangeOutbox")
+                oldest = cursor.fetchone()[0]
+            finally:
+                conn.close()
+            if oldest is not None and oldest > self.cursors.get(source, 0) + 1:
+                return True
+        return False
+
+    def _rebuild(self):
+        sources = self._feed_sources()
+        cursors, count = {}, 0
+        for source, connect in sources:
+            conn = connect()
+            try:
+                cursor = conn.cursor()
+                sequence_pending(conn)
+                # Take the feed position first: anything registered after it is replayed from the feed
+                cursor.execute("SELECT COALESCE(MAX(FeedSeq), 0) FROM ChangeOutbox")
+                cursors[source] = cursor.fetchone()[0]
+                cursor.execute("SELECT COUNT(*) FROM ProductInstances")
+                count += cursor.fetchone()[0]
+            finally:
+                conn.close()
+        bloom = SerialBloom(max(config.SERIAL_BLOOM_CAPACITY, 2 * count), config.SERIAL_BLOOM_ERROR_RATE)
+        for source, connect in sources:
+            conn = connect()
+            try:
+                cursor = conn.cursor()
+                cursor.execute("SELECT SerialNumber FROM ProductInstances")
+                for (serial,) in cursor:
+                    bloom.add(serial)
+            finally:
+                conn.close()
+        with self._lock:
+            self.bloom = bloom
+            self.cursors = cursors
+            self._summaries.clear()
+            self._by_instance.clear()
+            # Anything read before the rebuild may predate changes the new cursors skip
+            self._generation += 1
+            self._evictions.append((self._generation, None))
+
+    def _apply_feed(self):
+        """Apply every source's new changes; False if a busy sequencer may be holding some back."""
+        complete = True
+        for source, connect in self._feed_sources():
+            conn = connect()
+            try:
+                # A busy sequencer may be holding back committed rows; retry next time
+                complete = sequence_pending(conn) is not None and complete
+                while True:
+                    changes = fetch_changes(conn, self.cursors.get(source, 0), 1000, SERIAL_ENTITIES)
+                    with self._lock:
+                        for change in changes:
+                            data = change['data']
+                            if change['entity'] == 'ProductInstance':
+                                self.bloom.add(data['SerialNumber'])
+                            self._evict(int(data['InstanceID']))
+                            self.cursors[source] = change['cursor']
+                    if len(changes) < 1000:
+                        break
+            finally:
+                conn.close()
+        return complete
+
+    def _evict(self, instance_id):
+        serial = self._by_instance.pop(instance_id, None)
+        if serial is not None:
+            self._summaries.pop(serial, None)
+        self._generation += 1
+        self._evictions.append((self._generation, instance_id))
+
+    def _evicted_since(self, generation, instance_id):
+        if generation == self._generation:
+            return False
+        if not self._evictions or self._evictions[0][0] > generation + 1:
+            # Too many evictions to tell; assume the worst
+            return True
+        return any(g > generation and i in (instance_id, None) for g, i in self._evictions)
+
+    # -------------------------
+    # LOOKUPS
+    # -------------------------
+    def lookup(self, serial):
+        """The instance summary for `serial`, or None if it is not registered."""
+        self.sync()
+        if serial not in self.bloom:
+            return None
+        summary = self.summary(serial)
+        if summary is None:
+            return None
+        manufactured = summary['manufactured_at']
+        return {
+            'serial': summary['serial'],
+            'instance_id': summary['instance_id'],
+            'product_id': summary['product_id'],
+            'model_name': summary['model_name'],
+            'state': summary['state'],
+            'age_days': (date.today() - manufactured.date()).days if manufactured else None,
+        }
+
+    def summary(self, serial):
+        with self._lock:
+            cached = self._summaries.get(serial)
+            if cached is not None:
+                self._summaries.move_to_end(serial)
+                return cached
+            generation = self._generation
+
+        conn = self._summary_connection(serial)
+        if conn is None:
+            # A Bloom false positive
+            return None
+        try:
+            cursor = conn.cursor(dictionary=True)
+            cursor.execute(SUMMARY_QUERY, (serial,))
+            row = cursor.fetchone()
+            manufactured = None
+            if row is not None:
+                for query in MANUFACTURED_QUERIES:
+                    cursor.execute(query, (row['InstanceID'],))
+                    manufactured = cursor.fetchone()['ManufacturedAt']
+                    if manufactured is not None:
+                        break
+        finally:
+            conn.close()
+        if row is None:
+            # A Bloom false positive
+            return None
+
+        if isinstance(manufactured, str):
+            manufactured = datetime.fromisoformat(manufactured)
+        summary = {
+            'serial': row['SerialNumber'],
+            'instance_id': row['InstanceID'],
+            'product_id': row['ProductID'],
+            'model_name': row['ModelName'],
+            'state': row['CurrentState'],
+            'manufactured_at': manufactured,
+        }
+        with self._lock:
+            # The instance may have changed while the query ran; don't cache a stale row
+            if not self._evicted_since(generation, summary['instance_id']):
+                self._summaries[serial] = summary
+                self._by_instance[summary['instance_id']] = serial
+                while len(self._summaries) > config.SERIAL_CACHE_ENTRIES:
+                    _, old = self._summaries.popitem(last=False)
+                    self._by_instance.pop(old['instance_id'], None)
+        return summary
+
+
+    def _summary_connection(self, serial):
+        """Connection holding `serial`'s instance, or None if no instance has it."""
+        if not is_sharded():
+            return get_read_connection(after=self.read_after)
+        conn = get_read_connection(after=self.read_after)
+        try:
+            cursor = conn.cursor()
+            cursor.execute(REGISTRY_QUERY, (serial,))
+            row = cursor.fetchone()
+        finally:
+            conn.close()
+        return instance_connection(row[0]) if row is not None else None
+
+
+SERIAL_INDEX = SerialIndex()
+
+
+# -------------------------
+# WSGI FAST PATH
+# -------------------------
+SERIAL_PREFIX = '/api/serials/'
+NOT_FOUND = json.dumps({'message': 'Unknown serial', 'status': 'error'}, separators=(',', ':')).encode('utf-8') + b'\n'
+
+
+class SerialLookupMiddleware:
+
+    def __init__(self, wsgi_app, index=SERIAL_INDEX):
+        self.wsgi_app = wsgi_app
+        self.index = index
+
+    def __call__(self, environ, start_response):
+        path = environ.get('PATH_INFO', '')
+        if environ.get('REQUEST_METHOD') != 'GET' or not path.startswith(SERIAL_PREFIX):
+            return self.wsgi_app(environ, start_response)
+        # WSGI passes the path as latin-1 decoded bytes
+        serial = path[len(SERIAL_PREFIX):].encode('latin-1').decode('utf-8', 'replace')
+        try:
+            summary = self.index.lookup(serial)
+        except Exception:
+            # Let Flask produce (and log) the error response
+            return self.wsgi_app(environ, start_response)
+        if summary is None:
+            status, body = '404 NOT FOUND', NOT_FOUND
+        else:
+            status, body = '200 OK', json.dumps(summary, sort_keys=True, separators=(',', ':')).encode('utf-8') + b'\n'
+        start_response(status, [('Content-Type', 'application/json'), ('Content-Length', str(len(body)))])
+        return [body]
+
+
+def init_app(app):
+    if config.SERIAL_FAST_PATH:
+        app.wsgi_app = SerialLookupMiddleware(app.wsgi_app)
@@ -0,0 +1,65 @@
+"""Production launcher: runs app.py under gunicorn.
+
+    python serve.py
+
+Settings come from the environment (see config.py): WEB_BIND, WEB_WORKERS,
+WEB_THREADS, WEB_TIMEOUT, WEB_MAX_REQUESTS, DB_POOL_SIZE and the DB_* connection
+variables. The app and the ML artifacts are loaded once in the master and
+shared copy-on-write with the forked workers; each worker then builds its
+own connection pool on first use.
+"""
+import gc
+
+from gunicorn.app.base import BaseApplication
+
+import config
+from app import app
+from model import load_model
+
+
+def post_fork(server, worker):
+    # Pools are per process; make sure nothing inherited from the master is reused
+    import db
+    db._pool = None
+    db._pool_pid = None
+    if config.SEARCH_PRELOAD:
+        from search import SEARCH_INDEX
+        SEARCH_INDEX.start()
+
+
+class ProductionServer(BaseApplication):
+
+    def __init__(self, application, options):
+        self.application = application
+        self.options = options
+        super().__init__()
+
+    def load_config(self):
+        for key, value in self.options.items():
+            self.cfg.set(key, value)
+
+    def load(self):
+        return self.application
+
+
+def gunicorn_options():
+    return {
+        'bind': config.WEB_BIND,
+        'workers': config.WEB_WORKERS,
+        'threads': config.WEB_THREADS,
+        'worker_class': 'gthread' if config.WEB_THREADS > 1 else 'sync',
+        'timeout': config.WEB_TIMEOUT,
+        'max_requests': config.WEB_MAX_REQUESTS,
+        'max_requests_jitter': config.WEB_MAX_REQUESTS // 10,
+        'preload_app': True,
+        'post_fork': post_fork,
+        'accesslog': '-',
+    }
+
+
+if __name__ == '__main__':
+    load_model()
+    # Move everything loaded so far out of the GC's reach so collections in
+    # the workers don't touch (and un-share) those pages.
+    gc.freeze()
+    ProductionServer(app, gunicorn_options()).run()
@@ -0,0 +1,502 @@
+"""Sharding of ProductInstances and LifecycleEvents across database nodes.
+
+With DB_SHARDS set, an instance and all of its lifecycle events live on
+shard CRC32(InstanceID) % N -- the same expression in MySQL, so placement
+can be checked with plain SQL. The primary (DB_HOST) stays the catalog
+node: Products, Components, RawMaterials, BillOfMaterial,
+ComponentComposition, Suppliers and Sourcing are written there and copied
+to every shard by sync_catalog(), so per-instance queries (hazard checks,
+passports, predictions) still join locally on the shard.
+
+The primary also hands out InstanceIDs in blocks of DB_SHARD_ID_BLOCK
+(IdBlocks) and keeps serial numbers unique across shards (SerialRegistry).
+TableVersions stays on the primary: shard writes bump it there too, so the
+response cache and the other version watchers keep working.
+
+Fleet-wide reads run on every shard in parallel (scatter) and are merged
+here (gather_*). Without DB_SHARDS every helper uses the single database,
+so callers need no special case.
+
+    python shards.py init      # registry + catalog on every shard, then move the primary's instances out
+    python shards.py sync      # copy the catalog to every shard now
+    python shards.py status    # instances / events per shard, and any misplaced rows
+"""
+import heapq
+import os
+import sys
+import threading
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+from operator import itemgetter
+
+import mysql.connector
+
+import config
+from cache import table_versions
+from db import DB_CONFIG, get_db_connection, make_pool
+
+# Replicated to every shard, parents before children; with their primary keys
+CATALOG = (
+    ('Components', ('ComponentID',)),
+    ('RawMaterials', ('MaterialID',)),
+    ('Suppliers', ('SupplierID',)),
+    ('Products', ('ProductID',)),
+    ('BillOfMaterial', ('ParentComponentID', 'ChildComponentID')),
+    ('ComponentComposition', ('ComponentID', 'MaterialID')),
+    ('Sourcing', ('SourcingID',)),
+)
+CATALOG_TABLES = tuple(name for name, _ in CATALOG)
+
+
+class Shard:
+
+    def __init__(self, index, address):
+        self.index = index
+        self.address = address
+        self.pool = None
+
+    def connect(self):
+        if self.address.startswith('sqlite:'):
+            import sqlite_backend
+            return sqlite_backend.connect(self.address[len('sqlite:'):])
+        host, _, port = self.address.partition(':')
+        settings = dict(DB_CONFIG, host=host, port=int(port or 3306))
+        if config.DB_POOL_SIZE <= 0:
+            return mysql.connector.connect(**settings)
+        if self.pool is None:
+            self.pool = make_pool(f'splm-{os.getpid()}-s{self.index}', settings)
+        return self.pool.get_connection()
+
+
+_shards = None
+_shards_pid = None
+_executor = None
+
+
+def get_shards():
+    global _shards, _shards_pid, _executor
+    if _shards is None or _shards_pid != os.getpid():
+        addresses = [a.strip() for a in config.DB_SHARDS.split(',') if a.strip()]
+        _shards = [Shard(i, a) for i, a in enumerate(addresses)]
+        _shards_pid = os.getpid()
+        # Threads don't survive a fork, so neither may the executor
+        _executor = ThreadPoolExecutor(max_workers=4 * len(_shards), thread_name_prefix='scatter') if _shards else None
+    return _shards
+
+
+def is_sharded():
+    return bool(get_shards())
+
+
+def shard_for(instance_id):
+    return zlib.crc32(str(int(instance_id)).encode('utf-8')) % len(get_shards())
+
+
+def shard_connection(index):
+    shards = get_shards()
+    return shards[index].connect() if shards else get_db_connection()
+
+
+def instance_connection(instance_id, connect=get_db_connection):
+    """Connection to the node holding `instance_id`: its shard, or connect() when unsharded."""
+    return shard_connection(shard_for(instance_id)) if is_sharded() else connect()
+
+
+def group_by_shard(items, instance_id_of):
+    """{shard index: items}; everything under 0 when unsharded."""
+    if not is_sharded():
+        return {0: list(items)} if items else {}
+    groups = {}
+    for item in items:
+        groups.setdefault(shard_for(instance_id_of(item)), []).append(item)
+    return groups
+
+
+def bump_primary(*tables):
+    """Record a shard write in the primary's TableVersions (no-op when unsharded)."""
+    if not is_sharded():
+        return
+    conn = get_db_connection()
+    try:
+        cursor = conn.cursor()
+        for table in tables:
+            cursor.callproc('BumpTableVersion', [table])
+        conn.commit()
+    finally:
+        conn.close()
+
+
+# -------------------------
+# SCATTER / GATHER
+# -------------------------
+def _fetch(conn, sql, params):
+    cursor = conn.cursor(dictionary=True)
+    cursor.execute(sql, params)
+    return cursor.fetchall()
+
+
+def _fetch_shard(shard, sql, params):
+    conn = shard.connect()
+    try:
+        return _fetch(conn, sql, params)
+    finally:
+        conn.close()
+
+
+def scatter(sql, params=(), conn=None):
+    """Rows of `sql` from every shard, queried in parallel: one list per shard.
+
+    Unsharded, `sql` runs once on `conn` (or a new primary connection).
+    """
+    shards = get_shards()
+    if not shards:
+        if conn is not None:
+            return [_fetch(conn, sql, params)]
+        conn = get_db_connection()
+        try:
+            return [_fetch(conn, sql, params)]
+        finally:
+            conn.close()
+    futures = [_executor.submit(_fetch_shard, shard, sql, params) for shard in shards]
+    return [f.result() for f in futures]
+
+
+def _call_shard(shard, fn, args=()):
+    conn = shard.connect()
+    try:
+        return fn(conn, *args)
+    finally:
+        conn.close()
+
+
+def scatter_call(fn, args=None):
+    """fn(conn) on every shard in parallel: one result per shard.
+
+    args, if given, is one tuple of extra arguments per shard (one in all
+    when unsharded). Unsharded, fn runs once on a new primary connection.
+    """
+    shards = get_shards()
+    args = args or [()] * (len(shards) or 1)
+    if not shards:
+        conn = get_db_connection()
+        try:
+            return [fn(conn, *args[0])]
+        finally:
+            conn.close()
+    futures = [_executor.submit(_call_shard, shard, fn, shard_args) for shard, shard_args in zip(shards, args)]
+    return [f.result() for f in futures]
+
+
+def gather_sum(results, column):
+    return sum(row[column] or 0 for rows in results for row in rows)
+
+
+def gather_counts(results, key, column='cnt'):
+    counts = {}
+    for rows in results:
+        for row in rows:
+            counts[row[key]] = counts.get(row[key], 0) + row[column]
+    return counts
+
+
+def gather_sorted(results, key, reverse=False, limit=None):
+    """Merge per-shard results that are each already ordered by `key` (ORDER BY in the SQL)."""
+    merged = heapq.merge(*results, key=itemgetter(key), reverse=reverse)
+    return list(islice(merged, limit))
+
+
+# -------------------------
+# GLOBAL INSTANCE IDS
+# -------------------------
+class IdAllocator:
+    """Hands out IDs from blocks reserved in the primary's IdBlocks table."""
+
+    def __init__(self, name):
+        self.name = name
+        self._next = self._end = 0
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def next_id(self):
+        with self._lock:
+            # A block inherited from the master process is the master's, not ours
+            if self._pid != os.getpid() or self._next >= self._end:
+                self._next, self._end = self._reserve(config.DB_SHARD_ID_BLOCK)
+                self._pid = os.getpid()
+            self._next += 1
+            return self._next - 1
+
+    def _reserve(self, size):
+        conn = get_db_connection()
+        try:
+            cursor = conn.cursor()
+            cursor.execute("SELECT NextID FROM IdBlocks WHERE Name = %s FOR UPDATE", (self.name,))
+            row = cursor.fetchone()
+            if row is None:
+                raise RuntimeError(f"No IdBlocks row for {self.name}; run `python shards.py init`")
+            cursor.execute("UPDATE IdBlocks SET NextID = %s WHERE Name = %s", (row[0] + size, self.name))
+            conn.commit()
+        finally:
+            conn.close()
+        return row[0], row[0] + size
+
+
+INSTANCE_IDS = IdAllocator('InstanceID')
+
+
+def register_instance(conn, serial, product_id):
+    """Register an instance and its Manufactured event. The caller commits `conn` (the primary).
+
+    Unsharded this is the RegisterProductInstance procedure. Sharded, the
+    serial is claimed in SerialRegistry under a new global InstanceID and the
+    instance is written (and committed) on its shard; if that fails the
+    claim is released again.
+    """
+    cursor = conn.cursor()
+    if not is_sharded():
+        cursor.callproc('RegisterProductInstance', [serial, product_id])
+        return None
+
+    sync_catalog()
+    instance_id = INSTANCE_IDS.next_id()
+    cursor.execute("INSERT INTO SerialRegistry (SerialNumber, InstanceID) VALUES (%s, %s)", (serial, instance_id))
+    conn.commit()
+    shard = instance_connection(instance_id)
+    try:
+        shard_cursor = shard.cursor()
+        shard_cursor.execute(
+            "INSERT INTO ProductInstances (InstanceID, SerialNumber, ProductID) VALUES (%s, %s, %s)",
+            (instance_id, serial, product_id)
+        )
+        shard_cursor.callproc('AddLifecycleEvent', [instance_id, 'Manufactured'])
+        shard_cursor.callproc('BumpTableVersion', ['ProductInstances'])
+        shard.commit()
+    except Exception:
+        shard.rollback()
+        cursor.execute("DELETE FROM SerialRegistry WHERE SerialNumber = %s", (serial,))
+        conn.commit()
+        raise
+    finally:
+        shard.close()
+    cursor.callproc('BumpTableVersion', ['ProductInstances'])
+    cursor.callproc('BumpTableVersion', ['LifecycleEvents'])
+    return instance_id
+
+
+# -------------------------
+# CATALOG REPLICATION
+# -------------------------
+_synced = (None, None)
+_sync_lock = threading.Lock()
+
+
+def _catalog_changes(keys, wanted, present):
+    """(inserts, updates, deletes) turning the shard's rows `present` into `wanted`."""
+    key = lambda row: tuple(row[k] for k in keys)  # noqa: E731
+    want = {key(r): r for r in wanted}
+    have = {key(r): r for r in present}
+    inserts = [r for k, r in want.items() if k not in have]
+    updates = [r for k, r in want.items() if k in have and have[k] != r]
+    deletes = [k for k in have if k not in want]
+    return inserts, updates, deletes
+
+
+def _sync_shard(shard, rows, versions, force):
+    conn = shard.connect()
+    try:
+        cursor = conn.cursor()
+        placeholders = ", ".join(["%s"] * len(CATALOG_TABLES))
+        cursor.execute(f"SELECT TableName, Version FROM TableVersions WHERE TableName IN ({placeholders})",
+                       CATALOG_TABLES)
+        current = dict(cursor.fetchall())
+        if not force and all(current.get(t, 0) >= v for t, v in zip(CATALOG_TABLES, versions)):
+            return 0
+
+        changed = 0
+        shard_rows = {name: _fetch(conn, f"SELECT * FROM {name}", ()) for name in CATALOG_TABLES}
+        pending_deletes = []
+        for name, keys in CATALOG:
+            inserts, updates, deletes = _catalog_changes(keys, rows[name], shard_rows[name])
+            for row in inserts:
+                columns = list(row)
+                cursor.execute(
+                    f"INSERT INTO {name} ({', '.join(columns)}) VALUES ({', '.join(['%s'] * len(columns))})",
+                    tuple(row[c] for c in columns)
+                )
+            for row in updates:
+                columns = [c for c in row if c not in keys]
+                cursor.execute(
+                    f"UPDATE {name} SET {', '.join(c + ' = %s' for c in columns)} "
+                    f"WHERE {' AND '.join(k + ' = %s' for k in keys)}",
+                    tuple(row[c] for c in columns) + tuple(row[k] for k in keys)
+                )
+            pending_deletes.append((name, keys, deletes))
+            changed += len(inserts) + len(updates) + len(deletes)
+        # Children before parents
+        for name, keys, deletes in reversed(pending_deletes):
+            for key in deletes:
+                cursor.execute(f"DELETE FROM {name} WHERE {' AND '.join(k + ' = %s' for k in keys)}", key)
+
+        cursor.execute(f"DELETE FROM TableVersions WHERE TableName IN ({placeholders})", CATALOG_TABLES)
+        cursor.executemany(
+            "INSERT INTO TableVersions (TableName, Version, UpdatedAt) VALUES (%s, %s, UTC_TIMESTAMP())",
+            list(zip(CATALOG_TABLES, versions))
+        )
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+    return changed
+
+
+def sync_catalog(force=False):
+    """Bring every shard's catalog tables up to the primary's; returns rows changed."""
+    global _synced
+    shards = get_shards()
+    if not shards:
+        return 0
+    versions, _ = table_versions(CATALOG_TABLES)
+    if not force and _synced == (os.getpid(), versions):
+        return 0
+    with _sync_lock:
+        # Read after the versions, so the copy is at least as new as its label
+        conn = get_db_connection()
+        try:
+            rows = {name: _fetch(conn, f"SELECT * FROM {name}", ()) for name in CATALOG_TABLES}
+        finally:
+            conn.close()
+        changed = sum(_sync_shard(shard, rows, versions, force) for shard in shards)
+        _synced = (os.getpid(), versions)
+    return changed
+
+
+# -------------------------
+# SETUP AND CHECKS
+# -------------------------
+INSTANCE_TABLES = ('LifecycleBackup', 'LifecycleEventsArchive', 'LifecycleEvents', 'ProductInstances')
+
+
+def _clear_instances(conn):
+    cursor = conn.cursor()
+    # Tells Before_Lifecycle_Delete not to copy these rows to LifecycleBackup
+    cursor.execute("SET @archiving = 1")
+    for table in INSTANCE_TABLES:
+        cursor.execute(f"DELETE FROM {table}")
+    cursor.execute("SET @archiving = NULL")
+
+
+def _move_instances(primary):
+    """Copy the primary's instances and events to their shards, then drop them from the primary."""
+    instances = _fetch(primary, "SELECT InstanceID, SerialNumber, ProductID FROM ProductInstances", ())
+    moved = 0
+    for index, batch in group_by_shard(instances, itemgetter('InstanceID')).items():
+        ids = [r['InstanceID'] for r in batch]
+        placeholders = ", ".join(["%s"] * len(ids))
+        events = {
+            table: _fetch(primary, f"SELECT EventID, EventType, EventDate, InstanceID FROM {table} "
+                                   f"WHERE InstanceID IN ({placeholders}) ORDER BY EventDate, EventID", tuple(ids))
+            for table in ('LifecycleEvents', 'LifecycleEventsArchive')
+        }
+        conn = shard_connection(index)
+        try:
+            cursor = conn.cursor()
+            cursor.executemany("INSERT INTO ProductInstances (InstanceID, SerialNumber, ProductID) VALUES (%s, %s, %s)",
+                               [(r['InstanceID'], r['SerialNumber'], r['ProductID']) for r in batch])
+            for table, rows in events.items():
+                # In date order, as Before_Lifecycle_Insert requires
+                cursor.executemany(
+                    f"INSERT INTO {table} (EventID, EventType, EventDate, InstanceID) VALUES (%s, %s, %s, %s)",
+                    [(r['EventID'], r['EventType'], r['EventDate'], r['InstanceID']) for r in rows]
+                )
+            if events['LifecycleEventsArchive']:
+                # Archived instances have no live events to set it
+                cursor.executemany("UPDATE ProductInstances SET CurrentState = %s WHERE InstanceID = %s",
+                                   [(state, i) for i, state in _final_states(events).items()])
+            conn.commit()
+        finally:
+            conn.close()
+        primary.cursor().executemany("INSERT INTO SerialRegistry (SerialNumber, InstanceID) VALUES (%s, %s)",
+                                     [(r['SerialNumber'], r['InstanceID']) for r in batch])
+        moved += len(batch)
+    _clear_instances(primary)
+    primary.commit()
+    return moved
+
+
+def _final_states(events):
+    rows = sorted(events['LifecycleEventsArchive'] + events['LifecycleEvents'],
+                  key=lambda r: (str(r['EventDate']), r['EventID']))
+    return {r['InstanceID']: r['EventType'] for r in rows}
+
+
+def init():
+    """Prepare the primary and fresh shard nodes (created from commands.sql) for sharding."""
+    from migrate import migrate
+
+    shards = get_shards()
+    if not shards:
+        sys.exit("DB_SHARDS is empty")
+    if config.DB_BACKEND == 'mysql':
+        migrate()
+        for shard in shards:
+            migrate(shard.connect)
+
+    primary = get_db_connection()
+    try:
+        cursor = primary.cursor()
+        cursor.execute("SELECT COUNT(*) FROM SerialRegistry")
+        first_run = cursor.fetchone()[0] == 0
+        highest = gather_sum([_fetch(primary, "SELECT COALESCE(MAX(InstanceID), 0) AS m FROM ProductInstances", ())], 'm')
+        cursor.execute("SELECT NextID FROM IdBlocks WHERE Name = 'InstanceID'")
+        if cursor.fetchone() is None:
+            cursor.execute("INSERT INTO IdBlocks (Name, NextID) VALUES ('InstanceID', %s)", (highest + 1,))
+        primary.commit()
+
+        print(f"Catalog rows copied: {sync_catalog(force=True)}")
+        if first_run:
+            # Shards start as copies of commands.sql; their seed instances are the primary's
+            for shard in shards:
+                conn = shard.connect()
+                try:
+                    _clear_instances(conn)
+                    conn.commit()
+                finally:
+                    conn.close()
+            print(f"Instances moved to shards: {_move_instances(primary)}")
+        cursor.callproc('BumpTableVersion', ['ProductInstances'])
+        cursor.callproc('BumpTableVersion', ['LifecycleEvents'])
+        primary.commit()
+    finally:
+        primary.close()
+
+
+def status():
+    shards = get_shards()
+    for shard in shards:
+        conn = shard.connect()
+        try:
+            row = _fetch(conn, f"""
+                SELECT (SELECT COUNT(*) FROM ProductInstances) AS instances,
+                       (SELECT COUNT(*) FROM LifecycleEventsAll) AS events,
+                       (SELECT COUNT(*) FROM ProductInstances
+                        WHERE CRC32(InstanceID) % {len(shards)} <> {shard.index}) AS misplaced
+            """, None)[0]
+        finally:
+            conn.close()
+        print(f"shard {shard.index} {shard.address}: {row['instances']} instances, {row['events']} events, "
+              f"{row['misplaced']} misplaced")
+
+
+if __name__ == '__main__':
+    command = sys.argv[1:2]
+    if command == ['init']:
+        init()
+    elif command == ['sync']:
+        print(f"Catalog rows changed: {sync_catalog(force=True)}")
+    elif command == ['status']:
+        status()
+    else:
+        print(__doc__)
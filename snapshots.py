@@ -0,0 +1,259 @@
+"""Point-in-time fleet state from periodic snapshots.
+
+A snapshot is the state code (lifecycle.STATE_CODES) of every instance that
+had at least one event at a given time, with the time of that event, stored
+as compact arrays in an .npz file under SNAPSHOT_DIR. "How many units were
+in Repair on 2025-03-31?" loads the newest snapshot taken at or before that
+moment and replays only the events between the two, instead of the whole
+log.
+
+    python snapshots.py                    # take any snapshots that are due
+    python snapshots.py verify 2025-03-31  # compare against a full replay
+
+Snapshots are taken every SNAPSHOT_INTERVAL_DAYS, and never closer than
+SNAPSHOT_LAG_HOURS to the present, so most late-arriving events (e.g.
+flushed from a scanner journal) land after the latest snapshot. The rest
+are caught too: a snapshot records the highest EventID it had seen, and
+the replay on top of it also reads older-dated events above that ID. An
+instance's state is that of its latest event by EventDate; the database
+refuses events dated before an instance's latest, but they may still
+predate a snapshot.
+
+With DB_SHARDS set the events are read from every shard in parallel;
+snapshots hold global InstanceIDs and one highest EventID per shard.
+"""
+import glob
+import os
+import sys
+import time
+from datetime import datetime, timedelta
+
+import numpy as np
+
+import config
+from lifecycle import STATES, STATE_CODES
+from shards import get_shards, scatter, scatter_call
+
+FETCH_BATCH_SIZE = 50000
+FILE_PATTERN = 'fleet-*.npz'
+
+
+def _empty():
+    return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int8), np.empty(0, dtype=np.float64)
+
+
+def _snapshot_path(as_of):
+    return os.path.join(config.SNAPSHOT_DIR, f"fleet-{datetime.fromtimestamp(as_of):%Y%m%dT%H%M%S}.npz")
+
+
+def list_snapshots():
+    """[(as_of, path)] sorted by time."""
+    snapshots = []
+    for path in glob.glob(os.path.join(config.SNAPSHOT_DIR, FILE_PATTERN)):
+        stamp = os.path.basename(path)[len('fleet-'):-len('.npz')]
+        snapshots.append((datetime.strptime(stamp, '%Y%m%dT%H%M%S').timestamp(), path))
+    return sorted(snapshots)
+
+
+def source_count():
+    return len(get_shards()) or 1
+
+
+def load_snapshot(path, sources=None):
+    """(as_of, instance_ids, states, times, seen), or None if the snapshot cannot be used.
+
+    seen holds the highest EventID the snapshot includes, one per source.
+    """
+    with np.load(path) as data:
+        if 'seen' not in data.files or (sources is not None and len(data['seen']) != sources):
+            # Written before late events were tracked, or for another shard layout
+            return None
+        return (float(data['as_of']), data['instance_ids'], data['states'], data['times'],
+                [int(s) for s in data['seen']])
+
+
+def save_snapshot(as_of, instance_ids, states, times, seen):
+    os.makedirs(config.SNAPSHOT_DIR, exist_ok=True)
+    path = _snapshot_path(as_of)
+    tmp = path + '.tmp'
+    with open(tmp, 'wb') as f:
+        np.savez(f, as_of=np.float64(as_of), instance_ids=instance_ids.astype(np.int64),
+                 states=states.astype(np.int8), times=times.astype(np.float64),
+                 seen=np.asarray(seen, dtype=np.int64))
+    os.replace(tmp, path)
+    return path
+
+
+def _read_events(cursor, sql, params):
+    cursor.execute(sql, params)
+    ids, codes, stamps = [], [], []
+    while True:
+        batch = cursor.fetchmany(FETCH_BATCH_SIZE)
+        if not batch:
+            break
+        ids.append(np.fromiter((r[0] for r in batch), dtype=np.int64, count=len(batch)))
+        codes.append(np.fromiter((STATE_CODES.get(r[1], 0) for r in batch), dtype=np.int8, count=len(batch)))
+        stamps.append(np.fromiter((float(r[2]) for r in batch), dtype=np.float64, count=len(batch)))
+    return ids, codes, stamps
+
+
+def fetch_events(conn, after, until, seen=None):
+    """Events with EventDate <= until and either EventDate > after or EventID > seen.
+
+    after / seen may be None (from the start of the log / no late events to
+    look for). Returns (instance ids, state codes, unix times, highest
+    EventID before the read); events are in log order.
+    """
+    cursor = conn.cursor()
+    # Taken first, so an event inserted during the read is (at worst) read again next time
+    high = 0
+    for table in ('LifecycleEvents', 'LifecycleEventsArchive'):
+        cursor.execute(f"SELECT COALESCE(MAX(EventID), 0) FROM {table}")
+        high = max(high, int(cursor.fetchone()[0]))
+
+    cursor = conn.cursor(buffered=False)
+    sql = """
+        SELECT InstanceID, EventType, UNIX_TIMESTAMP(EventDate)
+        FROM LifecycleEventsAll
+        WHERE EventDate <= FROM_UNIXTIME(%s)
+    """
+    params = [until]
+    if after is not None:
+        sql += " AND EventDate > FROM_UNIXTIME(%s)"
+        params.append(after)
+    sql += " ORDER BY InstanceID, EventDate, EventID"
+    ids, codes, stamps = _read_events(cursor, sql, tuple(params))
+    if after is not None and seen is not None:
+        # Inserted after the base was taken but dated before it
+        late = _read_events(cursor, """
+            SELECT InstanceID, EventType, UNIX_TIMESTAMP(EventDate)
+            FROM LifecycleEventsAll
+            WHERE EventID > %s AND EventDate <= FROM_UNIXTIME(%s)
+            ORDER BY InstanceID, EventDate, EventID
+        """, (seen, min(after, until)))
+        for parts, more in zip((ids, codes, stamps), late):
+            parts.extend(more)
+    cursor.close()
+    if not ids:
+        return _empty() + (high,)
+    return np.concatenate(ids), np.concatenate(codes), np.concatenate(stamps), high
+
+
+def fetch_fleet_events(after, until, seen=None):
+    """fetch_events from every shard, with `seen` one EventID per shard; returns a list of highest EventIDs."""
+    seen = seen or [None] * source_count()
+    parts = scatter_call(lambda conn, shard_seen: fetch_events(conn, after, until, shard_seen),
+                         args=[(s,) for s in seen])
+    return (np.concatenate([p[0] for p in parts]), np.concatenate([p[1] for p in parts]),
+            np.concatenate([p[2] for p in parts]), [p[3] for p in parts])
+
+
+def replay(instance_ids, states, times, event_ids, event_codes, event_times):
+    """Latest state per instance from a base (e.g. a snapshot) and events read after it.
+
+    An instance's latest entry by time wins; on a tie, the later one in the
+    input (events after the base, in log order) does.
+    Returns (instance_ids, states, times), sorted by instance.
+    """
+    all_ids = np.concatenate([instance_ids, event_ids])
+    all_states = np.concatenate([states, event_codes])
+    all_times = np.concatenate([times, event_times])
+    order = np.lexsort((np.arange(len(all_ids)), all_times, all_ids))
+    all_ids = all_ids[order]
+    last = np.ones(len(all_ids), dtype=bool)
+    last[:-1] = all_ids[1:] != all_ids[:-1]
+    return all_ids[last], all_states[order][last], all_times[order][last]
+
+
+def state_as_of(as_of, use_snapshots=True, fetch=fetch_fleet_events):
+    """(instance_ids, state codes) at `as_of` (unix seconds).
+
+    fetch(after, until, seen) returns events like fetch_fleet_events.
+    """
+    base = None
+    if use_snapshots:
+        for snap_time, path in reversed(list_snapshots()):
+            if snap_time <= as_of:
+                base = load_snapshot(path, source_count())
+                if base is not None:
+                    break
+
+    if base is None:
+        after, seen, (ids, states, times) = None, None, _empty()
+    else:
+        after, ids, states, times, seen = base
+    event_ids, event_codes, event_times, _ = fetch(after, as_of, seen)
+    ids, states, _ = replay(ids, states, times, event_ids, event_codes, event_times)
+    return ids, states
+
+
+def first_event_time():
+    """Unix time of the earliest event on any node, or None for an empty log."""
+    firsts = [r['first'] for rows in scatter("SELECT UNIX_TIMESTAMP(MIN(EventDate)) AS first "
+                                             "FROM LifecycleEventsAll") for r in rows if r['first'] is not None]
+    return float(min(firsts)) if firsts else None
+
+
+def count_states(states):
+    counts = np.bincount(states.astype(np.int64), minlength=len(STATES))
+    return {STATES[c]: int(counts[c]) for c in range(1, len(STATES))}
+
+
+def fleet_state_as_of(as_of):
+    _, states = state_as_of(as_of)
+    return count_states(states)
+
+
+def take_due_snapshots(now=None, fetch=fetch_fleet_events, first_event=first_event_time):
+    """Write every snapshot due since the last one; returns the new paths."""
+    now = time.time() if now is None else now
+    interval = config.SNAPSHOT_INTERVAL_DAYS * 86400
+    horizon = now - config.SNAPSHOT_LAG_HOURS * 3600
+
+    written = []
+    base = None
+    for _, path in reversed(list_snapshots()):
+        base = load_snapshot(path, source_count())
+        if base is not None:
+            break
+    if base is not None:
+        as_of, ids, states, times, seen = base
+    else:
+        first = first_event()
+        if first is None:
+            return written
+        # Unusable older snapshots are overwritten as the chain is rebuilt
+        as_of, seen, (ids, states, times) = first - 1, None, _empty()
+
+    # Each snapshot is built from the previous one, so the log is read once overall
+    while as_of + interval <= horizon:
+        next_as_of = as_of + interval
+        event_ids, event_codes, event_times, seen = fetch(as_of, next_as_of, seen)
+        ids, states, times = replay(ids, states, times, event_ids, event_codes, event_times)
+        written.append(save_snapshot(next_as_of, ids, states, times, seen))
+        as_of = next_as_of
+    return written
+
+
+def verify(as_of):
+    """Check the snapshot-based answer against a full replay of the log."""
+    fast_ids, fast_states = state_as_of(as_of)
+    full_ids, full_states = state_as_of(as_of, use_snapshots=False)
+    return np.array_equal(fast_ids, full_ids) and np.array_equal(fast_states, full_states)
+
+
+def parse_as_of(value):
+    """ISO date or datetime -> unix seconds; a bare date means the end of that day."""
+    moment = datetime.fromisoformat(value)
+    if len(value) <= 10:
+        moment += timedelta(days=1, seconds=-1)
+    return moment.timestamp()
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 2 and sys.argv[1] == 'verify':
+        ok = verify(parse_as_of(sys.argv[2]))
+        print("✅ Snapshot replay matches full replay" if ok else "❌ Snapshot replay differs from full replay")
+        sys.exit(0 if ok else 1)
+    for path in take_due_snapshots():
+        print(f"Snapshot written: {path}")
@@ -0,0 +1,808 @@
+"""In-process SQLite backend (DB_BACKEND=sqlite).
+
+For local runs, benchmarks of the app logic without a network hop, and
+small depot installs without a MySQL server. db.get_db_connection() returns
+a SQLiteConnection here, which speaks the subset of the mysql-connector API
+the app uses: cursor(dictionary=..., buffered=...), %s placeholders,
+callproc() + stored_results(), commit/rollback/close.
+
+commands.sql plus migrations/ is the reference schema. Its pieces are
+reproduced as follows (tests/test_sqlite_schema.py fails when a table,
+column, view, trigger or routine exists on one side only):
+
+    tables, views, seed rows    SCHEMA below + the INSERTs from commands.sql
+    functions                   Python functions registered as SQL functions
+    procedures                  PROCEDURES, run by callproc()
+    simple triggers             SQLite triggers
+    hazard index triggers       queue the touched component in
+                                HazardIndexDirty; the queue is drained
+                                (RefreshHazardIndexFor) after each write
+
+Statements are translated on the way in (placeholders, GROUP_CONCAT ...
+SEPARATOR, FOR UPDATE, SET @var). MySQL-only maintenance (partitions in
+archive.py, index_advisor.py) is not supported.
+"""
+import os
+import re
+import sqlite3
+import threading
+import zlib
+from datetime import date, datetime, timezone
+from decimal import Decimal
+
+import config
+
+SCHEMA_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'commands.sql')
+
+SCHEMA = """
+CREATE TABLE Components (
+  ComponentID VARCHAR(50) PRIMARY KEY,
+  ComponentName VARCHAR(100) NOT NULL
+);
+
+CREATE TABLE Products (
+  ProductID VARCHAR(50) PRIMARY KEY,
+  ModelName VARCHAR(100) NOT NULL,
+  RootComponentID VARCHAR(50) REFERENCES Components(ComponentID)
+);
+
+CREATE TABLE RawMaterials (
+  MaterialID VARCHAR(50) PRIMARY KEY,
+  MaterialName VARCHAR(100) NOT NULL,
+  IsHazardous BOOLEAN DEFAULT 0,
+  RecyclableGrade VARCHAR(20)
+);
+
+CREATE TABLE Suppliers (
+  SupplierID VARCHAR(50) PRIMARY KEY,
+  SupplierName VARCHAR(100) NOT NULL
+);
+
+CREATE TABLE ProductInstances (
+  InstanceID INTEGER PRIMARY KEY AUTOINCREMENT,
+  SerialNumber VARCHAR(100) NOT NULL UNIQUE,
+  ProductID VARCHAR(50) NOT NULL REFERENCES Products(ProductID),
+  CurrentState VARCHAR(50) NOT NULL DEFAULT 'NoEvents'
+);
+
+CREATE TABLE LifecycleTransitions (
+  FromState VARCHAR(50) NOT NULL,
+  EventType VARCHAR(50) NOT NULL,
+  PRIMARY KEY (FromState, EventType)
+);
+
+CREATE TABLE LifecycleEvents (
+  EventID INTEGER PRIMARY KEY AUTOINCREMENT,
+  EventType VARCHAR(50) NOT NULL,
+  EventDate DATETIME NOT NULL,
+  InstanceID INT NOT NULL
+);
+CREATE INDEX idx_le_instance_date ON LifecycleEvents (InstanceID, EventDate);
+
+CREATE TABLE LifecycleEventsArchive (
+  EventID INT PRIMARY KEY,
+  EventType VARCHAR(50) NOT NULL,
+  EventDate DATETIME NOT NULL,
+  InstanceID INT NOT NULL,
+  ArchivedAt DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+CREATE INDEX idx_lea_instance ON LifecycleEventsArchive (InstanceID, EventDate);
+
+CREATE TABLE LifecycleBackup (
+  EventID INT,
+  EventType VARCHAR(50),
+  EventDate DATETIME,
+  InstanceID INT
+);
+
+CREATE VIEW LifecycleEventsAll AS
+  SELECT EventID, EventType, EventDate, InstanceID FROM LifecycleEvents
+  UNION ALL
+  SELECT EventID, EventType, EventDate, InstanceID FROM LifecycleEventsArchive;
+
+CREATE TABLE BillOfMaterial (
+  ParentComponentID VARCHAR(50) NOT NULL REFERENCES Components(ComponentID),
+  ChildComponentID VARCHAR(50) NOT NULL REFERENCES Components(ComponentID),
+  Quantity INT NOT NULL CHECK (Quantity > 0),
+  PRIMARY KEY (ParentComponentID, ChildComponentID)
+);
+
+CREATE TABLE ComponentComposition (
+  ComponentID VARCHAR(50) NOT NULL REFERENCES Components(ComponentID),
+  MaterialID VARCHAR(50) NOT NULL REFERENCES RawMaterials(MaterialID),
+  WeightInGrams DECIMAL(10, 2) NOT NULL CHECK (WeightInGrams > 0),
+  PRIMARY KEY (ComponentID, MaterialID)
+);
+
+CREATE TABLE Sourcing (
+  SourcingID INTEGER PRIMARY KEY AUTOINCREMENT,
+  SupplierID VARCHAR(50) NOT NULL REFERENCES Suppliers(SupplierID),
+  ComponentID VARCHAR(50) REFERENCES Components(ComponentID),
+  MaterialID VARCHAR(50) REFERENCES RawMaterials(MaterialID),
+  CHECK ((ComponentID IS NOT NULL AND MaterialID IS NULL) OR
+         (ComponentID IS NULL AND MaterialID IS NOT NULL))
+);
+
+CREATE TABLE AssemblyHazardIndex (
+  ComponentID VARCHAR(50) PRIMARY KEY REFERENCES Components(ComponentID),
+  HazardousCount INT NOT NULL DEFAULT 0,
+  HazardousWeight DECIMAL(12, 2) NOT NULL DEFAULT 0
+);
+
+/* Components whose hazard index entry is stale ('*' = all) */
+CREATE TABLE HazardIndexDirty (
+  ComponentID VARCHAR(50) PRIMARY KEY
+);
+
+CREATE TABLE JournalApplied (
+  EventUUID CHAR(36) PRIMARY KEY,
+  Rejected BOOLEAN NOT NULL DEFAULT 0,
+  AppliedAt DATETIME NOT NULL DEFAULT (strftime('%Y-%m-%d %H:%M:%S', 'now', 'localtime'))
+);
+CREATE INDEX idx_journal_applied_at ON JournalApplied (AppliedAt);
+
+/* Global instance registry for sharded deployments (shards.py) */
+CREATE TABLE IdBlocks (
+  Name VARCHAR(64) PRIMARY KEY,
+  NextID BIGINT NOT NULL
+);
+
+CREATE TABLE SerialRegistry (
+  SerialNumber VARCHAR(100) PRIMARY KEY,
+  InstanceID INT NOT NULL UNIQUE,
+  RegisteredAt DATETIME NOT NULL DEFAULT (strftime('%Y-%m-%d %H:%M:%S', 'now', 'localtime'))
+);
+
+CREATE TABLE TableVersions (
+  TableName VARCHAR(64) PRIMARY KEY,
+  Version BIGINT NOT NULL DEFAULT 0,
+  UpdatedAt DATETIME(6) NOT NULL
+);
+
+/* Every material of every component in each product's expanded BOM */
+CREATE VIEW ProductMaterialPassport AS
+  WITH RECURSIVE subtree (ProductID, ComponentID) AS (
+    SELECT ProductID, RootComponentID FROM Products WHERE RootComponentID IS NOT NULL
+    UNION
+    SELECT s.ProductID, b.ChildComponentID
+    FROM subtree s JOIN BillOfMaterial b ON b.ParentComponentID = s.ComponentID
+  )
+  SELECT s.ProductID, c.ComponentName, rm.MaterialName, cc.WeightInGrams,
+         rm.RecyclableGrade, rm.IsHazardous
+  FROM subtree s
+  JOIN Components c ON c.ComponentID = s.ComponentID
+  JOIN ComponentComposition cc ON cc.ComponentID = s.ComponentID
+  JOIN RawMaterials rm ON rm.MaterialID = cc.MaterialID;
+
+CREATE TRIGGER Before_Lifecycle_Insert
+BEFORE INSERT ON LifecycleEvents
+BEGIN
+  SELECT RAISE(ABORT, 'Lifecycle event not allowed in the instance''s current state')
+  WHERE NOT EXISTS (
+    SELECT 1 FROM ProductInstances pi
+    JOIN LifecycleTransitions t ON t.FromState = pi.CurrentState AND t.EventType = NEW.EventType
+    WHERE pi.InstanceID = NEW.InstanceID
+  );
+  SELECT RAISE(ABORT, 'Lifecycle event dated before the instance''s latest event')
+  WHERE EXISTS (
+    SELECT 1 FROM LifecycleEvents WHERE InstanceID = NEW.InstanceID AND EventDate > NEW.EventDate
+  );
+END;
+
+CREATE TRIGGER After_Lifecycle_Insert
+AFTER INSERT ON LifecycleEvents
+BEGIN
+  UPDATE ProductInstances SET CurrentState = NEW.EventType WHERE InstanceID = NEW.InstanceID;
+END;
+
+CREATE TRIGGER Before_Hazardous_Material
+BEFORE INSERT ON ComponentComposition
+WHEN NEW.WeightInGrams > 500
+ AND (SELECT IsHazardous FROM RawMaterials WHERE MaterialID = NEW.MaterialID) = 1
+BEGIN
+  SELECT RAISE(ABORT, 'Excessive hazardous material use detected!');
+END;
+
+CREATE TRIGGER Before_Lifecycle_Delete
+BEFORE DELETE ON LifecycleEvents
+WHEN session_var('archiving') IS NULL
+BEGIN
+  INSERT INTO LifecycleBackup (EventID, EventType, EventDate, InstanceID)
+  VALUES (OLD.EventID, OLD.EventType, OLD.EventDate, OLD.InstanceID);
+END;
+
+CREATE TRIGGER After_Composition_Insert AFTER INSERT ON ComponentComposition
+BEGIN
+  INSERT OR IGNORE INTO HazardIndexDirty VALUES (NEW.ComponentID);
+END;
+
+CREATE TRIGGER After_Composition_Update AFTER UPDATE ON ComponentComposition
+BEGIN
+  INSERT OR IGNORE INTO HazardIndexDirty VALUES (NEW.ComponentID);
+  INSERT OR IGNORE INTO HazardIndexDirty VALUES (OLD.ComponentID);
+END;
+
+CREATE TRIGGER After_Composition_Delete AFTER DELETE ON ComponentComposition
+BEGIN
+  INSERT OR IGNORE INTO HazardIndexDirty VALUES (OLD.ComponentID);
+END;
+
+CREATE TRIGGER After_BOM_Insert AFTER INSERT ON BillOfMaterial
+BEGIN
+  INSERT OR IGNORE INTO HazardIndexDirty VALUES (NEW.ParentComponentID);
+END;
+
+CREATE TRIGGER After_BOM_Update AFTER UPDATE ON BillOfMaterial
+BEGIN
+  INSERT OR IGNORE INTO HazardIndexDirty VALUES (NEW.ParentComponentID);
+  INSERT OR IGNORE INTO HazardIndexDirty VALUES (OLD.ParentComponentID);
+END;
+
+CREATE TRIGGER After_BOM_Delete AFTER DELETE ON BillOfMaterial
+BEGIN
+  INSERT OR IGNORE INTO HazardIndexDirty VALUES (OLD.ParentComponentID);
+END;
+
+CREATE TRIGGER After_Material_Hazard_Update AFTER UPDATE ON RawMaterials
+WHEN OLD.IsHazardous IS NOT NEW.IsHazardous
+BEGIN
+  INSERT OR IGNORE INTO HazardIndexDirty VALUES ('*');
+END;
+
+CREATE TABLE ChangeOutbox (
+  ChangeID INTEGER PRIMARY KEY AUTOINCREMENT,
+  EntityType VARCHAR(32) NOT NULL,
+  EntityID VARCHAR(100) NOT NULL,
+  ChangeType VARCHAR(16) NOT NULL,
+  Payload JSON NOT NULL,
+  CreatedAt DATETIME(6) NOT NULL DEFAULT (strftime('%Y-%m-%d %H:%M:%f', 'now', 'localtime')),
+  FeedSeq BIGINT NULL UNIQUE
+);
+
+CREATE TRIGGER Outbox_ProductInstance_Insert AFTER INSERT ON ProductInstances
+BEGIN
+  INSERT INTO ChangeOutbox (EntityType, EntityID, ChangeType, Payload)
+  VALUES ('ProductInstance', NEW.InstanceID, 'insert',
+          json_object('InstanceID', NEW.InstanceID, 'SerialNumber', NEW.SerialNumber, 'ProductID', NEW.ProductID));
+END;
+
+CREATE TRIGGER Outbox_LifecycleEvent_Insert AFTER INSERT ON LifecycleEvents
+BEGIN
+  INSERT INTO ChangeOutbox (EntityType, EntityID, ChangeType, Payload)
+  VALUES ('LifecycleEvent', NEW.EventID, 'insert',
+          json_object('EventID', NEW.EventID, 'InstanceID', NEW.InstanceID, 'EventType', NEW.EventType,
+                      'EventDate', NEW.EventDate));
+END;
+
+CREATE TRIGGER Outbox_Supplier_Insert AFTER INSERT ON Suppliers
+BEGIN
+  INSERT INTO ChangeOutbox (EntityType, EntityID, ChangeType, Payload)
+  VALUES ('Supplier', NEW.SupplierID, 'insert',
+          json_object('SupplierID', NEW.SupplierID, 'SupplierName', NEW.SupplierName));
+END;
+
+CREATE TRIGGER Outbox_Sourcing_Insert AFTER INSERT ON Sourcing
+BEGIN
+  INSERT INTO ChangeOutbox (EntityType, EntityID, ChangeType, Payload)
+  VALUES ('Sourcing', NEW.SourcingID, 'insert',
+          json_object('SourcingID', NEW.SourcingID, 'SupplierID', NEW.SupplierID,
+                      'ComponentID', NEW.ComponentID, 'MaterialID', NEW.MaterialID));
+END;
+
+CREATE TRIGGER Outbox_Composition_Insert AFTER INSERT ON ComponentComposition
+BEGIN
+  INSERT INTO ChangeOutbox (EntityType, EntityID, ChangeType, Payload)
+  VALUES ('ComponentComposition', NEW.ComponentID || '/' || NEW.MaterialID, 'insert',
+          json_object('ComponentID', NEW.ComponentID, 'MaterialID', NEW.MaterialID,
+                      'WeightInGrams', NEW.WeightInGrams));
+END;
+"""
+
+
+class SignalError(sqlite3.DatabaseError):
+    """A procedure rejected its input (SIGNAL SQLSTATE '45000' in MySQL)."""
+
+
+# -------------------------
+# 1) TYPES
+# -------------------------
+def _parse_datetime(value):
+    return datetime.fromisoformat(value.decode('utf-8'))
+
+
+sqlite3.register_adapter(datetime, lambda d: d.isoformat(' '))
+sqlite3.register_adapter(date, lambda d: d.isoformat())
+sqlite3.register_adapter(Decimal, str)
+sqlite3.register_converter('DATETIME', _parse_datetime)
+sqlite3.register_converter('DATE', lambda v: _parse_datetime(v).date())
+sqlite3.register_converter('DECIMAL', lambda v: Decimal(v.decode('utf-8')))
+
+
+# -------------------------
+# 2) MYSQL BUILT-INS
+# -------------------------
+def _to_datetime(value):
+    if value is None or isinstance(value, datetime):
+        return value
+    return datetime.fromisoformat(str(value))
+
+
+def _now():
+    return datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+
+
+def _utc_timestamp(precision=0):
+    return datetime.now(timezone.utc).replace(tzinfo=None).isoformat(' ')
+
+
+def _curdate():
+    return date.today().isoformat()
+
+
+def _datediff(a, b):
+    if a is None or b is None:
+        return None
+    return (_to_datetime(a).date() - _to_datetime(b).date()).days
+
+
+def _unix_timestamp(value=None):
+    if value is None:
+        return datetime.now().timestamp()
+    return _to_datetime(value).timestamp()
+
+
+def _from_unixtime(seconds):
+    return None if seconds is None else datetime.fromtimestamp(float(seconds)).strftime('%Y-%m-%d %H:%M:%S')
+
+
+# MySQL DATE_FORMAT specifiers used by the app -> strftime
+_DATE_FORMAT = {'%i': '%M', '%s': '%S', '%h': '%I', '%p': '%p', '%Y': '%Y', '%m': '%m',
+                '%d': '%d', '%H': '%H', '%y': '%y', '%b': '%b', '%M': '%B'}
+
+
+def _date_format(value, fmt):
+    if value is None:
+        return None
+    return _to_datetime(value).strftime(re.sub(r'%\w', lambda m: _DATE_FORMAT.get(m.group(0), m.group(0)), fmt))
+
+
+def _concat(*parts):
+    if any(p is None for p in parts):
+        return None
+    return ''.join(str(p) for p in parts)
+
+
+def _crc32(value):
+    # MySQL's CRC32() hashes the value's string form (shards.shard_for relies on it)
+    return None if value is None else zlib.crc32(str(value).encode('utf-8'))
+
+
+# -------------------------
+# 3) STATEMENT TRANSLATION
+# -------------------------
+_GROUP_CONCAT = re.compile(r"GROUP_CONCAT\((.*?)\s+SEPARATOR\s+('[^']*')\)", re.IGNORECASE | re.DOTALL)
+_FOR_UPDATE = re.compile(r'\s+FOR\s+UPDATE\s*$', re.IGNORECASE)
+_SET_VARIABLE = re.compile(r'^\s*SET\s+@(\w+)\s*=\s*(.+?)\s*;?\s*$', re.IGNORECASE)
+_translated = {}
+
+
+def translate(sql):
+    """MySQL statement -> (SQLite statement, needs write lock)."""
+    result = _translated.get(sql)
+    if result is None:
+        out = _GROUP_CONCAT.sub(r'group_concat(\1, \2)', sql)
+        locking = bool(_FOR_UPDATE.search(out))
+        out = _FOR_UPDATE.sub('', out)
+        out = out.replace('%s', '?').replace('%%', '%')
+        result = _translated[sql] = (out, locking)
+    return result
+
+
+# -------------------------
+# 4) STORED FUNCTIONS
+# -------------------------
+def _scalar(conn, sql, params=()):
+    row = conn.execute(sql, params).fetchone()
+    return row[0] if row else None
+
+
+def _functions(conn):
+    def get_component_weight(comp_id):
+        total = _scalar(conn, "SELECT SUM(WeightInGrams) FROM ComponentComposition WHERE ComponentID = ?", (comp_id,))
+        return float(total or 0)
+
+    def get_product_total_components(parent):
+        return _scalar(conn, "SELECT COUNT(*) FROM BillOfMaterial WHERE ParentComponentID = ?", (parent,)) or 0
+
+    def is_material_hazardous(mat_id):
+        return bool(_scalar(conn, "SELECT IsHazardous FROM RawMaterials WHERE MaterialID = ?", (mat_id,)))
+
+    def get_supplier_type(supp_id):
+        comp = _scalar(conn, "SELECT COUNT(*) FROM Sourcing WHERE SupplierID = ? AND ComponentID IS NOT NULL", (supp_id,))
+        mat = _scalar(conn, "SELECT COUNT(*) FROM Sourcing WHERE SupplierID = ? AND MaterialID IS NOT NULL", (supp_id,))
+        if comp and mat:
+            return 'Both'
+        if comp:
+            return 'Component Supplier'
+        if mat:
+            return 'Material Supplier'
+        return 'Unknown'
+
+    def get_recyclable_score(grade):
+        return {'A': 4, 'B': 3, 'C': 2, 'D': 1}.get(grade, 0)
+
+    def get_lifecycle_age(inst_id):
+        manufactured = _scalar(conn, """
+            SELECT EventDate FROM LifecycleEventsAll
+            WHERE InstanceID = ? AND EventType = 'Manufactured'
+            ORDER BY EventDate LIMIT 1
+        """, (inst_id,))
+        return _datediff(_curdate(), manufactured)
+
+    def sublist(parent, expression):
+        return _scalar(conn, f"""
+            SELECT group_concat({expression}, ', ')
+            FROM BillOfMaterial b JOIN Components c ON b.ChildComponentID = c.ComponentID
+            WHERE b.ParentComponentID = ?
+        """, (parent,))
+
+    def get_component_details(parent):
+        return sublist(parent, 'c.ComponentName') or 'No subcomponents'
+
+    def get_component_summary(parent):
+        total = get_product_total_components(parent)
+        names = sublist(parent, "c.ComponentName || ' (x' || b.Quantity || ')'")
+        return f"{total} subcomponents: {names or 'No subcomponents'}"
+
+    return {
+        'GetComponentWeight': get_component_weight,
+        'GetProductTotalComponents': get_product_total_components,
+        'IsMaterialHazardous': is_material_hazardous,
+        'GetSupplierType': get_supplier_type,
+        'GetRecyclableScore': get_recyclable_score,
+        'GetLifecycleAge': get_lifecycle_age,
+        'GetComponentDetails': get_component_details,
+        'GetComponentSummary': get_component_summary,
+    }
+
+
+# -------------------------
+# 5) STORED PROCEDURES
+# -------------------------
+# Each takes (conn, *args) and returns a list of (description, rows) result sets.
+_HAZARD_SELECT = """
+  SELECT s.RootID,
+         COUNT(CASE WHEN rm.IsHazardous = 1 THEN 1 END),
+         COALESCE(SUM(CASE WHEN rm.IsHazardous = 1 THEN cc.WeightInGrams * s.Multiplier END), 0)
+  FROM subtree s
+  LEFT JOIN ComponentComposition cc ON cc.ComponentID = s.ComponentID
+  LEFT JOIN RawMaterials rm ON rm.MaterialID = cc.MaterialID
+  GROUP BY s.RootID
+"""
+
+
+def bump_table_version(conn, table):
+    conn.execute("""
+        INSERT INTO TableVersions (TableName, Version, UpdatedAt) VALUES (?, 1, ?)
+        ON CONFLICT (TableName) DO UPDATE SET Version = Version + 1, UpdatedAt = excluded.UpdatedAt
+    """, (table, _utc_timestamp()))
+    return []
+
+
+def add_lifecycle_event(conn, instance_id, event_type):
+    conn.execute("INSERT INTO LifecycleEvents (EventType, EventDate, InstanceID) VALUES (?, ?, ?)",
+                 (event_type, _now(), instance_id))
+    return bump_table_version(conn, 'LifecycleEvents')
+
+
+def register_product_instance(conn, serial, product_id):
+    cursor = conn.execute("INSERT INTO ProductInstances (SerialNumber, ProductID) VALUES (?, ?)",
+                          (serial, product_id))
+    add_lifecycle_event(conn, cursor.lastrowid, 'Manufactured')
+    return bump_table_version(conn, 'ProductInstances')
+
+
+def refresh_hazard_index_for(conn, component_id):
+    conn.execute(f"""
+        WITH RECURSIVE ancestors (ComponentID) AS (
+          SELECT ?
+          UNION
+          SELECT b.ParentComponentID
+          FROM BillOfMaterial b JOIN ancestors a ON b.ChildComponentID = a.ComponentID
+        ),
+        subtree (RootID, ComponentID, Multiplier) AS (
+          SELECT ComponentID, ComponentID, 1 FROM ancestors
+          UNION ALL
+          SELECT s.RootID, b.ChildComponentID, s.Multiplier * b.Quantity
+          FROM subtree s JOIN BillOfMaterial b ON b.ParentComponentID = s.ComponentID
+        )
+        REPLACE INTO AssemblyHazardIndex (ComponentID, HazardousCount, HazardousWeight)
+        {_HAZARD_SELECT}
+    """, (component_id,))
+    return []
+
+
+def refresh_hazard_index(conn):
+    conn.execute(f"""
+        WITH RECURSIVE subtree (RootID, ComponentID, Multiplier) AS (
+          SELECT ComponentID, ComponentID, 1 FROM Components
+          UNION ALL
+          SELECT s.RootID, b.ChildComponentID, s.Multiplier * b.Quantity
+          FROM subtree s JOIN BillOfMaterial b ON b.ParentComponentID = s.ComponentID
+        )
+        REPLACE INTO AssemblyHazardIndex (ComponentID, HazardousCount, HazardousWeight)
+        {_HAZARD_SELECT}
+    """)
+    return []
+
+
+def recycle_product(conn, instance_id):
+    count = _scalar(conn, """
+        SELECT COALESCE(h.HazardousCount, 0)
+        FROM ProductInstances pi
+        JOIN Products p ON p.ProductID = pi.ProductID
+        LEFT JOIN AssemblyHazardIndex h ON h.ComponentID = p.RootComponentID
+        WHERE pi.InstanceID = ?
+    """, (instance_id,))
+    event_type = 'Recycled_Hazardous' if count else 'Recycled'
+    conn.execute("INSERT INTO LifecycleEvents (EventType, EventDate, InstanceID) VALUES (?, ?, ?)",
+                 (event_type, _now(), instance_id))
+    return bump_table_version(conn, 'LifecycleEvents')
+
+
+def _result(conn, sql, params=()):
+    cursor = conn.execute(sql, params)
+    return [(cursor.description, cursor.fetchall())]
+
+
+def get_product_trace(conn, product_id):
+    # Same (unfiltered) statement as the MySQL procedure
+    return _result(conn, """
+        SELECT c.ComponentName, rm.MaterialName, cc.WeightInGrams, rm.RecyclableGrade
+        FROM Components c
+        JOIN BillOfMaterial bom ON bom.ChildComponentID = c.ComponentID
+        JOIN ComponentComposition cc ON cc.ComponentID = c.ComponentID
+        JOIN RawMaterials rm ON rm.MaterialID = cc.MaterialID
+    """)
+
+
+def add_new_supplier(conn, supplier_id, name):
+    conn.execute("INSERT INTO Suppliers (SupplierID, SupplierName) VALUES (?, ?)", (supplier_id, name))
+    return bump_table_version(conn, 'Suppliers')
+
+
+def get_supplier_summary(conn, supplier_id):
+    return _result(conn, """
+        SELECT SupplierName, ComponentID, MaterialID
+        FROM Sourcing JOIN Suppliers USING (SupplierID)
+        WHERE SupplierID = ?
+    """, (supplier_id,))
+
+
+def add_material_composition(conn, component_id, material_id, weight):
+    if weight is None or Decimal(str(weight)) <= 0:
+        raise SignalError('Invalid weight value')
+    conn.execute("INSERT INTO ComponentComposition (ComponentID, MaterialID, WeightInGrams) VALUES (?, ?, ?)",
+                 (component_id, material_id, str(Decimal(str(weight)))))
+    return bump_table_version(conn, 'ComponentComposition')
+
+
+def get_lifecycle_report(conn, instance_id):
+    return _result(conn, """
+        SELECT EventType, DATE_FORMAT(EventDate, '%Y-%m-%d %H:%i') AS EventTime
+        FROM LifecycleEventsAll
+        WHERE InstanceID = ?
+        ORDER BY EventDate
+    """, (instance_id,))
+
+
+PROCEDURES = {
+    'BumpTableVersion': bump_table_version,
+    'RegisterProductInstance': register_product_instance,
+    'AddLifecycleEvent': add_lifecycle_event,
+    'RefreshHazardIndexFor': refresh_hazard_index_for,
+    'RefreshHazardIndex': refresh_hazard_index,
+    'RecycleProduct': recycle_product,
+    'GetProductTrace': get_product_trace,
+    'AddNewSupplier': add_new_supplier,
+    'GetSupplierSummary': get_supplier_summary,
+    'AddMaterialComposition': add_material_composition,
+    'GetLifecycleReport': get_lifecycle_report,
+}
+
+
+def drain_hazard_queue(conn):
+    """Run RefreshHazardIndexFor for every component the triggers queued."""
+    dirty = [r[0] for r in conn.execute("SELECT ComponentID FROM HazardIndexDirty").fetchall()]
+    if not dirty:
+        return
+    if '*' in dirty:
+        refresh_hazard_index(conn)
+    else:
+        for component_id in dirty:
+            refresh_hazard_index_for(conn, component_id)
+    conn.execute("DELETE FROM HazardIndexDirty")
+
+
+# -------------------------
+# 6) CONNECTION / CURSOR
+# -------------------------
+class StoredResult:
+
+    def __init__(self, description, rows, dictionary):
+        self.description = description
+        self.column_names = tuple(d[0] for d in description or ())
+        self._rows = [dict(zip(self.column_names, r)) for r in rows] if dictionary else rows
+
+    def fetchall(self):
+        return self._rows
+
+
+class SQLiteCursor:
+
+    def __init__(self, connection, dictionary=False):
+        self.connection = connection
+        self.dictionary = dictionary
+        self._cursor = connection.raw.cursor()
+        self._results = []
+
+    @property
+    def description(self):
+        return self._cursor.description
+
+    @property
+    def column_names(self):
+        return tuple(d[0] for d in self._cursor.description or ())
+
+    @property
+    def lastrowid(self):
+        return self._cursor.lastrowid
+
+    @property
+    def rowcount(self):
+        return self._cursor.rowcount
+
+    def _row(self, row):
+        if row is None or not self.dictionary:
+            return row
+        return dict(zip(self.column_names, row))
+
+    def execute(self, sql, params=()):
+        match = _SET_VARIABLE.match(sql)
+        if match:
+            name, value = match.groups()
+            self.connection.variables[name] = None if value.upper() == 'NULL' else value.strip("'")
+            return
+        statement, locking = translate(sql)
+        if locking:
+            self.connection.lock_for_write()
+        before = self.connection.raw.total_changes
+        self._cursor.execute(statement, tuple(params or ()))
+        if self.connection.raw.total_changes != before:
+            drain_hazard_queue(self.connection.raw)
+
+    def executemany(self, sql, seq_params):
+        statement, _ = translate(sql)
+        self._cursor.executemany(statement, [tuple(p) for p in seq_params])
+        drain_hazard_queue(self.connection.raw)
+
+    def callproc(self, name, args=()):
+        try:
+            procedure = PROCEDURES[name]
+        except KeyError:
+            raise sqlite3.OperationalError(f"PROCEDURE {name} does not exist")
+        self._results = [StoredResult(d, rows, self.dictionary) for d, rows in procedure(self.connection.raw, *args)]
+        drain_hazard_queue(self.connection.raw)
+        return args
+
+    def stored_results(self):
+        return iter(self._results)
+
+    def fetchone(self):
+        return self._row(self._cursor.fetchone())
+
+    def fetchmany(self, size=1):
+        return [self._row(r) for r in self._cursor.fetchmany(size)]
+
+    def fetchall(self):
+        return [self._row(r) for r in self._cursor.fetchall()]
+
+    def __iter__(self):
+        return iter(self.fetchall())
+
+    def close(self):
+        self._cursor.close()
+
+
+class SQLiteConnection:
+
+    def __init__(self, raw):
+        self.raw = raw
+        self.variables = {}
+        raw.create_function('session_var', 1, self.variables.get)
+
+    def cursor(self, dictionary=False, buffered=None):
+        # Every SQLite cursor is effectively unbuffered; `buffered` is accepted for compatibility
+        return SQLiteCursor(self, dictionary=dictionary)
+
+    def lock_for_write(self):
+        """SELECT ... FOR UPDATE: take the database write lock for this transaction."""
+        if not self.raw.in_transaction:
+            self.raw.execute("BEGIN IMMEDIATE")
+
+    def commit(self):
+        self.raw.commit()
+
+    def rollback(self):
+        self.raw.rollback()
+
+    def close(self):
+        self.raw.rollback()
+        self.raw.close()
+
+
+# -------------------------
+# 7) SETUP
+# -------------------------
+_setup_lock = threading.Lock()
+_memory_anchor = None
+_memory_pid = None
+
+
+def _database_uri(path):
+    if path == ':memory:':
+        # One shared in-memory database per process, alive while the anchor is open
+        return f"file:splm-{os.getpid()}?mode=memory&cache=shared"
+    return f"file:{path}"
+
+
+def _open(path):
+    raw = sqlite3.connect(_database_uri(path), uri=True, timeout=30,
+                          detect_types=sqlite3.PARSE_DECLTYPES, check_same_thread=False)
+    raw.execute("PRAGMA foreign_keys = ON")
+    raw.execute("PRAGMA journal_mode = WAL")
+    for name, func in [('NOW', _now), ('CURDATE', _curdate), ('DATEDIFF', _datediff),
+                       ('UNIX_TIMESTAMP', _unix_timestamp), ('FROM_UNIXTIME', _from_unixtime),
+                       ('DATE_FORMAT', _date_format), ('CONCAT', _concat), ('CRC32', _crc32),
+                       # Writers are already serialized by SQLite's write lock (FOR UPDATE
+                       # takes it), so named locks always succeed
+                       ('GET_LOCK', lambda *args: 1), ('RELEASE_LOCK', lambda *args: 1)]:
+        raw.create_function(name, -1, func)
+    raw.create_function('UTC_TIMESTAMP', -1, _utc_timestamp)
+    for name, func in _functions(raw).items():
+        raw.create_function(name, 1, func)
+    return raw
+
+
+def seed_statements(schema_path=SCHEMA_PATH):
+    """The seed INSERTs of commands.sql (between the data section and the functions)."""
+    text = open(schema_path, encoding='utf-8').read()
+    data = text.split('DATA INSERTION SECTION', 1)[1].split('FUNCTIONS', 1)[0]
+    return re.findall(r'INSERT INTO .*?;', data, re.DOTALL)
+
+
+def create_schema(raw):
+    raw.executescript(SCHEMA)
+    for stmt in seed_statements():
+        raw.execute(stmt)
+    drain_hazard_queue(raw)
+    # As with MySQL, the feed starts after the seed data
+    raw.execute("DELETE FROM ChangeOutbox")
+    raw.commit()
+
+
+def connect(path=None):
+    """A new connection to `path` (DB_SQLITE_PATH by default); creates and seeds the schema on first use."""
+    global _memory_anchor, _memory_pid
+    path = path or config.DB_SQLITE_PATH
+    raw = _open(path)
+    with _setup_lock:
+        if path == ':memory:' and _memory_pid != os.getpid():
+            _memory_anchor, _memory_pid = raw, os.getpid()
+            raw = _open(path)
+        exists = raw.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'ProductInstances'"
+        ).fetchone()
+        if not exists:
+            create_schema(raw)
+    return SQLiteConnection(raw)
@@ -0,0 +1,176 @@
+"""Incremental page rendering for views with large tables.
+
+A view opens a StreamGroup on its connection and passes group.query(...)
+results to the template instead of fetchall() lists. render_page() then
+streams the response: the layout goes out first, and each table's rows are
+fetched in STREAM_BATCH_SIZE batches from an unbuffered cursor while the
+template loop consumes them, so neither the rows nor the HTML are ever
+held in full.
+
+    group = StreamGroup(conn)
+    rows = group.query("SELECT ... FROM Sourcing ...")
+    return render_page(group, 'suppliers.html', sourcing=rows)
+
+A RowStream supports `{% if rows %}` (it peeks at the first batch) and one
+`{% for %}` pass; after that, `{% if rows %}` still reflects whether there
+were any rows. One connection can only read one unbuffered result at a
+time, so if the template starts a second stream before finishing the
+first, the rest of the first is buffered.
+
+The connection stays checked out until the last byte is sent; render_page()
+closes it then, or when the client goes away mid-page (dropping it, rather
+than reading the rest of a result nobody will see). Pass conn= to query()
+(or adopt() it) to read from another connection, e.g. an instance's shard;
+the group closes that one too.
+
+With STREAM_TEMPLATES=0, query() runs the query immediately and returns
+a plain list, and render_page() renders the whole page before sending it.
+
+init_app() also points Jinja at a bytecode cache in JINJA_CACHE_DIR, so a
+fresh worker loads compiled templates instead of parsing and compiling
+every template on its first request.
+"""
+import os
+from collections import deque
+
+from flask import Response, current_app, get_flashed_messages, render_template, stream_with_context
+from jinja2 import FileSystemBytecodeCache
+
+import config
+from db import discard_connection
+from repository import Query, fetch_all
+
+
+class RowStream:
+
+    def __init__(self, group, conn, sql, params, make=None):
+        self.group = group
+        self.conn = conn
+        self.sql = sql
+        self.params = params
+        self.make = make
+        self.count = 0
+        self._cursor = None
+        self._buffer = deque()
+        self._started = False
+        self._done = False
+
+    def _start(self):
+        if self._started:
+            return
+        self._started = True
+        self.group.activate(self)
+        self._cursor = self.conn.cursor(dictionary=self.make is None, buffered=False)
+        self._cursor.execute(self.sql, self.params)
+
+    def _fill(self):
+        batch = self._cursor.fetchmany(config.STREAM_BATCH_SIZE)
+        if batch and self.make is not None:
+            batch = [self.make(r) for r in batch]
+        if batch:
+            self._buffer.extend(batch)
+            self.count += len(batch)
+        else:
+            self._done = True
+            self._cursor.close()
+
+    def drain(self):
+        """Buffer everything not yet read, freeing the connection for another query."""
+        while not self._done:
+            self._fill()
+
+    @property
+    def pending(self):
+        """True while the server still has rows of this stream to send."""
+        return self._started and not self._done
+
+    def __bool__(self):
+        self._start()
+        if not self._buffer and not self._done:
+            self._fill()
+        return self.count > 0
+
+    def __iter__(self):
+        self._start()
+        while True:
+            while self._buffer:
+                yield self._buffer.popleft()
+            if self._done:
+                return
+            self._fill()
+
+
+class StreamGroup:
+    """The RowStreams of one page, on the view's connection and any it adopts."""
+
+    def __init__(self, conn):
+        self.conn = conn
+        self.connections = [conn]
+        self.active = {}
+
+    def adopt(self, conn):
+        """Have the group close `conn` (e.g. a shard connection) with the page; returns it."""
+        if not any(c is conn for c in self.connections):
+            self.connections.append(conn)
+        return conn
+
+    def query(self, sql, params=(), conn=None):
+        """Rows of `sql` (a string, for dict rows, or a repository.Query)."""
+        conn = self.adopt(conn) if conn is not None else self.conn
+        if isinstance(sql, Query):
+            if not config.STREAM_TEMPLATES:
+                return fetch_all(conn, sql, params)
+            # Streamed over the text protocol: an unbuffered result would tie up the prepared statement
+            return RowStream(self, conn, sql.sql, params, sql.row._make)
+        if not config.STREAM_TEMPLATES:
+            cursor = conn.cursor(dictionary=True)
+            cursor.execute(sql, params)
+            return cursor.fetchall()
+        return RowStream(self, conn, sql, params)
+
+    def activate(self, stream):
+        active = self.active.get(id(stream.conn))
+        if active is not None and active is not stream:
+            active.drain()
+        self.active[id(stream.conn)] = stream
+
+    def close(self):
+        # A connection left mid-result (the page was abandoned) is dropped, not read to the end
+        unfinished = {key for key, stream in self.active.items() if stream.pending}
+        for conn in self.connections:
+            if id(conn) in unfinished:
+                discard_connection(conn)
+            else:
+                conn.close()
+
+
+def render_page(group, template_name, **context):
+    """Render `template_name` (streamed unless STREAM_TEMPLATES=0), then close the group's connections."""
+    if not config.STREAM_TEMPLATES:
+        try:
+            return render_template(template_name, **context)
+        finally:
+            group.close()
+
+    # The session cookie is written before the body: pop the flashes now so
+    # they are not shown again on the next page
+    get_flashed_messages()
+    app = current_app._get_current_object()
+    app.update_template_context(context)
+    stream = app.jinja_env.get_template(template_name).stream(context)
+    # Send a few KB at a time rather than one chunk per template expression
+    stream.enable_buffering(config.STREAM_BUFFER_ITEMS)
+
+    def generate():
+        try:
+            yield from stream
+        finally:
+            group.close()
+
+    return Response(stream_with_context(generate()), mimetype='text/html')
+
+
+def init_app(app):
+    if config.JINJA_CACHE_DIR:
+        os.makedirs(config.JINJA_CACHE_DIR, exist_ok=True)
+        app.jinja_env.bytecode_cache = FileSystemBytecodeCache(config.JINJA_CACHE_DIR)
@@ -0,0 +1,13 @@
+import os
+import sys
+import tempfile
+
+# Point the app at a throwaway SQLite database before config is imported
+_directory = tempfile.mkdtemp(prefix='splm-tests-')
+os.environ.setdefault('DB_BACKEND', 'sqlite')
+os.environ.setdefault('DB_SQLITE_PATH', os.path.join(_directory, 'test.sqlite3'))
+os.environ.setdefault('CATALOG_SNAPSHOT_PATH', '')
+os.environ.setdefault('SEARCH_SNAPSHOT_PATH', '')
+os.environ.setdefault('CACHE_ENABLED', '0')
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,57 @@
+import numpy as np
+
+import analytics
+from lifecycle import STATE_CODES
+
+
+def arrays(instances, events):
+    """load_event_arrays-style dict from {instance: product} and [(instance, code, ts)] in log order."""
+    instance_ids = np.array(sorted(instances), dtype=np.int64)
+    products, product_of = np.unique(np.array([instances[i] for i in instance_ids], dtype=str), return_inverse=True)
+    events = sorted(events, key=lambda e: (e[0], e[2]))
+    return {
+        'instance_ids': instance_ids,
+        'products': products,
+        'product_of': product_of,
+        'inst': np.searchsorted(instance_ids, np.array([e[0] for e in events], dtype=np.int64)),
+        'code': np.array([e[1] for e in events], dtype=np.int8),
+        'ts': np.array([e[2] for e in events], dtype=np.float64),
+    }
+
+
+def test_merge_event_arrays_matches_one_database():
+    instances = {1: 'P100', 2: 'P200', 3: 'P100', 4: 'P300'}
+    events = [(1, 1, 10.0), (1, 2, 20.0), (2, 1, 5.0), (3, 1, 7.0), (3, 3, 9.0), (4, 1, 1.0), (2, 5, 30.0)]
+    # Shards split instances by CRC32; any disjoint split will do here
+    shard_a = arrays({i: p for i, p in instances.items() if i % 2}, [e for e in events if e[0] % 2])
+    shard_b = arrays({i: p for i, p in instances.items() if not i % 2}, [e for e in events if not e[0] % 2])
+
+    merged = analytics.merge_event_arrays([shard_b, shard_a])
+    whole = arrays(instances, events)
+    for key in whole:
+        np.testing.assert_array_equal(merged[key], whole[key], err_msg=key)
+
+
+def test_kaplan_meier_fixed_input():
+    # Units followed 2, 3, 3, 5 and 7 days; the second 3-day and the 7-day unit are still in service
+    durations = np.array([5.0, 3.0, 2.0, 7.0, 3.0])
+    observed = np.array([True, True, True, False, False])
+    times, survival = analytics.kaplan_meier(durations, observed)
+    # At risk 5, 4, 2: S = 4/5, then * 3/4, then * 1/2; no drop at the censored 7
+    np.testing.assert_allclose(times, [2.0, 3.0, 5.0])
+    np.testing.assert_allclose(survival, [0.8, 0.6, 0.3])
+
+    times, survival = analytics.kaplan_meier(np.empty(0), np.empty(0, dtype=bool))
+    assert len(times) == 0 and len(survival) == 0
+
+
+def test_time_in_state_fixed_input():
+    day = analytics.SECONDS_PER_DAY
+    code = STATE_CODES
+    data = arrays({1: 'P100', 2: 'P200'}, [
+        (1, code['Manufactured'], 0.0), (1, code['Sold'], 2 * day), (1, code['Repair'], 5 * day),
+        (1, code['Recycled'], 6 * day),
+        (2, code['Manufactured'], 1 * day), (2, code['Sold'], 4 * day),
+    ])
+    # Instance 2 is still Sold at `now`; the terminal Recycled state is not counted
+    assert analytics.time_in_state(data, now=10 * day) == {'Manufactured': 2.5, 'Sold': 4.5, 'Repair': 1.0}
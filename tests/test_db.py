@@ -0,0 +1,142 @@
+import mysql.connector
+from mysql.connector.abstracts import MySQLConnectionAbstract
+import pytest
+
+import config
+import db
+
+A = '3e11fa47-71ca-11e1-9e33-c80aa9429562'
+B = '4a6b1c2d-0000-11e1-9e33-c80aa9429562'
+
+
+def test_parse_gtid_set():
+    assert db.parse_gtid_set(f"{A}:1-5:7,\n{B.upper()}:3") == {A: [(1, 5), (7, 7)], B: [(3, 3)]}
+    assert db.parse_gtid_set(f"{A}:1-3:batch:1-2") == {A: [(1, 3)], f"{A}:batch": [(1, 2)]}
+    assert db.parse_gtid_set('') == {} and db.parse_gtid_set(None) == {}
+
+
+@pytest.mark.parametrize('needed, executed, expected', [
+    (f"{A}:1-5", f"{A}:1-10", True),
+    (f"{A}:1-5,{B}:2", f"{A}:1-10,{B}:1-2", True),
+    (f"{A}:6", f"{A}:1-5:7-9", False),
+    (f"{A}:1-5", f"{B}:1-10", False),
+    ('', f"{A}:1-5", True),
+])
+def test_gtid_subset(needed, executed, expected):
+    assert db.gtid_subset(db.parse_gtid_set(needed), db.parse_gtid_set(executed)) is expected
+
+
+class FakeConnection:
+
+    def close(self):
+        pass
+
+
+class FakeReplica(db.Replica):
+
+    def __init__(self, index, executed, lag=0.0, live_answer=False):
+        super().__init__(index, 'replica', 3306)
+        self.lag = lag
+        self.executed = db.parse_gtid_set(executed)
+        self.live_answer = live_answer
+        self.asked = 0
+
+    def connect(self):
+        return FakeConnection()
+
+    def has_executed(self, conn, after):
+        self.asked += 1
+        return self.live_answer
+
+
+@pytest.fixture
+def replicas(monkeypatch):
+    primary = FakeConnection()
+    fleet = []
+    monkeypatch.setattr(config, 'DB_BACKEND', 'mysql')
+    monkeypatch.setattr(db, 'get_replicas', lambda: fleet)
+    monkeypatch.setattr(db, '_refresh_lag', lambda replicas: None)
+    monkeypatch.setattr(db, 'get_db_connection', lambda: primary)
+    return fleet, primary
+
+
+def test_read_goes_to_a_replica_that_has_the_write(replicas):
+    fleet, primary = replicas
+    behind, caught_up = FakeReplica(0, f"{A}:1-4"), FakeReplica(1, f"{A}:1-5")
+    fleet += [behind, caught_up]
+    conn = db.get_read_connection(after=f"{A}:1-5")
+    assert conn._replica is caught_up and behind.asked == 0
+    conn.close()
+    assert caught_up.outstanding == 0
+
+
+def test_unknown_replica_state_is_asked_then_primary(replicas):
+    fleet, primary = replicas
+    stale = FakeReplica(0, f"{A}:1-4")
+    fleet.append(stale)
+    assert db.get_read_connection(after=f"{A}:1-5") is primary
+    assert stale.asked == 1 and stale.outstanding == 0
+    stale.live_answer = True
+    assert db.get_read_connection(after=f"{A}:1-5")._replica is stale
+
+
+def test_lagging_replica_is_skipped(replicas):
+    fleet, primary = replicas
+    fleet.append(FakeReplica(0, f"{A}:1-5", lag=config.DB_REPLICA_MAX_LAG + 1))
+    assert db.get_read_connection() is primary
+
+
+class FakeMySQLConnection(MySQLConnectionAbstract):
+    """A connection in the middle of an unbuffered result."""
+
+    server_host = 'db1'
+    server_port = 3307
+    connection_id = 42
+
+    def __init__(self):
+        self.executed = []
+        self.closed = False
+        self.unread_result = True
+
+    def cursor(self, **kwargs):
+        return self
+
+    def execute(self, sql, params=()):
+        self.executed.append((sql, params))
+
+    def close(self):
+        self.closed = True
+
+
+FakeMySQLConnection.__abstractmethods__ = frozenset()
+
+
+class FakePooledConnection:
+
+    def __init__(self, cnx):
+        self._cnx = cnx
+        self.returned = False
+
+    def close(self):
+        self.returned = True
+        # What the pool's session reset does on a dead connection
+        raise mysql.connector.OperationalError("MySQL Connection not available")
+
+
+def test_discard_connection_kills_it_on_the_server(monkeypatch):
+    killers = []
+
+    def connect(**settings):
+        killers.append((settings['host'], settings['port'], FakeMySQLConnection()))
+        return killers[-1][2]
+    monkeypatch.setattr(mysql.connector, 'connect', connect)
+    cnx = FakeMySQLConnection()
+    pooled = FakePooledConnection(cnx)
+    db.discard_connection(pooled)
+
+    [(host, port, killer)] = killers
+    assert (host, port) == ('db1', 3307)
+    assert killer.executed == [("KILL %s", (42,))] and killer.closed
+    # Closed unread, and back in the pool, where the next checkout reconnects it
+    assert cnx.closed and not cnx.unread_result and cnx.executed == []
+    assert pooled.returned
@@ -0,0 +1,156 @@
+import json
+import os
+import random
+
+import joblib
+import numpy as np
+import pytest
+
+import config
+import drift
+from drift import DriftMonitor, QuantileSketch, Summary
+
+FEATURES = ['weight', 'grade']
+
+
+class Frame(dict):
+    """The two things build_reference uses of predict.py's DataFrame."""
+
+    @property
+    def columns(self):
+        return list(self)
+
+
+def sample(rng, n, shift=0.0):
+    return {'weight': rng.normal(1300 + shift, 200, n), 'grade': rng.uniform(1, 4, n)}
+
+
+@pytest.fixture(autouse=True)
+def seeded():
+    # The sketch's compactions pick odd or even items at random
+    random.seed(3)
+
+
+def rank_error(sketch, values):
+    exact = np.sort(values)
+    points = list(np.quantile(exact, drift.QUANTILES))
+    estimated = sketch.cdf(points)
+    return max(abs(e - np.searchsorted(exact, p, side='right') / len(exact)) for e, p in zip(estimated, points))
+
+
+def test_sketch_rank_error_against_exact_quantiles():
+    values = np.random.default_rng(1).lognormal(0, 1, 100000)
+    sketch = QuantileSketch(200)
+    for x in values:
+        sketch.add(float(x))
+    assert sketch.size < 2000
+    assert rank_error(sketch, values) < 0.015
+    # The values it reports sit at about the requested ranks
+    exact = np.sort(values)
+    for q, v in zip(drift.QUANTILES, sketch.quantiles(drift.QUANTILES)):
+        assert abs(np.searchsorted(exact, v, side='right') / len(exact) - q) < 0.015
+
+
+def test_merged_sketches_keep_the_bound():
+    rng = np.random.default_rng(2)
+    parts = [rng.normal(i, 1, 30000) for i in range(4)]
+    merged = QuantileSketch(200)
+    for part in parts:
+        sketch = QuantileSketch(200)
+        for x in part:
+            sketch.add(float(x))
+        merged.merge(sketch)
+    assert merged.size < merged.max_size
+    assert rank_error(merged, np.concatenate(parts)) < 0.015
+
+
+def roundtrip(summary):
+    """What one process's flush and another's merged() do to a summary."""
+    return Summary(state=json.loads(json.dumps(summary.state())))
+
+
+def test_summaries_merge_across_processes():
+    rng = np.random.default_rng(3)
+    edges = [1000.0, 1300.0, 1600.0]
+    parts = [rng.normal(1300, 200, n) for n in (5000, 1, 12000)]
+    merged = Summary()
+    for part in parts:
+        summary = Summary(edges)
+        for x in part:
+            summary.add(float(x))
+        merged.merge(roundtrip(summary))
+
+    values = np.concatenate(parts)
+    assert merged.moments.count == len(values)
+    assert merged.moments.mean == pytest.approx(values.mean())
+    assert merged.moments.std == pytest.approx(values.std())
+    assert (merged.moments.low, merged.moments.high) == (values.min(), values.max())
+    assert merged.edges == edges
+    assert merged.bins == np.bincount(np.searchsorted(edges, values, side='left'), minlength=4).tolist()
+    assert rank_error(merged.sketch, values) < 0.015
+
+
+def test_bins_against_another_reference_are_dropped():
+    old, new, again = Summary([1.0, 2.0]), Summary([1.0, 3.0]), Summary([1.0, 2.0])
+    for summary in (old, new, again):
+        summary.add(2.5)
+    merged = Summary()
+    merged.merge(old)
+    merged.merge(again)
+    assert merged.bins == [0, 0, 2]
+    # A worker still on the model before retraining
+    merged.merge(new)
+    assert merged.bins is None and merged.moments.count == 3
+    merged.merge(again)
+    assert merged.bins is None
+
+
+@pytest.fixture
+def reference(tmp_path, monkeypatch):
+    monkeypatch.setattr(config, 'DRIFT_DIR', str(tmp_path / 'drift'))
+    monkeypatch.setattr(config, 'DRIFT_MONITOR', True)
+    monkeypatch.setattr(config, 'DRIFT_FLUSH_INTERVAL', 3600)
+    rng = np.random.default_rng(4)
+    path = str(tmp_path / 'reference.pkl')
+    joblib.dump(drift.build_reference(Frame(sample(rng, 20000)), rng.beta(2, 3, 20000)), path)
+    return path
+
+
+def observed(path, rng, n, shift=0.0):
+    monitor = DriftMonitor(FEATURES, path, path + '.no-scaler')
+    columns = sample(rng, n, shift)
+    probabilities = rng.beta(2, 3, n)
+    for i in range(n):
+        monitor.observe({f: columns[f][i] for f in FEATURES}, probabilities[i])
+    return monitor
+
+
+def test_psi_and_ks_flag_a_shifted_feature(reference):
+    rng = np.random.default_rng(5)
+    steady = observed(reference, rng, 5000).scores()
+    for name in ('weight', 'grade', drift.PREDICTION):
+        assert steady[name]['count'] == 5000
+        assert steady[name]['psi'] < 0.01 and steady[name]['ks'] < 0.03
+        assert abs(steady[name]['mean_shift']) < 0.05
+
+    os.remove(os.path.join(config.DRIFT_DIR, f"{os.getpid()}.json"))
+    shifted = observed(reference, rng, 5000, shift=200.0).scores()
+    assert shifted['weight']['psi'] > 0.25 and shifted['weight']['ks'] > 0.3
+    assert shifted['weight']['mean_shift'] == pytest.approx(1.0, abs=0.1)
+    assert shifted['grade']['psi'] < 0.01
+
+
+def test_metrics_merge_every_process_file(reference):
+    rng = np.random.default_rng(6)
+    observed(reference, rng, 300).flush()
+    # Written by another worker
+    os.rename(os.path.join(config.DRIFT_DIR, f"{os.getpid()}.json"), os.path.join(config.DRIFT_DIR, "1.json"))
+    monitor = observed(reference, rng, 200)
+    assert monitor.merged()['weight'].moments.count == 500
+    text = monitor.metrics_text()
+    assert 'splm_model_observations{feature="weight"} 500\n' in text
+    assert 'splm_model_drift_psi{feature="probability"}' in text
+    # A stopped worker's file ages out
+    os.utime(os.path.join(config.DRIFT_DIR, "1.json"), (0, 0))
+    assert monitor.merged()['weight'].moments.count == 200
+    assert not os.path.exists(os.path.join(config.DRIFT_DIR, "1.json"))
@@ -0,0 +1,62 @@
+import pytest
+
+import exports
+
+
+class FakeCursor:
+    description = [('ID',), ('Name',)]
+
+    def __init__(self, rows):
+        self.rows = rows
+        self.closed = False
+
+    def execute(self, sql, params):
+        pass
+
+    def fetchmany(self, size):
+        batch, self.rows = self.rows[:size], self.rows[size:]
+        return batch
+
+    def close(self):
+        self.closed = True
+
+
+class FakeConnection:
+    def __init__(self, rows):
+        self.cursor_ = FakeCursor(rows)
+        self.closed = False
+
+    def cursor(self, buffered=True):
+        return self.cursor_
+
+    def close(self):
+        self.closed = True
+
+
+def test_empty_csv_export_has_header():
+    body = b''.join(exports.generate_export('sourcing', 'csv', {'supplier_id': 'NO-SUCH-SUPPLIER'}))
+    assert body.decode('utf-8').splitlines() == [
+        'SupplierID,SupplierName,ComponentID,ComponentName,MaterialID,MaterialName']
+    assert b''.join(exports.generate_export('sourcing', 'ndjson', {'supplier_id': 'NO-SUCH-SUPPLIER'})) == b''
+
+
+def test_abandoned_export_drops_the_connection_unread(monkeypatch):
+    conn = FakeConnection([(i, f"row {i}") for i in range(exports.EXPORT_BATCH_SIZE * 3 + 5)])
+    monkeypatch.setattr(exports, 'get_db_connection', lambda: conn)
+    discarded = []
+    monkeypatch.setattr(exports, 'discard_connection', discarded.append)
+
+    chunks = exports.generate_export('sourcing', 'csv', {})
+    assert next(chunks).startswith(b'ID,Name\r\n0,row 0')
+    # What the WSGI server does when the client disconnects
+    chunks.close()
+    assert len(conn.cursor_.rows) == exports.EXPORT_BATCH_SIZE * 2 + 5
+    assert discarded == [conn] and not conn.cursor_.closed
+
+
+def test_finished_export_returns_the_connection(monkeypatch):
+    conn = FakeConnection([(1, 'row 1')])
+    monkeypatch.setattr(exports, 'get_db_connection', lambda: conn)
+    monkeypatch.setattr(exports, 'discard_connection', lambda conn: pytest.fail("discarded"))
+    assert b''.join(exports.generate_export('sourcing', 'ndjson', {})) == b'{"ID": 1, "Name": "row 1"}\n'
+    assert conn.cursor_.closed and conn.closed
@@ -0,0 +1,72 @@
+import numpy as np
+
+import analytics
+import forecast
+from lifecycle import STATE_CODES
+from test_analytics import arrays
+
+DAY = 86400.0
+MONTH = forecast.SECONDS_PER_MONTH
+MADE, RECYCLED = STATE_CODES['Manufactured'], STATE_CODES['Recycled']
+
+
+def fleet():
+    # P100: one unit recycled after 100 days, one in service; P200: in service only, no end-of-life yet
+    return arrays({1: 'P100', 2: 'P100', 3: 'P200'},
+                  [(1, 1, 0.0), (1, 2, DAY), (1, 4, 100 * DAY), (2, 1, 0.0), (3, 1, 5 * DAY)])
+
+
+def test_hazards_cached_per_table_version(monkeypatch):
+    loads = []
+    versions = [(1, 1)]
+    monkeypatch.setattr(analytics, 'load_fleet_event_arrays', lambda: loads.append(1) or fleet())
+    monkeypatch.setattr(forecast, 'table_versions', lambda tables: (versions[0], None))
+    monkeypatch.setattr(forecast, '_current', (None, None))
+
+    first = forecast.fleet_forecast()
+    assert forecast.fleet_forecast() is first
+    assert len(loads) == 1
+
+    versions[0] = (2, 1)
+    forecast.fleet_forecast()
+    assert len(loads) == 2
+
+    # An explicit `now` is computed fresh and not cached
+    products, units, in_service = forecast.fleet_forecast(now=200 * DAY)
+    assert len(loads) == 3
+    assert forecast.fleet_forecast() is not None and len(loads) == 3
+    np.testing.assert_array_equal(products, ['P100', 'P200'])
+    np.testing.assert_array_equal(in_service, [1, 1])
+    assert units.shape == (forecast.MAX_MONTHS, 2)
+
+
+def test_constant_hazard():
+    hazard, in_service = forecast.product_hazards(fleet(), 200 * DAY)
+    np.testing.assert_array_equal(in_service, [1, 1])
+    # End-of-life events / unit-months at risk; P200 falls back to the fleet-wide rate
+    np.testing.assert_allclose(hazard, [MONTH / (300 * DAY), MONTH / (495 * DAY)])
+
+
+def test_returns_follow_survival_at_each_units_age():
+    # Two units ended at 10 and 20 months; two more are in service, 5 and 15 months old
+    data = arrays({1: 'P100', 2: 'P100', 3: 'P100', 4: 'P100'}, [
+        (1, MADE, 0.0), (1, RECYCLED, 10 * MONTH),
+        (2, MADE, 0.0), (2, RECYCLED, 20 * MONTH),
+        (3, MADE, 25 * MONTH), (4, MADE, 15 * MONTH),
+    ])
+    units = forecast.expected_units(data, 30 * MONTH, months=24)[:, 0]
+    # S(10) = 2/3, S(20) = 0: the 5-month-old unit ends at 10 (1/3) or at 20 (2/3),
+    # the 15-month-old one at 20, five months from now
+    want = np.zeros(24)
+    want[4], want[14] = 4 / 3, 2 / 3
+    np.testing.assert_allclose(units, want, atol=1e-12)
+
+
+def test_products_without_end_of_life_use_the_constant_hazard():
+    data = fleet()
+    units = forecast.expected_units(data, 200 * DAY, months=12)
+    hazard, in_service = forecast.product_hazards(data, 200 * DAY)
+    k = np.arange(12)
+    np.testing.assert_allclose(units[:, 1], in_service[1] * (1 - hazard[1]) ** k * hazard[1])
+    # The in-service P100 unit (6.6 months old) is older than the one that ended at 3.3 months
+    np.testing.assert_allclose(units[:, 0], in_service[0] * (1 - hazard[0]) ** k * hazard[0])
@@ -0,0 +1,177 @@
+import os
+import sqlite3
+import time
+
+import pytest
+
+import config
+import journal
+from db import get_db_connection
+
+
+def applied_uuids():
+    conn = get_db_connection()
+    try:
+        cursor = conn.cursor()
+        cursor.execute("SELECT EventUUID FROM JournalApplied ORDER BY EventUUID")
+        return [row[0] for row in cursor.fetchall()]
+    finally:
+        conn.close()
+
+
+def stamp(days_ago):
+    return time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(time.time() - days_ago * 86400))
+
+
+def new_instance(serial):
+    conn = get_db_connection()
+    try:
+        cursor = conn.cursor()
+        cursor.execute("INSERT INTO ProductInstances (SerialNumber, ProductID) VALUES (%s, 'P100')", (serial,))
+        conn.commit()
+        return cursor.lastrowid
+    finally:
+        conn.close()
+
+
+def history(instance_id):
+    conn = get_db_connection()
+    try:
+        cursor = conn.cursor()
+        cursor.execute("SELECT EventType FROM LifecycleEvents WHERE InstanceID = %s ORDER BY EventDate, EventID",
+                       (instance_id,))
+        return [row[0] for row in cursor.fetchall()]
+    finally:
+        conn.close()
+
+
+@pytest.fixture
+def journal_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(config, 'JOURNAL_DIR', str(tmp_path))
+    return tmp_path
+
+
+@pytest.fixture
+def own_journal(journal_dir):
+    j = journal.Journal(str(journal_dir / 'w-1'))
+    yield j
+    j.close()
+
+
+def test_prune_applied_keeps_rows_within_retention():
+    conn = get_db_connection()
+    try:
+        cursor = conn.cursor()
+        cursor.execute("DELETE FROM JournalApplied")
+        cursor.executemany("INSERT INTO JournalApplied (EventUUID, AppliedAt) VALUES (%s, %s)",
+                           [('expired', stamp(8)), ('recent', stamp(6))])
+        cursor.execute("INSERT INTO JournalApplied (EventUUID) VALUES ('now')")
+        conn.commit()
+    finally:
+        conn.close()
+
+    assert journal.prune_applied(days=7) == 1
+    assert applied_uuids() == ['now', 'recent']
+
+
+def test_drain_resumes_from_checkpoint(own_journal):
+    instance_id = new_instance('J-RESUME')
+    own_journal.append(instance_id, 'Manufactured', '2025-01-01 10:00:00')
+    assert journal.drain(own_journal.directory) == 1
+    segment_size = os.path.getsize(journal._segment_path(own_journal.directory, 1))
+    assert journal.read_checkpoint(own_journal.directory) == (1, segment_size)
+
+    own_journal.append(instance_id, 'Sold', '2025-01-02 10:00:00')
+    assert journal.drain(own_journal.directory) == 1
+    assert journal.drain(own_journal.directory) == 0
+    assert history(instance_id) == ['Manufactured', 'Sold']
+
+
+def test_lost_checkpoint_applies_nothing_twice(own_journal):
+    instance_id = new_instance('J-LOST')
+    uuids = [own_journal.append(instance_id, 'Manufactured', '2025-01-01 10:00:00'),
+             own_journal.append(instance_id, 'Sold', '2025-01-02 10:00:00')]
+    assert journal.drain(own_journal.directory) == 2
+
+    # As if the process died between the commit and the checkpoint write
+    os.remove(os.path.join(own_journal.directory, 'checkpoint.json'))
+    assert journal.drain(own_journal.directory) == 2
+    assert history(instance_id) == ['Manufactured', 'Sold']
+    assert set(uuids) <= set(applied_uuids())
+
+
+def test_orphaned_journal_is_adopted(journal_dir):
+    instance_id = new_instance('J-ORPHAN')
+    orphan = journal.Journal(str(journal_dir / 'w-99999'))
+    orphan.append(instance_id, 'Manufactured', '2025-01-01 10:00:00')
+    # Closing releases its LOCK, as the owner exiting would
+    orphan.close()
+
+    assert journal.adopt_orphans(str(journal_dir / 'w-1')) == 1
+    assert not os.path.exists(journal_dir / 'w-99999')
+    assert history(instance_id) == ['Manufactured']
+
+
+def test_unstorable_records_do_not_block_the_journal(own_journal):
+    instance_id = new_instance('J-BAD')
+    own_journal.append(instance_id, 'Manufactured', '2025-01-01 10:00:00')
+    own_journal.append(instance_id, 'Sold', None, {'x': 1})
+    own_journal.append(instance_id, 'Sold', 'yesterday')
+    own_journal.append(instance_id, 'Sold', '2025-01-02 10:00:00', 'a' * 37)
+    good = own_journal.append(instance_id, 'Sold', '2025-01-02 10:00:00')
+
+    assert journal.drain(own_journal.directory) == 5
+    segment_size = os.path.getsize(journal._segment_path(own_journal.directory, 1))
+    assert journal.read_checkpoint(own_journal.directory) == (1, segment_size)
+    assert history(instance_id) == ['Manufactured', 'Sold']
+    assert good in applied_uuids()
+
+
+def test_record_the_database_refuses_is_rejected_alone(own_journal, monkeypatch):
+    good_id, bad_id = new_instance('J-GOOD'), new_instance('J-REFUSED')
+    apply_events = journal.apply_events
+
+    def refusing(conn, events):
+        if any(e[0] == bad_id for e in events):
+            raise sqlite3.IntegrityError('refused')
+        return apply_events(conn, events)
+
+    monkeypatch.setattr(journal, 'apply_events', refusing)
+    own_journal.append(good_id, 'Manufactured', '2025-01-01 10:00:00')
+    refused = own_journal.append(bad_id, 'Manufactured', '2025-01-01 10:00:00')
+    own_journal.append(good_id, 'Sold', '2025-01-02 10:00:00')
+
+    applied, rejected, duplicates = journal.apply_batch(journal.read_batch(own_journal.directory, 1, 0, 10)[0])
+    assert (applied, duplicates) == (2, 0)
+    assert [(event[0], reason) for event, reason in rejected] == [(bad_id, 'refused')]
+    assert history(good_id) == ['Manufactured', 'Sold'] and history(bad_id) == []
+    assert refused in applied_uuids()
+
+
+def test_connection_errors_still_fail_the_batch(own_journal, monkeypatch):
+    instance_id = new_instance('J-DOWN')
+
+    def down(conn, events):
+        raise sqlite3.OperationalError('database is locked')
+
+    monkeypatch.setattr(journal, 'apply_events', down)
+    own_journal.append(instance_id, 'Manufactured', '2025-01-01 10:00:00')
+    with pytest.raises(sqlite3.OperationalError):
+        journal.drain(own_journal.directory)
+    assert journal.read_checkpoint(own_journal.directory) == (1, 0)
+
+
+@pytest.mark.parametrize('journal_enabled', [False, True])
+@pytest.mark.parametrize('event', [
+    {'instance_id': 1, 'event_type': 'Repair', 'event_uuid': {'x': 1}},
+    {'instance_id': 1, 'event_type': 'Repair', 'event_uuid': 'a' * 37},
+    {'instance_id': 1, 'event_type': 'Repair', 'event_date': '31/03/2025'},
+    {'instance_id': 1, 'event_type': 'Repair', 'event_date': 20250331},
+])
+def test_api_events_rejects_unstorable_fields(event, journal_enabled, monkeypatch):
+    import app
+
+    monkeypatch.setattr(config, 'JOURNAL_ENABLED', journal_enabled)
+    monkeypatch.setattr(app, 'get_journal', lambda: pytest.fail("journaled an invalid event"))
+    response = app.app.test_client().post('/api/events', json=event)
+    assert response.status_code == 400
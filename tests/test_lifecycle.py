@@ -0,0 +1,85 @@
+import pytest
+
+import sqlite_backend
+from lifecycle import LIFECYCLE, IllegalTransition, apply_events, check_transition, is_allowed
+
+
+@pytest.fixture
+def conn(tmp_path):
+    conn = sqlite_backend.connect(str(tmp_path / 'lifecycle.sqlite3'))
+    yield conn
+    conn.close()
+
+
+def current_state(conn, instance_id):
+    cursor = conn.cursor()
+    cursor.execute("SELECT CurrentState FROM ProductInstances WHERE InstanceID = %s", (instance_id,))
+    return cursor.fetchone()[0]
+
+
+def new_instance(conn, serial='T-0001'):
+    cursor = conn.cursor()
+    cursor.execute("INSERT INTO ProductInstances (SerialNumber, ProductID) VALUES (%s, 'P100')", (serial,))
+    return cursor.lastrowid
+
+
+def test_unknown_state_is_rejected():
+    assert not is_allowed('Refurbished', 'Sold')
+    with pytest.raises(IllegalTransition):
+        check_transition('Refurbished', 'Sold')
+    assert is_allowed('Sold', 'Repair')
+
+
+def test_transition_table_matches_lifecycle(conn):
+    cursor = conn.cursor()
+    cursor.execute("SELECT FromState, EventType FROM LifecycleTransitions")
+    assert set(cursor.fetchall()) == {(state, event) for state, events in LIFECYCLE.items() for event in events}
+
+
+def test_database_rejects_events_that_bypass_lifecycle(conn):
+    instance = new_instance(conn)
+    with pytest.raises(Exception, match='not allowed'):
+        conn.cursor().callproc('AddLifecycleEvent', [instance, 'Disposed'])
+    # Seed instance 1 is already disposed
+    with pytest.raises(Exception, match='not allowed'):
+        conn.cursor().callproc('RecycleProduct', [1])
+    assert current_state(conn, instance) == 'NoEvents'
+
+
+def test_backdated_event_is_rejected(conn):
+    instance = new_instance(conn)
+    accepted, rejected = apply_events(conn, [(instance, 'Manufactured', '2024-01-01 00:00:00'),
+                                             (instance, 'Sold', '2024-03-01 00:00:00')])
+    assert len(accepted) == 2 and not rejected
+    apply_events(conn, [(instance, 'Repair', '2024-06-01 00:00:00')])
+    # A repair scanned in April but only uploaded now, after a later repair
+    accepted, rejected = apply_events(conn, [(instance, 'Repair', '2024-04-01 00:00:00')])
+    assert not accepted and 'before the instance' in rejected[0][1]
+    # Disposed before it was sold: the current state (Repair) would allow it
+    accepted, rejected = apply_events(conn, [(instance, 'Disposed', '2024-02-01 00:00:00')])
+    assert not accepted and len(rejected) == 1
+    # Inside one batch too, and a tie with the latest event is fine
+    accepted, rejected = apply_events(conn, [(instance, 'Repair', '2024-07-01 00:00:00'),
+                                             (instance, 'Repair', '2024-06-15 00:00:00'),
+                                             (instance, 'Disposed', '2024-07-01 00:00:00')])
+    assert [e[1] for e in accepted] == ['Repair', 'Disposed'] and len(rejected) == 1
+    assert current_state(conn, instance) == 'Disposed'
+
+
+def test_database_rejects_backdated_events(conn):
+    instance = new_instance(conn)
+    apply_events(conn, [(instance, 'Manufactured', '2024-01-01 00:00:00'), (instance, 'Sold', '2024-03-01 00:00:00')])
+    cursor = conn.cursor()
+    with pytest.raises(Exception, match='before the instance'):
+        cursor.execute("INSERT INTO LifecycleEvents (EventType, EventDate, InstanceID) VALUES ('Disposed', %s, %s)",
+                       ('2024-02-01 00:00:00', instance))
+    assert current_state(conn, instance) == 'Sold'
+
+
+def test_apply_events_rejects_illegal_and_unknown(conn):
+    instance = new_instance(conn)
+    accepted, rejected = apply_events(conn, [(instance, 'Sold', None), (instance, 'Manufactured', None),
+                                             (999999, 'Manufactured', None)])
+    assert [e[1] for e in accepted] == ['Manufactured']
+    assert [e[0] for e, _ in rejected] == [instance, 999999]
+    assert current_state(conn, instance) == 'Manufactured'
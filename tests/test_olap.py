@@ -0,0 +1,111 @@
+import pytest
+
+import cache
+import config
+import olap
+from db import get_db_connection
+from lifecycle import apply_events
+
+
+@pytest.fixture
+def exported(tmp_path, monkeypatch):
+    """A private database and OLAP_DIR, exported once; yields a store of its own."""
+    monkeypatch.setattr(config, 'DB_SQLITE_PATH', str(tmp_path / 'olap.sqlite3'))
+    monkeypatch.setattr(config, 'OLAP_DIR', str(tmp_path / 'olap'))
+    monkeypatch.setattr(config, 'OLAP_CHECK_INTERVAL', 0)
+    cache.note_write()
+    olap.export()
+    yield olap.OlapStore()
+    cache.note_write()
+
+
+def execute(sql, params=()):
+    conn = get_db_connection()
+    try:
+        cursor = conn.cursor()
+        cursor.execute(sql, params)
+        conn.commit()
+        return cursor.lastrowid
+    finally:
+        conn.close()
+
+
+def db_rows(sql):
+    conn = get_db_connection()
+    try:
+        cursor = conn.cursor()
+        cursor.execute(sql)
+        return cursor.fetchall()
+    finally:
+        conn.close()
+
+
+def exported_event_ids(store):
+    cursor = store.connect().cursor()
+    cursor.execute("SELECT EventID FROM LifecycleEventsAll ORDER BY EventID")
+    return [r[0] for r in cursor.fetchall()]
+
+
+def test_export_appends_each_row_once(exported):
+    ids = [r[0] for r in db_rows("SELECT EventID FROM LifecycleEvents ORDER BY EventID")]
+    assert exported_event_ids(exported) == ids
+    # Nothing new: the overlap is re-read but nothing in it is appended again
+    assert olap.export() == {'catalog': [], 'events': 0, 'instances': 0, 'compacted': 0}
+    assert exported_event_ids(exported) == ids
+
+
+def test_rows_committed_below_the_watermark_are_picked_up(exported, monkeypatch):
+    instance = execute("INSERT INTO ProductInstances (SerialNumber, ProductID) VALUES ('OLAP-1', 'P100')")
+    top = max(exported_event_ids(exported))
+    # EventIDs handed out in this order, the lower one committing after the next export
+    execute("INSERT INTO LifecycleEvents (EventID, EventType, EventDate, InstanceID) "
+            "VALUES (%s, 'Manufactured', '2025-01-01 00:00:00', %s)", (top + 5, instance))
+    assert olap.export()['events'] == 1
+    execute("INSERT INTO LifecycleEvents (EventID, EventType, EventDate, InstanceID) "
+            "VALUES (%s, 'Sold', '2025-02-01 00:00:00', %s)", (top + 2, instance))
+    assert olap.export() == {'catalog': [], 'events': 1, 'instances': 0, 'compacted': 0}
+    assert exported_event_ids(exported)[-2:] == [top + 2, top + 5]
+    assert olap.read_manifest()['watermarks']['primary']['events'] == top + 5
+
+    # Older than the overlap: missed for good
+    monkeypatch.setattr(config, 'OLAP_ID_OVERLAP', 2)
+    execute("INSERT INTO LifecycleEvents (EventID, EventType, EventDate, InstanceID) "
+            "VALUES (%s, 'Repair', '2025-03-01 00:00:00', %s)", (top + 1, instance))
+    assert olap.export()['events'] == 0
+
+
+def test_composition_report_is_the_same_on_both_engines(exported):
+    conn = get_db_connection()
+    try:
+        want = olap.composition_report(conn)
+    finally:
+        conn.close()
+    assert want['total_grams'] > 0 and want['suppliers']
+    assert olap.composition_report(exported.connect()) == want
+
+
+def test_writes_since_the_export_send_readers_to_the_database(exported):
+    tables = olap.SOURCE_TABLES
+    assert exported.connect(tables) is not None
+    instance = execute("INSERT INTO ProductInstances (SerialNumber, ProductID) VALUES ('OLAP-2', 'P100')")
+    conn = get_db_connection()
+    try:
+        assert apply_events(conn, [(instance, 'Manufactured', None)])[0]
+        conn.commit()
+    finally:
+        conn.close()
+    cache.note_write()
+    assert exported.connect(tables) is None
+    # Tables not written are still served from the copy
+    assert exported.connect(('Products',)) is not None
+    olap.export()
+    assert exported.connect(tables) is not None
+
+
+def test_old_manifests_only_serve_callers_without_tables(exported):
+    manifest = olap.read_manifest()
+    del manifest['versions']
+    olap._write_manifest(manifest)
+    exported._checked = 0.0
+    assert exported.connect() is not None
+    assert exported.connect(('Products',)) is None
@@ -0,0 +1,196 @@
+import threading
+
+import pytest
+
+import cache
+import config
+import outbox
+from db import get_db_connection
+from lifecycle import apply_events
+
+
+@pytest.fixture(autouse=True)
+def feed(tmp_path, monkeypatch):
+    """A private database, whose feed starts empty after the seed data."""
+    monkeypatch.setattr(config, 'DB_SQLITE_PATH', str(tmp_path / 'outbox.sqlite3'))
+    cache.note_write()
+    yield
+    cache.note_write()
+
+
+def execute(*statements):
+    conn = get_db_connection()
+    try:
+        cursor = conn.cursor()
+        for sql, params in statements:
+            cursor.execute(sql, params)
+        conn.commit()
+        return cursor.lastrowid
+    finally:
+        conn.close()
+
+
+def add_suppliers(*ids):
+    conn = get_db_connection()
+    try:
+        cursor = conn.cursor()
+        for i in ids:
+            cursor.execute("INSERT INTO Suppliers (SupplierID, SupplierName) VALUES (%s, %s)", (i, f"Supplier {i}"))
+        # What wakes long-polls
+        cursor.callproc('BumpTableVersion', ['Suppliers'])
+        conn.commit()
+    finally:
+        conn.close()
+    cache.note_write()
+
+
+def cursors(changes):
+    return [c['cursor'] for c in changes]
+
+
+def test_every_insert_adds_an_outbox_row():
+    instance = execute(("INSERT INTO ProductInstances (SerialNumber, ProductID) VALUES ('OB-1', 'P100')", ()))
+    conn = get_db_connection()
+    apply_events(conn, [(instance, 'Manufactured', '2025-01-01 00:00:00')])
+    conn.commit()
+    conn.close()
+    add_suppliers('OB-S')
+    execute(("INSERT INTO Sourcing (SupplierID, ComponentID) VALUES ('OB-S', 'C101')", ()),
+            ("INSERT INTO ComponentComposition (ComponentID, MaterialID, WeightInGrams) "
+             "VALUES ('C102', 'M1', 5)", ()))
+
+    changes, complete = outbox.read_changes()
+    assert complete
+    assert [(c['cursor'], c['entity']) for c in changes] == [
+        (1, 'ProductInstance'), (2, 'LifecycleEvent'), (3, 'Supplier'), (4, 'Sourcing'),
+        (5, 'ComponentComposition')]
+    assert {c['change'] for c in changes} == {'insert'}
+    assert changes[0]['data'] == {'InstanceID': instance, 'SerialNumber': 'OB-1', 'ProductID': 'P100'}
+    assert changes[1]['data']['InstanceID'] == instance and changes[1]['data']['EventType'] == 'Manufactured'
+    assert changes[2]['id'] == 'OB-S' and changes[2]['data']['SupplierName'] == 'Supplier OB-S'
+    assert changes[3]['data']['ComponentID'] == 'C101'
+    assert changes[4]['id'] == 'C102/M1' and changes[4]['data']['WeightInGrams'] == 5
+
+
+def test_sequencing_numbers_committed_rows_once():
+    add_suppliers('OB-1', 'OB-2', 'OB-3')
+    conn = get_db_connection()
+    try:
+        assert outbox.sequence_pending(conn, limit=2) == 2
+        assert outbox.sequence_pending(conn) == 1
+        assert outbox.sequence_pending(conn) == 0
+        # FeedSeq follows on from the highest assigned, even after rows are pruned
+        conn.cursor().execute("DELETE FROM ChangeOutbox WHERE FeedSeq < 3")
+        conn.commit()
+        add_suppliers('OB-4')
+        assert outbox.sequence_pending(conn) == 1
+        assert [(c['id'], c['cursor']) for c in outbox.fetch_changes(conn)] == [('OB-3', 3), ('OB-4', 4)]
+    finally:
+        conn.close()
+
+
+class LockedCursor:
+    """GET_LOCK answering 0: another worker is sequencing."""
+
+    def __init__(self):
+        self.executed = []
+
+    def execute(self, sql, params=()):
+        self.executed.append(sql)
+
+    def fetchone(self):
+        return (0,)
+
+
+class LockedConnection:
+
+    def __init__(self):
+        self.cursor_ = LockedCursor()
+
+    def cursor(self):
+        return self.cursor_
+
+
+def test_sequencing_backs_off_while_another_worker_holds_the_lock():
+    conn = LockedConnection()
+    assert outbox.sequence_pending(conn) is None
+    assert conn.cursor_.executed == ["SELECT GET_LOCK(%s, 0)"]
+
+
+def test_feed_is_in_feedseq_order_not_changeid_order():
+    add_suppliers('OB-1', 'OB-2', 'OB-3')
+    # The second insert committed last: it was sequenced after the third
+    execute(*[("UPDATE ChangeOutbox SET FeedSeq = %s WHERE EntityID = %s", (seq, supplier))
+              for seq, supplier in ((1, 'OB-1'), (2, 'OB-3'), (3, 'OB-2'))])
+    changes, _ = outbox.read_changes()
+    assert [(c['id'], c['cursor']) for c in changes] == [('OB-1', 1), ('OB-3', 2), ('OB-2', 3)]
+
+
+def test_paging_with_the_cursor():
+    add_suppliers(*[f"OB-{i}" for i in range(7)])
+    seen, after = [], 0
+    while True:
+        changes, _ = outbox.read_changes(after, limit=3)
+        if not changes:
+            break
+        assert len(changes) <= 3
+        seen += changes
+        after = changes[-1]['cursor']
+    assert cursors(seen) == list(range(1, 8))
+    assert [c['id'] for c in seen] == [f"OB-{i}" for i in range(7)]
+    # Filtered by entity, the cursor still counts every change
+    execute(("INSERT INTO Sourcing (SupplierID, ComponentID) VALUES ('OB-0', 'C101')", ()))
+    assert cursors(outbox.read_changes(0, entities=['Sourcing'])[0]) == [8]
+    assert outbox.read_changes(8)[0] == []
+
+
+def test_long_poll_returns_when_a_change_arrives(monkeypatch):
+    monkeypatch.setattr(config, 'OUTBOX_POLL_INTERVAL', 0.01)
+    assert outbox.wait_for_changes(0, timeout=0.05) == []
+    writer = threading.Timer(0.05, add_suppliers, ['OB-LATE'])
+    writer.start()
+    changes = outbox.wait_for_changes(0, timeout=5)
+    writer.join()
+    assert [c['id'] for c in changes] == ['OB-LATE']
+
+
+def test_pruned_cursor_must_resync():
+    add_suppliers('OB-1', 'OB-2', 'OB-3', 'OB-4')
+    outbox.read_changes()
+    # Everything is old enough; the newest row stays
+    assert outbox.prune(days=-1) == 3
+    assert cursors(outbox.read_changes(3)[0]) == [4]
+    assert cursors(outbox.read_changes(0)[0]) == [4]
+    with pytest.raises(outbox.CursorPruned):
+        outbox.read_changes(2)
+
+    import app
+    client = app.app.test_client()
+    assert client.get('/api/changes?after=2').status_code == 410
+    assert client.get('/api/changes/stream?after=2').status_code == 410
+    assert client.get('/api/changes?after=3').get_json()['cursor'] == 4
+
+
+def test_sse_streams_per_worker_are_capped(monkeypatch):
+    monkeypatch.setattr(outbox, '_stream_slots', threading.BoundedSemaphore(1))
+    add_suppliers('OB-1')
+    import app
+    client = app.app.test_client()
+    first = client.get('/api/changes/stream', buffered=False)
+    assert first.status_code == 200
+    assert next(first.response) == b"retry: 2000\n\n"
+    assert next(first.response).startswith(b"id: 1\nevent: change\n")
+
+    second = client.get('/api/changes/stream')
+    assert second.status_code == 503 and second.headers['Retry-After'] == '5'
+    # Long-polls are not limited
+    assert client.get('/api/changes').status_code == 200
+
+    first.close()
+    third = client.get('/api/changes/stream', buffered=False)
+    assert third.status_code == 200
+    # Closed before a byte was read: the slot comes back all the same
+    third.close()
+    fourth = client.get('/api/changes/stream', buffered=False)
+    assert fourth.status_code == 200
+    fourth.close()
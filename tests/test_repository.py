@@ -0,0 +1,94 @@
+from mysql.connector.abstracts import MySQLConnectionAbstract
+import pytest
+
+import config
+import repository
+import sqlite_backend
+
+
+class FakeCursor:
+
+    def __init__(self, prepared=False):
+        self.prepared = prepared
+        self.executed = []
+
+    def execute(self, sql, params=()):
+        self.executed.append((sql, params))
+
+    def fetchall(self):
+        return [('P100', 'Model X')]
+
+
+class FakeMySQLConnection(MySQLConnectionAbstract):
+    """Just enough of a mysql.connector connection for repository.py."""
+
+    def __init__(self):
+        self.session = 1
+        self.cursors = []
+
+    @property
+    def connection_id(self):
+        return self.session
+
+    def cursor(self, prepared=False, **kwargs):
+        cursor = FakeCursor(prepared)
+        self.cursors.append(cursor)
+        return cursor
+
+
+FakeMySQLConnection.__abstractmethods__ = frozenset()
+
+
+class FakePooledConnection:
+    """Like mysql.connector's PooledMySQLConnection: the real connection is _cnx."""
+
+    def __init__(self, cnx):
+        self._cnx = cnx
+
+    def cursor(self, **kwargs):
+        return self._cnx.cursor(**kwargs)
+
+
+@pytest.fixture
+def statement_cache(monkeypatch):
+    monkeypatch.setattr(config, 'DB_STATEMENT_CACHE', True)
+
+
+def test_no_prepared_statements_by_default():
+    cnx = FakeMySQLConnection()
+    assert repository._prepared_cursor(cnx, repository.PRODUCTS) is None
+    assert repository.product_options(FakePooledConnection(cnx)) == [('P100', 'Model X')]
+    assert [c.prepared for c in cnx.cursors] == [False]
+
+
+def test_prepared_cursor_is_kept_per_connection(statement_cache):
+    cnx = FakeMySQLConnection()
+    # Each checkout of the pool wraps the same connection anew
+    first = repository.product_options(FakePooledConnection(cnx))
+    second = repository.product_options(FakePooledConnection(cnx))
+    assert first == second and first[0].ModelName == 'Model X'
+    assert len(cnx.cursors) == 1 and cnx.cursors[0].prepared
+    # The same SQL object each time, so mysql.connector reuses the statement
+    assert [sql for sql, _ in cnx.cursors[0].executed] == [repository.PRODUCTS.sql] * 2
+
+    repository.fetch_all(cnx, repository.COMPONENTS)
+    assert len(cnx.cursors) == 2
+    assert repository._prepared_cursor(cnx, repository.PRODUCTS) is cnx.cursors[0]
+
+
+def test_reconnect_prepares_again(statement_cache):
+    cnx = FakeMySQLConnection()
+    before = repository._prepared_cursor(cnx, repository.PRODUCTS)
+    cnx.session = 2
+    after = repository._prepared_cursor(cnx, repository.PRODUCTS)
+    assert after is not before and after.prepared
+    assert repository._prepared_cursor(cnx, repository.PRODUCTS) is after
+
+
+def test_other_connections_use_plain_cursors(statement_cache, tmp_path):
+    conn = sqlite_backend.connect(str(tmp_path / 'repository.sqlite3'))
+    try:
+        assert repository._prepared_cursor(conn, repository.PRODUCTS) is None
+        assert 'P100' in [row.ProductID for row in repository.product_options(conn)]
+    finally:
+        conn.close()
@@ -0,0 +1,83 @@
+import numpy as np
+import pytest
+
+from catalog import Catalog
+from scenario import ScenarioEngine, ScenarioError
+
+
+def small_catalog():
+    # P1 is component C101 alone: 50 g of M1 (grade A) and 50 g of M2 (grade D)
+    return Catalog(
+        product_ids=['P1'], product_names=['Widget'], product_root=[0],
+        component_ids=['C101'], component_names=['Casing'],
+        material_ids=['M1', 'M2'], material_names=['Aluminium', 'ABS'],
+        material_grade=['A', 'D'], material_hazard=[False, False],
+        bom=np.zeros((1, 1)), composition=np.array([[50.0, 50.0]]),
+    )
+
+
+def cell(engine, overlays):
+    _, d_composition = engine._deltas(overlays)
+    return engine.catalog.composition.toarray() + d_composition.toarray()
+
+
+def test_substitute_then_weight_sets_the_cell():
+    engine = ScenarioEngine(small_catalog())
+    overlays = [
+        {'type': 'substitute', 'component': 'C101', 'from': 'M2', 'to': 'M1'},
+        {'type': 'weight', 'component': 'C101', 'material': 'M1', 'grams': 10},
+    ]
+    assert cell(engine, overlays).tolist() == [[10.0, 0.0]]
+    _, scenario = engine.evaluate(overlays)
+    assert scenario[0] == pytest.approx(4.0)
+
+
+def test_last_weight_wins():
+    engine = ScenarioEngine(small_catalog())
+    overlays = [
+        {'type': 'weight', 'component': 'C101', 'material': 'M2', 'grams': 10},
+        {'type': 'weight', 'component': 'C101', 'material': 'M2', 'grams': 10},
+    ]
+    assert cell(engine, overlays).tolist() == [[50.0, 10.0]]
+    baseline, scenario = engine.evaluate(overlays)
+    assert baseline[0] == pytest.approx(2.5)
+    assert scenario[0] == pytest.approx((50 * 4 + 10 * 1) / 60)
+
+
+def test_substitute_after_weight_moves_the_new_weight():
+    engine = ScenarioEngine(small_catalog())
+    overlays = [
+        {'type': 'weight', 'component': 'C101', 'material': 'M2', 'grams': 20},
+        {'type': 'substitute', 'component': 'C101', 'from': 'M2', 'to': 'M1'},
+    ]
+    assert cell(engine, overlays).tolist() == [[70.0, 0.0]]
+
+
+@pytest.mark.parametrize('overlays', [
+    {'type': 'grade'},
+    'M2',
+    ['grade'],
+    [{'type': 'weight', 'component': 'C101', 'material': 'M1', 'grams': 'ten'}],
+    [{'type': 'weight', 'component': 'C101', 'material': 'M1', 'grams': [10]}],
+    [{'type': 'weight', 'component': 'C101', 'material': 'M1', 'grams': -1}],
+    [{'type': 'weight', 'component': 'C101', 'material': 'M1', 'grams': True}],
+    [{'type': 'grade', 'material': 'M1', 'grade': ['A']}],
+])
+def test_malformed_overlays_are_rejected(overlays):
+    with pytest.raises(ScenarioError):
+        ScenarioEngine(small_catalog()).report(overlays)
+
+
+@pytest.mark.parametrize('body', [
+    {'overlays': {'type': 'grade'}},
+    {'overlays': [{'type': 'weight', 'component': 'C101', 'material': 'M1', 'grams': 'ten'}]},
+    {'overlays': [{'type': 'weight', 'component': 'C101', 'material': 'M1', 'grams': False}]},
+    {'overlays': [{'type': 'grade', 'material': 'M1', 'grade': ['A']}]},
+    ['not', 'an', 'object'],
+])
+def test_route_answers_400_for_malformed_body(body):
+    from app import app
+
+    response = app.test_client().post('/api/scenarios/score', json=body)
+    assert response.status_code == 400
+    assert response.get_json()['status'] == 'error'
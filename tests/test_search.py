@@ -0,0 +1,171 @@
+import pytest
+
+import cache
+import config
+import search
+from db import get_db_connection
+from search import FrozenIndex, InvertedIndex, LayeredIndex, SearchIndex, write_index
+
+
+def small_index():
+    index = InvertedIndex()
+    index.add('component', 'C1', 'Battery Pack')
+    index.add('component', 'C2', 'Batteries')
+    index.add('material', 'M1', 'Battery Grade Lithium')
+    index.add('supplier', 'S1', 'Acme Powerbattery Works')
+    index.add('product', 'P1', 'Pack Battery')
+    index.add('serial', 7, 'SN-2024-0012345')
+    index.add('serial', 8, 'SN-2024-0099999')
+    return index
+
+
+def hits(index, query, **kwargs):
+    return [(kind, key) for _, kind, key, _ in index.search(query, **kwargs)]
+
+
+def test_ranking_whole_word_then_prefix_then_substring():
+    found = small_index().search('battery')
+    # Whole words by kind; "Powerbattery" only contains it, and "Batteries" doesn't
+    assert [(score, key) for score, _, key, _ in found] == [(3, 'P1'), (3, 'C1'), (3, 'M1'), (1, 'S1')]
+    # All prefixes: by kind, then the shorter name
+    assert [key for _, _, key, _ in small_index().search('batt')] == ['P1', 'C2', 'C1', 'M1', 'S1']
+
+
+def test_short_words_match_word_starts_only():
+    index = small_index()
+    # "ba" starts Battery/Batteries but is inside no word otherwise; "at" starts nothing
+    assert {key for _, key in hits(index, 'ba')} == {'C1', 'C2', 'M1', 'P1'}
+    assert hits(index, 'at') == []
+    # Three characters and more also match inside words
+    assert {key for _, key in hits(index, 'att')} == {'C1', 'C2', 'M1', 'P1', 'S1'}
+    assert hits(index, '0099') == [('serial', 8)]
+    assert hits(index, '2024 12345') == [('serial', 7)]
+
+
+def test_every_query_word_must_match():
+    index = small_index()
+    assert {key for _, key in hits(index, 'battery pack')} == {'C1', 'P1'}
+    assert hits(index, 'battery pack', kinds=['product']) == [('product', 'P1')]
+    assert hits(index, 'battery zinc') == []
+
+
+def test_changed_and_removed_entries_are_dead():
+    index = small_index()
+    index.add('component', 'C1', 'Motor Housing')
+    index.remove('supplier', 'S1')
+    # Unchanged text is not added again
+    index.add('serial', 7, 'SN-2024-0012345')
+    assert len(index) == 8
+    assert ('component', 'C1') not in hits(index, 'battery')
+    assert hits(index, 'motor') == [('component', 'C1')]
+    assert hits(index, 'acme') == []
+    assert not index.alive[0] and index.live_keys('supplier') == []
+
+
+def test_snapshot_searches_like_the_index_it_was_written_from(tmp_path):
+    index = small_index()
+    index.add('component', 'C1', 'Motor Housing')
+    index.remove('supplier', 'S1')
+    path = str(tmp_path / 'search.snapshot')
+    write_index(index, path, {'built': 1})
+    frozen = FrozenIndex(path)
+    assert frozen.header['built'] == 1
+    # Dead entries are left out
+    assert len(frozen) == 6
+    for query in ('battery', 'batt', 'ba', 'b', 'att', 'pack battery', 'motor', 'acme', '0012', 'sn 2024', 'x'):
+        assert frozen.search(query) == index.search(query), query
+    assert frozen.keys[frozen.entry_of('serial', 7)] == 7
+    assert frozen.entry_of('supplier', 'S1') is None
+    assert sorted(frozen.live_keys('component')) == ['C1', 'C2']
+
+
+def test_layered_index_overrides_the_shared_one(tmp_path):
+    path = str(tmp_path / 'search.snapshot')
+    write_index(small_index(), path, {})
+    layered = LayeredIndex(FrozenIndex(path))
+    layered.add('component', 'C2', 'Batteries')          # unchanged: stays in the shared index
+    layered.add('component', 'C1', 'Motor Housing')      # changed: moves on top
+    layered.add('serial', 9, 'SN-2025-0000001')
+    layered.remove('material', 'M1')
+    assert len(layered.top) == 2
+    assert hits(layered, 'battery') == [('product', 'P1'), ('supplier', 'S1')]
+    assert hits(layered, 'motor') == [('component', 'C1')]
+    # Merged in one ranking: equal scores, kinds and lengths go by text
+    assert [key for _, key in hits(layered, 'sn')] == [7, 8, 9]
+    assert layered.live_keys('component') == {'C1', 'C2'}
+    assert layered.live_keys('material') == set()
+    with pytest.raises(TypeError):
+        layered.base.add('component', 'C3', 'Frame')
+
+
+# -------------------------
+# SHARED BETWEEN WORKERS
+# -------------------------
+@pytest.fixture
+def shared(tmp_path, monkeypatch):
+    monkeypatch.setattr(config, 'DB_SQLITE_PATH', str(tmp_path / 'search.sqlite3'))
+    monkeypatch.setattr(config, 'SEARCH_SNAPSHOT_PATH', str(tmp_path / 'search.snapshot'))
+    writes = []
+    real_write = search.write_index
+
+    def counted(index, path, header):
+        writes.append(header)
+        real_write(index, path, header)
+    monkeypatch.setattr(search, 'write_index', counted)
+    cache.note_write()
+    yield writes
+    cache.note_write()
+
+
+def add_supplier(supplier_id, name):
+    conn = get_db_connection()
+    try:
+        cursor = conn.cursor()
+        cursor.execute("INSERT INTO Suppliers (SupplierID, SupplierName) VALUES (%s, %s)", (supplier_id, name))
+        cursor.callproc('BumpTableVersion', ['Suppliers'])
+        conn.commit()
+    finally:
+        conn.close()
+    cache.note_write()
+
+
+def test_workers_map_one_snapshot(shared):
+    first, second = SearchIndex(), SearchIndex()
+    assert first.search('aluminum', limit=5)[0]['id'] == 'M1'
+    assert len(shared) == 1
+    assert second.search('aluminum', limit=5) == first.search('aluminum', limit=5)
+    # The second worker mapped the file the first one wrote
+    assert len(shared) == 1 and second.index.base.header['built'] == first.index.base.header['built']
+
+    add_supplier('SRCH1', 'Zirconia Recovery')
+    for worker in (first, second):
+        assert [r['id'] for r in worker.search('zirconia')] == ['SRCH1']
+        assert len(worker.index.top) == 1
+    assert len(shared) == 1
+
+
+def test_large_delta_writes_a_new_snapshot(shared, monkeypatch):
+    worker = SearchIndex()
+    worker.sync()
+    built = worker.index.base.header['built']
+    monkeypatch.setattr(config, 'SEARCH_SNAPSHOT_MAX_DELTA', 1)
+    add_supplier('SRCH2', 'Tungsten One')
+    add_supplier('SRCH3', 'Tungsten Two')
+    assert len(worker.search('tungsten')) == 2 and len(worker.index.top) == 2
+    add_supplier('SRCH4', 'Tungsten Three')
+    assert len(worker.search('tungsten')) == 3
+    # Rebuilt from the database, which already had the third supplier: nothing on top
+    assert len(shared) == 2 and worker.index.base.header['built'] > built
+    assert worker.index.base.entry_of('supplier', 'SRCH4') is not None
+    assert len(worker.index.top) == 0
+
+
+def test_without_a_snapshot_each_worker_keeps_everything(tmp_path, monkeypatch):
+    monkeypatch.setattr(config, 'DB_SQLITE_PATH', str(tmp_path / 'search.sqlite3'))
+    cache.note_write()
+    worker = SearchIndex()
+    assert [r['id'] for r in worker.search('aluminum')] == ['M1']
+    assert worker.index.base is None and len(worker.index.top) > 0
+    add_supplier('SRCH5', 'Cobalt Circle')
+    assert [r['id'] for r in worker.search('cobalt')] == ['SRCH5']
+    cache.note_write()
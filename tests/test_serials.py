@@ -0,0 +1,134 @@
+import json
+
+import pytest
+from werkzeug.test import Client
+
+import cache
+import config
+from db import get_db_connection
+from lifecycle import apply_events
+from serials import SerialBloom, SerialIndex, SerialLookupMiddleware
+
+
+def test_bloom_has_no_false_negatives():
+    bloom = SerialBloom(5000, 0.01)
+    serials = [f"SN-{i:07d}" for i in range(5000)]
+    for serial in serials:
+        bloom.add(serial)
+    assert all(serial in bloom for serial in serials)
+    false_positives = sum(f"XX-{i:07d}" in bloom for i in range(20000))
+    # About the configured rate at capacity
+    assert false_positives < 20000 * 0.02
+
+
+@pytest.fixture
+def index(tmp_path, monkeypatch):
+    monkeypatch.setattr(config, 'DB_SQLITE_PATH', str(tmp_path / 'serials.sqlite3'))
+    cache.note_write()
+    yield SerialIndex()
+    cache.note_write()
+
+
+def register(serial, *events):
+    conn = get_db_connection()
+    try:
+        cursor = conn.cursor()
+        cursor.execute("INSERT INTO ProductInstances (SerialNumber, ProductID) VALUES (%s, 'P100')", (serial,))
+        instance_id = cursor.lastrowid
+        cursor.callproc('BumpTableVersion', ['ProductInstances'])
+        conn.commit()
+    finally:
+        conn.close()
+    add_events(instance_id, *events)
+    return instance_id
+
+
+def add_events(instance_id, *events):
+    conn = get_db_connection()
+    try:
+        accepted, rejected = apply_events(conn, [(instance_id, event, date) for event, date in events])
+        assert not rejected
+        conn.commit()
+    finally:
+        conn.close()
+    cache.note_write()
+
+
+def test_lookup_answers_from_the_filter_and_the_cache(index):
+    assert index.lookup('ALPHA-0002')['state'] == 'Recycled'
+    assert index.lookup('NO-SUCH-SERIAL') is None
+    assert list(index._summaries) == ['ALPHA-0002']
+    # Registered after the filter was built: added from the feed
+    instance_id = register('SER-NEW', ('Manufactured', '2025-01-01 00:00:00'))
+    summary = index.lookup('SER-NEW')
+    assert summary['instance_id'] == instance_id and summary['state'] == 'Manufactured'
+    assert summary['age_days'] > 0
+
+
+def test_feed_events_evict_the_instance_summary(index):
+    instance_id = register('SER-1', ('Manufactured', '2025-01-01 00:00:00'))
+    register('SER-2', ('Manufactured', '2025-01-01 00:00:00'))
+    assert index.lookup('SER-1')['state'] == 'Manufactured'
+    assert index.lookup('SER-2')['state'] == 'Manufactured'
+    add_events(instance_id, ('Sold', '2025-02-01 00:00:00'))
+    assert index.lookup('SER-1')['state'] == 'Sold'
+    # Only the changed instance was dropped
+    generation = index._generation
+    assert index.lookup('SER-2')['state'] == 'Manufactured' and index._generation == generation
+
+
+def test_cache_keeps_the_most_recently_used(index, monkeypatch):
+    monkeypatch.setattr(config, 'SERIAL_CACHE_ENTRIES', 2)
+    for serial in ('ALPHA-0001', 'ALPHA-0002', 'ALPHA-0001', 'ECO-0001'):
+        index.lookup(serial)
+    assert list(index._summaries) == ['ALPHA-0001', 'ECO-0001']
+    assert set(index._by_instance.values()) == {'ALPHA-0001', 'ECO-0001'}
+
+
+def test_summary_read_across_a_rebuild_is_not_cached(index):
+    index.sync()
+    index._evict(99)
+    generation = index._generation
+    # A lookup's query running while the filter is rebuilt (e.g. the feed was pruned)
+    index._rebuild()
+    assert index._evicted_since(generation, 1)
+    assert not index._evicted_since(index._generation, 1)
+    index._evict(98)
+    assert index._evicted_since(generation, 1)
+
+
+class FakeIndex:
+
+    def __init__(self, answer):
+        self.answer = answer
+
+    def lookup(self, serial):
+        if isinstance(self.answer, Exception):
+            raise self.answer
+        return self.answer and dict(self.answer, serial=serial)
+
+
+def flask_stand_in(environ, start_response):
+    start_response('500 INTERNAL SERVER ERROR', [('Content-Type', 'text/plain')])
+    return [b'from flask: ' + environ['PATH_INFO'].encode('latin-1')]
+
+
+@pytest.mark.parametrize('answer, status, body', [
+    ({'state': 'Sold'}, 200, {'serial': 'SN-1/é', 'state': 'Sold'}),
+    (None, 404, {'message': 'Unknown serial', 'status': 'error'}),
+])
+def test_middleware_answers_lookups(answer, status, body):
+    client = Client(SerialLookupMiddleware(flask_stand_in, FakeIndex(answer)))
+    response = client.get('/api/serials/SN-1/%C3%A9')
+    assert response.status_code == status
+    assert json.loads(response.data) == body
+    assert response.headers['Content-Length'] == str(len(response.data))
+
+
+def test_middleware_leaves_errors_and_other_requests_to_flask():
+    client = Client(SerialLookupMiddleware(flask_stand_in, FakeIndex(RuntimeError("database down"))))
+    response = client.get('/api/serials/SN-1')
+    assert response.status_code == 500 and response.data == b'from flask: /api/serials/SN-1'
+    client = Client(SerialLookupMiddleware(flask_stand_in, FakeIndex({'state': 'Sold'})))
+    assert client.post('/api/serials/SN-1').data == b'from flask: /api/serials/SN-1'
+    assert client.get('/api/search').data == b'from flask: /api/search'
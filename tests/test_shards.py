@@ -0,0 +1,159 @@
+import pytest
+
+import archive
+import cache
+import config
+import shards
+from db import get_db_connection
+from lifecycle import apply_events
+
+SHARDS = 3
+
+
+def fetch(conn, sql, params=()):
+    try:
+        return shards._fetch(conn, sql, params)
+    finally:
+        conn.close()
+
+
+def on_shard(index, sql, params=()):
+    return fetch(shards.shard_connection(index), sql, params)
+
+
+def on_primary(sql, params=()):
+    return fetch(get_db_connection(), sql, params)
+
+
+@pytest.fixture
+def sharded(tmp_path, monkeypatch):
+    """A fresh primary with the seed instances plus one sold and one unused, moved out to three sqlite shards."""
+    monkeypatch.setattr(config, 'DB_SQLITE_PATH', str(tmp_path / 'primary.sqlite3'))
+    primary = get_db_connection()
+    cursor = primary.cursor()
+    cursor.execute("INSERT INTO ProductInstances (SerialNumber, ProductID) VALUES ('SH-SOLD', 'P100')")
+    sold = cursor.lastrowid
+    cursor.execute("INSERT INTO ProductInstances (SerialNumber, ProductID) VALUES ('SH-NEW', 'P100')")
+    apply_events(primary, [(sold, 'Manufactured', '2025-01-01 00:00:00'), (sold, 'Sold', '2025-02-01 00:00:00')])
+    primary.commit()
+    # Instance 2 (recycled) keeps its history in the archive only
+    archive.archive_instances(primary, [2])
+    primary.close()
+
+    monkeypatch.setattr(config, 'DB_SHARDS', ','.join(f"sqlite:{tmp_path / f'shard{i}.sqlite3'}" for i in range(SHARDS)))
+    monkeypatch.setattr(shards, '_shards', None)
+    monkeypatch.setattr(shards, '_executor', None)
+    monkeypatch.setattr(shards, '_synced', (None, None))
+    monkeypatch.setattr(shards, 'INSTANCE_IDS', shards.IdAllocator('InstanceID'))
+    cache.note_write()
+    shards.init()
+    yield shards.get_shards()
+    shards._executor.shutdown()
+    cache.note_write()
+
+
+def test_shard_for_matches_crc32_in_sql(sharded):
+    placed = {i: shards.shard_for(i) for i in range(1, 200)}
+    assert set(placed.values()) == set(range(SHARDS))
+    for index in range(SHARDS):
+        misplaced = on_shard(index, f"SELECT COUNT(*) AS n FROM ProductInstances WHERE CRC32(InstanceID) % {SHARDS} <> %s",
+                             (index,))
+        assert misplaced[0]['n'] == 0
+
+
+def test_init_moves_instances_with_their_state(sharded):
+    assert on_primary("SELECT COUNT(*) AS n FROM ProductInstances")[0]['n'] == 0
+    states = {}
+    for index in range(SHARDS):
+        for row in on_shard(index, "SELECT InstanceID, SerialNumber, CurrentState FROM ProductInstances"):
+            assert shards.shard_for(row['InstanceID']) == index
+            states[row['SerialNumber']] = row['CurrentState']
+    assert states['SH-SOLD'] == 'Sold' and states['SH-NEW'] == 'NoEvents'
+    # Disposed after a repair; the archived instance's state comes from the archive
+    index = shards.shard_for(1)
+    assert on_shard(index, "SELECT CurrentState FROM ProductInstances WHERE InstanceID = 1")[0]['CurrentState'] == 'Disposed'
+    index = shards.shard_for(2)
+    assert on_shard(index, "SELECT CurrentState FROM ProductInstances WHERE InstanceID = 2")[0]['CurrentState'] == 'Recycled'
+    assert on_shard(index, "SELECT COUNT(*) AS n FROM LifecycleEventsArchive WHERE InstanceID = 2")[0]['n'] == 3
+    registry = {r['SerialNumber']: r['InstanceID'] for r in on_primary("SELECT * FROM SerialRegistry")}
+    assert len(registry) == len(states)
+
+
+def test_register_instance_on_its_shard(sharded):
+    primary = get_db_connection()
+    try:
+        instance_id = shards.register_instance(primary, 'SH-REG', 'P100')
+        primary.commit()
+        with pytest.raises(Exception):
+            shards.register_instance(primary, 'SH-REG', 'P100')
+    finally:
+        primary.close()
+    # Above every moved instance: IDs come from the primary's IdBlocks
+    assert instance_id > 6
+    rows = on_shard(shards.shard_for(instance_id), "SELECT SerialNumber, CurrentState FROM ProductInstances "
+                                                   "WHERE InstanceID = %s", (instance_id,))
+    assert rows == [{'SerialNumber': 'SH-REG', 'CurrentState': 'Manufactured'}]
+    assert on_primary("SELECT InstanceID FROM SerialRegistry WHERE SerialNumber = 'SH-REG'") == [
+        {'InstanceID': instance_id}]
+
+
+def test_register_instance_releases_the_claim_when_the_shard_fails(sharded):
+    # The serial is free in the registry but already taken on every shard
+    for index in range(SHARDS):
+        conn = shards.shard_connection(index)
+        conn.cursor().execute("INSERT INTO ProductInstances (InstanceID, SerialNumber, ProductID) "
+                              "VALUES (%s, 'SH-CLASH', 'P100')", (1000 + index,))
+        conn.commit()
+        conn.close()
+    primary = get_db_connection()
+    try:
+        with pytest.raises(Exception):
+            shards.register_instance(primary, 'SH-CLASH', 'P100')
+    finally:
+        primary.close()
+    assert on_primary("SELECT * FROM SerialRegistry WHERE SerialNumber = 'SH-CLASH'") == []
+    for index in range(SHARDS):
+        assert [r['InstanceID'] for r in on_shard(index, "SELECT InstanceID FROM ProductInstances "
+                                                         "WHERE SerialNumber = 'SH-CLASH'")] == [1000 + index]
+
+
+def test_sync_catalog_copies_inserts_updates_and_deletes(sharded):
+    primary = get_db_connection()
+    cursor = primary.cursor()
+    cursor.execute("INSERT INTO RawMaterials (MaterialID, MaterialName, IsHazardous, RecyclableGrade) "
+                   "VALUES ('M99', 'Graphene', 0, 'B')")
+    cursor.execute("UPDATE RawMaterials SET MaterialName = 'Recycled Aluminium' WHERE MaterialID = 'M1'")
+    cursor.execute("DELETE FROM ComponentComposition WHERE ComponentID = 'C101' AND MaterialID = 'M2'")
+    for table in ('RawMaterials', 'ComponentComposition'):
+        cursor.callproc('BumpTableVersion', [table])
+    primary.commit()
+    primary.close()
+    cache.note_write()
+
+    assert shards.sync_catalog() == 3 * SHARDS
+    assert shards.sync_catalog() == 0
+    for table in ('RawMaterials', 'ComponentComposition'):
+        want = on_primary(f"SELECT * FROM {table} ORDER BY 1, 2")
+        for index in range(SHARDS):
+            assert on_shard(index, f"SELECT * FROM {table} ORDER BY 1, 2") == want
+
+
+def test_gather_merges_shard_results(sharded):
+    results = shards.scatter("SELECT InstanceID, CurrentState FROM ProductInstances ORDER BY InstanceID DESC")
+    assert len(results) == SHARDS
+    everything = sorted((r['InstanceID'] for rows in results for r in rows), reverse=True)
+    newest = shards.gather_sorted(results, 'InstanceID', reverse=True, limit=3)
+    assert [r['InstanceID'] for r in newest] == everything[:3]
+
+    counts = shards.gather_counts(shards.scatter(
+        "SELECT CurrentState, COUNT(*) AS cnt FROM ProductInstances GROUP BY CurrentState"), 'CurrentState')
+    assert counts == {'Disposed': 2, 'Recycled': 2, 'Sold': 1, 'NoEvents': 1}
+    assert shards.gather_sum(shards.scatter("SELECT COUNT(*) AS n FROM LifecycleEventsAll"), 'n') == 15
+
+
+def test_gather_sorted_by_hand():
+    results = [[{'k': 1}, {'k': 4}], [], [{'k': 2}, {'k': 3}, {'k': 5}]]
+    assert [r['k'] for r in shards.gather_sorted(results, 'k')] == [1, 2, 3, 4, 5]
+    assert [r['k'] for r in shards.gather_sorted([rows[::-1] for rows in results], 'k', reverse=True, limit=2)] == [5, 4]
+    assert shards.gather_counts([[{'s': 'a', 'cnt': 2}], [{'s': 'a', 'cnt': 1}, {'s': 'b', 'cnt': 4}]], 's') == {
+        'a': 3, 'b': 4}
@@ -0,0 +1,123 @@
+import random
+
+import numpy as np
+import pytest
+
+import config
+import snapshots
+from lifecycle import STATES
+
+DAY = 86400
+T0 = 1735700000
+
+
+class FakeLog:
+    """In-memory LifecycleEventsAll for one source: (EventID, InstanceID, code, EventDate) in insert order."""
+
+    def __init__(self):
+        self.events = []
+
+    def insert(self, instance_id, code, date):
+        self.events.append((len(self.events) + 1, instance_id, code, date))
+
+    def fetch(self, after, until, seen=None):
+        high = len(self.events)
+        rows = [e for e in self.events if e[3] <= until and (after is None or e[3] > after)]
+        if after is not None and seen is not None:
+            rows += [e for e in self.events if e[0] > seen[0] and e[3] <= min(after, until)]
+        rows.sort(key=lambda e: (e[1], e[3], e[0]))
+        return (np.array([e[1] for e in rows], dtype=np.int64), np.array([e[2] for e in rows], dtype=np.int8),
+                np.array([e[3] for e in rows], dtype=np.float64), [high])
+
+    def first(self):
+        return min((e[3] for e in self.events), default=None)
+
+    def expected(self, as_of):
+        """Full replay: each instance's latest event by (EventDate, EventID)."""
+        latest = {}
+        for event_id, instance_id, code, date in self.events:
+            if date <= as_of and (date, event_id) > latest.get(instance_id, (-1, -1, 0))[:2]:
+                latest[instance_id] = (date, event_id, code)
+        ids = sorted(latest)
+        return np.array(ids, dtype=np.int64), np.array([latest[i][2] for i in ids], dtype=np.int8)
+
+
+@pytest.fixture(autouse=True)
+def snapshot_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(config, 'SNAPSHOT_DIR', str(tmp_path))
+    monkeypatch.setattr(config, 'SNAPSHOT_INTERVAL_DAYS', 7)
+    monkeypatch.setattr(config, 'SNAPSHOT_LAG_HOURS', 24)
+
+
+def take(log, now):
+    return snapshots.take_due_snapshots(now=now, fetch=log.fetch, first_event=log.first)
+
+
+def assert_matches_full_replay(log, as_of):
+    ids, states = snapshots.state_as_of(as_of, fetch=log.fetch)
+    full_ids, full_states = snapshots.state_as_of(as_of, use_snapshots=False, fetch=log.fetch)
+    want_ids, want_states = log.expected(as_of)
+    np.testing.assert_array_equal(full_ids, want_ids)
+    np.testing.assert_array_equal(full_states, want_states)
+    np.testing.assert_array_equal(ids, want_ids, err_msg=f"as_of={as_of}")
+    np.testing.assert_array_equal(states, want_states, err_msg=f"as_of={as_of}")
+
+
+def test_replay_keeps_latest_event_per_instance():
+    ids, states, times = snapshots.replay(
+        np.array([1, 2], dtype=np.int64), np.array([2, 2], dtype=np.int8), np.array([50.0, 50.0]),
+        np.array([1, 2, 2, 3], dtype=np.int64), np.array([3, 1, 4, 1], dtype=np.int8),
+        np.array([40.0, 60.0, 60.0, 10.0]))
+    # 1: the backdated event loses to the base; 2: a tie goes to the later event; 3: new instance
+    np.testing.assert_array_equal(ids, [1, 2, 3])
+    np.testing.assert_array_equal(states, [2, 4, 1])
+    np.testing.assert_array_equal(times, [50.0, 60.0, 10.0])
+
+
+def test_snapshot_plus_delta_matches_full_replay():
+    rng = random.Random(7)
+    log = FakeLog()
+    log.insert(1, 1, T0)
+    interval = config.SNAPSHOT_INTERVAL_DAYS * DAY
+    boundaries = [T0 - 1 + k * interval for k in range(1, 9)]
+
+    written = []
+    for day in range(60):
+        now = T0 + day * DAY
+        for _ in range(rng.randint(5, 15)):
+            instance_id = rng.randint(1, 40)
+            code = rng.randint(1, len(STATES) - 1)
+            if rng.random() < 0.2:
+                # Backdated, often to before a snapshot already taken
+                log.insert(instance_id, code, max(T0, now - rng.randint(0, 20 * DAY)))
+            else:
+                log.insert(instance_id, code, now + rng.randint(0, DAY - 1))
+        if day and day % 9 == 0:
+            # Dated exactly on a snapshot boundary, inserted after it was taken
+            log.insert(rng.randint(1, 40), rng.randint(1, len(STATES) - 1),
+                       max(b for b in boundaries if b < now))
+        written += take(log, now)
+    assert len(written) >= 7
+
+    taken = [as_of for as_of, _ in snapshots.list_snapshots()]
+    assert taken == boundaries[:len(taken)]
+    cut_offs = [c for b in taken for c in (b - 1, b, b + 1)]
+    cut_offs += [T0 + rng.randint(-DAY, 62 * DAY) for _ in range(40)]
+    for as_of in cut_offs:
+        assert_matches_full_replay(log, as_of)
+
+
+def test_unusable_snapshots_are_rebuilt(tmp_path):
+    log = FakeLog()
+    for day in range(20):
+        log.insert(day % 3 + 1, day % 5 + 1, T0 + day * DAY)
+    old = snapshots._snapshot_path(T0 - 1 + 7 * DAY)
+    with open(old, 'wb') as f:
+        # Written before snapshots recorded times and EventIDs
+        np.savez(f, as_of=np.float64(T0 - 1 + 7 * DAY), instance_ids=np.array([1], dtype=np.int64),
+                 states=np.array([5], dtype=np.int8))
+    assert snapshots.load_snapshot(old) is None
+
+    assert take(log, T0 + 20 * DAY)[0] == old
+    assert snapshots.load_snapshot(old) is not None
+    assert_matches_full_replay(log, T0 + 10 * DAY)
@@ -0,0 +1,93 @@
+"""sqlite_backend.SCHEMA is written by hand from commands.sql and the migrations; keep them in step."""
+import glob
+import os
+import re
+
+import pytest
+
+import sqlite_backend
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# The SQLite backend's stand-in for the hazard index triggers' direct refresh
+SQLITE_ONLY_TABLES = {'HazardIndexDirty', 'sqlite_sequence'}
+NOT_COLUMNS = {'PRIMARY', 'KEY', 'INDEX', 'UNIQUE', 'CONSTRAINT', 'FOREIGN', 'CHECK'}
+
+
+def _mysql_sources():
+    paths = [os.path.join(ROOT, 'commands.sql')] + sorted(glob.glob(os.path.join(ROOT, 'migrations', '*.sql')))
+    for path in paths:
+        text = open(path, encoding='utf-8').read()
+        yield re.sub(r'--[^\n]*', ' ', re.sub(r'/\*.*?\*/', ' ', text, flags=re.DOTALL))
+
+
+def _table_body(text, start):
+    """The text between the parenthesis at `start` and its match."""
+    depth = 0
+    for i in range(start, len(text)):
+        depth += {'(': 1, ')': -1}.get(text[i], 0)
+        if depth == 0:
+            return text[start + 1:i]
+    raise ValueError("unbalanced parentheses")
+
+
+def _top_level_items(body):
+    items, depth, current = [], 0, ''
+    for ch in body:
+        depth += {'(': 1, ')': -1}.get(ch, 0)
+        if ch == ',' and depth == 0:
+            items.append(current)
+            current = ''
+        else:
+            current += ch
+    return items + [current]
+
+
+def mysql_schema():
+    tables, views, triggers, routines = {}, set(), set(), set()
+    for text in _mysql_sources():
+        for match in re.finditer(r'CREATE TABLE (\w+)\s*(\(|LIKE\s+(\w+))', text):
+            name, like = match.group(1), match.group(3)
+            if like:
+                tables[name] = list(tables[like])
+                continue
+            items = _top_level_items(_table_body(text, match.start(2)))
+            tables[name] = [item.split()[0] for item in items
+                            if item.strip() and item.split()[0].upper() not in NOT_COLUMNS]
+        for name, column in re.findall(r'ALTER TABLE (\w+)[^;]*?ADD COLUMN (\w+)', text):
+            tables[name].append(column)
+        views.update(re.findall(r'CREATE (?:OR REPLACE )?VIEW (\w+)', text))
+        triggers.update(re.findall(r'CREATE TRIGGER (\w+)', text))
+        routines.update(re.findall(r'CREATE (?:PROCEDURE|FUNCTION) (\w+)', text))
+    return tables, views, triggers, routines
+
+
+@pytest.fixture(scope='module')
+def sqlite_conn(tmp_path_factory):
+    conn = sqlite_backend.connect(str(tmp_path_factory.mktemp('schema') / 'schema.sqlite3'))
+    yield conn.raw
+    conn.close()
+
+
+def sqlite_objects(raw, kind):
+    return {row[0] for row in raw.execute("SELECT name FROM sqlite_master WHERE type = ?", (kind,))}
+
+
+def test_tables_and_columns_match(sqlite_conn):
+    tables, _, _, _ = mysql_schema()
+    sqlite_tables = sqlite_objects(sqlite_conn, 'table') - SQLITE_ONLY_TABLES
+    assert sqlite_tables == set(tables)
+    for table, columns in tables.items():
+        sqlite_columns = [row[1] for row in sqlite_conn.execute(f"PRAGMA table_info({table})")]
+        assert sqlite_columns == columns, table
+
+
+def test_views_and_triggers_match(sqlite_conn):
+    _, views, triggers, _ = mysql_schema()
+    assert sqlite_objects(sqlite_conn, 'view') == views
+    assert sqlite_objects(sqlite_conn, 'trigger') == triggers
+
+
+def test_every_routine_is_implemented(sqlite_conn):
+    _, _, _, routines = mysql_schema()
+    implemented = set(sqlite_backend.PROCEDURES) | set(sqlite_backend._functions(sqlite_conn))
+    assert routines == implemented
@@ -0,0 +1,112 @@
+from flask import Flask
+from jinja2 import DictLoader
+import pytest
+
+import config
+import streaming
+from streaming import StreamGroup, render_page
+
+
+class FakeCursor:
+
+    def __init__(self, conn, dictionary):
+        self.conn = conn
+        self.dictionary = dictionary
+        self.rows = []
+        self.closed = False
+
+    def execute(self, sql, params=()):
+        self.rows = list(self.conn.results[sql])
+        self.conn.executed.append(sql)
+
+    def fetchmany(self, size):
+        batch, self.rows = self.rows[:size], self.rows[size:]
+        return [{'n': n} if self.dictionary else (n,) for n in batch]
+
+    def close(self):
+        self.closed = True
+
+
+class FakeConnection:
+    """Hands out cursors over canned results: {sql: [n, ...]}."""
+
+    def __init__(self, **results):
+        self.results = results
+        self.executed = []
+        self.cursors = []
+        self.closed = False
+
+    def cursor(self, dictionary=False, buffered=True):
+        assert not buffered
+        self.cursors.append(FakeCursor(self, dictionary))
+        return self.cursors[-1]
+
+    def close(self):
+        self.closed = True
+
+
+@pytest.fixture(autouse=True)
+def small_batches(monkeypatch):
+    monkeypatch.setattr(config, 'STREAM_TEMPLATES', True)
+    monkeypatch.setattr(config, 'STREAM_BATCH_SIZE', 2)
+    monkeypatch.setattr(config, 'STREAM_BUFFER_ITEMS', 2)
+
+
+def test_row_stream_peeks_then_iterates_once():
+    conn = FakeConnection(none=[], five=[1, 2, 3, 4, 5])
+    group = StreamGroup(conn)
+    empty, five = group.query('none'), group.query('five')
+    assert not empty and list(empty) == []
+    # Nothing is run until the template looks at the rows
+    assert conn.executed == ['none']
+    assert five and five.count == 2
+    assert [r['n'] for r in five] == [1, 2, 3, 4, 5]
+    assert five and five.count == 5 and not five.pending
+    assert conn.cursors[1].closed
+
+
+def test_second_stream_on_a_connection_buffers_the_first():
+    conn = FakeConnection(first=[1, 2, 3, 4, 5], second=[6, 7])
+    group = StreamGroup(conn)
+    first, second = group.query('first'), group.query('second')
+    rows = iter(first)
+    assert next(rows) == {'n': 1}
+    assert [r['n'] for r in second] == [6, 7]
+    # The rest of the first result was read before the second query ran
+    assert conn.cursors[0].closed and not first.pending
+    assert [r['n'] for r in rows] == [2, 3, 4, 5]
+
+
+@pytest.fixture
+def app():
+    app = Flask(__name__)
+    app.secret_key = 'test'
+    app.jinja_env.loader = DictLoader({
+        'page.html': "{% for r in rows %}<p>{{ r.n }}</p>{% endfor %}|{% for r in shard %}<i>{{ r.n }}</i>{% endfor %}",
+    })
+    with app.test_request_context():
+        yield app
+
+
+def test_render_page_closes_every_connection(app):
+    conn, shard = FakeConnection(rows=[1, 2, 3]), FakeConnection(rows=[4])
+    group = StreamGroup(conn)
+    response = render_page(group, 'page.html', rows=group.query('rows'), shard=group.query('rows', conn=shard))
+    assert not conn.closed
+    assert ''.join(response.response) == '<p>1</p><p>2</p><p>3</p>|<i>4</i>'
+    assert conn.closed and shard.closed
+
+
+def test_abandoned_page_drops_connections_left_mid_result(app, monkeypatch):
+    discarded = []
+    monkeypatch.setattr(streaming, 'discard_connection', discarded.append)
+    conn, shard = FakeConnection(rows=list(range(100))), FakeConnection(rows=[4])
+    group = StreamGroup(conn)
+    response = render_page(group, 'page.html', rows=group.query('rows'), shard=group.query('rows', conn=shard))
+    body = iter(response.response)
+    assert next(body).startswith('<p>0')
+    # What the WSGI server does when the client disconnects
+    response.response.close()
+    assert discarded == [conn] and len(conn.cursors[0].rows) > 90
+    # Never started: handed back as usual
+    assert shard.closed and shard.cursors == []